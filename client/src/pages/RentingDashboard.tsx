@@ -23,7 +23,7 @@ const RentingDashboard: React.FC = () => {
     try {
       setLoading(true);
       const [managementRes, accountingRes] = await Promise.all([
-        apiClient.get('/api/fursatkum/rental-management'),
+        apiClient.get('/api/fursatkum/rental-management', { params: { summary: true } }),
         apiClient.get('/api/fursatkum/rental-accounting'),
       ]);
       setManagement(managementRes.data);
@@ -66,7 +66,7 @@ const RentingDashboard: React.FC = () => {
           <Card>
             <CardContent>
               <Typography color="text.secondary">مستحق</Typography>
-              <Typography variant="h5">{management?.pending?.length || 0}</Typography>
+              <Typography variant="h5">{management?.counts?.pending || 0}</Typography>
               <Button size="small" sx={{ mt: 1 }} onClick={() => navigate('/fursatkum/renting/management')}>
                 عرض التفاصيل
               </Button>
@@ -77,7 +77,7 @@ const RentingDashboard: React.FC = () => {
           <Card>
             <CardContent>
               <Typography color="text.secondary">متأخر</Typography>
-              <Typography variant="h5">{management?.overdue?.length || 0}</Typography>
+              <Typography variant="h5">{management?.counts?.overdue || 0}</Typography>
             </CardContent>
           </Card>
         </Grid>
@@ -85,7 +85,7 @@ const RentingDashboard: React.FC = () => {
           <Card>
             <CardContent>
               <Typography color="text.secondary">مدفوع جزئياً</Typography>
-              <Typography variant="h5">{management?.partiallyPaid?.length || 0}</Typography>
+              <Typography variant="h5">{management?.counts?.partiallyPaid || 0}</Typography>
             </CardContent>
           </Card>
         </Grid>
@@ -93,7 +93,7 @@ const RentingDashboard: React.FC = () => {
           <Card>
             <CardContent>
               <Typography color="text.secondary">مدفوع</Typography>
-              <Typography variant="h5">{management?.paid?.length || 0}</Typography>
+              <Typography variant="h5">{management?.counts?.paid || 0}</Typography>
             </CardContent>
           </Card>
         </Grid>
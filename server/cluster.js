@@ -0,0 +1,109 @@
+// Entry point with optional cluster mode.
+// With CLUSTER_WORKERS unset (or 1) this simply runs index.js. Otherwise the
+// primary forks that many workers (or one per CPU for CLUSTER_WORKERS=auto),
+// which share the listening port. The primary:
+//   - relays cache invalidation messages between workers (utils/cluster.js);
+//   - elects one leader worker to run the schedulers, re-electing on exit;
+//   - replaces workers that crash;
+//   - on SIGHUP, restarts workers one at a time, waiting for each replacement
+//     to listen before the old worker is disconnected;
+//   - on SIGTERM/SIGINT, disconnects every worker and exits once they are gone.
+// Workers still serving requests after CLUSTER_SHUTDOWN_TIMEOUT_MS are killed.
+
+const cluster = require('cluster');
+const os = require('os');
+require('dotenv').config();
+
+const requested = process.env.CLUSTER_WORKERS;
+const WORKERS = requested === 'auto' ? os.availableParallelism?.() || os.cpus().length : parseInt(requested, 10) || 1;
+const SHUTDOWN_TIMEOUT_MS = parseInt(process.env.CLUSTER_SHUTDOWN_TIMEOUT_MS, 10) || 30 * 1000;
+const RESPAWN_DELAY_MS = 1000;
+
+if (WORKERS <= 1 || !cluster.isPrimary) {
+  require('./index');
+} else {
+  let leaderId = null;
+  let stopping = false;
+  let restarting = false;
+  const retiring = new Set();
+
+  const liveWorkers = () => Object.values(cluster.workers)
+    .filter((worker) => worker && worker.isConnected() && !retiring.has(worker.id));
+
+  // The oldest live worker leads; it keeps leading until it leaves
+  const electLeader = () => {
+    if (stopping) return;
+    const current = cluster.workers[leaderId];
+    if (current && current.isConnected() && !retiring.has(leaderId)) return;
+    const [next] = liveWorkers().sort((a, b) => a.id - b.id);
+    if (current && current.isConnected()) current.send({ cluster: 'leader', leader: false });
+    leaderId = next ? next.id : null;
+    if (next) next.send({ cluster: 'leader', leader: true });
+  };
+
+  const retire = (worker) => new Promise((resolve) => {
+    retiring.add(worker.id);
+    electLeader();
+    const timer = setTimeout(() => worker.process.kill('SIGKILL'), SHUTDOWN_TIMEOUT_MS);
+    worker.once('exit', () => {
+      clearTimeout(timer);
+      retiring.delete(worker.id);
+      resolve();
+    });
+    worker.disconnect();
+  });
+
+  const fork = () => new Promise((resolve) => {
+    const worker = cluster.fork();
+    worker.once('listening', () => {
+      electLeader();
+      resolve(worker);
+    });
+  });
+
+  cluster.on('message', (worker, message) => {
+    if (!message || message.cluster !== 'broadcast') return;
+    Object.values(cluster.workers).forEach((other) => {
+      if (other && other.id !== worker.id && other.isConnected()) other.send(message);
+    });
+  });
+
+  cluster.on('exit', (worker, code, signal) => {
+    if (worker.id === leaderId) leaderId = null;
+    electLeader();
+    if (stopping || retiring.has(worker.id) || worker.exitedAfterDisconnect) return;
+    console.error(`❌ Worker ${worker.id} exited (${signal || code}), starting a replacement`);
+    setTimeout(fork, RESPAWN_DELAY_MS);
+  });
+
+  const rollingRestart = async () => {
+    if (restarting || stopping) return;
+    restarting = true;
+    console.log('🔄 Rolling restart of the workers...');
+    try {
+      for (const worker of liveWorkers()) {
+        await fork();
+        await retire(worker);
+      }
+      console.log('✅ Rolling restart finished');
+    } finally {
+      restarting = false;
+    }
+  };
+
+  const shutdown = async (signal) => {
+    if (stopping) return;
+    stopping = true;
+    console.log(`\n⚠️  Received ${signal}. Stopping ${Object.keys(cluster.workers).length} workers...`);
+    await Promise.all(Object.values(cluster.workers).filter(Boolean).map(retire));
+    console.log('👋 Goodbye!');
+    process.exit(0);
+  };
+
+  process.on('SIGHUP', () => { rollingRestart(); });
+  process.on('SIGTERM', () => shutdown('SIGTERM'));
+  process.on('SIGINT', () => shutdown('SIGINT'));
+
+  console.log(`🧩 Cluster mode: starting ${WORKERS} workers`);
+  for (let i = 0; i < WORKERS; i += 1) fork();
+}
@@ -1,9 +1,23 @@
+const cluster = require('cluster');
 const express = require('express');
 const cors = require('cors');
 const mongoose = require('mongoose');
 const path = require('path');
 const compression = require('compression');
 require('dotenv').config();
+const { collectionVersionPlugin } = require('./utils/queryCache');
+const { authenticate } = require('./utils/auth');
+const { whenLeader } = require('./utils/cluster');
+const { requestMetrics, watchMongoPool } = require('./utils/metrics');
+const { slowQueryPlugin } = require('./utils/slowQueries');
+const { requestTracing, tracingPlugin } = require('./utils/tracing');
+
+// Bump per-collection cache versions on every write (must run before models are compiled)
+mongoose.plugin(collectionVersionPlugin);
+// Time every query and aggregate; log and explain the slow ones
+mongoose.plugin(slowQueryPlugin);
+// Per-request spans of every query and aggregate (Server-Timing)
+mongoose.plugin(tracingPlugin);
 
 const app = express();
 const PORT = process.env.PORT || 5000;
@@ -37,11 +51,16 @@ const corsOptions = {
   },
   credentials: true, // Allow cookies and authorization headers
   methods: ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'HEAD'],
-  allowedHeaders: ['Content-Type', 'Authorization', 'X-Requested-With'],
+  allowedHeaders: ['Content-Type', 'Authorization', 'X-Requested-With', 'X-Request-Id'],
+  exposedHeaders: ['Server-Timing', 'X-Request-Id', 'X-Cache'],
   optionsSuccessStatus: 200 // Some legacy browsers choke on 204
 };
 
 // Middleware
+// Latency/status/size per route, first so the timing covers everything else
+app.use(requestMetrics);
+// Request ID and Server-Timing breakdown
+app.use(requestTracing);
 app.use(compression()); // Enable gzip compression
 app.use(cors(corsOptions));
 app.use(express.json({ limit: '10mb' })); // Increase JSON payload limit
@@ -126,12 +145,17 @@ db.on('disconnected', () => {
   setTimeout(connectWithRetry, 5000);
 });
 
+db.on('connected', () => watchMongoPool());
+
 db.on('reconnected', () => {
   console.log('✅ تم إعادة الاتصال بقاعدة البيانات');
 });
 
 db.once('open', () => {
   console.log('🎉 قاعدة البيانات جاهزة للاستخدام');
+  // Only one worker runs the scheduler in cluster mode
+  const { startOverdueScheduler, stopOverdueScheduler } = require('./utils/overdueVisas');
+  whenLeader(() => startOverdueScheduler(), stopOverdueScheduler);
 });
 
 // Health check endpoint
@@ -144,6 +168,9 @@ app.get('/api/health', (req, res) => {
   });
 });
 
+// Resolve req.user once per request; routers only enforce it
+app.use('/api', authenticate);
+
 // Routes
 app.use('/api/health', require('./routes/health'));
 app.use('/api/secretaries', require('./routes/secretaries'));
@@ -177,6 +204,15 @@ app.use('/api/fursatkum/exports', require('./routes/exports'));
 app.use('/api/farwaniya1', require('./routes/farwaniya1'));
 app.use('/api/farwaniya2', require('./routes/farwaniya2'));
 
+// Prometheus metrics
+app.use('/api/metrics', require('./routes/metrics'));
+
+// All dashboards in one request
+app.use('/api/overview', require('./routes/overview'));
+
+// Ledger maintenance (admin)
+app.use('/api/ledger', require('./routes/ledger'));
+
 
 // Error handling middleware
 app.use((err, req, res, next) => {
@@ -229,6 +265,16 @@ const gracefulShutdown = (signal) => {
   });
 };
 
+// In cluster mode the primary retires a worker by disconnecting it; by then
+// the server has stopped accepting connections and finished the open ones
+if (cluster.isWorker) {
+  cluster.worker.on('disconnect', () => {
+    mongoose.connection.close()
+      .catch((error) => console.error('❌ Error closing database connection:', error))
+      .finally(() => process.exit(0));
+  });
+}
+
 // Handle process termination
 process.on('SIGTERM', () => gracefulShutdown('SIGTERM'));
 process.on('SIGINT', () => gracefulShutdown('SIGINT'));
@@ -0,0 +1,34 @@
+const mongoose = require('mongoose');
+
+// Progress of the hot/cold archival of one collection (see utils/archive.js).
+// `cutoff` is the archive boundary readers consult: rows dated before it may
+// live in the `<collection>_archive` collection.
+const archiveStateSchema = new mongoose.Schema({
+  collectionName: {
+    type: String,
+    required: true,
+    unique: true,
+  },
+  cutoff: Date,
+  status: {
+    type: String,
+    enum: ['idle', 'running', 'failed'],
+    default: 'idle',
+  },
+  movedCount: {
+    type: Number,
+    default: 0,
+  },
+  lastRunMoved: {
+    type: Number,
+    default: 0,
+  },
+  lastBatchAt: Date,
+  startedAt: Date,
+  finishedAt: Date,
+  error: String,
+}, {
+  versionKey: false,
+});
+
+module.exports = mongoose.model('ArchiveState', archiveStateSchema);
@@ -0,0 +1,19 @@
+const mongoose = require('mongoose');
+
+// Named monotonically increasing sequences used for reference numbers.
+// The document _id is the sequence key (e.g. "FursatkumAccount:income").
+const counterSchema = new mongoose.Schema({
+  _id: {
+    type: String,
+    required: true,
+  },
+  seq: {
+    type: Number,
+    default: 0,
+  },
+}, {
+  timestamps: true,
+  versionKey: false,
+});
+
+module.exports = mongoose.model('Counter', counterSchema);
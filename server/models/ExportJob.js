@@ -0,0 +1,52 @@
+const mongoose = require('mongoose');
+
+// State of a background export job (see utils/exportJobs.js), shared by every
+// process so a status or download request can be answered by any worker.
+// `owner` is the host:pid running the job. Expired records are removed with
+// their file by the job sweeper; the TTL index is only a late backstop.
+const exportJobSchema = new mongoose.Schema({
+  _id: {
+    type: String,
+  },
+  type: {
+    type: String,
+    required: true,
+  },
+  query: {
+    type: mongoose.Schema.Types.Mixed,
+    default: {},
+  },
+  key: {
+    type: String,
+    required: true,
+  },
+  status: {
+    type: String,
+    enum: ['queued', 'running', 'completed', 'failed'],
+    default: 'queued',
+  },
+  filename: String,
+  filePath: String,
+  owner: String,
+  bytesWritten: {
+    type: Number,
+    default: 0,
+  },
+  error: String,
+  createdAt: {
+    type: Date,
+    default: Date.now,
+  },
+  startedAt: Date,
+  finishedAt: Date,
+  expiresAt: Date,
+}, {
+  versionKey: false,
+  minimize: false,
+});
+
+exportJobSchema.index({ key: 1, createdAt: -1 });
+exportJobSchema.index({ status: 1, owner: 1 });
+exportJobSchema.index({ expiresAt: 1 }, { expireAfterSeconds: 24 * 60 * 60 });
+
+module.exports = mongoose.model('ExportJob', exportJobSchema);
@@ -1,4 +1,18 @@
 const mongoose = require('mongoose');
+const { referenceStatics } = require('../utils/counters');
+
+// Invoice counters kept in step with every invoice posting (see utils/offices.js)
+const invoiceSummarySchema = new mongoose.Schema({
+  incomeCount: { type: Number, default: 0 },
+  spendingCount: { type: Number, default: 0 },
+  deletedCount: { type: Number, default: 0 },
+  incomeTotal: { type: Number, default: 0 },
+  spendingTotal: { type: Number, default: 0 },
+  // Unset until the counters have been rebuilt from the invoices once
+  rebuiltAt: { type: Date },
+  // Bumped by every counter change so a rebuild can tell it raced one
+  version: { type: Number, default: 0 },
+}, { _id: false });
 
 const fw1AccountSchema = new mongoose.Schema({
   balance: {
@@ -21,6 +35,10 @@ const fw1AccountSchema = new mongoose.Schema({
     type: Number,
     default: 0,
   },
+  summary: {
+    type: invoiceSummarySchema,
+    default: () => ({}),
+  },
 }, {
   timestamps: true,
 });
@@ -39,24 +57,13 @@ fw1AccountSchema.statics.getAccount = async function() {
   return account;
 };
 
-fw1AccountSchema.statics.getNextReference = async function(type) {
-  const account = await this.getAccount();
-  let counter;
-  let prefix;
-
-  if (type === 'income') {
-    account.incomeCounter += 1;
-    counter = account.incomeCounter;
-    prefix = 'F1-INC';
-  } else {
-    account.spendingCounter += 1;
-    counter = account.spendingCounter;
-    prefix = 'F1-SPD';
-  }
-
-  await account.save();
-  return `${prefix}-${counter.toString().padStart(3, '0')}`;
+// Reference number prefixes and the legacy account counter each sequence continues from
+const REFERENCE_TYPES = {
+  income: { counterField: 'incomeCounter', prefix: 'F1-INC' },
+  spending: { counterField: 'spendingCounter', prefix: 'F1-SPD' },
 };
 
+Object.assign(fw1AccountSchema.statics, referenceStatics(REFERENCE_TYPES));
+
 module.exports = mongoose.model('FW1Account', fw1AccountSchema);
 
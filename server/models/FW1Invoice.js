@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const editHistorySchema = new mongoose.Schema({
   field: {
@@ -93,8 +94,10 @@ const fw1InvoiceSchema = new mongoose.Schema({
 
 fw1InvoiceSchema.index({ type: 1, status: 1 });
 fw1InvoiceSchema.index({ referenceNumber: 1 });
-fw1InvoiceSchema.index({ date: -1 });
-fw1InvoiceSchema.index({ status: 1, date: -1 });
+fw1InvoiceSchema.index({ date: -1, _id: -1 });
+fw1InvoiceSchema.index({ status: 1, date: -1, _id: -1 });
+
+fw1InvoiceSchema.plugin(ledgerCheckpointPlugin, { office: 'farwaniya1' });
 
 module.exports = mongoose.model('FW1Invoice', fw1InvoiceSchema);
 
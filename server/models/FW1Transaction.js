@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const fw1TransactionSchema = new mongoose.Schema({
   type: {
@@ -42,8 +43,10 @@ const fw1TransactionSchema = new mongoose.Schema({
   timestamps: true,
 });
 
-fw1TransactionSchema.index({ date: -1 });
+fw1TransactionSchema.index({ date: -1, _id: -1 });
 fw1TransactionSchema.index({ invoiceId: 1 });
 
+fw1TransactionSchema.plugin(ledgerCheckpointPlugin, { office: 'farwaniya1' });
+
 module.exports = mongoose.model('FW1Transaction', fw1TransactionSchema);
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const editHistorySchema = new mongoose.Schema({
   field: {
@@ -93,8 +94,10 @@ const fw2InvoiceSchema = new mongoose.Schema({
 
 fw2InvoiceSchema.index({ type: 1, status: 1 });
 fw2InvoiceSchema.index({ referenceNumber: 1 });
-fw2InvoiceSchema.index({ date: -1 });
-fw2InvoiceSchema.index({ status: 1, date: -1 });
+fw2InvoiceSchema.index({ date: -1, _id: -1 });
+fw2InvoiceSchema.index({ status: 1, date: -1, _id: -1 });
+
+fw2InvoiceSchema.plugin(ledgerCheckpointPlugin, { office: 'farwaniya2' });
 
 module.exports = mongoose.model('FW2Invoice', fw2InvoiceSchema);
 
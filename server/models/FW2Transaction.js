@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const fw2TransactionSchema = new mongoose.Schema({
   type: {
@@ -42,8 +43,10 @@ const fw2TransactionSchema = new mongoose.Schema({
   timestamps: true,
 });
 
-fw2TransactionSchema.index({ date: -1 });
+fw2TransactionSchema.index({ date: -1, _id: -1 });
 fw2TransactionSchema.index({ invoiceId: 1 });
 
+fw2TransactionSchema.plugin(ledgerCheckpointPlugin, { office: 'farwaniya2' });
+
 module.exports = mongoose.model('FW2Transaction', fw2TransactionSchema);
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { referenceStatics } = require('../utils/counters');
 
 const bankInfoSchema = new mongoose.Schema({
   bankName: { type: String, default: 'بنك الكويت الوطني' },
@@ -7,6 +8,19 @@ const bankInfoSchema = new mongoose.Schema({
   iban: { type: String, default: 'KW00NBOK0000000000000000000000' },
 }, { _id: false });
 
+// Invoice counters kept in step with every invoice posting (see utils/offices.js)
+const invoiceSummarySchema = new mongoose.Schema({
+  incomeCount: { type: Number, default: 0 },
+  spendingCount: { type: Number, default: 0 },
+  deletedCount: { type: Number, default: 0 },
+  incomeTotal: { type: Number, default: 0 },
+  spendingTotal: { type: Number, default: 0 },
+  // Unset until the counters have been rebuilt from the invoices once
+  rebuiltAt: { type: Date },
+  // Bumped by every counter change so a rebuild can tell it raced one
+  version: { type: Number, default: 0 },
+}, { _id: false });
+
 const fursatkumAccountSchema = new mongoose.Schema({
   bankBalance: {
     type: Number,
@@ -38,6 +52,10 @@ const fursatkumAccountSchema = new mongoose.Schema({
     type: bankInfoSchema,
     default: () => ({}),
   },
+  summary: {
+    type: invoiceSummarySchema,
+    default: () => ({}),
+  },
 }, {
   timestamps: true,
 });
@@ -59,34 +77,16 @@ fursatkumAccountSchema.statics.getAccount = async function() {
   return account;
 };
 
-// Method to generate next reference number
-fursatkumAccountSchema.statics.getNextReference = async function(type) {
-  const account = await this.getAccount();
-  let counter;
-  let prefix;
-
-  if (type === 'income') {
-    account.incomeCounter += 1;
-    counter = account.incomeCounter;
-    prefix = 'F-INC';
-  } else if (type === 'loan') {
-    account.loanCounter += 1;
-    counter = account.loanCounter;
-    prefix = 'F-LOAN';
-  } else if (type === 'salary') {
-    account.salaryCounter += 1;
-    counter = account.salaryCounter;
-    prefix = 'F-SAL';
-  } else {
-    account.spendingCounter += 1;
-    counter = account.spendingCounter;
-    prefix = 'F-SPD';
-  }
-
-  await account.save();
-  return `${prefix}-${counter.toString().padStart(3, '0')}`;
+// Reference number prefixes and the legacy account counter each sequence continues from
+const REFERENCE_TYPES = {
+  income: { counterField: 'incomeCounter', prefix: 'F-INC' },
+  spending: { counterField: 'spendingCounter', prefix: 'F-SPD' },
+  loan: { counterField: 'loanCounter', prefix: 'F-LOAN' },
+  salary: { counterField: 'salaryCounter', prefix: 'F-SAL' },
 };
 
+Object.assign(fursatkumAccountSchema.statics, referenceStatics(REFERENCE_TYPES));
+
 module.exports = mongoose.model('FursatkumAccount', fursatkumAccountSchema);
 
 
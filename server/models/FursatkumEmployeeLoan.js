@@ -45,6 +45,7 @@ const fursatkumEmployeeLoanSchema = new mongoose.Schema({
 
 fursatkumEmployeeLoanSchema.index({ employeeId: 1, status: 1 });
 fursatkumEmployeeLoanSchema.index({ referenceNumber: 1 });
+fursatkumEmployeeLoanSchema.index({ createdAt: -1, _id: -1 });
 
 module.exports = mongoose.model('FursatkumEmployeeLoan', fursatkumEmployeeLoanSchema);
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const editHistorySchema = new mongoose.Schema({
   field: { type: String, required: true },
@@ -81,10 +82,12 @@ const fursatkumInvoiceSchema = new mongoose.Schema({
 // Indexes for efficient queries
 fursatkumInvoiceSchema.index({ type: 1, status: 1 });
 fursatkumInvoiceSchema.index({ referenceNumber: 1 });
-fursatkumInvoiceSchema.index({ date: -1 });
-fursatkumInvoiceSchema.index({ status: 1, date: -1 });
+fursatkumInvoiceSchema.index({ date: -1, _id: -1 });
+fursatkumInvoiceSchema.index({ status: 1, date: -1, _id: -1 });
 fursatkumInvoiceSchema.index({ ledger: 1, type: 1, status: 1 });
 
+fursatkumInvoiceSchema.plugin(ledgerCheckpointPlugin, { office: 'fursatkum' });
+
 module.exports = mongoose.model('FursatkumInvoice', fursatkumInvoiceSchema);
 
 
@@ -46,6 +46,7 @@ const fursatkumSalaryPaymentSchema = new mongoose.Schema({
 
 fursatkumSalaryPaymentSchema.index({ employeeId: 1, date: -1 });
 fursatkumSalaryPaymentSchema.index({ referenceNumber: 1 });
+fursatkumSalaryPaymentSchema.index({ date: -1, _id: -1 });
 
 module.exports = mongoose.model('FursatkumSalaryPayment', fursatkumSalaryPaymentSchema);
 
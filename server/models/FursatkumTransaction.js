@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const fursatkumTransactionSchema = new mongoose.Schema({
   type: {
@@ -58,10 +59,13 @@ const fursatkumTransactionSchema = new mongoose.Schema({
 });
 
 // Indexes for efficient queries
-fursatkumTransactionSchema.index({ ledger: 1, date: -1 });
+// Point-in-time balance seeks (utils/balances.js) walk this index backwards
+fursatkumTransactionSchema.index({ ledger: 1, date: -1, _id: -1 });
 fursatkumTransactionSchema.index({ type: 1 });
 fursatkumTransactionSchema.index({ invoiceId: 1 });
-fursatkumTransactionSchema.index({ date: -1 });
+fursatkumTransactionSchema.index({ date: -1, _id: -1 });
+
+fursatkumTransactionSchema.plugin(ledgerCheckpointPlugin, { office: 'fursatkum' });
 
 module.exports = mongoose.model('FursatkumTransaction', fursatkumTransactionSchema);
 
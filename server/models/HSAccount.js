@@ -1,4 +1,18 @@
 const mongoose = require('mongoose');
+const { referenceStatics } = require('../utils/counters');
+
+// Invoice counters kept in step with every invoice posting (see utils/offices.js)
+const invoiceSummarySchema = new mongoose.Schema({
+  incomeCount: { type: Number, default: 0 },
+  spendingCount: { type: Number, default: 0 },
+  deletedCount: { type: Number, default: 0 },
+  incomeTotal: { type: Number, default: 0 },
+  spendingTotal: { type: Number, default: 0 },
+  // Unset until the counters have been rebuilt from the invoices once
+  rebuiltAt: { type: Date },
+  // Bumped by every counter change so a rebuild can tell it raced one
+  version: { type: Number, default: 0 },
+}, { _id: false });
 
 const hsAccountSchema = new mongoose.Schema({
   fundingCredit: {
@@ -19,6 +33,10 @@ const hsAccountSchema = new mongoose.Schema({
     type: Number,
     default: 0,
   },
+  summary: {
+    type: invoiceSummarySchema,
+    default: () => ({}),
+  },
 }, {
   timestamps: true,
 });
@@ -37,25 +55,13 @@ hsAccountSchema.statics.getAccount = async function() {
   return account;
 };
 
-// Method to generate next reference number
-hsAccountSchema.statics.getNextReference = async function(type) {
-  const account = await this.getAccount();
-  let counter;
-  let prefix;
-  
-  if (type === 'income') {
-    account.incomeCounter += 1;
-    counter = account.incomeCounter;
-    prefix = 'INC';
-  } else {
-    account.spendingCounter += 1;
-    counter = account.spendingCounter;
-    prefix = 'SPD';
-  }
-  
-  await account.save();
-  return `${prefix}-${counter.toString().padStart(3, '0')}`;
+// Reference number prefixes and the legacy account counter each sequence continues from
+const REFERENCE_TYPES = {
+  income: { counterField: 'incomeCounter', prefix: 'INC' },
+  spending: { counterField: 'spendingCounter', prefix: 'SPD' },
 };
 
+Object.assign(hsAccountSchema.statics, referenceStatics(REFERENCE_TYPES));
+
 module.exports = mongoose.model('HSAccount', hsAccountSchema);
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const editHistorySchema = new mongoose.Schema({
   field: {
@@ -100,8 +101,10 @@ const hsInvoiceSchema = new mongoose.Schema({
 // Indexes for efficient queries
 hsInvoiceSchema.index({ type: 1, status: 1 });
 hsInvoiceSchema.index({ referenceNumber: 1 });
-hsInvoiceSchema.index({ date: -1 });
-hsInvoiceSchema.index({ status: 1, date: -1 });
+hsInvoiceSchema.index({ date: -1, _id: -1 });
+hsInvoiceSchema.index({ status: 1, date: -1, _id: -1 });
+
+hsInvoiceSchema.plugin(ledgerCheckpointPlugin, { office: 'home-service' });
 
 module.exports = mongoose.model('HSInvoice', hsInvoiceSchema);
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { ledgerCheckpointPlugin } = require('../utils/ledgerCheckpoints');
 
 const hsTransactionSchema = new mongoose.Schema({
   type: {
@@ -54,10 +55,13 @@ const hsTransactionSchema = new mongoose.Schema({
 });
 
 // Indexes for efficient queries
-hsTransactionSchema.index({ category: 1, date: -1 });
+// Point-in-time balance seeks (utils/balances.js) walk this index backwards
+hsTransactionSchema.index({ category: 1, date: -1, _id: -1 });
 hsTransactionSchema.index({ type: 1 });
 hsTransactionSchema.index({ invoiceId: 1 });
-hsTransactionSchema.index({ date: -1 });
+hsTransactionSchema.index({ date: -1, _id: -1 });
+
+hsTransactionSchema.plugin(ledgerCheckpointPlugin, { office: 'home-service' });
 
 module.exports = mongoose.model('HSTransaction', hsTransactionSchema);
 
@@ -0,0 +1,50 @@
+const mongoose = require('mongoose');
+
+// Monthly closing figures for one office ledger (see utils/ledgerCheckpoints.js).
+// Movement figures come from the transaction rows dated in the period, invoice
+// figures from the invoices dated in it. A checkpoint is marked dirty when a
+// row in its period is written after it was closed, and is re-closed on the
+// next read.
+const ledgerCheckpointSchema = new mongoose.Schema({
+  office: {
+    type: String,
+    required: true,
+  },
+  ledger: {
+    type: String,
+    required: true,
+  },
+  period: {
+    type: String,
+    required: true, // YYYY-MM (UTC)
+  },
+  periodStart: Date,
+  periodEnd: Date,
+  openingBalance: { type: Number, default: 0 },
+  income: { type: Number, default: 0 },
+  spending: { type: Number, default: 0 },
+  reversals: { type: Number, default: 0 },
+  adjustments: { type: Number, default: 0 },
+  closingBalance: { type: Number, default: 0 },
+  transactionCount: { type: Number, default: 0 },
+  invoices: {
+    incomeCount: { type: Number, default: 0 },
+    incomeTotal: { type: Number, default: 0 },
+    spendingCount: { type: Number, default: 0 },
+    spendingTotal: { type: Number, default: 0 },
+    deletedCount: { type: Number, default: 0 },
+  },
+  dirty: {
+    type: Boolean,
+    default: true,
+  },
+  dirtiedAt: Date,
+  closedAt: Date,
+}, {
+  versionKey: false,
+});
+
+ledgerCheckpointSchema.index({ office: 1, ledger: 1, period: 1 }, { unique: true });
+ledgerCheckpointSchema.index({ office: 1, dirty: 1, period: 1 });
+
+module.exports = mongoose.model('LedgerCheckpoint', ledgerCheckpointSchema);
@@ -1,5 +1,6 @@
 const mongoose = require('mongoose');
 const dayjs = require('dayjs');
+const { nextSequence } = require('../utils/counters');
 
 const rentalMonthSchema = new mongoose.Schema({
   monthIndex: Number,
@@ -121,6 +122,9 @@ const rentalContractSchema = new mongoose.Schema({
 rentalContractSchema.index({ rentalSecretaryId: 1, status: 1 });
 rentalContractSchema.index({ unitId: 1, status: 1 });
 rentalContractSchema.index({ referenceNumber: 1 });
+// Month-level lookups for the management and accounting views (utils/rentalMonths.js)
+rentalContractSchema.index({ 'months.monthYear': 1 });
+rentalContractSchema.index({ 'months.dueDate': 1 });
 
 function padNumber(num, size = 4) {
   let s = String(num);
@@ -129,9 +133,12 @@ function padNumber(num, size = 4) {
 }
 
 rentalContractSchema.statics.generateReferenceNumber = async function generateReferenceNumber() {
-  const count = await this.countDocuments();
+  // The sequence starts from the existing contract count the first time it is used
+  const counter = await nextSequence('RentalContract:referenceNumber', {
+    seed: () => this.countDocuments(),
+  });
   const year = dayjs().format('YY');
-  return `RC-${year}-${padNumber(count + 1, 5)}`;
+  return `RC-${year}-${padNumber(counter, 5)}`;
 };
 
 function buildSchedule(startDate, dueDay, duration, rentAmount) {
@@ -161,6 +168,129 @@ rentalContractSchema.methods.ensureSchedule = function ensureSchedule() {
   }
 };
 
+// Pipeline update that moves one schedule month by `delta`, rewrites its
+// payments with `payments` (an expression over $$month.payments) and derives
+// remainingAmount and status in the same write, with the rules used on save.
+function monthPaymentUpdate(monthYear, delta, payments) {
+  return [{
+    $set: {
+      months: {
+        $map: {
+          input: '$months',
+          as: 'month',
+          in: {
+            $cond: [
+              { $eq: ['$$month.monthYear', monthYear] },
+              {
+                $let: {
+                  vars: { totalPaid: { $add: [{ $ifNull: ['$$month.totalPaid', 0] }, delta] } },
+                  in: {
+                    $let: {
+                      vars: { remaining: { $max: [0, { $subtract: ['$$month.dueAmount', '$$totalPaid'] }] } },
+                      in: {
+                        $mergeObjects: ['$$month', {
+                          totalPaid: '$$totalPaid',
+                          remainingAmount: '$$remaining',
+                          status: {
+                            $switch: {
+                              branches: [
+                                { case: { $lte: ['$$remaining', 0] }, then: 'Paid' },
+                                { case: { $gt: ['$$NOW', '$$month.dueDate'] }, then: 'Overdue' },
+                                { case: { $gt: ['$$totalPaid', 0] }, then: 'Partially Paid' },
+                              ],
+                              default: 'Pending',
+                            },
+                          },
+                          payments,
+                        }],
+                      },
+                    },
+                  },
+                },
+              },
+              '$$month',
+            ],
+          },
+        },
+      },
+    },
+  }];
+}
+
+// Payment entry as pipeline values; $literal keeps user input from being read as a field path
+function paymentEntry(payment) {
+  const entry = {};
+  Object.entries(payment).forEach(([field, value]) => {
+    if (value !== undefined) entry[field] = { $literal: value };
+  });
+  return entry;
+}
+
+function addPaymentUpdate(monthYear, payment) {
+  return monthPaymentUpdate(monthYear, payment.amount, {
+    $concatArrays: [{ $ifNull: ['$$month.payments', []] }, [paymentEntry(payment)]],
+  });
+}
+
+function removePaymentUpdate(monthYear, { paymentId, amount }) {
+  return monthPaymentUpdate(monthYear, -amount, {
+    $filter: {
+      input: { $ifNull: ['$$month.payments', []] },
+      cond: { $ne: ['$$this.paymentId', paymentId] },
+    },
+  });
+}
+
+/**
+ * Atomically add a payment to one schedule month.
+ *
+ * @param {ObjectId|string} contractId
+ * @param {string} monthYear - YYYY-MM
+ * @param {Object} payment - { paymentId, amount, method, transactionRef, paymentDate }
+ * @returns {Promise<Object|null>} the updated contract (lean), or null when the contract or month is missing
+ */
+rentalContractSchema.statics.applyMonthPayment = function applyMonthPayment(contractId, monthYear, payment) {
+  return this.findOneAndUpdate(
+    { _id: contractId, 'months.monthYear': monthYear },
+    addPaymentUpdate(monthYear, payment),
+    { new: true, lean: true }
+  );
+};
+
+// Undo applyMonthPayment() when a later step of the payment fails
+rentalContractSchema.statics.revertMonthPayment = function revertMonthPayment(contractId, monthYear, payment) {
+  return this.updateOne(
+    { _id: contractId, months: { $elemMatch: { monthYear, 'payments.paymentId': payment.paymentId } } },
+    removePaymentUpdate(monthYear, payment)
+  );
+};
+
+/**
+ * Add many payments in one unordered bulkWrite (one pipeline update per payment).
+ *
+ * @param {Object[]} payments - { contractId, monthYear, payment } items
+ * @returns {Promise<BulkWriteResult>}
+ */
+rentalContractSchema.statics.applyMonthPayments = function applyMonthPayments(payments) {
+  return this.bulkWrite(payments.map(({ contractId, monthYear, payment }) => ({
+    updateOne: {
+      filter: { _id: contractId, 'months.monthYear': monthYear },
+      update: addPaymentUpdate(monthYear, payment),
+    },
+  })), { ordered: false });
+};
+
+// Undo applyMonthPayments() for the given items
+rentalContractSchema.statics.revertMonthPayments = function revertMonthPayments(payments) {
+  if (!payments.length) return Promise.resolve(null);
+  return this.bulkWrite(payments.map(({ contractId, monthYear, payment }) => ({
+    updateOne: {
+      filter: { _id: contractId, months: { $elemMatch: { monthYear, 'payments.paymentId': payment.paymentId } } },
+      update: removePaymentUpdate(monthYear, payment),
+    },
+  })), { ordered: false });
+};
+
 rentalContractSchema.pre('save', async function preSave(next) {
   if (!this.referenceNumber) {
     this.referenceNumber = await this.constructor.generateReferenceNumber();
@@ -50,6 +50,7 @@ const rentalUnitSchema = new mongoose.Schema({
     type: mongoose.Schema.Types.ObjectId,
     ref: 'RentalContract',
   },
+  // Legacy embedded history, read-only; new events go to RentalUnitHistory
   history: [{
     contractId: {
       type: mongoose.Schema.Types.ObjectId,
@@ -0,0 +1,39 @@
+const mongoose = require('mongoose');
+
+// Append-only event log for rental units (contract created / terminated,
+// payments). Kept out of the RentalUnit document so units do not grow with
+// every payment; entries are only ever inserted.
+const rentalUnitHistorySchema = new mongoose.Schema({
+  unitId: {
+    type: mongoose.Schema.Types.ObjectId,
+    ref: 'RentalUnit',
+    required: true,
+  },
+  contractId: {
+    type: mongoose.Schema.Types.ObjectId,
+    ref: 'RentalContract',
+  },
+  action: {
+    type: String,
+    required: true,
+  },
+  meta: mongoose.Schema.Types.Mixed,
+  timestamp: {
+    type: Date,
+    default: Date.now,
+  },
+}, {
+  versionKey: false,
+});
+
+rentalUnitHistorySchema.index({ unitId: 1, timestamp: -1 });
+
+// Record one event; history is best-effort and never fails the calling request
+rentalUnitHistorySchema.statics.record = function record(entry) {
+  return this.create(entry).catch((error) => {
+    console.error('خطأ في تسجيل سجل الوحدة:', error.message);
+    return null;
+  });
+};
+
+module.exports = mongoose.model('RentalUnitHistory', rentalUnitHistorySchema);
@@ -0,0 +1,38 @@
+const mongoose = require('mongoose');
+
+// One document per run of a scheduled server job (e.g. the overdue-visa check),
+// with what it changed and how long it took. Old reports expire after 90 days.
+const schedulerRunSchema = new mongoose.Schema({
+  job: {
+    type: String,
+    required: true,
+  },
+  trigger: {
+    type: String,
+    enum: ['schedule', 'manual'],
+    default: 'schedule',
+  },
+  status: {
+    type: String,
+    enum: ['success', 'failed'],
+    required: true,
+  },
+  startedAt: {
+    type: Date,
+    required: true,
+  },
+  finishedAt: Date,
+  durationMs: Number,
+  counts: {
+    type: mongoose.Schema.Types.Mixed,
+    default: {},
+  },
+  error: String,
+}, {
+  versionKey: false,
+});
+
+schedulerRunSchema.index({ job: 1, startedAt: -1 });
+schedulerRunSchema.index({ startedAt: 1 }, { expireAfterSeconds: 90 * 24 * 60 * 60 });
+
+module.exports = mongoose.model('SchedulerRun', schedulerRunSchema);
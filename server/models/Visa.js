@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const VisaStat = require('./VisaStat');
 
 const expenseSchema = new mongoose.Schema({
   amount: {
@@ -250,11 +251,28 @@ visaSchema.pre('save', function(next) {
   next();
 });
 
+// لقطة مساهمة التأشيرة في جدول الإحصائيات كما هي في قاعدة البيانات
+visaSchema.post('init', function() {
+  this.$locals.statContributions = VisaStat.contributionsFor(this);
+});
+
+// تحديث جدول الإحصائيات بالفرق فقط بعد كل حفظ (إنشاء، مصروف، بيع، إلغاء، استبدال...)
+visaSchema.post('save', async function() {
+  const before = this.$locals.statContributions || [];
+  const after = VisaStat.contributionsFor(this);
+  try {
+    await VisaStat.applyVisaChange(before, after);
+    this.$locals.statContributions = after;
+  } catch (error) {
+    console.error('❌ فشل تحديث إحصائيات التأشيرات:', error.message);
+  }
+});
+
 // إضافة فهارس قاعدة البيانات لتحسين الأداء
 visaSchema.index({ status: 1 }); // فهرس على حالة التأشيرة
 visaSchema.index({ currentStage: 1 }); // فهرس على المرحلة الحالية
 visaSchema.index({ secretary: 1 }); // فهرس على السكرتيرة
-visaSchema.index({ createdAt: -1 }); // فهرس على تاريخ الإنشاء (ترتيب تنازلي)
+visaSchema.index({ createdAt: -1, _id: -1 }); // فهرس على تاريخ الإنشاء (ترتيب تنازلي، يدعم الترقيم بالمؤشر)
 visaSchema.index({ status: 1, currentStage: 1 }); // فهرس مركب للحالة والمرحلة
 visaSchema.index({ secretary: 1, status: 1 }); // فهرس مركب للسكرتيرة والحالة
 
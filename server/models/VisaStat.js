@@ -0,0 +1,301 @@
+const mongoose = require('mongoose');
+
+// تجميع إحصائيات التأشيرات لكل سكرتيرة ولكل شهر
+// كل تأشيرة تساهم في شهر إنشائها (العدد، الحالة، المصروفات، الدين)
+// وفي شهر بيعها (أرباح السكرتيرة، الربح، ربح الشركة)
+// يتم تحديث الجدول تدريجياً عند حفظ التأشيرة (انظر models/Visa.js)
+const visaStatSchema = new mongoose.Schema({
+  secretary: {
+    type: mongoose.Schema.Types.ObjectId,
+    ref: 'Secretary',
+    required: true
+  },
+  year: {
+    type: Number,
+    required: true
+  },
+  month: {
+    type: Number,
+    required: true
+  },
+
+  // حسب شهر الإنشاء
+  visas: { type: Number, default: 0 },
+  purchasing: { type: Number, default: 0 },
+  awaitingArrival: { type: Number, default: 0 },
+  available: { type: Number, default: 0 },
+  sold: { type: Number, default: 0 },
+  cancelled: { type: Number, default: 0 },
+  expenses: { type: Number, default: 0 },
+  debt: { type: Number, default: 0 },
+  createdCompanyProfit: { type: Number, default: 0 },
+
+  // حسب شهر البيع
+  earnings: { type: Number, default: 0 },
+  profit: { type: Number, default: 0 },
+  companyProfit: { type: Number, default: 0 }
+}, {
+  timestamps: true
+});
+
+visaStatSchema.index({ secretary: 1, year: 1, month: 1 }, { unique: true });
+visaStatSchema.index({ year: 1, month: 1 });
+
+const STATUS_FIELDS = {
+  'قيد_الشراء': 'purchasing',
+  'في_انتظار_الوصول': 'awaitingArrival',
+  'معروضة_للبيع': 'available',
+  'مباعة': 'sold',
+  'ملغاة': 'cancelled'
+};
+
+const bucketOf = (date) => {
+  const d = date ? new Date(date) : new Date();
+  return { year: d.getFullYear(), month: d.getMonth() + 1 };
+};
+
+// مساهمة تأشيرة واحدة في جدول الإحصائيات: [{ secretary, year, month, values }]
+function contributionsFor(visa) {
+  if (!visa || !visa.secretary) return [];
+  const secretary = String(visa.secretary._id || visa.secretary);
+  const totalExpenses = visa.totalExpenses || 0;
+  const isSold = visa.status === 'مباعة';
+
+  const created = {
+    secretary,
+    ...bucketOf(visa.createdAt),
+    values: { visas: 1, expenses: totalExpenses }
+  };
+  const statusField = STATUS_FIELDS[visa.status];
+  if (statusField) created.values[statusField] = 1;
+  if (visa.status === 'ملغاة') created.values.debt = totalExpenses;
+
+  if (!isSold) return [created];
+
+  const profit = visa.profit || 0;
+  const earnings = visa.secretaryEarnings || 0;
+  created.values.createdCompanyProfit = profit - earnings;
+
+  const sold = {
+    secretary,
+    ...bucketOf(visa.soldAt || visa.createdAt),
+    values: { earnings, profit, companyProfit: profit - earnings }
+  };
+  return [created, sold];
+}
+
+// تجميع المساهمات حسب المفتاح (سكرتيرة/سنة/شهر) مع الإشارة (+1 أو -1)
+function addContributions(target, contributions, sign) {
+  contributions.forEach(({ secretary, year, month, values }) => {
+    const key = `${secretary}:${year}:${month}`;
+    if (!target.has(key)) {
+      target.set(key, { secretary, year, month, values: {} });
+    }
+    const entry = target.get(key).values;
+    Object.entries(values).forEach(([field, value]) => {
+      entry[field] = (entry[field] || 0) + sign * value;
+    });
+  });
+  return target;
+}
+
+visaStatSchema.statics.contributionsFor = contributionsFor;
+
+// تطبيق الفرق بين مساهمة التأشيرة قبل التعديل وبعده بعملية واحدة
+visaStatSchema.statics.applyVisaChange = async function(before, after) {
+  const deltas = addContributions(addContributions(new Map(), after, 1), before, -1);
+  const operations = [];
+  deltas.forEach(({ secretary, year, month, values }) => {
+    const inc = {};
+    Object.entries(values).forEach(([field, value]) => {
+      if (value !== 0) inc[field] = value;
+    });
+    if (Object.keys(inc).length) {
+      operations.push({
+        updateOne: {
+          filter: { secretary, year, month },
+          update: { $inc: inc },
+          upsert: true
+        }
+      });
+    }
+  });
+  if (operations.length) {
+    await this.bulkWrite(operations, { ordered: false });
+  }
+  return operations.length;
+};
+
+// إعادة بناء الجدول بالكامل من التأشيرات (للإصلاح أو التشغيل الأول)
+visaStatSchema.statics.rebuild = async function() {
+  const Visa = mongoose.model('Visa');
+  const buckets = new Map();
+  const cursor = Visa.find()
+    .select('secretary status totalExpenses profit secretaryEarnings createdAt soldAt')
+    .lean()
+    .cursor();
+  for await (const visa of cursor) {
+    addContributions(buckets, contributionsFor(visa), 1);
+  }
+
+  const docs = [...buckets.values()].map(({ secretary, year, month, values }) => ({
+    secretary, year, month, ...values
+  }));
+  await this.deleteMany({});
+  if (docs.length) {
+    await this.insertMany(docs, { ordered: false });
+  }
+  return docs.length;
+};
+
+/**
+ * تلخيص الإحصائيات من الجدول المجمّع
+ * @param {Object} match - فلتر إضافي (مثلاً { secretary })
+ * @param {Object} options - groupBySecretary لتجميع النتائج لكل سكرتيرة
+ * @returns {Promise<Array>} صف لكل سكرتيرة (أو صف واحد للشركة)
+ */
+visaStatSchema.statics.summarize = async function(match = {}, { groupBySecretary = false, now = new Date() } = {}) {
+  await this.ensureBuilt();
+  const year = now.getFullYear();
+  const month = now.getMonth() + 1;
+  const isYear = { $eq: ['$year', year] };
+  const isMonth = { $and: [isYear, { $eq: ['$month', month] }] };
+  const when = (cond, field) => ({ $sum: { $cond: [cond, `$${field}`, 0] } });
+
+  return this.aggregate([
+    { $match: match },
+    {
+      $group: {
+        _id: groupBySecretary ? '$secretary' : null,
+        totalVisas: { $sum: '$visas' },
+        activeVisas: { $sum: '$purchasing' },
+        awaitingArrivalVisas: { $sum: '$awaitingArrival' },
+        availableVisas: { $sum: '$available' },
+        soldVisas: { $sum: '$sold' },
+        cancelledVisas: { $sum: '$cancelled' },
+        totalExpenses: { $sum: '$expenses' },
+        totalEarnings: { $sum: '$earnings' },
+        totalDebt: { $sum: '$debt' },
+        totalProfit: { $sum: '$profit' },
+        totalCompanyProfit: { $sum: '$companyProfit' },
+        monthlyExpenses: when(isMonth, 'expenses'),
+        monthlyEarnings: when(isMonth, 'earnings'),
+        monthlyCompanyProfit: when(isMonth, 'createdCompanyProfit'),
+        yearlyExpenses: when(isYear, 'expenses'),
+        yearlyEarnings: when(isYear, 'earnings'),
+        yearlyCompanyProfit: when(isYear, 'companyProfit')
+      }
+    }
+  ]);
+};
+
+// صف إحصائيات فارغ عند عدم وجود بيانات
+visaStatSchema.statics.emptySummary = function() {
+  return {
+    totalVisas: 0,
+    activeVisas: 0,
+    awaitingArrivalVisas: 0,
+    availableVisas: 0,
+    soldVisas: 0,
+    cancelledVisas: 0,
+    totalExpenses: 0,
+    totalEarnings: 0,
+    totalDebt: 0,
+    totalProfit: 0,
+    totalCompanyProfit: 0,
+    monthlyExpenses: 0,
+    monthlyEarnings: 0,
+    monthlyCompanyProfit: 0,
+    yearlyExpenses: 0,
+    yearlyEarnings: 0,
+    yearlyCompanyProfit: 0
+  };
+};
+
+// إحصائيات السكرتيرة بالشكل الذي تعيده نقاط النهاية
+visaStatSchema.statics.toSecretaryStatistics = function(row) {
+  const stats = { ...this.emptySummary(), ...row };
+  return {
+    totalVisas: stats.totalVisas,
+    activeVisas: stats.activeVisas,
+    availableVisas: stats.availableVisas,
+    soldVisas: stats.soldVisas,
+    cancelledVisas: stats.cancelledVisas,
+    totalExpenses: stats.totalExpenses,
+    totalEarnings: stats.totalEarnings,
+    totalDebt: stats.totalDebt,
+    totalProfit: stats.totalProfit,
+    averageProfitPerVisa: stats.soldVisas > 0 ? stats.totalProfit / stats.soldVisas : 0,
+    monthlyExpenses: stats.monthlyExpenses,
+    monthlyEarnings: stats.monthlyEarnings,
+    yearlyExpenses: stats.yearlyExpenses,
+    yearlyEarnings: stats.yearlyEarnings
+  };
+};
+
+visaStatSchema.statics.forSecretary = async function(secretaryId) {
+  const [row] = await this.summarize({ secretary: new mongoose.Types.ObjectId(String(secretaryId)) });
+  return this.toSecretaryStatistics(row);
+};
+
+// الإحصائيات الشهرية والسنوية بصيغة Account.monthlyStats / Account.yearlyStats
+// profitField: earnings لحساب السكرتيرة أو companyProfit لحساب الشركة
+visaStatSchema.statics.periodStats = async function(match = {}, profitField = 'companyProfit') {
+  await this.ensureBuilt();
+  const monthlyStats = await this.aggregate([
+    { $match: match },
+    {
+      $group: {
+        _id: { year: '$year', month: '$month' },
+        expenses: { $sum: '$expenses' },
+        profit: { $sum: `$${profitField}` },
+        visasBought: { $sum: '$visas' },
+        visasSold: { $sum: '$sold' },
+        visasCancelled: { $sum: '$cancelled' }
+      }
+    },
+    { $sort: { '_id.year': 1, '_id.month': 1 } },
+    { $project: { _id: 0, year: '$_id.year', month: '$_id.month', expenses: 1, profit: 1, visasBought: 1, visasSold: 1, visasCancelled: 1 } }
+  ]);
+
+  const years = new Map();
+  monthlyStats.forEach(({ year, expenses, profit, visasBought, visasSold, visasCancelled }) => {
+    const entry = years.get(year) || { year, expenses: 0, profit: 0, visasBought: 0, visasSold: 0, visasCancelled: 0 };
+    entry.expenses += expenses;
+    entry.profit += profit;
+    entry.visasBought += visasBought;
+    entry.visasSold += visasSold;
+    entry.visasCancelled += visasCancelled;
+    years.set(year, entry);
+  });
+  const yearlyStats = [...years.values()].map((entry) => ({
+    ...entry,
+    averageProfitPerVisa: entry.visasSold > 0 ? entry.profit / entry.visasSold : 0
+  }));
+
+  return { monthlyStats, yearlyStats };
+};
+
+// بناء الجدول مرة واحدة لكل عملية إذا لم يطابق عدد التأشيرات (أول تشغيل أو بيانات قديمة)
+let builtCheck = null;
+visaStatSchema.statics.ensureBuilt = function() {
+  if (!builtCheck) {
+    builtCheck = (async () => {
+      const Visa = mongoose.model('Visa');
+      const [rollup, visaCount] = await Promise.all([
+        this.aggregate([{ $group: { _id: null, visas: { $sum: '$visas' } } }]),
+        Visa.countDocuments()
+      ]);
+      if ((rollup[0]?.visas || 0) !== visaCount) {
+        console.log('🔄 إعادة بناء جدول إحصائيات التأشيرات...');
+        await this.rebuild();
+      }
+    })().catch((error) => {
+      builtCheck = null;
+      throw error;
+    });
+  }
+  return builtCheck;
+};
+
+module.exports = mongoose.model('VisaStat', visaStatSchema);
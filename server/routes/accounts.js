@@ -3,33 +3,17 @@ const router = express.Router();
 const Account = require('../models/Account');
 const Secretary = require('../models/Secretary');
 const Visa = require('../models/Visa');
+const VisaStat = require('../models/VisaStat');
+const { queryCache, cacheResponse, clearEverywhere } = require('../utils/queryCache');
+const { getVisaSummary } = require('../utils/overview');
+const { authCacheStatus } = require('../utils/auth');
 
-// In-memory cache for dashboard data (5 minutes TTL)
-let dashboardCache = {
-  data: null,
-  timestamp: 0,
-  TTL: 5 * 60 * 1000 // 5 minutes
-};
-
-// Function to clear server-side cache
-const clearServerCache = () => {
-  dashboardCache.data = null;
-  dashboardCache.timestamp = 0;
-  console.log('🧹 Server-side dashboard cache cleared');
-};
+// Dashboard reads are cached until a visa, secretary or account write bumps their collection version
+const dashboardSources = [Visa, VisaStat, Secretary, Account];
 
 // الحصول على حساب الشركة (فرصتكم) - محسّن مع التخزين المؤقت
-router.get('/company', async (req, res) => {
+router.get('/company', cacheResponse(dashboardSources), async (req, res) => {
   try {
-    // Check cache first
-    const now = Date.now();
-    if (dashboardCache.data && (now - dashboardCache.timestamp) < dashboardCache.TTL) {
-      console.log('📦 Dashboard cache hit - serving cached data');
-      return res.json(dashboardCache.data);
-    }
-
-    console.log('🔄 Dashboard cache miss - fetching fresh data');
-
     let companyAccount = await Account.findOne({ type: 'شركة' });
     
     if (!companyAccount) {
@@ -41,73 +25,17 @@ router.get('/company', async (req, res) => {
       await companyAccount.save();
     }
 
-    // حساب الإحصائيات باستخدام تجميع قاعدة البيانات (أسرع بكثير)
-    const stats = await Visa.aggregate([
-      {
-        $group: {
-          _id: null,
-          totalVisas: { $sum: 1 },
-          totalExpenses: { $sum: "$totalExpenses" },
-          soldVisas: {
-            $sum: {
-              $cond: [{ $eq: ["$status", "مباعة"] }, 1, 0]
-            }
-          },
-          cancelledVisas: {
-            $sum: {
-              $cond: [{ $eq: ["$status", "ملغاة"] }, 1, 0]
-            }
-          },
-          activeVisas: {
-            $sum: {
-              $cond: [{ $eq: ["$status", "قيد_الشراء"] }, 1, 0]
-            }
-          },
-          availableVisas: {
-            $sum: {
-              $cond: [{ $eq: ["$status", "معروضة_للبيع"] }, 1, 0]
-            }
-          },
-          totalProfit: {
-            $sum: {
-              $cond: [
-                { $eq: ["$status", "مباعة"] },
-                { $subtract: ["$profit", "$secretaryEarnings"] },
-                0
-              ]
-            }
-          },
-          totalSecretaryEarnings: {
-            $sum: {
-              $cond: [
-                { $eq: ["$status", "مباعة"] },
-                "$secretaryEarnings",
-                0
-              ]
-            }
-          }
-        }
-      }
-    ]);
-
-    const statsData = stats[0] || {
-      totalVisas: 0,
-      totalExpenses: 0,
-      soldVisas: 0,
-      cancelledVisas: 0,
-      activeVisas: 0,
-      availableVisas: 0,
-      totalProfit: 0,
-      totalSecretaryEarnings: 0
-    };
+    // الإحصائيات من جدول الإحصائيات المجمّع (سكرتيرة/شهر)
+    const [statsRow] = await VisaStat.summarize();
+    const statsData = { ...VisaStat.emptySummary(), ...statsRow };
 
     const totalVisasBought = statsData.totalVisas;
     const totalVisasSold = statsData.soldVisas;
     const totalVisasCancelled = statsData.cancelledVisas;
     const totalActiveVisas = statsData.activeVisas + statsData.availableVisas;
     const totalExpenses = statsData.totalExpenses;
-    const totalProfit = statsData.totalProfit;
-    const totalSecretaryEarnings = statsData.totalSecretaryEarnings;
+    const totalProfit = statsData.totalCompanyProfit;
+    const totalSecretaryEarnings = statsData.totalEarnings;
     
     // جلب تفاصيل التأشيرات المباعة فقط (محدود جداً لتحسين الأداء)
     const soldVisasDetails = await Visa.find({ status: 'مباعة' })
@@ -195,78 +123,11 @@ router.get('/company', async (req, res) => {
       };
     });
 
-    // حساب الإحصائيات الشهرية والسنوية باستخدام تجميع قاعدة البيانات
-    const currentYear = new Date().getFullYear();
-    const currentMonth = new Date().getMonth() + 1;
-
-    const monthlyStats = await Visa.aggregate([
-      {
-        $match: {
-          $expr: {
-            $and: [
-              { $eq: [{ $year: "$createdAt" }, currentYear] },
-              { $eq: [{ $month: "$createdAt" }, currentMonth] }
-            ]
-          }
-        }
-      },
-      {
-        $group: {
-          _id: null,
-          monthlyExpenses: { $sum: "$totalExpenses" },
-          monthlySoldProfit: {
-            $sum: {
-              $cond: [
-                { $eq: ["$status", "مباعة"] },
-                { $subtract: ["$profit", "$secretaryEarnings"] },
-                0
-              ]
-            }
-          }
-        }
-      }
-    ]);
-
-    const yearlyStats = await Visa.aggregate([
-      {
-        $match: {
-          $expr: { $eq: [{ $year: "$createdAt" }, currentYear] }
-        }
-      },
-      {
-        $group: {
-          _id: null,
-          yearlyExpenses: { $sum: "$totalExpenses" }
-        }
-      }
-    ]);
-
-    const monthlyData = monthlyStats[0] || { monthlyExpenses: 0, monthlySoldProfit: 0 };
-    const yearlyData = yearlyStats[0] || { yearlyExpenses: 0 };
-
-    const monthlyExpenses = monthlyData.monthlyExpenses;
-    const monthlyProfit = monthlyData.monthlySoldProfit;
-    const yearlyExpenses = yearlyData.yearlyExpenses;
-
-    // حساب الربح السنوي للتأشيرات المباعة
-    const yearlyProfitStats = await Visa.aggregate([
-      {
-        $match: {
-          status: 'مباعة',
-          $expr: { $eq: [{ $year: "$soldAt" }, currentYear] }
-        }
-      },
-      {
-        $group: {
-          _id: null,
-          yearlyProfit: {
-            $sum: { $subtract: ["$profit", "$secretaryEarnings"] }
-          }
-        }
-      }
-    ]);
-
-    const yearlyProfit = yearlyProfitStats[0]?.yearlyProfit || 0;
+    // الإحصائيات الشهرية والسنوية
+    const monthlyExpenses = statsData.monthlyExpenses;
+    const monthlyProfit = statsData.monthlyCompanyProfit;
+    const yearlyExpenses = statsData.yearlyExpenses;
+    const yearlyProfit = statsData.yearlyCompanyProfit;
 
     const averageProfitPerVisa = totalVisasSold > 0 ? totalProfit / totalVisasSold : 0;
 
@@ -289,11 +150,6 @@ router.get('/company', async (req, res) => {
           }
         };
 
-        // Cache the result for 5 minutes
-        dashboardCache.data = companyData;
-        dashboardCache.timestamp = Date.now();
-        console.log('💾 Dashboard data cached successfully');
-
         res.json(companyData);
   } catch (error) {
     res.status(500).json({ message: error.message });
@@ -301,86 +157,10 @@ router.get('/company', async (req, res) => {
 });
 
 // نقطة نهاية محسّنة للوحة التحكم - بيانات أساسية فقط
-router.get('/summary', async (req, res) => {
+router.get('/summary', cacheResponse(dashboardSources), async (req, res) => {
   try {
-    // Check cache first
-    const now = Date.now();
-    if (dashboardCache.data && (now - dashboardCache.timestamp) < dashboardCache.TTL) {
-      console.log('📦 Dashboard summary cache hit');
-      const summary = {
-        totalVisas: dashboardCache.data.statistics.totalVisasBought,
-        activeVisas: dashboardCache.data.statistics.totalActiveVisas,
-        availableVisas: dashboardCache.data.statistics.availableVisas || 0,
-        soldVisas: dashboardCache.data.statistics.totalVisasSold,
-        cancelledVisas: dashboardCache.data.statistics.totalVisasCancelled,
-        totalExpenses: dashboardCache.data.statistics.totalExpenses,
-        totalProfit: dashboardCache.data.statistics.totalProfit,
-        totalSecretaryEarnings: dashboardCache.data.statistics.totalSecretaryEarnings || 0,
-        totalCompanyProfit: dashboardCache.data.statistics.totalProfit,
-        totalSecretaryDebt: 0,
-        secretaryCount: await Secretary.countDocuments(),
-        overdueVisas: 0
-      };
-      return res.json(summary);
-    }
-
-    // Fast aggregation for dashboard summary only
-    const [stats, secretaryCount] = await Promise.all([
-      Visa.aggregate([
-        {
-          $group: {
-            _id: null,
-            totalVisas: { $sum: 1 },
-            totalExpenses: { $sum: "$totalExpenses" },
-            soldVisas: { $sum: { $cond: [{ $eq: ["$status", "مباعة"] }, 1, 0] } },
-            cancelledVisas: { $sum: { $cond: [{ $eq: ["$status", "ملغاة"] }, 1, 0] } },
-            activeVisas: { $sum: { $cond: [{ $eq: ["$status", "قيد_الشراء"] }, 1, 0] } },
-            availableVisas: { $sum: { $cond: [{ $eq: ["$status", "معروضة_للبيع"] }, 1, 0] } },
-            totalProfit: {
-              $sum: {
-                $cond: [
-                  { $eq: ["$status", "مباعة"] },
-                  { $subtract: ["$profit", "$secretaryEarnings"] },
-                  0
-                ]
-              }
-            },
-            totalSecretaryEarnings: {
-              $sum: {
-                $cond: [{ $eq: ["$status", "مباعة"] }, "$secretaryEarnings", 0]
-              }
-            }
-          }
-        }
-      ]),
-      Secretary.countDocuments()
-    ]);
-
-    const statsData = stats[0] || {
-      totalVisas: 0,
-      totalExpenses: 0,
-      soldVisas: 0,
-      cancelledVisas: 0,
-      activeVisas: 0,
-      availableVisas: 0,
-      totalProfit: 0,
-      totalSecretaryEarnings: 0
-    };
-
-    const summary = {
-      totalVisas: statsData.totalVisas,
-      activeVisas: statsData.activeVisas,
-      availableVisas: statsData.availableVisas,
-      soldVisas: statsData.soldVisas,
-      cancelledVisas: statsData.cancelledVisas,
-      totalExpenses: statsData.totalExpenses,
-      totalProfit: statsData.totalProfit,
-      totalSecretaryEarnings: statsData.totalSecretaryEarnings,
-      totalCompanyProfit: statsData.totalProfit,
-      totalSecretaryDebt: 0,
-      secretaryCount: secretaryCount,
-      overdueVisas: 0
-    };
+    // Summary from the per-secretary monthly rollup
+    const summary = await getVisaSummary();
 
     console.log('⚡ Dashboard summary generated in fast mode');
     res.json(summary);
@@ -391,86 +171,93 @@ router.get('/summary', async (req, res) => {
 });
 
 // الحصول على جميع حسابات السكرتارية
-router.get('/secretaries', async (req, res) => {
+// الإحصائيات من تجميع واحد على الجدول المجمّع، والتأشيرات اختيارية ومرقّمة:
+// ?includeVisas=true&visaPage=1&visaLimit=20
+router.get('/secretaries', cacheResponse(dashboardSources), async (req, res) => {
   try {
-    const secretaries = await Secretary.find().sort({ name: 1 });
-    const secretaryAccounts = [];
+    const { includeVisas, visaPage = 1, visaLimit = 20 } = req.query;
 
-    for (const secretary of secretaries) {
-      const account = await Account.findOne({ 
-        type: 'سكرتيرة', 
-        secretaryId: secretary._id 
-      });
-
-      if (!account) {
-        // إنشاء الحساب إذا لم يكن موجوداً
-        const newAccount = new Account({
-          name: `حساب ${secretary.name}`,
-          type: 'سكرتيرة',
-          secretaryId: secretary._id
-        });
-        await newAccount.save();
-      }
-
-      // الحصول على جميع التأشيرات لهذه السكرتيرة
-      const visas = await Visa.find({ secretary: secretary._id });
-      const soldVisas = visas.filter(v => v.status === 'مباعة');
-      const cancelledVisas = visas.filter(v => v.status === 'ملغاة');
-      const activeVisas = visas.filter(v => v.status === 'قيد_الشراء');
-      const availableVisas = visas.filter(v => v.status === 'معروضة_للبيع');
+    const [secretaries, accounts, statsRows] = await Promise.all([
+      Secretary.find().sort({ name: 1 }),
+      Account.find({ type: 'سكرتيرة' }),
+      VisaStat.summarize({}, { groupBySecretary: true })
+    ]);
 
-      // حساب الإحصائيات الفورية
-      const totalExpenses = visas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-      const totalEarnings = soldVisas.reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-      const totalDebt = cancelledVisas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-      const totalProfit = soldVisas.reduce((sum, visa) => sum + visa.profit, 0);
+    const accountsBySecretary = new Map(accounts.map(account => [String(account.secretaryId), account]));
+
+    // إنشاء الحسابات المفقودة دفعة واحدة
+    const missing = secretaries.filter(secretary => !accountsBySecretary.has(String(secretary._id)));
+    if (missing.length > 0) {
+      await Account.bulkWrite(missing.map(secretary => ({
+        updateOne: {
+          filter: { type: 'سكرتيرة', secretaryId: secretary._id },
+          update: {
+            $setOnInsert: {
+              name: `حساب ${secretary.name}`,
+              type: 'سكرتيرة',
+              secretaryId: secretary._id,
+              createdAt: new Date(),
+              updatedAt: new Date()
+            }
+          },
+          upsert: true
+        }
+      })), { ordered: false });
 
-      // حساب الإحصائيات الشهرية والسنوية
-      const currentYear = new Date().getFullYear();
-      const currentMonth = new Date().getMonth() + 1;
+      const created = await Account.find({
+        type: 'سكرتيرة',
+        secretaryId: { $in: missing.map(secretary => secretary._id) }
+      });
+      created.forEach(account => accountsBySecretary.set(String(account.secretaryId), account));
+    }
 
-      const monthlyExpenses = visas
-        .filter(v => new Date(v.createdAt).getFullYear() === currentYear && 
-                     new Date(v.createdAt).getMonth() + 1 === currentMonth)
-        .reduce((sum, visa) => sum + visa.totalExpenses, 0);
+    const statsBySecretary = new Map(statsRows.map(row => [String(row._id), row]));
 
-      const monthlyEarnings = soldVisas
-        .filter(v => new Date(v.soldAt).getFullYear() === currentYear && 
-                     new Date(v.soldAt).getMonth() + 1 === currentMonth)
-        .reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
+    // التأشيرات لكل سكرتيرة (صفحة واحدة) بتجميع واحد
+    let visasBySecretary = null;
+    let pageNum = 1;
+    let limitNum = 20;
+    if (includeVisas === 'true') {
+      pageNum = Math.max(1, parseInt(visaPage, 10) || 1);
+      limitNum = Math.min(100, Math.max(1, parseInt(visaLimit, 10) || 20));
+      const skip = (pageNum - 1) * limitNum;
 
-      const yearlyExpenses = visas
-        .filter(v => new Date(v.createdAt).getFullYear() === currentYear)
-        .reduce((sum, visa) => sum + visa.totalExpenses, 0);
+      const visaGroups = await Visa.aggregate([
+        { $match: { secretary: { $in: secretaries.map(secretary => secretary._id) } } },
+        { $sort: { createdAt: -1, _id: -1 } },
+        {
+          $group: {
+            _id: '$secretary',
+            visas: { $firstN: { input: '$$ROOT', n: skip + limitNum } },
+            total: { $sum: 1 }
+          }
+        },
+        { $project: { total: 1, visas: { $slice: ['$visas', skip, limitNum] } } }
+      ]);
+      visasBySecretary = new Map(visaGroups.map(group => [String(group._id), group]));
+    }
 
-      const yearlyEarnings = soldVisas
-        .filter(v => new Date(v.soldAt).getFullYear() === currentYear)
-        .reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
+    const secretaryAccounts = secretaries.map(secretary => {
+      const id = String(secretary._id);
+      const entry = {
+        secretary,
+        account: accountsBySecretary.get(id),
+        statistics: VisaStat.toSecretaryStatistics(statsBySecretary.get(id))
+      };
 
-      const averageProfitPerVisa = soldVisas.length > 0 ? totalProfit / soldVisas.length : 0;
+      if (visasBySecretary) {
+        const group = visasBySecretary.get(id) || { visas: [], total: 0 };
+        entry.visas = group.visas;
+        entry.visasPagination = {
+          page: pageNum,
+          limit: limitNum,
+          total: group.total,
+          pages: Math.max(1, Math.ceil(group.total / limitNum))
+        };
+      }
 
-      secretaryAccounts.push({
-        secretary,
-        account: account || newAccount,
-        statistics: {
-          totalVisas: visas.length,
-          activeVisas: activeVisas.length,
-          availableVisas: availableVisas.length,
-          soldVisas: soldVisas.length,
-          cancelledVisas: cancelledVisas.length,
-          totalExpenses,
-          totalEarnings,
-          totalDebt,
-          totalProfit,
-          averageProfitPerVisa,
-          monthlyExpenses,
-          monthlyEarnings,
-          yearlyExpenses,
-          yearlyEarnings
-        },
-        visas
-      });
-    }
+      return entry;
+    });
 
     res.json(secretaryAccounts);
   } catch (error) {
@@ -479,7 +266,7 @@ router.get('/secretaries', async (req, res) => {
 });
 
 // الحصول على حساب سكرتيرة محددة
-router.get('/secretaries/:id', async (req, res) => {
+router.get('/secretaries/:id', cacheResponse(dashboardSources), async (req, res) => {
   try {
     const secretary = await Secretary.findById(req.params.id);
     if (!secretary) {
@@ -500,62 +287,16 @@ router.get('/secretaries/:id', async (req, res) => {
       await account.save();
     }
 
-    // الحصول على جميع التأشيرات لهذه السكرتيرة
-    const visas = await Visa.find({ secretary: req.params.id });
-    const soldVisas = visas.filter(v => v.status === 'مباعة');
-    const cancelledVisas = visas.filter(v => v.status === 'ملغاة');
-    const activeVisas = visas.filter(v => v.status === 'قيد_الشراء');
-    const availableVisas = visas.filter(v => v.status === 'معروضة_للبيع');
-
-    // حساب الإحصائيات الفورية
-    const totalExpenses = visas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-    const totalEarnings = soldVisas.reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-    const totalDebt = cancelledVisas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-    const totalProfit = soldVisas.reduce((sum, visa) => sum + visa.profit, 0);
-
-    // حساب الإحصائيات الشهرية والسنوية
-    const currentYear = new Date().getFullYear();
-    const currentMonth = new Date().getMonth() + 1;
-
-    const monthlyExpenses = visas
-      .filter(v => new Date(v.createdAt).getFullYear() === currentYear && 
-                   new Date(v.createdAt).getMonth() + 1 === currentMonth)
-      .reduce((sum, visa) => sum + visa.totalExpenses, 0);
-
-    const monthlyEarnings = soldVisas
-      .filter(v => new Date(v.soldAt).getFullYear() === currentYear && 
-                   new Date(v.soldAt).getMonth() + 1 === currentMonth)
-      .reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-
-    const yearlyExpenses = visas
-      .filter(v => new Date(v.createdAt).getFullYear() === currentYear)
-      .reduce((sum, visa) => sum + visa.totalExpenses, 0);
-
-    const yearlyEarnings = soldVisas
-      .filter(v => new Date(v.soldAt).getFullYear() === currentYear)
-      .reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-
-    const averageProfitPerVisa = soldVisas.length > 0 ? totalProfit / soldVisas.length : 0;
+    // الإحصائيات من الجدول المجمّع، والتأشيرات للعرض فقط
+    const [statistics, visas] = await Promise.all([
+      VisaStat.forSecretary(req.params.id),
+      Visa.find({ secretary: req.params.id })
+    ]);
 
     const secretaryAccountData = {
       secretary,
       account,
-      statistics: {
-        totalVisas: visas.length,
-        activeVisas: activeVisas.length,
-        availableVisas: availableVisas.length,
-        soldVisas: soldVisas.length,
-        cancelledVisas: cancelledVisas.length,
-        totalExpenses,
-        totalEarnings,
-        totalDebt,
-        totalProfit,
-        averageProfitPerVisa,
-        monthlyExpenses,
-        monthlyEarnings,
-        yearlyExpenses,
-        yearlyEarnings
-      },
+      statistics,
       visas
     };
 
@@ -577,50 +318,49 @@ router.put('/update-statistics', async (req, res) => {
         return res.status(404).json({ message: 'السكرتيرة غير موجودة' });
       }
 
-      const visas = await Visa.find({ secretary: secretaryId });
-      const soldVisas = visas.filter(v => v.status === 'مباعة');
-      const cancelledVisas = visas.filter(v => v.status === 'ملغاة');
-
-      const totalExpenses = visas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-      const totalEarnings = soldVisas.reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-      const totalDebt = cancelledVisas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
+      const secretaryMatch = { secretary: secretary._id };
+      const [statistics, periods] = await Promise.all([
+        VisaStat.forSecretary(secretary._id),
+        VisaStat.periodStats(secretaryMatch, 'earnings')
+      ]);
 
       // تحديث السكرتيرة
-      secretary.totalEarnings = totalEarnings;
-      secretary.totalDebt = totalDebt;
+      secretary.totalEarnings = statistics.totalEarnings;
+      secretary.totalDebt = statistics.totalDebt;
       await secretary.save();
 
       // تحديث حساب السكرتيرة
       let account = await Account.findOne({ type: 'سكرتيرة', secretaryId });
       if (account) {
-        account.totalExpenses = totalExpenses;
-        account.totalEarnings = totalEarnings;
-        account.totalDebt = totalDebt;
-        account.totalVisasBought = visas.length;
-        account.totalVisasSold = soldVisas.length;
-        account.totalVisasCancelled = cancelledVisas.length;
-        account.activeVisas = visas.filter(v => v.status === 'قيد_الشراء').length;
+        account.totalExpenses = statistics.totalExpenses;
+        account.totalEarnings = statistics.totalEarnings;
+        account.totalDebt = statistics.totalDebt;
+        account.totalVisasBought = statistics.totalVisas;
+        account.totalVisasSold = statistics.soldVisas;
+        account.totalVisasCancelled = statistics.cancelledVisas;
+        account.activeVisas = statistics.activeVisas;
+        account.monthlyStats = periods.monthlyStats;
+        account.yearlyStats = periods.yearlyStats;
         await account.save();
       }
     } else {
       // تحديث حساب الشركة
-      const allVisas = await Visa.find();
-      const soldVisas = allVisas.filter(v => v.status === 'مباعة');
-      const cancelledVisas = allVisas.filter(v => v.status === 'ملغاة');
-
-      const totalExpenses = allVisas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-      const totalProfit = soldVisas.reduce((sum, visa) => sum + (visa.profit - visa.secretaryEarnings), 0);
+      const [[statsRow], periods] = await Promise.all([
+        VisaStat.summarize(),
+        VisaStat.periodStats({}, 'companyProfit')
+      ]);
+      const statsData = { ...VisaStat.emptySummary(), ...statsRow };
 
       let companyAccount = await Account.findOne({ type: 'شركة' });
       if (companyAccount) {
-        companyAccount.totalExpenses = totalExpenses;
-        companyAccount.totalProfit = totalProfit;
-        companyAccount.totalVisasBought = allVisas.length;
-        companyAccount.totalVisasSold = soldVisas.length;
-        companyAccount.totalVisasCancelled = cancelledVisas.length;
-        companyAccount.activeVisas = allVisas.filter(v => 
-          v.status === 'قيد_الشراء' || v.status === 'معروضة_للبيع'
-        ).length;
+        companyAccount.totalExpenses = statsData.totalExpenses;
+        companyAccount.totalProfit = statsData.totalCompanyProfit;
+        companyAccount.totalVisasBought = statsData.totalVisas;
+        companyAccount.totalVisasSold = statsData.soldVisas;
+        companyAccount.totalVisasCancelled = statsData.cancelledVisas;
+        companyAccount.activeVisas = statsData.activeVisas + statsData.availableVisas;
+        companyAccount.monthlyStats = periods.monthlyStats;
+        companyAccount.yearlyStats = periods.yearlyStats;
         await companyAccount.save();
       }
     }
@@ -672,7 +412,8 @@ router.get('/summary', async (req, res) => {
 // Clear server-side cache endpoint
 router.post('/clear-cache', async (req, res) => {
   try {
-    clearServerCache();
+    clearEverywhere();
+    console.log('🧹 Server-side query cache cleared');
     
     res.json({
       success: true,
@@ -695,13 +436,8 @@ router.post('/clear-cache', async (req, res) => {
 router.get('/cache-status', async (req, res) => {
   try {
     const status = {
-      dashboardCache: {
-        hasData: !!dashboardCache.data,
-        timestamp: dashboardCache.timestamp,
-        age: dashboardCache.timestamp ? Date.now() - dashboardCache.timestamp : 0,
-        ttl: dashboardCache.TTL,
-        expired: dashboardCache.timestamp ? (Date.now() - dashboardCache.timestamp) > dashboardCache.TTL : true
-      },
+      queryCache: queryCache.status(),
+      authCache: authCacheStatus(),
       serverTime: new Date().toISOString()
     };
     
@@ -1,13 +1,28 @@
 const express = require('express');
 const router = express.Router();
-const ExcelJS = require('exceljs');
 const Visa = require('../models/Visa');
+const VisaStat = require('../models/VisaStat');
 const Secretary = require('../models/Secretary');
 const RentalContract = require('../models/RentalContract');
 const RentalPayment = require('../models/RentalPayment');
 const RentalUnit = require('../models/RentalUnit');
 const RentingSecretary = require('../models/RentingSecretary');
 const moment = require('moment');
+const {
+  HEADER_STYLE,
+  setDownloadHeaders,
+  createWorkbookWriter,
+  createWorkbookStream,
+  styleHeaderRow,
+  exportCursor,
+  commitRow,
+  streamRows,
+  exportFailed,
+} = require('../utils/excelStream');
+const { exportJobs, UnknownExportError } = require('../utils/exportJobs');
+
+// جميع التصديرات تُكتب بشكل متدفق: الصفوف تُقرأ من مؤشر قاعدة البيانات
+// وتُرسل إلى الاستجابة صفاً بصف بدلاً من تحميل كل البيانات في الذاكرة
 
 // دالة مساعدة لتنسيق التاريخ
 const formatDate = (date) => {
@@ -25,118 +40,99 @@ const bilingualHeader = (arabic, english) => {
   return `${arabic} / ${english}`;
 };
 
+const visaReference = (visa) => `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`;
+
+// أعمدة قائمة التأشيرات
+const visaColumns = [
+  { header: 'المرجع', key: 'reference', width: 15 },
+  { header: 'الاسم', key: 'name', width: 25 },
+  { header: 'تاريخ الميلاد', key: 'dateOfBirth', width: 15 },
+  { header: 'الجنسية', key: 'nationality', width: 15 },
+  { header: 'رقم الجواز', key: 'passportNumber', width: 20 },
+  { header: 'رقم التأشيرة', key: 'visaNumber', width: 20 },
+  { header: 'السكرتيرة', key: 'secretary', width: 20 },
+  { header: 'المرحلة الحالية', key: 'currentStage', width: 15 },
+  { header: 'تاريخ إصدار التأشيرة', key: 'visaIssueDate', width: 15 },
+  { header: 'تاريخ انتهاء التأشيرة', key: 'visaExpiryDate', width: 15 },
+  { header: 'الموعد النهائي', key: 'visaDeadline', width: 15 },
+  { header: 'إجمالي المصروفات', key: 'totalExpenses', width: 15 },
+  { header: 'سعر البيع', key: 'sellingPrice', width: 15 },
+  { header: 'الربح', key: 'profit', width: 15 },
+  { header: 'أرباح السكرتيرة', key: 'secretaryEarnings', width: 20 },
+  { header: 'ربح الشركة', key: 'companyProfit', width: 15 },
+  { header: 'سكرتيرة البيع', key: 'sellingSecretary', width: 20 },
+  { header: 'عمولة البيع', key: 'sellingCommission', width: 15 },
+  { header: 'اسم العميل', key: 'customerName', width: 25 },
+  { header: 'هاتف العميل', key: 'customerPhone', width: 20 },
+  { header: 'تاريخ الإنشاء', key: 'createdAt', width: 15 },
+  { header: 'الحالة', key: 'status', width: 15 }
+];
+
+const visaRow = (visa) => ({
+  reference: visaReference(visa),
+  name: visa.name || '',
+  dateOfBirth: formatDate(visa.dateOfBirth),
+  nationality: visa.nationality || '',
+  passportNumber: visa.passportNumber || '',
+  visaNumber: visa.visaNumber || '',
+  secretary: visa.secretary ? visa.secretary.name : '',
+  currentStage: visa.currentStage || '',
+  visaIssueDate: formatDate(visa.visaIssueDate),
+  visaExpiryDate: formatDate(visa.visaExpiryDate),
+  visaDeadline: formatDate(visa.visaDeadline),
+  totalExpenses: visa.totalExpenses || 0,
+  sellingPrice: visa.sellingPrice || 0,
+  profit: visa.profit || 0,
+  secretaryEarnings: visa.secretaryEarnings || 0,
+  companyProfit: (visa.profit || 0) - (visa.secretaryEarnings || 0),
+  sellingSecretary: visa.sellingSecretary ? 'نعم' : 'لا',
+  sellingCommission: visa.sellingCommission || 0,
+  customerName: visa.customerName || '',
+  customerPhone: visa.customerPhone || '',
+  createdAt: formatDate(visa.createdAt),
+  status: visa.status || ''
+});
+
+// ورقة قائمة التأشيرات (رأس منسق وأعمدة العملة قبل أول صف)
+const streamVisaSheet = async (workbook, res, filter) => {
+  const worksheet = workbook.addWorksheet('التأشيرات');
+  worksheet.columns = visaColumns;
+  styleHeaderRow(worksheet);
+
+  // تنسيق أعمدة العملة
+  ['totalExpenses', 'sellingPrice', 'profit', 'secretaryEarnings', 'companyProfit', 'sellingCommission']
+    .forEach((key) => {
+      worksheet.getColumn(key).numFmt = '#,##0.00';
+    });
+
+  const cursor = exportCursor(
+    Visa.find(filter)
+      .populate('secretary', 'name code')
+      .sort({ createdAt: -1 })
+  );
+  const count = await streamRows(worksheet, cursor, res, visaRow);
+  worksheet.commit();
+  return count;
+};
+
 // تصدير جميع التأشيرات
 router.get('/visas/all', async (req, res) => {
   try {
     console.log('بدء تصدير جميع التأشيرات...');
     const { secretary } = req.query;
-    
+
     let filter = {};
     if (secretary) {
       filter.secretary = secretary;
     }
 
-    console.log('جاري البحث عن التأشيرات...');
-    const visas = await Visa.find(filter)
-      .populate('secretary', 'name code')
-      .sort({ createdAt: -1 });
-
-    console.log(`تم العثور على ${visas.length} تأشيرة`);
-
-    const workbook = new ExcelJS.Workbook();
-    const worksheet = workbook.addWorksheet('التأشيرات');
-
-    // تعريف الأعمدة
-    worksheet.columns = [
-      { header: 'المرجع', key: 'reference', width: 15 },
-      { header: 'الاسم', key: 'name', width: 25 },
-      { header: 'تاريخ الميلاد', key: 'dateOfBirth', width: 15 },
-      { header: 'الجنسية', key: 'nationality', width: 15 },
-      { header: 'رقم الجواز', key: 'passportNumber', width: 20 },
-      { header: 'رقم التأشيرة', key: 'visaNumber', width: 20 },
-      { header: 'السكرتيرة', key: 'secretary', width: 20 },
-      { header: 'المرحلة الحالية', key: 'currentStage', width: 15 },
-      { header: 'تاريخ إصدار التأشيرة', key: 'visaIssueDate', width: 15 },
-      { header: 'تاريخ انتهاء التأشيرة', key: 'visaExpiryDate', width: 15 },
-      { header: 'الموعد النهائي', key: 'visaDeadline', width: 15 },
-      { header: 'إجمالي المصروفات', key: 'totalExpenses', width: 15 },
-      { header: 'سعر البيع', key: 'sellingPrice', width: 15 },
-      { header: 'الربح', key: 'profit', width: 15 },
-      { header: 'أرباح السكرتيرة', key: 'secretaryEarnings', width: 20 },
-      { header: 'ربح الشركة', key: 'companyProfit', width: 15 },
-      { header: 'سكرتيرة البيع', key: 'sellingSecretary', width: 20 },
-      { header: 'عمولة البيع', key: 'sellingCommission', width: 15 },
-      { header: 'اسم العميل', key: 'customerName', width: 25 },
-      { header: 'هاتف العميل', key: 'customerPhone', width: 20 },
-      { header: 'تاريخ الإنشاء', key: 'createdAt', width: 15 },
-      { header: 'الحالة', key: 'status', width: 15 }
-    ];
-
-    console.log('جاري إضافة البيانات...');
-    // إضافة البيانات
-    visas.forEach((visa, index) => {
-      try {
-        const reference = `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`;
-        
-        worksheet.addRow({
-          reference,
-          name: visa.name || '',
-          dateOfBirth: formatDate(visa.dateOfBirth),
-          nationality: visa.nationality || '',
-          passportNumber: visa.passportNumber || '',
-          visaNumber: visa.visaNumber || '',
-          secretary: visa.secretary ? visa.secretary.name : '',
-          currentStage: visa.currentStage || '',
-          visaIssueDate: formatDate(visa.visaIssueDate),
-          visaExpiryDate: formatDate(visa.visaExpiryDate),
-          visaDeadline: formatDate(visa.visaDeadline),
-          totalExpenses: visa.totalExpenses || 0,
-          sellingPrice: visa.sellingPrice || 0,
-          profit: visa.profit || 0,
-          secretaryEarnings: visa.secretaryEarnings || 0,
-          companyProfit: (visa.profit || 0) - (visa.secretaryEarnings || 0),
-          sellingSecretary: visa.sellingSecretary ? 'نعم' : 'لا',
-          sellingCommission: visa.sellingCommission || 0,
-          customerName: visa.customerName || '',
-          customerPhone: visa.customerPhone || '',
-          createdAt: formatDate(visa.createdAt),
-          status: visa.status || ''
-        });
-      } catch (rowError) {
-        console.error(`خطأ في إضافة صف ${index}:`, rowError);
-      }
-    });
-
-    console.log('جاري تنسيق الملف...');
-    // تنسيق صف العنوان
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' }
-    };
-
-    // تنسيق أعمدة العملة
-    worksheet.getColumn('totalExpenses').numFmt = '#,##0.00';
-    worksheet.getColumn('sellingPrice').numFmt = '#,##0.00';
-    worksheet.getColumn('profit').numFmt = '#,##0.00';
-    worksheet.getColumn('secretaryEarnings').numFmt = '#,##0.00';
-    worksheet.getColumn('companyProfit').numFmt = '#,##0.00';
-    worksheet.getColumn('sellingCommission').numFmt = '#,##0.00';
-
-    // تعيين رؤوس الاستجابة
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=visas-all-${moment().format('YYYY-MM-DD')}.xlsx`);
-
-    console.log('جاري كتابة الملف...');
-    // الكتابة إلى الاستجابة
-    await workbook.xlsx.write(res);
-    res.end();
-    console.log('تم تصدير الملف بنجاح');
+    const workbook = createWorkbookStream(res, `visas-all-${moment().format('YYYY-MM-DD')}.xlsx`);
+    const count = await streamVisaSheet(workbook, res, filter);
+    await workbook.commit();
+    console.log(`تم تصدير ${count} تأشيرة بنجاح`);
   } catch (error) {
     console.error('خطأ في تصدير التأشيرات:', error);
-    res.status(500).json({ message: `خطأ في تصدير البيانات: ${error.message}` });
+    exportFailed(res, error, { message: `خطأ في تصدير البيانات: ${error.message}` });
   }
 });
 
@@ -145,121 +141,41 @@ router.get('/visas/:status', async (req, res) => {
   try {
     const { status } = req.params;
     const { secretary } = req.query;
-    
+
     let filter = { status };
     if (secretary) {
       filter.secretary = secretary;
     }
 
-    const visas = await Visa.find(filter)
-      .populate('secretary', 'name code')
-      .sort({ createdAt: -1 });
-
-    const workbook = new ExcelJS.Workbook();
-    const worksheet = workbook.addWorksheet('التأشيرات');
-
-    // تعريف الأعمدة
-    worksheet.columns = [
-      { header: 'المرجع', key: 'reference', width: 15 },
-      { header: 'الاسم', key: 'name', width: 25 },
-      { header: 'تاريخ الميلاد', key: 'dateOfBirth', width: 15 },
-      { header: 'الجنسية', key: 'nationality', width: 15 },
-      { header: 'رقم الجواز', key: 'passportNumber', width: 20 },
-      { header: 'رقم التأشيرة', key: 'visaNumber', width: 20 },
-      { header: 'السكرتيرة', key: 'secretary', width: 20 },
-      { header: 'المرحلة الحالية', key: 'currentStage', width: 15 },
-      { header: 'تاريخ إصدار التأشيرة', key: 'visaIssueDate', width: 15 },
-      { header: 'تاريخ انتهاء التأشيرة', key: 'visaExpiryDate', width: 15 },
-      { header: 'الموعد النهائي', key: 'visaDeadline', width: 15 },
-      { header: 'إجمالي المصروفات', key: 'totalExpenses', width: 15 },
-      { header: 'سعر البيع', key: 'sellingPrice', width: 15 },
-      { header: 'الربح', key: 'profit', width: 15 },
-      { header: 'أرباح السكرتيرة', key: 'secretaryEarnings', width: 20 },
-      { header: 'ربح الشركة', key: 'companyProfit', width: 15 },
-      { header: 'سكرتيرة البيع', key: 'sellingSecretary', width: 20 },
-      { header: 'عمولة البيع', key: 'sellingCommission', width: 15 },
-      { header: 'اسم العميل', key: 'customerName', width: 25 },
-      { header: 'هاتف العميل', key: 'customerPhone', width: 20 },
-      { header: 'تاريخ الإنشاء', key: 'createdAt', width: 15 },
-      { header: 'الحالة', key: 'status', width: 15 }
-    ];
-
-    // إضافة البيانات
-    visas.forEach(visa => {
-      const reference = `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`;
-      
-             worksheet.addRow({
-         reference,
-         name: visa.name || '',
-         dateOfBirth: formatDate(visa.dateOfBirth),
-         nationality: visa.nationality || '',
-         passportNumber: visa.passportNumber || '',
-         visaNumber: visa.visaNumber || '',
-         secretary: visa.secretary ? visa.secretary.name : '',
-         currentStage: visa.currentStage || '',
-         visaIssueDate: formatDate(visa.visaIssueDate),
-         visaExpiryDate: formatDate(visa.visaExpiryDate),
-         visaDeadline: formatDate(visa.visaDeadline),
-         totalExpenses: visa.totalExpenses || 0,
-         sellingPrice: visa.sellingPrice || 0,
-         profit: visa.profit || 0,
-         secretaryEarnings: visa.secretaryEarnings || 0,
-         companyProfit: (visa.profit || 0) - (visa.secretaryEarnings || 0),
-         sellingSecretary: visa.sellingSecretary ? 'نعم' : 'لا',
-         sellingCommission: visa.sellingCommission || 0,
-         customerName: visa.customerName || '',
-         customerPhone: visa.customerPhone || '',
-         createdAt: formatDate(visa.createdAt),
-         status: visa.status || ''
-       });
-    });
-
-    // تنسيق صف العنوان
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' }
-    };
-
-    // تنسيق أعمدة العملة
-    worksheet.getColumn('totalExpenses').numFmt = '#,##0.00';
-    worksheet.getColumn('sellingPrice').numFmt = '#,##0.00';
-    worksheet.getColumn('profit').numFmt = '#,##0.00';
-    worksheet.getColumn('secretaryEarnings').numFmt = '#,##0.00';
-    worksheet.getColumn('companyProfit').numFmt = '#,##0.00';
-    worksheet.getColumn('sellingCommission').numFmt = '#,##0.00';
-
-    // تعيين رؤوس الاستجابة
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=visas-${status}-${moment().format('YYYY-MM-DD')}.xlsx`);
-
-    // الكتابة إلى الاستجابة
-    await workbook.xlsx.write(res);
-    res.end();
+    const workbook = createWorkbookStream(res, `visas-${status}-${moment().format('YYYY-MM-DD')}.xlsx`);
+    await streamVisaSheet(workbook, res, filter);
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: error.message });
+    exportFailed(res, error, { message: error.message });
   }
 });
 
 // تصدير تقرير السكرتيرة
 router.get('/secretary/:id', async (req, res) => {
   try {
-    const secretary = await Secretary.findById(req.params.id);
+    const secretary = await Secretary.findById(req.params.id).lean();
     if (!secretary) {
       return res.status(404).json({ message: 'السكرتيرة غير موجودة' });
     }
 
-    const visas = await Visa.find({ secretary: req.params.id })
-      .populate('secretary', 'name code')
-      .sort({ createdAt: -1 });
+    // الإحصائيات من جدول الإحصائيات المجمّع بدلاً من تحميل التأشيرات
+    const stats = await VisaStat.forSecretary(secretary._id);
 
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `secretary-${secretary.code}-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet(`تقرير ${secretary.name}`);
 
+    // تنسيق أعمدة العملة
+    ['E', 'F', 'G', 'H'].forEach(col => {
+      worksheet.getColumn(col).numFmt = '#,##0.00';
+    });
+
     // إضافة قسم الملخص
-    worksheet.addRow(['تقرير السكرتيرة']);
+    worksheet.addRow(['تقرير السكرتيرة']).font = { bold: true, size: 16 };
     worksheet.addRow(['']);
     worksheet.addRow(['الاسم:', secretary.name]);
     worksheet.addRow(['الرمز:', secretary.code]);
@@ -268,16 +184,11 @@ router.get('/secretary/:id', async (req, res) => {
     worksheet.addRow(['']);
 
     // إضافة الإحصائيات
-    const activeVisas = visas.filter(v => v.status === 'قيد_الشراء');
-    const availableVisas = visas.filter(v => v.status === 'معروضة_للبيع');
-    const soldVisas = visas.filter(v => v.status === 'مباعة');
-    const cancelledVisas = visas.filter(v => v.status === 'ملغاة');
-
-    worksheet.addRow(['الإحصائيات']);
-    worksheet.addRow(['التأشيرات النشطة:', activeVisas.length]);
-    worksheet.addRow(['المعروضة للبيع:', availableVisas.length]);
-    worksheet.addRow(['التأشيرات المباعة:', soldVisas.length]);
-    worksheet.addRow(['التأشيرات الملغاة:', cancelledVisas.length]);
+    worksheet.addRow(['الإحصائيات']).font = { bold: true };
+    worksheet.addRow(['التأشيرات النشطة:', stats.activeVisas]);
+    worksheet.addRow(['المعروضة للبيع:', stats.availableVisas]);
+    worksheet.addRow(['التأشيرات المباعة:', stats.soldVisas]);
+    worksheet.addRow(['التأشيرات الملغاة:', stats.cancelledVisas]);
     worksheet.addRow(['']);
 
     // إضافة تفاصيل التأشيرات
@@ -285,125 +196,99 @@ router.get('/secretary/:id', async (req, res) => {
     worksheet.addRow(['']);
 
     // تعريف الأعمدة لتفاصيل التأشيرات
-    worksheet.addRow([
+    await commitRow(worksheet, [
       'المرجع', 'الاسم', 'الحالة', 'المرحلة الحالية', 'إجمالي المصروفات',
       'سعر البيع', 'الربح', 'أرباح السكرتيرة', 'اسم العميل',
       'تاريخ الإنشاء', 'تاريخ الإكمال', 'تاريخ البيع'
-    ]);
+    ], res, HEADER_STYLE);
 
     // إضافة بيانات التأشيرات
-    visas.forEach(visa => {
-      const reference = `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`;
-      
-      worksheet.addRow([
-        reference,
-        visa.name,
-        visa.status,
-        visa.currentStage,
-        visa.totalExpenses,
-        visa.sellingPrice || 0,
-        visa.profit || 0,
-        visa.secretaryEarnings || 0,
-        visa.customerName || '',
-        moment(visa.createdAt).format('DD/MM/YYYY'),
-        visa.completedAt ? moment(visa.completedAt).format('DD/MM/YYYY') : '',
-        visa.soldAt ? moment(visa.soldAt).format('DD/MM/YYYY') : ''
-      ]);
-    });
-
-    // تنسيق ورقة العمل
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true, size: 16 };
-
-    const statsHeader = worksheet.getRow(10);
-    statsHeader.font = { bold: true };
-
-    const visaHeader = worksheet.getRow(17);
-    visaHeader.font = { bold: true };
-    visaHeader.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' }
-    };
-
-    // تنسيق أعمدة العملة
-    const currencyColumns = ['E', 'F', 'G', 'H'];
-    currencyColumns.forEach(col => {
-      worksheet.getColumn(col).numFmt = '#,##0.00';
-    });
-
-    // تعيين رؤوس الاستجابة
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=secretary-${secretary.code}-${moment().format('YYYY-MM-DD')}.xlsx`);
+    const cursor = exportCursor(
+      Visa.find({ secretary: req.params.id }).sort({ createdAt: -1 })
+    );
+    await streamRows(worksheet, cursor, res, (visa) => [
+      visaReference(visa),
+      visa.name,
+      visa.status,
+      visa.currentStage,
+      visa.totalExpenses,
+      visa.sellingPrice || 0,
+      visa.profit || 0,
+      visa.secretaryEarnings || 0,
+      visa.customerName || '',
+      moment(visa.createdAt).format('DD/MM/YYYY'),
+      visa.completedAt ? moment(visa.completedAt).format('DD/MM/YYYY') : '',
+      visa.soldAt ? moment(visa.soldAt).format('DD/MM/YYYY') : ''
+    ]);
 
-    // الكتابة إلى الاستجابة
-    await workbook.xlsx.write(res);
-    res.end();
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: error.message });
+    exportFailed(res, error, { message: error.message });
   }
 });
 
 // تصدير التقرير المالي للشركة
-router.get('/company-report', async (req, res) => {
-  try {
-    const allVisas = await Visa.find().populate('secretary', 'name code');
-    const secretaries = await Secretary.find();
+const companyReportExport = {
+  filename: () => `company-report-${moment().format('YYYY-MM-DD')}.xlsx`,
+  write: async (out) => {
+    // الملخصات من جدول الإحصائيات المجمّع، والتأشيرات تُقرأ بالمؤشر
+    const [[companyRow], secretaryRows, secretaries] = await Promise.all([
+      VisaStat.summarize(),
+      VisaStat.summarize({}, { groupBySecretary: true }),
+      Secretary.find().lean()
+    ]);
+    const stats = { ...VisaStat.emptySummary(), ...companyRow };
+    const statsBySecretary = new Map(secretaryRows.map((row) => [String(row._id), row]));
 
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookWriter(out);
     const worksheet = workbook.addWorksheet('تقرير الشركة');
 
+    // تنسيق أعمدة العملة
+    const currencyColumns = ['G', 'H', 'I', 'J', 'K', 'L', 'M'];
+    currencyColumns.forEach(col => {
+      worksheet.getColumn(col).numFmt = '#,##0.00';
+    });
+
     // إضافة ملخص الشركة
-    worksheet.addRow(['تقرير شركة فرصتكم']);
+    worksheet.addRow(['تقرير شركة فرصتكم']).font = { bold: true, size: 16 };
     worksheet.addRow(['']);
     worksheet.addRow(['تاريخ التوليد:', moment().format('DD/MM/YYYY HH:mm')]);
     worksheet.addRow(['']);
 
     // حساب الإحصائيات
-    const soldVisas = allVisas.filter(v => v.status === 'مباعة');
-    const cancelledVisas = allVisas.filter(v => v.status === 'ملغاة');
-    const activeVisas = allVisas.filter(v => v.status === 'قيد_الشراء');
-    const availableVisas = allVisas.filter(v => v.status === 'معروضة_للبيع');
-
-    const totalExpenses = allVisas.reduce((sum, visa) => sum + visa.totalExpenses, 0);
-    const totalProfit = soldVisas.reduce((sum, visa) => sum + visa.profit, 0);
-    const totalSecretaryEarnings = soldVisas.reduce((sum, visa) => sum + visa.secretaryEarnings, 0);
-    const totalCompanyProfit = totalProfit - totalSecretaryEarnings;
-    const totalSecretaryDebt = secretaries.reduce((sum, sec) => sum + sec.totalDebt, 0);
+    const totalSecretaryDebt = secretaries.reduce((sum, sec) => sum + (sec.totalDebt || 0), 0);
 
     // إضافة إحصائيات الملخص
-    worksheet.addRow(['إحصائيات الملخص']);
-    worksheet.addRow(['إجمالي التأشيرات:', allVisas.length]);
-    worksheet.addRow(['التأشيرات النشطة:', activeVisas.length]);
-    worksheet.addRow(['المعروضة للبيع:', availableVisas.length]);
-    worksheet.addRow(['التأشيرات المباعة:', soldVisas.length]);
-    worksheet.addRow(['التأشيرات الملغاة:', cancelledVisas.length]);
-    worksheet.addRow(['إجمالي المصروفات:', totalExpenses]);
-    worksheet.addRow(['إجمالي الربح:', totalProfit]);
-    worksheet.addRow(['إجمالي أرباح السكرتارية:', totalSecretaryEarnings]);
-    worksheet.addRow(['ربح الشركة:', totalCompanyProfit]);
+    worksheet.addRow(['إحصائيات الملخص']).font = { bold: true };
+    worksheet.addRow(['إجمالي التأشيرات:', stats.totalVisas]);
+    worksheet.addRow(['التأشيرات النشطة:', stats.activeVisas]);
+    worksheet.addRow(['المعروضة للبيع:', stats.availableVisas]);
+    worksheet.addRow(['التأشيرات المباعة:', stats.soldVisas]);
+    worksheet.addRow(['التأشيرات الملغاة:', stats.cancelledVisas]);
+    worksheet.addRow(['إجمالي المصروفات:', stats.totalExpenses]);
+    worksheet.addRow(['إجمالي الربح:', stats.totalProfit]);
+    worksheet.addRow(['إجمالي أرباح السكرتارية:', stats.totalEarnings]);
+    worksheet.addRow(['ربح الشركة:', stats.totalProfit - stats.totalEarnings]);
     worksheet.addRow(['إجمالي ديون السكرتارية:', totalSecretaryDebt]);
-    worksheet.addRow(['متوسط الربح لكل تأشيرة:', soldVisas.length > 0 ? totalProfit / soldVisas.length : 0]);
+    worksheet.addRow(['متوسط الربح لكل تأشيرة:', stats.soldVisas > 0 ? stats.totalProfit / stats.soldVisas : 0]);
     worksheet.addRow(['']);
 
     // إضافة ملخص السكرتارية
     worksheet.addRow(['ملخص السكرتارية']);
-    worksheet.addRow(['الاسم', 'الرمز', 'إجمالي التأشيرات', 'التأشيرات المباعة', 'إجمالي الأرباح', 'إجمالي الدين']);
-
-    secretaries.forEach(secretary => {
-      const secretaryVisas = allVisas.filter(v => v.secretary._id.toString() === secretary._id.toString());
-      const secretarySoldVisas = secretaryVisas.filter(v => v.status === 'مباعة');
-      const secretaryEarnings = secretarySoldVisas.reduce((sum, v) => sum + v.secretaryEarnings, 0);
+    await commitRow(worksheet, ['الاسم', 'الرمز', 'إجمالي التأشيرات', 'التأشيرات المباعة', 'إجمالي الأرباح', 'إجمالي الدين'], out, HEADER_STYLE);
 
-      worksheet.addRow([
+    for (const secretary of secretaries) {
+      const secretaryStats = statsBySecretary.get(String(secretary._id)) || VisaStat.emptySummary();
+      await commitRow(worksheet, [
         secretary.name,
         secretary.code,
-        secretaryVisas.length,
-        secretarySoldVisas.length,
-        secretaryEarnings,
+        secretaryStats.totalVisas,
+        secretaryStats.soldVisas,
+        secretaryStats.totalEarnings,
         secretary.totalDebt
-      ]);
-    });
+      ], out);
+    }
 
     worksheet.addRow(['']);
 
@@ -412,71 +297,40 @@ router.get('/company-report', async (req, res) => {
     worksheet.addRow(['']);
 
     // تعريف الأعمدة
-    worksheet.addRow([
+    await commitRow(worksheet, [
       'المرجع', 'الاسم', 'السكرتيرة', 'الحالة', 'إجمالي المصروفات',
       'سعر البيع', 'الربح', 'أرباح السكرتيرة', 'ربح الشركة',
       'اسم العميل', 'تاريخ الإنشاء', 'تاريخ البيع'
-    ]);
+    ], out, HEADER_STYLE);
 
     // إضافة بيانات التأشيرات
-    allVisas.forEach(visa => {
-      const reference = `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`;
-      const companyProfit = visa.profit ? visa.profit - visa.secretaryEarnings : 0;
-      
-      worksheet.addRow([
-        reference,
-        visa.name,
-        visa.secretary.name,
-        visa.status,
-        visa.totalExpenses,
-        visa.sellingPrice || 0,
-        visa.profit || 0,
-        visa.secretaryEarnings || 0,
-        companyProfit,
-        visa.customerName || '',
-        moment(visa.createdAt).format('DD/MM/YYYY'),
-        visa.soldAt ? moment(visa.soldAt).format('DD/MM/YYYY') : ''
-      ]);
-    });
-
-    // تنسيق ورقة العمل
-    const titleRow = worksheet.getRow(1);
-    titleRow.font = { bold: true, size: 16 };
-
-    const summaryHeader = worksheet.getRow(6);
-    summaryHeader.font = { bold: true };
-
-    const secretaryHeader = worksheet.getRow(20);
-    secretaryHeader.font = { bold: true };
-    secretaryHeader.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' }
-    };
-
-    const visaHeader = worksheet.getRow(28 + secretaries.length);
-    visaHeader.font = { bold: true };
-    visaHeader.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' }
-    };
-
-    // تنسيق أعمدة العملة
-    const currencyColumns = ['G', 'H', 'I', 'J', 'K', 'L', 'M'];
-    currencyColumns.forEach(col => {
-      worksheet.getColumn(col).numFmt = '#,##0.00';
-    });
+    const cursor = exportCursor(Visa.find().populate('secretary', 'name code'));
+    await streamRows(worksheet, cursor, out, (visa) => [
+      visaReference(visa),
+      visa.name,
+      visa.secretary ? visa.secretary.name : '',
+      visa.status,
+      visa.totalExpenses,
+      visa.sellingPrice || 0,
+      visa.profit || 0,
+      visa.secretaryEarnings || 0,
+      visa.profit ? visa.profit - visa.secretaryEarnings : 0,
+      visa.customerName || '',
+      moment(visa.createdAt).format('DD/MM/YYYY'),
+      visa.soldAt ? moment(visa.soldAt).format('DD/MM/YYYY') : ''
+    ]);
 
-    // تعيين رؤوس الاستجابة
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=company-report-${moment().format('YYYY-MM-DD')}.xlsx`);
+    worksheet.commit();
+    await workbook.commit();
+  },
+};
 
-    // الكتابة إلى الاستجابة
-    await workbook.xlsx.write(res);
-    res.end();
+router.get('/company-report', async (req, res) => {
+  try {
+    setDownloadHeaders(res, companyReportExport.filename(req.query));
+    await companyReportExport.write(res, req.query);
   } catch (error) {
-    res.status(500).json({ message: error.message });
+    exportFailed(res, error, { message: error.message });
   }
 });
 
@@ -484,39 +338,43 @@ router.get('/company-report', async (req, res) => {
 router.get('/expenses/:visaId', async (req, res) => {
   try {
     const visa = await Visa.findById(req.params.visaId)
-      .populate('secretary', 'name code');
-    
+      .populate('secretary', 'name code')
+      .lean();
+
     if (!visa) {
       return res.status(404).json({ message: 'التأشيرة غير موجودة' });
     }
 
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `expenses-${visaReference(visa)}-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('تقرير المصروفات');
 
+    // تنسيق عمود العملة
+    worksheet.getColumn('C').numFmt = '#,##0.00';
+
     // إضافة معلومات التأشيرة
-    worksheet.addRow(['تقرير مصروفات التأشيرة']);
+    worksheet.addRow(['تقرير مصروفات التأشيرة']).font = { bold: true, size: 16 };
     worksheet.addRow(['']);
-    worksheet.addRow(['المرجع:', `${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}`]);
+    worksheet.addRow(['المرجع:', visaReference(visa)]);
     worksheet.addRow(['الاسم:', visa.name]);
-          worksheet.addRow(['السكرتيرة:', visa.secretary.name]);
+    worksheet.addRow(['السكرتيرة:', visa.secretary ? visa.secretary.name : '']);
     worksheet.addRow(['الحالة:', visa.status]);
     worksheet.addRow(['إجمالي المصروفات:', visa.totalExpenses]);
     worksheet.addRow(['']);
 
     // إضافة المصروفات حسب المرحلة
     const stages = [
-      { name: 'المرحلة أ', expenses: visa.stageAExpenses },
-      { name: 'المرحلة ب', expenses: visa.stageBExpenses },
-      { name: 'المرحلة ج', expenses: visa.stageCExpenses },
-      { name: 'المرحلة د', expenses: visa.stageDExpenses },
-      { name: 'الاستبدال', expenses: visa.replacementExpenses }
+      { name: 'المرحلة أ', expenses: visa.stageAExpenses || [] },
+      { name: 'المرحلة ب', expenses: visa.stageBExpenses || [] },
+      { name: 'المرحلة ج', expenses: visa.stageCExpenses || [] },
+      { name: 'المرحلة د', expenses: visa.stageDExpenses || [] },
+      { name: 'الاستبدال', expenses: visa.replacementExpenses || [] }
     ];
 
     stages.forEach(stage => {
       if (stage.expenses.length > 0) {
         worksheet.addRow([stage.name]);
         worksheet.addRow(['التاريخ', 'الوصف', 'المبلغ']);
-        
+
         stage.expenses.forEach(expense => {
           worksheet.addRow([
             moment(expense.date).format('DD/MM/YYYY'),
@@ -524,29 +382,17 @@ router.get('/expenses/:visaId', async (req, res) => {
             expense.amount
           ]);
         });
-        
+
         const stageTotal = stage.expenses.reduce((sum, exp) => sum + exp.amount, 0);
         worksheet.addRow(['', 'الإجمالي:', stageTotal]);
         worksheet.addRow(['']);
       }
     });
 
-    // تنسيق ورقة العمل
-    const titleRow = worksheet.getRow(1);
-    titleRow.font = { bold: true, size: 16 };
-
-    // تنسيق عمود العملة
-    worksheet.getColumn('C').numFmt = '#,##0.00';
-
-    // تعيين رؤوس الاستجابة
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=expenses-${visa.secretaryCode}${visa.orderNumber.toString().padStart(3, '0')}-${moment().format('YYYY-MM-DD')}.xlsx`);
-
-    // الكتابة إلى الاستجابة
-    await workbook.xlsx.write(res);
-    res.end();
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: error.message });
+    exportFailed(res, error, { message: error.message });
   }
 });
 
@@ -554,8 +400,7 @@ router.get('/expenses/:visaId', async (req, res) => {
 // Rental exports
 router.get('/rental-secretaries', async (req, res) => {
   try {
-    const secretaries = await RentingSecretary.find().sort({ createdAt: -1 });
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `rental-secretaries-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('سكرتارية التأجير');
 
     worksheet.columns = [
@@ -568,34 +413,27 @@ router.get('/rental-secretaries', async (req, res) => {
       { header: bilingualHeader('تاريخ الإنشاء', 'Created At'), key: 'createdAt', width: 18 },
     ];
 
-    secretaries.forEach((sec) => {
-      worksheet.addRow({
-        name: sec.name,
-        phone: sec.phone,
-        email: sec.email || '',
-        address: sec.address || '',
-        status: sec.status,
-        docs: (sec.documents || []).length,
-        createdAt: formatDate(sec.createdAt),
-      });
-    });
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-secretaries-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = exportCursor(RentingSecretary.find().sort({ createdAt: -1 }));
+    await streamRows(worksheet, cursor, res, (sec) => ({
+      name: sec.name,
+      phone: sec.phone,
+      email: sec.email || '',
+      address: sec.address || '',
+      status: sec.status,
+      docs: (sec.documents || []).length,
+      createdAt: formatDate(sec.createdAt),
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير سكرتارية التأجير', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير سكرتارية التأجير', error: error.message });
   }
 });
 
 router.get('/rental-units', async (req, res) => {
   try {
-    const units = await RentalUnit.find()
-      .populate('currentContract', 'referenceNumber status startDate')
-      .sort({ unitNumber: 1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `rental-units-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('الوحدات المؤجرة');
 
     worksheet.columns = [
@@ -610,34 +448,31 @@ router.get('/rental-units', async (req, res) => {
 
     worksheet.getColumn('rentAmount').numFmt = '#,##0.000';
 
-    units.forEach((unit) => {
-      worksheet.addRow({
-        unitNumber: unit.unitNumber,
-        unitType: unit.unitType,
-        address: unit.address,
-        rentAmount: unit.rentAmount,
-        status: unit.status,
-        contract: unit.currentContract ? unit.currentContract.referenceNumber : '',
-        updatedAt: formatDate(unit.updatedAt),
-      });
-    });
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-units-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = exportCursor(
+      RentalUnit.find()
+        .populate('currentContract', 'referenceNumber status startDate')
+        .sort({ unitNumber: 1 })
+    );
+    await streamRows(worksheet, cursor, res, (unit) => ({
+      unitNumber: unit.unitNumber,
+      unitType: unit.unitType,
+      address: unit.address,
+      rentAmount: unit.rentAmount,
+      status: unit.status,
+      contract: unit.currentContract ? unit.currentContract.referenceNumber : '',
+      updatedAt: formatDate(unit.updatedAt),
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير الوحدات', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير الوحدات', error: error.message });
   }
 });
 
 router.get('/rental-contracts', async (req, res) => {
   try {
-    const contracts = await RentalContract.find()
-      .populate('unitId', 'unitNumber unitType address')
-      .populate('rentalSecretaryId', 'name phone');
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `rental-contracts-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('عقود التأجير');
 
     worksheet.columns = [
@@ -654,42 +489,35 @@ router.get('/rental-contracts', async (req, res) => {
 
     worksheet.getColumn('rent').numFmt = '#,##0.000';
 
-    contracts.forEach((contract) => {
-      worksheet.addRow({
-        reference: contract.referenceNumber,
-        unit: contract.unitId ? contract.unitId.unitNumber : contract.unitSnapshot?.unitNumber,
-        unitType: contract.unitId ? contract.unitId.unitType : contract.unitSnapshot?.unitType,
-        secretary: contract.rentalSecretaryId ? contract.rentalSecretaryId.name : contract.secretarySnapshot?.name,
-        rent: contract.rentAmount,
-        startDate: formatDate(contract.startDate),
-        duration: contract.durationMonths,
-        dueDay: contract.dueDay,
-        status: contract.status,
-      });
-    });
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-contracts-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    // الأشهر غير مطلوبة في هذا التقرير
+    const cursor = exportCursor(
+      RentalContract.find()
+        .select('-months')
+        .populate('unitId', 'unitNumber unitType address')
+        .populate('rentalSecretaryId', 'name phone')
+    );
+    await streamRows(worksheet, cursor, res, (contract) => ({
+      reference: contract.referenceNumber,
+      unit: contract.unitId ? contract.unitId.unitNumber : contract.unitSnapshot?.unitNumber,
+      unitType: contract.unitId ? contract.unitId.unitType : contract.unitSnapshot?.unitType,
+      secretary: contract.rentalSecretaryId ? contract.rentalSecretaryId.name : contract.secretarySnapshot?.name,
+      rent: contract.rentAmount,
+      startDate: formatDate(contract.startDate),
+      duration: contract.durationMonths,
+      dueDay: contract.dueDay,
+      status: contract.status,
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير العقود', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير العقود', error: error.message });
   }
 });
 
 router.get('/rental-payments', async (req, res) => {
   try {
-    const payments = await RentalPayment.find()
-      .populate({
-        path: 'contractId',
-        populate: [
-          { path: 'unitId', select: 'unitNumber unitType' },
-          { path: 'rentalSecretaryId', select: 'name phone' },
-        ],
-      })
-      .sort({ paymentDate: -1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `rental-payments-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('مدفوعات التأجير');
 
     worksheet.columns = [
@@ -709,38 +537,43 @@ router.get('/rental-payments', async (req, res) => {
     worksheet.getColumn('amount').numFmt = '#,##0.000';
     worksheet.getColumn('remaining').numFmt = '#,##0.000';
 
-    payments.forEach((payment) => {
-      worksheet.addRow({
-        date: formatDate(payment.paymentDate),
-        month: payment.monthYear,
-        contract: payment.contractId?.referenceNumber,
-        unit: payment.contractId?.unitId?.unitNumber || payment.contractId?.unitSnapshot?.unitNumber,
-        secretary: payment.contractId?.rentalSecretaryId?.name || payment.contractId?.secretarySnapshot?.name,
-        amount: payment.amount,
-        ledger: payment.ledger || '',
-        method: payment.method,
-        transaction: payment.transactionRef || '',
-        fursatkumRef: payment.fursatkumInvoiceRef || '',
-        remaining: payment.remainingBalance,
-      });
-    });
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-payments-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = exportCursor(
+      RentalPayment.find()
+        .populate({
+          path: 'contractId',
+          select: 'referenceNumber unitId rentalSecretaryId unitSnapshot secretarySnapshot',
+          populate: [
+            { path: 'unitId', select: 'unitNumber unitType' },
+            { path: 'rentalSecretaryId', select: 'name phone' },
+          ],
+        })
+        .sort({ paymentDate: -1 })
+    );
+    await streamRows(worksheet, cursor, res, (payment) => ({
+      date: formatDate(payment.paymentDate),
+      month: payment.monthYear,
+      contract: payment.contractId?.referenceNumber,
+      unit: payment.contractId?.unitId?.unitNumber || payment.contractId?.unitSnapshot?.unitNumber,
+      secretary: payment.contractId?.rentalSecretaryId?.name || payment.contractId?.secretarySnapshot?.name,
+      amount: payment.amount,
+      ledger: payment.ledger || '',
+      method: payment.method,
+      transaction: payment.transactionRef || '',
+      fursatkumRef: payment.fursatkumInvoiceRef || '',
+      remaining: payment.remainingBalance,
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير المدفوعات', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير المدفوعات', error: error.message });
   }
 });
 
-router.get('/rental-management', async (req, res) => {
-  try {
-    const contracts = await RentalContract.find()
-      .populate('unitId', 'unitNumber unitType')
-      .populate('rentalSecretaryId', 'name phone');
-
-    const workbook = new ExcelJS.Workbook();
+const rentalManagementExport = {
+  filename: () => `rental-management-${moment().format('YYYY-MM-DD')}.xlsx`,
+  write: async (out) => {
+    const workbook = createWorkbookWriter(out);
     const worksheet = workbook.addWorksheet('إدارة الإيجارات');
 
     worksheet.columns = [
@@ -758,38 +591,46 @@ router.get('/rental-management', async (req, res) => {
     worksheet.getColumn('paid').numFmt = '#,##0.000';
     worksheet.getColumn('remaining').numFmt = '#,##0.000';
 
-    contracts.forEach((contract) => {
-      contract.months.forEach((month) => {
-        worksheet.addRow({
+    const cursor = exportCursor(
+      RentalContract.find()
+        .populate('unitId', 'unitNumber unitType')
+        .populate('rentalSecretaryId', 'name phone')
+    );
+    for await (const contract of cursor) {
+      const unit = contract.unitId ? contract.unitId.unitNumber : contract.unitSnapshot?.unitNumber;
+      const secretary = contract.rentalSecretaryId ? contract.rentalSecretaryId.name : contract.secretarySnapshot?.name;
+      for (const month of contract.months || []) {
+        await commitRow(worksheet, {
           monthYear: month.monthYear,
           dueDate: formatDate(month.dueDate),
-          unit: contract.unitId ? contract.unitId.unitNumber : contract.unitSnapshot?.unitNumber,
-          secretary: contract.rentalSecretaryId ? contract.rentalSecretaryId.name : contract.secretarySnapshot?.name,
+          unit,
+          secretary,
           dueAmount: month.dueAmount,
           paid: month.totalPaid,
           remaining: month.remainingAmount,
           status: month.status,
-        });
-      });
-    });
+        }, out);
+      }
+    }
+
+    worksheet.commit();
+    await workbook.commit();
+  },
+};
 
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-management-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+router.get('/rental-management', async (req, res) => {
+  try {
+    setDownloadHeaders(res, rentalManagementExport.filename(req.query));
+    await rentalManagementExport.write(res, req.query);
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير إدارة الإيجارات', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير إدارة الإيجارات', error: error.message });
   }
 });
 
 router.get('/rental-accounting', async (req, res) => {
   try {
     const targetMonth = req.query.month || moment().format('YYYY-MM');
-    const contracts = await RentalContract.find()
-      .populate('unitId', 'unitNumber unitType')
-      .populate('rentalSecretaryId', 'name phone');
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `rental-accounting-${targetMonth}.xlsx`);
     const worksheet = workbook.addWorksheet('محاسبة التأجير');
 
     worksheet.columns = [
@@ -806,11 +647,17 @@ router.get('/rental-accounting', async (req, res) => {
     worksheet.getColumn('paid').numFmt = '#,##0.000';
     worksheet.getColumn('remaining').numFmt = '#,##0.000';
 
-    contracts.forEach((contract) => {
+    // العقود التي تحتوي على الشهر المطلوب فقط
+    const cursor = exportCursor(
+      RentalContract.find({ 'months.monthYear': targetMonth })
+        .populate('unitId', 'unitNumber unitType')
+        .populate('rentalSecretaryId', 'name phone')
+    );
+    await streamRows(worksheet, cursor, res, (contract) => {
       const monthEntry = contract.months.find((m) => m.monthYear === targetMonth);
-      if (!monthEntry) return;
+      if (!monthEntry) return null;
 
-      worksheet.addRow({
+      return {
         month: targetMonth,
         unit: contract.unitId ? contract.unitId.unitNumber : contract.unitSnapshot?.unitNumber,
         secretary: contract.rentalSecretaryId ? contract.rentalSecretaryId.name : contract.secretarySnapshot?.name,
@@ -818,15 +665,13 @@ router.get('/rental-accounting', async (req, res) => {
         paid: monthEntry.totalPaid,
         remaining: monthEntry.remainingAmount,
         status: monthEntry.status,
-      });
+      };
     });
 
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=rental-accounting-${targetMonth}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير محاسبة التأجير', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير محاسبة التأجير', error: error.message });
   }
 });
 
@@ -843,7 +688,8 @@ const FW2Transaction = require('../models/FW2Transaction');
 const FW2Account = require('../models/FW2Account');
 const FursatkumInvoice = require('../models/FursatkumInvoice');
 const FursatkumTransaction = require('../models/FursatkumTransaction');
-const FursatkumAccount = require('../models/FursatkumAccount');
+const { getAccountSummary } = require('../utils/offices');
+const { archiveAwareCursor } = require('../utils/archive');
 
 // Export Home Service Invoices
 router.get('/home-service/invoices', async (req, res) => {
@@ -854,11 +700,7 @@ router.get('/home-service/invoices', async (req, res) => {
       filters.type = type;
     }
 
-    const invoices = await HSInvoice.find(filters)
-      .populate('createdBy', 'username')
-      .sort({ date: -1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `home-service-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('فواتير الخدمات المنزلية');
 
     worksheet.columns = [
@@ -875,6 +717,7 @@ router.get('/home-service/invoices', async (req, res) => {
     ];
 
     worksheet.getColumn('value').numFmt = '#,##0.000';
+    styleHeaderRow(worksheet);
 
     const typeLabels = {
       income: 'فاتورة دخل / Income',
@@ -886,47 +729,35 @@ router.get('/home-service/invoices', async (req, res) => {
       deleted: 'محذوف / Deleted',
     };
 
-    invoices.forEach((invoice) => {
-      worksheet.addRow({
-        reference: invoice.referenceNumber,
-        type: typeLabels[invoice.type] || invoice.type,
-        name: invoice.name,
-        value: invoice.value,
-        date: formatDate(invoice.date),
-        details: invoice.details || '',
-        status: statusLabels[invoice.status] || invoice.status,
-        isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
-        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-        createdAt: formatDate(invoice.createdAt),
-      });
-    });
-
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=home-service-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = await archiveAwareCursor(HSInvoice, filters.date, { date: -1 }, (M) => exportCursor(
+      M.find(filters)
+        .populate('createdBy', 'username')
+        .sort({ date: -1 })
+    ));
+    await streamRows(worksheet, cursor, res, (invoice) => ({
+      reference: invoice.referenceNumber,
+      type: typeLabels[invoice.type] || invoice.type,
+      name: invoice.name,
+      value: invoice.value,
+      date: formatDate(invoice.date),
+      details: invoice.details || '',
+      status: statusLabels[invoice.status] || invoice.status,
+      isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
+      createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+      createdAt: formatDate(invoice.createdAt),
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير الفواتير', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير الفواتير', error: error.message });
   }
 });
 
 // Export Home Service Deleted Invoices
 router.get('/home-service/deleted', async (req, res) => {
   try {
-    const invoices = await HSInvoice.find({ status: 'deleted' })
-      .populate('createdBy', 'username')
-      .populate('deletedBy', 'username')
-      .sort({ deletedAt: -1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `home-service-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('الفواتير المحذوفة');
 
     worksheet.columns = [
@@ -942,40 +773,35 @@ router.get('/home-service/deleted', async (req, res) => {
     ];
 
     worksheet.getColumn('value').numFmt = '#,##0.000';
+    styleHeaderRow(worksheet);
 
     const typeLabels = {
       income: 'فاتورة دخل / Income',
       spending: 'إيصال صرف / Spending',
     };
 
-    invoices.forEach((invoice) => {
-      worksheet.addRow({
-        reference: invoice.referenceNumber,
-        type: typeLabels[invoice.type] || invoice.type,
-        name: invoice.name,
-        value: invoice.value,
-        date: formatDate(invoice.date),
-        details: invoice.details || '',
-        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-        deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
-        deletedAt: formatDate(invoice.deletedAt),
-      });
-    });
-
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=home-service-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = await archiveAwareCursor(HSInvoice, undefined, { deletedAt: -1 }, (M) => exportCursor(
+      M.find({ status: 'deleted' })
+        .populate('createdBy', 'username')
+        .populate('deletedBy', 'username')
+        .sort({ deletedAt: -1 })
+    ));
+    await streamRows(worksheet, cursor, res, (invoice) => ({
+      reference: invoice.referenceNumber,
+      type: typeLabels[invoice.type] || invoice.type,
+      name: invoice.name,
+      value: invoice.value,
+      date: formatDate(invoice.date),
+      details: invoice.details || '',
+      createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+      deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
+      deletedAt: formatDate(invoice.deletedAt),
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
   }
 });
 
@@ -983,22 +809,18 @@ router.get('/home-service/deleted', async (req, res) => {
 router.get('/home-service/accounting', async (req, res) => {
   try {
     const account = await HSAccount.getAccount();
-    const transactions = await HSTransaction.find()
-      .populate('performedBy', 'username')
-      .sort({ date: -1 });
 
-    const workbook = new ExcelJS.Workbook();
-    
+    const workbook = createWorkbookStream(res, `home-service-accounting-${moment().format('YYYY-MM-DD')}.xlsx`);
+
     const summarySheet = workbook.addWorksheet('ملخص المحاسبة');
-    summarySheet.addRow([bilingualHeader('ملخص المحاسبة', 'Accounting Summary')]);
+    summarySheet.getColumn(2).numFmt = '#,##0.000';
+    summarySheet.addRow([bilingualHeader('ملخص المحاسبة', 'Accounting Summary')]).font = { bold: true, size: 14 };
     summarySheet.addRow([]);
     summarySheet.addRow([bilingualHeader('رصيد التمويل', 'Funding Credit'), account.fundingCredit]);
     summarySheet.addRow([bilingualHeader('أرباح الدخل', 'Income Profit'), account.incomeProfit]);
     summarySheet.addRow([]);
     summarySheet.addRow([bilingualHeader('تاريخ التصدير', 'Export Date'), formatDate(new Date())]);
-    
-    summarySheet.getRow(1).font = { bold: true, size: 14 };
-    summarySheet.getColumn(2).numFmt = '#,##0.000';
+    summarySheet.commit();
 
     const transSheet = workbook.addWorksheet('سجل المعاملات');
     transSheet.columns = [
@@ -1014,6 +836,7 @@ router.get('/home-service/accounting', async (req, res) => {
 
     transSheet.getColumn('amount').numFmt = '#,##0.000';
     transSheet.getColumn('balanceAfter').numFmt = '#,##0.000';
+    styleHeaderRow(transSheet);
 
     const typeLabels = {
       add_funds: 'إضافة رصيد / Add Funds',
@@ -1030,33 +853,26 @@ router.get('/home-service/accounting', async (req, res) => {
       income: 'دخل / Income',
     };
 
-    transactions.forEach((trans) => {
-      transSheet.addRow({
-        date: formatDate(trans.date),
-        type: typeLabels[trans.type] || trans.type,
-        category: categoryLabels[trans.category] || trans.category,
-        amount: trans.amount,
-        balanceAfter: trans.balanceAfter,
-        invoiceRef: trans.invoiceRef || '',
-        description: trans.description || '',
-        performedBy: trans.performedBy ? trans.performedBy.username : '',
-      });
-    });
-
-    const headerRow = transSheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=home-service-accounting-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = await archiveAwareCursor(HSTransaction, undefined, { date: -1 }, (M) => exportCursor(
+      M.find()
+        .populate('performedBy', 'username')
+        .sort({ date: -1 })
+    ));
+    await streamRows(transSheet, cursor, res, (trans) => ({
+      date: formatDate(trans.date),
+      type: typeLabels[trans.type] || trans.type,
+      category: categoryLabels[trans.category] || trans.category,
+      amount: trans.amount,
+      balanceAfter: trans.balanceAfter,
+      invoiceRef: trans.invoiceRef || '',
+      description: trans.description || '',
+      performedBy: trans.performedBy ? trans.performedBy.username : '',
+    }));
+
+    transSheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير المحاسبة', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير المحاسبة', error: error.message });
   }
 });
 
@@ -1076,11 +892,7 @@ const farwaniyaExportFactory = ({
       const filters = { status };
       if (type && type !== 'all') filters.type = type;
 
-      const invoices = await invoiceModel.find(filters)
-        .populate('createdBy', 'username')
-        .sort({ date: -1 });
-
-      const workbook = new ExcelJS.Workbook();
+      const workbook = createWorkbookStream(res, `${key}-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
       const worksheet = workbook.addWorksheet(`فواتير ${arabicName}`);
 
       worksheet.columns = [
@@ -1096,6 +908,7 @@ const farwaniyaExportFactory = ({
       ];
 
       worksheet.getColumn('value').numFmt = '#,##0.000';
+      styleHeaderRow(worksheet);
 
       const typeLabels = {
         income: 'فاتورة دخل / Income',
@@ -1106,46 +919,34 @@ const farwaniyaExportFactory = ({
         deleted: 'محذوف / Deleted',
       };
 
-      invoices.forEach((invoice) => {
-        worksheet.addRow({
-          reference: invoice.referenceNumber,
-          type: typeLabels[invoice.type] || invoice.type,
-          name: invoice.name,
-          value: invoice.value,
-          date: formatDate(invoice.date),
-          details: invoice.details || '',
-          status: statusLabels[invoice.status] || invoice.status,
-          isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
-          createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-        });
-      });
-
-      const headerRow = worksheet.getRow(1);
-      headerRow.font = { bold: true };
-      headerRow.fill = {
-        type: 'pattern',
-        pattern: 'solid',
-        fgColor: { argb: 'FFE0E0E0' },
-      };
+      const cursor = await archiveAwareCursor(invoiceModel, filters.date, { date: -1 }, (M) => exportCursor(
+        M.find(filters)
+          .populate('createdBy', 'username')
+          .sort({ date: -1 })
+      ));
+      await streamRows(worksheet, cursor, res, (invoice) => ({
+        reference: invoice.referenceNumber,
+        type: typeLabels[invoice.type] || invoice.type,
+        name: invoice.name,
+        value: invoice.value,
+        date: formatDate(invoice.date),
+        details: invoice.details || '',
+        status: statusLabels[invoice.status] || invoice.status,
+        isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
+        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+      }));
 
-      res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-      res.setHeader('Content-Disposition', `attachment; filename=${key}-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
-      await workbook.xlsx.write(res);
-      res.end();
+      worksheet.commit();
+      await workbook.commit();
     } catch (error) {
-      res.status(500).json({ message: 'خطأ في تصدير الفواتير', error: error.message });
+      exportFailed(res, error, { message: 'خطأ في تصدير الفواتير', error: error.message });
     }
   });
 
   // Deleted invoices
   router.get(`/${key}/deleted`, async (req, res) => {
     try {
-      const invoices = await invoiceModel.find({ status: 'deleted' })
-        .populate('createdBy', 'username')
-        .populate('deletedBy', 'username')
-        .sort({ deletedAt: -1 });
-
-      const workbook = new ExcelJS.Workbook();
+      const workbook = createWorkbookStream(res, `${key}-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
       const worksheet = workbook.addWorksheet('الفواتير المحذوفة');
 
       worksheet.columns = [
@@ -1161,40 +962,35 @@ const farwaniyaExportFactory = ({
       ];
 
       worksheet.getColumn('value').numFmt = '#,##0.000';
+      styleHeaderRow(worksheet);
 
       const typeLabels = {
         income: 'فاتورة دخل / Income',
         spending: 'إيصال صرف / Spending',
       };
 
-      invoices.forEach((invoice) => {
-        worksheet.addRow({
-          reference: invoice.referenceNumber,
-          type: typeLabels[invoice.type] || invoice.type,
-          name: invoice.name,
-          value: invoice.value,
-          date: formatDate(invoice.date),
-          details: invoice.details || '',
-          createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-          deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
-          deletedAt: formatDate(invoice.deletedAt),
-        });
-      });
-
-      const headerRow = worksheet.getRow(1);
-      headerRow.font = { bold: true };
-      headerRow.fill = {
-        type: 'pattern',
-        pattern: 'solid',
-        fgColor: { argb: 'FFE0E0E0' },
-      };
+      const cursor = await archiveAwareCursor(invoiceModel, undefined, { deletedAt: -1 }, (M) => exportCursor(
+        M.find({ status: 'deleted' })
+          .populate('createdBy', 'username')
+          .populate('deletedBy', 'username')
+          .sort({ deletedAt: -1 })
+      ));
+      await streamRows(worksheet, cursor, res, (invoice) => ({
+        reference: invoice.referenceNumber,
+        type: typeLabels[invoice.type] || invoice.type,
+        name: invoice.name,
+        value: invoice.value,
+        date: formatDate(invoice.date),
+        details: invoice.details || '',
+        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+        deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
+        deletedAt: formatDate(invoice.deletedAt),
+      }));
 
-      res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-      res.setHeader('Content-Disposition', `attachment; filename=${key}-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
-      await workbook.xlsx.write(res);
-      res.end();
+      worksheet.commit();
+      await workbook.commit();
     } catch (error) {
-      res.status(500).json({ message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
+      exportFailed(res, error, { message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
     }
   });
 
@@ -1202,22 +998,19 @@ const farwaniyaExportFactory = ({
   router.get(`/${key}/accounting`, async (req, res) => {
     try {
       const account = await accountModel.getAccount();
-      const transactions = await transactionModel.find()
-        .populate('performedBy', 'username')
-        .sort({ date: -1 });
 
-      const workbook = new ExcelJS.Workbook();
+      const workbook = createWorkbookStream(res, `${key}-accounting-${moment().format('YYYY-MM-DD')}.xlsx`);
 
       const summarySheet = workbook.addWorksheet('ملخص المحاسبة');
-      summarySheet.addRow([bilingualHeader('ملخص المحاسبة', 'Accounting Summary')]);
+      summarySheet.getColumn(2).numFmt = '#,##0.000';
+      summarySheet.addRow([bilingualHeader('ملخص المحاسبة', 'Accounting Summary')]).font = { bold: true, size: 14 };
       summarySheet.addRow([]);
       summarySheet.addRow([bilingualHeader('الرصيد الحالي', 'Current Balance'), account.balance]);
       summarySheet.addRow([bilingualHeader('إجمالي الدخل', 'Total Income'), account.incomeTotal]);
       summarySheet.addRow([bilingualHeader('إجمالي المصروف', 'Total Spending'), account.spendingTotal]);
       summarySheet.addRow([]);
       summarySheet.addRow([bilingualHeader('تاريخ التصدير', 'Export Date'), formatDate(new Date())]);
-      summarySheet.getRow(1).font = { bold: true, size: 14 };
-      summarySheet.getColumn(2).numFmt = '#,##0.000';
+      summarySheet.commit();
 
       const transSheet = workbook.addWorksheet('سجل المعاملات');
       transSheet.columns = [
@@ -1231,6 +1024,7 @@ const farwaniyaExportFactory = ({
       ];
       transSheet.getColumn('amount').numFmt = '#,##0.000';
       transSheet.getColumn('balanceAfter').numFmt = '#,##0.000';
+      styleHeaderRow(transSheet);
 
       const typeLabels = {
         income: 'دخل / Income',
@@ -1241,32 +1035,25 @@ const farwaniyaExportFactory = ({
         spending_adjustment: 'تعديل صرف / Spending Adjustment',
       };
 
-      transactions.forEach((trans) => {
-        transSheet.addRow({
-          date: formatDate(trans.date),
-          type: typeLabels[trans.type] || trans.type,
-          amount: trans.amount,
-          balanceAfter: trans.balanceAfter,
-          invoiceRef: trans.invoiceRef || '',
-          description: trans.description || '',
-          performedBy: trans.performedBy ? trans.performedBy.username : '',
-        });
-      });
-
-      const headerRow = transSheet.getRow(1);
-      headerRow.font = { bold: true };
-      headerRow.fill = {
-        type: 'pattern',
-        pattern: 'solid',
-        fgColor: { argb: 'FFE0E0E0' },
-      };
+      const cursor = await archiveAwareCursor(transactionModel, undefined, { date: -1 }, (M) => exportCursor(
+        M.find()
+          .populate('performedBy', 'username')
+          .sort({ date: -1 })
+      ));
+      await streamRows(transSheet, cursor, res, (trans) => ({
+        date: formatDate(trans.date),
+        type: typeLabels[trans.type] || trans.type,
+        amount: trans.amount,
+        balanceAfter: trans.balanceAfter,
+        invoiceRef: trans.invoiceRef || '',
+        description: trans.description || '',
+        performedBy: trans.performedBy ? trans.performedBy.username : '',
+      }));
 
-      res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-      res.setHeader('Content-Disposition', `attachment; filename=${key}-accounting-${moment().format('YYYY-MM-DD')}.xlsx`);
-      await workbook.xlsx.write(res);
-      res.end();
+      transSheet.commit();
+      await workbook.commit();
     } catch (error) {
-      res.status(500).json({ message: 'خطأ في تصدير المحاسبة', error: error.message });
+      exportFailed(res, error, { message: 'خطأ في تصدير المحاسبة', error: error.message });
     }
   });
 };
@@ -1297,11 +1084,7 @@ router.get('/fursatkum/invoices', async (req, res) => {
     if (type && type !== 'all') filters.type = type;
     if (ledger && ledger !== 'all') filters.ledger = ledger;
 
-    const invoices = await FursatkumInvoice.find(filters)
-      .populate('createdBy', 'username')
-      .sort({ date: -1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `fursatkum-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('فواتير فرصتكم');
 
     worksheet.columns = [
@@ -1319,6 +1102,7 @@ router.get('/fursatkum/invoices', async (req, res) => {
     ];
 
     worksheet.getColumn('value').numFmt = '#,##0.000';
+    styleHeaderRow(worksheet);
 
     const typeLabels = {
       income: 'فاتورة دخل / Income',
@@ -1333,48 +1117,36 @@ router.get('/fursatkum/invoices', async (req, res) => {
       deleted: 'محذوف / Deleted',
     };
 
-    invoices.forEach((invoice) => {
-      worksheet.addRow({
-        reference: invoice.referenceNumber,
-        type: typeLabels[invoice.type] || invoice.type,
-        ledger: ledgerLabels[invoice.ledger] || invoice.ledger,
-        name: invoice.name,
-        value: invoice.value,
-        bankRef: invoice.ledger === 'bank' ? (invoice.bankReference || '') : '',
-        date: formatDate(invoice.date),
-        details: invoice.details || '',
-        status: statusLabels[invoice.status] || invoice.status,
-        isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
-        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-      });
-    });
-
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=fursatkum-invoices-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = await archiveAwareCursor(FursatkumInvoice, filters.date, { date: -1 }, (M) => exportCursor(
+      M.find(filters)
+        .populate('createdBy', 'username')
+        .sort({ date: -1 })
+    ));
+    await streamRows(worksheet, cursor, res, (invoice) => ({
+      reference: invoice.referenceNumber,
+      type: typeLabels[invoice.type] || invoice.type,
+      ledger: ledgerLabels[invoice.ledger] || invoice.ledger,
+      name: invoice.name,
+      value: invoice.value,
+      bankRef: invoice.ledger === 'bank' ? (invoice.bankReference || '') : '',
+      date: formatDate(invoice.date),
+      details: invoice.details || '',
+      status: statusLabels[invoice.status] || invoice.status,
+      isEdited: invoice.isEdited ? 'نعم / Yes' : 'لا / No',
+      createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير فواتير فرصتكم', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير فواتير فرصتكم', error: error.message });
   }
 });
 
 // Export Fursatkum Deleted Invoices
 router.get('/fursatkum/deleted', async (req, res) => {
   try {
-    const invoices = await FursatkumInvoice.find({ status: 'deleted' })
-      .populate('createdBy', 'username')
-      .populate('deletedBy', 'username')
-      .sort({ deletedAt: -1 });
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookStream(res, `fursatkum-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
     const worksheet = workbook.addWorksheet('الفواتير المحذوفة');
 
     worksheet.columns = [
@@ -1392,74 +1164,55 @@ router.get('/fursatkum/deleted', async (req, res) => {
     ];
 
     worksheet.getColumn('value').numFmt = '#,##0.000';
+    styleHeaderRow(worksheet);
 
     const typeLabels = { income: 'فاتورة دخل / Income', spending: 'إيصال صرف / Spending' };
     const ledgerLabels = { bank: 'حساب بنكي / Bank', cash: 'صندوق نقدي / Cash' };
 
-    invoices.forEach((invoice) => {
-      worksheet.addRow({
-        reference: invoice.referenceNumber,
-        type: typeLabels[invoice.type] || invoice.type,
-        ledger: ledgerLabels[invoice.ledger] || invoice.ledger,
-        name: invoice.name,
-        value: invoice.value,
-        bankRef: invoice.ledger === 'bank' ? (invoice.bankReference || '') : '',
-        date: formatDate(invoice.date),
-        reason: invoice.deleteReason || '',
-        createdBy: invoice.createdBy ? invoice.createdBy.username : '',
-        deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
-        deletedAt: formatDate(invoice.deletedAt),
-      });
-    });
-
-    const headerRow = worksheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
-
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=fursatkum-deleted-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+    const cursor = await archiveAwareCursor(FursatkumInvoice, undefined, { deletedAt: -1 }, (M) => exportCursor(
+      M.find({ status: 'deleted' })
+        .populate('createdBy', 'username')
+        .populate('deletedBy', 'username')
+        .sort({ deletedAt: -1 })
+    ));
+    await streamRows(worksheet, cursor, res, (invoice) => ({
+      reference: invoice.referenceNumber,
+      type: typeLabels[invoice.type] || invoice.type,
+      ledger: ledgerLabels[invoice.ledger] || invoice.ledger,
+      name: invoice.name,
+      value: invoice.value,
+      bankRef: invoice.ledger === 'bank' ? (invoice.bankReference || '') : '',
+      date: formatDate(invoice.date),
+      reason: invoice.deleteReason || '',
+      createdBy: invoice.createdBy ? invoice.createdBy.username : '',
+      deletedBy: invoice.deletedBy ? invoice.deletedBy.username : '',
+      deletedAt: formatDate(invoice.deletedAt),
+    }));
+
+    worksheet.commit();
+    await workbook.commit();
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
+    exportFailed(res, error, { message: 'خطأ في تصدير الفواتير المحذوفة', error: error.message });
   }
 });
 
 // Export Fursatkum Accounting Summary & Transactions
-router.get('/fursatkum/accounting', async (req, res) => {
-  try {
-    const account = await FursatkumAccount.getAccount();
-    const transactions = await FursatkumTransaction.find()
-      .populate('performedBy', 'username')
-      .sort({ date: -1 });
-
-    const [incomeAgg, spendingAgg] = await Promise.all([
-      FursatkumInvoice.aggregate([
-        { $match: { type: 'income', status: 'active' } },
-        { $group: { _id: null, total: { $sum: '$value' } } },
-      ]),
-      FursatkumInvoice.aggregate([
-        { $match: { type: 'spending', status: 'active' } },
-        { $group: { _id: null, total: { $sum: '$value' } } },
-      ]),
-    ]);
+const fursatkumAccountingExport = {
+  filename: () => `fursatkum-accounting-${moment().format('YYYY-MM-DD')}.xlsx`,
+  write: async (out) => {
+    // Totals come from the invoice summary counters kept on the account
+    const { account, summary } = await getAccountSummary('fursatkum');
 
-    const totalIncome = incomeAgg.length ? incomeAgg[0].total : 0;
-    const totalSpendings = spendingAgg.length ? spendingAgg[0].total : 0;
-
-    const workbook = new ExcelJS.Workbook();
+    const workbook = createWorkbookWriter(out);
 
     const summarySheet = workbook.addWorksheet('ملخص المحاسبة');
-    summarySheet.addRow([bilingualHeader('ملخص المحاسبة - فرصتكم', 'Fursatkum Accounting Summary')]);
+    summarySheet.getColumn(2).numFmt = '#,##0.000';
+    summarySheet.addRow([bilingualHeader('ملخص المحاسبة - فرصتكم', 'Fursatkum Accounting Summary')]).font = { bold: true, size: 14 };
     summarySheet.addRow([]);
     summarySheet.addRow([bilingualHeader('رصيد البنك', 'Bank Balance'), account.bankBalance]);
     summarySheet.addRow([bilingualHeader('رصيد الصندوق', 'Cash Balance'), account.cashBalance]);
-    summarySheet.addRow([bilingualHeader('إجمالي الدخل', 'Total Income'), totalIncome]);
-    summarySheet.addRow([bilingualHeader('إجمالي المصروفات', 'Total Spendings'), totalSpendings]);
+    summarySheet.addRow([bilingualHeader('إجمالي الدخل', 'Total Income'), summary.incomeTotal]);
+    summarySheet.addRow([bilingualHeader('إجمالي المصروفات', 'Total Spendings'), summary.spendingTotal]);
     summarySheet.addRow([]);
     summarySheet.addRow([bilingualHeader('البنك', 'Bank'), account.bankInfo.bankName]);
     summarySheet.addRow([bilingualHeader('اسم الحساب', 'Account Name'), account.bankInfo.accountName]);
@@ -1467,8 +1220,7 @@ router.get('/fursatkum/accounting', async (req, res) => {
     summarySheet.addRow([bilingualHeader('IBAN', 'IBAN'), account.bankInfo.iban]);
     summarySheet.addRow([]);
     summarySheet.addRow([bilingualHeader('تاريخ التصدير', 'Export Date'), formatDate(new Date())]);
-    summarySheet.getColumn(2).numFmt = '#,##0.000';
-    summarySheet.getRow(1).font = { bold: true, size: 14 };
+    summarySheet.commit();
 
     const transSheet = workbook.addWorksheet('سجل المعاملات');
     transSheet.columns = [
@@ -1485,6 +1237,7 @@ router.get('/fursatkum/accounting', async (req, res) => {
 
     transSheet.getColumn('amount').numFmt = '#,##0.000';
     transSheet.getColumn('balanceAfter').numFmt = '#,##0.000';
+    styleHeaderRow(transSheet);
 
     const typeLabels = {
       income: 'دخل / Income',
@@ -1499,36 +1252,92 @@ router.get('/fursatkum/accounting', async (req, res) => {
       cash: 'صندوق نقدي / Cash',
     };
 
-    transactions.forEach((trans) => {
-      transSheet.addRow({
-        date: formatDate(trans.date),
-        type: typeLabels[trans.type] || trans.type,
-        ledger: ledgerLabels[trans.ledger] || trans.ledger,
-        amount: trans.amount,
-        balanceAfter: trans.balanceAfter,
-        invoiceRef: trans.invoiceRef || '',
-        description: trans.description || '',
-        reason: trans.reason || '',
-        performedBy: trans.performedBy ? trans.performedBy.username : '',
-      });
-    });
+    const cursor = await archiveAwareCursor(FursatkumTransaction, undefined, { date: -1 }, (M) => exportCursor(
+      M.find()
+        .populate('performedBy', 'username')
+        .sort({ date: -1 })
+    ));
+    await streamRows(transSheet, cursor, out, (trans) => ({
+      date: formatDate(trans.date),
+      type: typeLabels[trans.type] || trans.type,
+      ledger: ledgerLabels[trans.ledger] || trans.ledger,
+      amount: trans.amount,
+      balanceAfter: trans.balanceAfter,
+      invoiceRef: trans.invoiceRef || '',
+      description: trans.description || '',
+      reason: trans.reason || '',
+      performedBy: trans.performedBy ? trans.performedBy.username : '',
+    }));
+
+    transSheet.commit();
+    await workbook.commit();
+  },
+};
 
-    const headerRow = transSheet.getRow(1);
-    headerRow.font = { bold: true };
-    headerRow.fill = {
-      type: 'pattern',
-      pattern: 'solid',
-      fgColor: { argb: 'FFE0E0E0' },
-    };
+router.get('/fursatkum/accounting', async (req, res) => {
+  try {
+    setDownloadHeaders(res, fursatkumAccountingExport.filename(req.query));
+    await fursatkumAccountingExport.write(res, req.query);
+  } catch (error) {
+    exportFailed(res, error, { message: 'خطأ في تصدير محاسبة فرصتكم', error: error.message });
+  }
+});
+
+// ==================== BACKGROUND EXPORT JOBS ====================
+
+// Exports too slow to finish inside one HTTP request can also run as jobs
+exportJobs.register('company-report', companyReportExport);
+exportJobs.register('rental-management', rentalManagementExport);
+exportJobs.register('fursatkum-accounting', fursatkumAccountingExport);
 
-    res.setHeader('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet');
-    res.setHeader('Content-Disposition', `attachment; filename=fursatkum-accounting-${moment().format('YYYY-MM-DD')}.xlsx`);
-    await workbook.xlsx.write(res);
-    res.end();
+// Create (or reuse) an export job: body { type, query }
+router.post('/jobs', async (req, res) => {
+  try {
+    const { type, query = {} } = req.body || {};
+    if (!type) {
+      return res.status(400).json({ message: 'نوع التصدير مطلوب', types: exportJobs.types() });
+    }
+    const { job, reused } = await exportJobs.submit(type, query);
+    res.status(reused ? 200 : 202).json({ job: exportJobs.describe(job), reused });
+  } catch (error) {
+    if (error instanceof UnknownExportError) {
+      return res.status(400).json({ message: 'نوع التصدير غير معروف', types: exportJobs.types() });
+    }
+    res.status(500).json({ message: 'خطأ في إنشاء مهمة التصدير', error: error.message });
+  }
+});
+
+// Job status and progress
+router.get('/jobs/:id', async (req, res) => {
+  try {
+    const job = await exportJobs.get(req.params.id);
+    if (!job) {
+      return res.status(404).json({ message: 'مهمة التصدير غير موجودة أو انتهت صلاحيتها' });
+    }
+    res.json({ job: exportJobs.describe(job) });
   } catch (error) {
-    res.status(500).json({ message: 'خطأ في تصدير محاسبة فرصتكم', error: error.message });
+    res.status(500).json({ message: 'خطأ في جلب مهمة التصدير', error: error.message });
   }
 });
 
+// Download the finished file
+router.get('/jobs/:id/download', async (req, res) => {
+  try {
+    const job = await exportJobs.get(req.params.id);
+    if (!job) {
+      return res.status(404).json({ message: 'مهمة التصدير غير موجودة أو انتهت صلاحيتها' });
+    }
+    if (job.status !== 'completed') {
+      return res.status(409).json({ message: 'الملف غير جاهز بعد', job: exportJobs.describe(job) });
+    }
+    res.download(job.filePath, job.filename, (error) => {
+      if (error && !res.headersSent) {
+        res.status(404).json({ message: 'ملف التصدير غير موجود', error: error.message });
+      }
+    });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في تنزيل ملف التصدير', error: error.message });
+  }
+});
 
-module.exports = router; 
\ No newline at end of file
+module.exports = router;
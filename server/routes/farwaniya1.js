@@ -2,26 +2,20 @@ const express = require('express');
 const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
-const jwt = require('jsonwebtoken');
 const FW1Invoice = require('../models/FW1Invoice');
 const FW1Transaction = require('../models/FW1Transaction');
 const FW1Account = require('../models/FW1Account');
+const { postEntry } = require('../utils/ledger');
+const { findPage, findOffsetPage, InvalidCursorError } = require('../utils/pagination');
+const { summaryChange, getDashboard } = require('../utils/offices');
+const { getLedgerTotals } = require('../utils/ledgerCheckpoints');
+const { balanceRoute } = require('../utils/balances');
+const { timeseriesRoute } = require('../utils/timeseries');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
 // ============ MIDDLEWARE ============
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 function requireFarwaniya1Access(req, res, next) {
   const allowedRoles = ['admin', 'farwaniya1_user'];
   if (!allowedRoles.includes(req.user.role)) {
@@ -62,30 +56,7 @@ const upload = multer({
 // ============ DASHBOARD ============
 router.get('/dashboard', async (req, res) => {
   try {
-    const account = await FW1Account.getAccount();
-    const recentTransactions = await FW1Transaction.find()
-      .sort({ date: -1 })
-      .limit(10)
-      .populate('performedBy', 'username');
-
-    const [incomeCount, spendingCount, deletedCount] = await Promise.all([
-      FW1Invoice.countDocuments({ type: 'income', status: 'active' }),
-      FW1Invoice.countDocuments({ type: 'spending', status: 'active' }),
-      FW1Invoice.countDocuments({ status: 'deleted' }),
-    ]);
-
-    res.json({
-      balance: account.balance,
-      incomeTotal: account.incomeTotal,
-      spendingTotal: account.spendingTotal,
-      invoiceCounts: {
-        income: incomeCount,
-        spending: spendingCount,
-        deleted: deletedCount,
-        total: incomeCount + spendingCount,
-      },
-      recentTransactions,
-    });
+    res.json(await getDashboard('farwaniya1'));
   } catch (error) {
     res.status(500).json({ message: 'خطأ في جلب بيانات لوحة التحكم', error: error.message });
   }
@@ -94,7 +65,7 @@ router.get('/dashboard', async (req, res) => {
 // ============ INVOICES ============
 router.get('/invoices', async (req, res) => {
   try {
-    const { type, status = 'active', page = 1, limit = 50, search } = req.query;
+    const { type, status = 'active', page = 1, limit = 50, search, cursor } = req.query;
 
     const filters = { status };
     if (type && type !== 'all') filters.type = type;
@@ -111,16 +82,29 @@ router.get('/invoices', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [invoices, total] = await Promise.all([
-      FW1Invoice.find(filters)
-        .sort({ date: -1, createdAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: invoices, pagination } = await findPage(FW1Invoice, filters, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('createdBy', 'username')
+          .populate('deletedBy', 'username')
+          .populate('editHistory.editedBy', 'username'),
+      });
+      return res.json({ invoices, pagination });
+    }
+
+    const { docs: invoices, total } = await findOffsetPage(FW1Invoice, filters, {
+      sort: { date: -1, createdAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username')
         .populate('editHistory.editedBy', 'username'),
-      FW1Invoice.countDocuments(filters),
-    ]);
+    });
 
     res.json({
       invoices,
@@ -132,6 +116,9 @@ router.get('/invoices', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب الفواتير', error: error.message });
   }
 });
@@ -143,15 +130,14 @@ router.get('/deleted', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [invoices, total] = await Promise.all([
-      FW1Invoice.find({ status: 'deleted' })
-        .sort({ deletedAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    const { docs: invoices, total } = await findOffsetPage(FW1Invoice, { status: 'deleted' }, {
+      sort: { deletedAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username'),
-      FW1Invoice.countDocuments({ status: 'deleted' }),
-    ]);
+    });
 
     res.json({
       invoices,
@@ -195,11 +181,7 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
       return res.status(400).json({ message: 'قيمة الفاتورة غير صالحة' });
     }
 
-    const account = await FW1Account.getAccount();
-    const referenceNumber = await FW1Account.getNextReference(type);
-
     const invoiceData = {
-      referenceNumber,
       type,
       name,
       value: numValue,
@@ -216,26 +198,27 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
     }
 
     const invoice = new FW1Invoice(invoiceData);
-    await invoice.save();
-
-    if (type === 'income') {
-      account.balance += numValue;
-      account.incomeTotal += numValue;
-    } else {
-      account.balance -= numValue;
-      account.spendingTotal += numValue;
-    }
-    await account.save();
 
-    await FW1Transaction.create({
-      type,
+    await postEntry(FW1Account, FW1Transaction, {
+      field: 'balance',
       amount: type === 'income' ? numValue : -numValue,
-      balanceAfter: account.balance,
-      date: new Date(date),
-      invoiceId: invoice._id,
-      invoiceRef: referenceNumber,
-      description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
-      performedBy: req.user.userId,
+      inc: {
+        [type === 'income' ? 'incomeTotal' : 'spendingTotal']: numValue,
+        ...summaryChange.created(type, numValue),
+      },
+      transaction: async () => {
+        invoice.referenceNumber = await FW1Account.getNextReference(type);
+        await invoice.save();
+        return {
+          type,
+          date: new Date(date),
+          invoiceId: invoice._id,
+          invoiceRef: invoice.referenceNumber,
+          description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
+          performedBy: req.user.userId,
+        };
+      },
+      rollback: () => FW1Invoice.deleteOne({ _id: invoice._id }),
     });
 
     res.status(201).json({ message: 'تم إنشاء الفاتورة بنجاح', invoice });
@@ -252,7 +235,9 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
 
     const { name, value, date, details } = req.body;
     const editHistory = [];
-    const account = await FW1Account.getAccount();
+    // Kept to restore the invoice if its adjustment row cannot be written
+    const original = invoice.toObject();
+    let revaluation = null;
 
     if (value !== undefined) {
       const newValue = parseFloat(value);
@@ -269,25 +254,22 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
           editedBy: req.user.userId,
         });
 
-        if (invoice.type === 'income') {
-          account.balance += difference;
-          account.incomeTotal += difference;
-        } else {
-          account.balance -= difference;
-          account.spendingTotal += difference;
-        }
-        await account.save();
-
-        await FW1Transaction.create({
-          type: `${invoice.type}_adjustment`,
+        revaluation = {
+          field: 'balance',
           amount: invoice.type === 'income' ? difference : -difference,
-          balanceAfter: account.balance,
-          date: new Date(),
-          invoiceId: invoice._id,
-          invoiceRef: invoice.referenceNumber,
-          description: `تعديل قيمة ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name} (${invoice.value} → ${newValue})`,
-          performedBy: req.user.userId,
-        });
+          inc: {
+            [invoice.type === 'income' ? 'incomeTotal' : 'spendingTotal']: difference,
+            ...summaryChange.revalued(invoice.type, difference),
+          },
+          transaction: {
+            type: `${invoice.type}_adjustment`,
+            date: new Date(),
+            invoiceId: invoice._id,
+            invoiceRef: invoice.referenceNumber,
+            description: `تعديل قيمة ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name} (${invoice.value} → ${newValue})`,
+            performedBy: req.user.userId,
+          },
+        };
 
         invoice.value = newValue;
       }
@@ -354,7 +336,22 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
       invoice.editHistory.push(...editHistory);
     }
 
-    await invoice.save();
+    if (revaluation) {
+      // The invoice is saved together with its adjustment row: a rejected
+      // balance change leaves it untouched, a failed row write restores it
+      await invoice.validate();
+      const row = revaluation.transaction;
+      await postEntry(FW1Account, FW1Transaction, {
+        ...revaluation,
+        transaction: async () => {
+          await invoice.save();
+          return row;
+        },
+        rollback: () => FW1Invoice.replaceOne({ _id: invoice._id }, original),
+      });
+    } else {
+      await invoice.save();
+    }
     res.json({ message: 'تم تحديث الفاتورة بنجاح', invoice });
   } catch (error) {
     res.status(500).json({ message: 'خطأ في تحديث الفاتورة', error: error.message });
@@ -367,26 +364,24 @@ router.delete('/invoices/:id', async (req, res) => {
     if (!invoice) return res.status(404).json({ message: 'الفاتورة غير موجودة' });
     if (invoice.status === 'deleted') return res.status(400).json({ message: 'الفاتورة محذوفة بالفعل' });
 
-    const account = await FW1Account.getAccount();
-
-    if (invoice.type === 'income') {
-      account.balance -= invoice.value;
-      account.incomeTotal = Math.max(0, account.incomeTotal - invoice.value);
-    } else {
-      account.balance += invoice.value;
-      account.spendingTotal = Math.max(0, account.spendingTotal - invoice.value);
-    }
-    await account.save();
-
-    await FW1Transaction.create({
-      type: `${invoice.type}_reversal`,
+    // Totals are clamped at zero, the running balance is not
+    const totalField = invoice.type === 'income' ? 'incomeTotal' : 'spendingTotal';
+    await postEntry(FW1Account, FW1Transaction, {
+      field: 'balance',
       amount: invoice.type === 'income' ? -invoice.value : invoice.value,
-      balanceAfter: account.balance,
-      date: new Date(),
-      invoiceId: invoice._id,
-      invoiceRef: invoice.referenceNumber,
-      description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
-      performedBy: req.user.userId,
+      inc: {
+        [totalField]: -invoice.value,
+        ...summaryChange.deleted(invoice.type, invoice.value),
+      },
+      floor: [totalField],
+      transaction: {
+        type: `${invoice.type}_reversal`,
+        date: new Date(),
+        invoiceId: invoice._id,
+        invoiceRef: invoice.referenceNumber,
+        description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
+        performedBy: req.user.userId,
+      },
     });
 
     invoice.status = 'deleted';
@@ -401,18 +396,28 @@ router.delete('/invoices/:id', async (req, res) => {
 });
 
 // ============ ACCOUNTING ============
+// Ledger balance at a point in time: ?asOf=<date>&ledger=<ledger>
+router.get('/balance', balanceRoute('farwaniya1'));
+
+// Income vs spending per day/week/month: ?granularity=month&from=&to=&ledger=
+router.get('/reports/timeseries', timeseriesRoute('farwaniya1'));
+
 router.get('/accounting', async (req, res) => {
   try {
-    const account = await FW1Account.getAccount();
-    const transactions = await FW1Transaction.find()
-      .sort({ date: -1 })
-      .limit(200)
-      .populate('performedBy', 'username');
+    const [account, ledgers, transactions] = await Promise.all([
+      FW1Account.getAccount(),
+      getLedgerTotals('farwaniya1'),
+      FW1Transaction.find()
+        .sort({ date: -1 })
+        .limit(200)
+        .populate('performedBy', 'username'),
+    ]);
 
     res.json({
       balance: account.balance,
       incomeTotal: account.incomeTotal,
       spendingTotal: account.spendingTotal,
+      ledgers,
       transactions,
     });
   } catch (error) {
@@ -422,19 +427,30 @@ router.get('/accounting', async (req, res) => {
 
 router.get('/transactions', async (req, res) => {
   try {
-    const { page = 1, limit = 50 } = req.query;
+    const { page = 1, limit = 50, cursor } = req.query;
     const pageNumber = Math.max(1, parseInt(page, 10) || 1);
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [transactions, total] = await Promise.all([
-      FW1Transaction.find()
-        .sort({ date: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: transactions, pagination } = await findPage(FW1Transaction, {}, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('performedBy', 'username'),
+      });
+      return res.json({ transactions, pagination });
+    }
+
+    const { docs: transactions, total } = await findOffsetPage(FW1Transaction, {}, {
+      sort: { date: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('performedBy', 'username'),
-      FW1Transaction.countDocuments(),
-    ]);
+    });
 
     res.json({
       transactions,
@@ -446,6 +462,9 @@ router.get('/transactions', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب المعاملات', error: error.message });
   }
 });
@@ -2,7 +2,6 @@ const express = require('express');
 const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
-const jwt = require('jsonwebtoken');
 const mongoose = require('mongoose');
 const FursatkumInvoice = require('../models/FursatkumInvoice');
 const FursatkumTransaction = require('../models/FursatkumTransaction');
@@ -10,23 +9,18 @@ const FursatkumAccount = require('../models/FursatkumAccount');
 const FursatkumEmployeeLoan = require('../models/FursatkumEmployeeLoan');
 const FursatkumSalaryPayment = require('../models/FursatkumSalaryPayment');
 const FursatkumEmployee = require('../models/FursatkumEmployee');
+const { postEntry, postBatch, InsufficientFundsError } = require('../utils/ledger');
+const { findPage, findOffsetPage, InvalidCursorError } = require('../utils/pagination');
+const { summaryChange, getAccountSummary, getDashboard } = require('../utils/offices');
+const { getLedgerTotals } = require('../utils/ledgerCheckpoints');
+const { balanceRoute } = require('../utils/balances');
+const { timeseriesRoute } = require('../utils/timeseries');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
 // ==================== MIDDLEWARE ====================
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 function requireAdmin(req, res, next) {
   if (req.user.role !== 'admin') {
     return res.status(403).json({ message: 'هذا الإجراء للمسؤول فقط' });
@@ -84,30 +78,7 @@ const getLedgerField = (ledger) => (ledger === 'bank' ? 'bankBalance' : 'cashBal
 // ==================== DASHBOARD ====================
 router.get('/dashboard', async (req, res) => {
   try {
-    const account = await FursatkumAccount.getAccount();
-    const recentTransactions = await FursatkumTransaction.find()
-      .sort({ date: -1 })
-      .limit(10)
-      .populate('performedBy', 'username');
-
-    const [incomeCount, spendingCount, deletedCount] = await Promise.all([
-      FursatkumInvoice.countDocuments({ type: 'income', status: 'active' }),
-      FursatkumInvoice.countDocuments({ type: 'spending', status: 'active' }),
-      FursatkumInvoice.countDocuments({ status: 'deleted' }),
-    ]);
-
-    res.json({
-      bankBalance: account.bankBalance,
-      cashBalance: account.cashBalance,
-      bankInfo: account.bankInfo,
-      invoiceCounts: {
-        income: incomeCount,
-        spending: spendingCount,
-        deleted: deletedCount,
-        total: incomeCount + spendingCount,
-      },
-      recentTransactions,
-    });
+    res.json(await getDashboard('fursatkum'));
   } catch (error) {
     res.status(500).json({ message: 'خطأ في جلب بيانات لوحة التحكم', error: error.message });
   }
@@ -118,7 +89,7 @@ router.get('/dashboard', async (req, res) => {
 // List invoices with filters
 router.get('/invoices', async (req, res) => {
   try {
-    const { type, ledger, status = 'active', page = 1, limit = 50, search, startDate, endDate } = req.query;
+    const { type, ledger, status = 'active', page = 1, limit = 50, search, startDate, endDate, cursor } = req.query;
 
     const filters = { status };
     if (type && type !== 'all') filters.type = type;
@@ -142,16 +113,29 @@ router.get('/invoices', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [invoices, total] = await Promise.all([
-      FursatkumInvoice.find(filters)
-        .sort({ date: -1, createdAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: invoices, pagination } = await findPage(FursatkumInvoice, filters, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('createdBy', 'username')
+          .populate('deletedBy', 'username')
+          .populate('editHistory.editedBy', 'username'),
+      });
+      return res.json({ invoices, pagination });
+    }
+
+    const { docs: invoices, total } = await findOffsetPage(FursatkumInvoice, filters, {
+      sort: { date: -1, createdAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username')
         .populate('editHistory.editedBy', 'username'),
-      FursatkumInvoice.countDocuments(filters),
-    ]);
+    });
 
     res.json({
       invoices,
@@ -163,6 +147,9 @@ router.get('/invoices', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب الفواتير', error: error.message });
   }
 });
@@ -175,15 +162,14 @@ router.get('/deleted', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [invoices, total] = await Promise.all([
-      FursatkumInvoice.find({ status: 'deleted' })
-        .sort({ deletedAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    const { docs: invoices, total } = await findOffsetPage(FursatkumInvoice, { status: 'deleted' }, {
+      sort: { deletedAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username'),
-      FursatkumInvoice.countDocuments({ status: 'deleted' }),
-    ]);
+    });
 
     res.json({
       invoices,
@@ -237,26 +223,7 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
       return res.status(400).json({ message: 'قيمة الفاتورة غير صالحة' });
     }
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(ledger);
-
-    if (type === 'spending') {
-      if (numValue > account[ledgerField]) {
-        return res.status(400).json({
-          message: 'الرصيد غير كافٍ في المصدر المحدد',
-          available: account[ledgerField],
-          required: numValue,
-        });
-      }
-      account[ledgerField] -= numValue;
-    } else {
-      account[ledgerField] += numValue;
-    }
-
-    const referenceNumber = await FursatkumAccount.getNextReference(type);
-
     const invoiceData = {
-      referenceNumber,
       type,
       ledger,
       bankReference: ledger === 'bank' ? bankReference : undefined,
@@ -275,24 +242,37 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
     }
 
     const invoice = new FursatkumInvoice(invoiceData);
-    await invoice.save();
-    await account.save();
 
-    // transaction
-    await FursatkumTransaction.create({
-      type,
-      ledger,
+    await postEntry(FursatkumAccount, FursatkumTransaction, {
+      field: getLedgerField(ledger),
       amount: type === 'income' ? numValue : -numValue,
-      balanceAfter: account[ledgerField],
-      date: new Date(date),
-      invoiceId: invoice._id,
-      invoiceRef: referenceNumber,
-      description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
-      performedBy: getUserId(req),
+      requireFunds: true,
+      inc: summaryChange.created(type, numValue),
+      transaction: async () => {
+        invoice.referenceNumber = await FursatkumAccount.getNextReference(type);
+        await invoice.save();
+        return {
+          type,
+          ledger,
+          date: new Date(date),
+          invoiceId: invoice._id,
+          invoiceRef: invoice.referenceNumber,
+          description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
+          performedBy: getUserId(req),
+        };
+      },
+      rollback: () => FursatkumInvoice.deleteOne({ _id: invoice._id }),
     });
 
     res.status(201).json({ message: 'تم إنشاء الفاتورة بنجاح', invoice });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({
+        message: 'الرصيد غير كافٍ في المصدر المحدد',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في إنشاء الفاتورة', error: error.message });
   }
 });
@@ -309,8 +289,9 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
 
     const { name, value, date, details, bankReference } = req.body;
     const editHistory = [];
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(invoice.ledger);
+    // Kept to restore the invoice if its adjustment row cannot be written
+    const original = invoice.toObject();
+    let revaluation = null;
 
     if (value !== undefined) {
       const newValue = parseFloat(value);
@@ -319,14 +300,23 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
       }
       const difference = newValue - invoice.value;
       if (difference !== 0) {
-        // spending increase needs balance check
-        if (invoice.type === 'spending' && difference > 0 && difference > account[ledgerField]) {
-          return res.status(400).json({
-            message: 'الرصيد غير كافٍ للزيادة',
-            available: account[ledgerField],
-            required: difference,
-          });
-        }
+        // spending increase is guarded against the ledger balance
+        revaluation = {
+          field: getLedgerField(invoice.ledger),
+          amount: invoice.type === 'income' ? difference : -difference,
+          requireFunds: invoice.type === 'spending',
+          inc: summaryChange.revalued(invoice.type, difference),
+          transaction: {
+            type: `${invoice.type}_adjustment`,
+            ledger: invoice.ledger,
+            date: new Date(),
+            invoiceId: invoice._id,
+            invoiceRef: invoice.referenceNumber,
+            description: `تعديل ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
+            reason,
+            performedBy: getUserId(req),
+          },
+        };
 
         editHistory.push({
           field: 'value',
@@ -337,28 +327,6 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
           editedBy: getUserId(req),
         });
 
-        let balanceAfter;
-        if (invoice.type === 'income') {
-          account[ledgerField] += difference;
-        } else {
-          account[ledgerField] -= difference;
-        }
-        balanceAfter = account[ledgerField];
-        await account.save();
-
-        await FursatkumTransaction.create({
-          type: `${invoice.type}_adjustment`,
-          ledger: invoice.ledger,
-          amount: invoice.type === 'income' ? difference : -difference,
-          balanceAfter,
-          date: new Date(),
-          invoiceId: invoice._id,
-          invoiceRef: invoice.referenceNumber,
-          description: `تعديل ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
-          reason,
-          performedBy: getUserId(req),
-        });
-
         invoice.value = newValue;
       }
     }
@@ -438,9 +406,31 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
       invoice.editHistory.push(...editHistory);
     }
 
-    await invoice.save();
+    if (revaluation) {
+      // The invoice is saved together with its adjustment row: a rejected
+      // balance change leaves it untouched, a failed row write restores it
+      await invoice.validate();
+      const row = revaluation.transaction;
+      await postEntry(FursatkumAccount, FursatkumTransaction, {
+        ...revaluation,
+        transaction: async () => {
+          await invoice.save();
+          return row;
+        },
+        rollback: () => FursatkumInvoice.replaceOne({ _id: invoice._id }, original),
+      });
+    } else {
+      await invoice.save();
+    }
     res.json({ message: 'تم تحديث الفاتورة بنجاح', invoice });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({
+        message: 'الرصيد غير كافٍ للزيادة',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في تحديث الفاتورة', error: error.message });
   }
 });
@@ -455,29 +445,22 @@ router.delete('/invoices/:id', async (req, res) => {
     if (!invoice) return res.status(404).json({ message: 'الفاتورة غير موجودة' });
     if (invoice.status === 'deleted') return res.status(400).json({ message: 'الفاتورة محذوفة بالفعل' });
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(invoice.ledger);
-
-    if (invoice.type === 'income') {
-      account[ledgerField] -= invoice.value;
-      if (account[ledgerField] < 0) account[ledgerField] = 0;
-    } else {
-      account[ledgerField] += invoice.value;
-    }
-
-    await account.save();
-
-    await FursatkumTransaction.create({
-      type: `${invoice.type}_reversal`,
-      ledger: invoice.ledger,
+    // Income reversals keep the historical clamp at zero
+    await postEntry(FursatkumAccount, FursatkumTransaction, {
+      field: getLedgerField(invoice.ledger),
       amount: invoice.type === 'income' ? -invoice.value : invoice.value,
-      balanceAfter: account[ledgerField],
-      date: new Date(),
-      invoiceId: invoice._id,
-      invoiceRef: invoice.referenceNumber,
-      description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
-      reason,
-      performedBy: getUserId(req),
+      floorAtZero: invoice.type === 'income',
+      inc: summaryChange.deleted(invoice.type, invoice.value),
+      transaction: {
+        type: `${invoice.type}_reversal`,
+        ledger: invoice.ledger,
+        date: new Date(),
+        invoiceId: invoice._id,
+        invoiceRef: invoice.referenceNumber,
+        description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
+        reason,
+        performedBy: getUserId(req),
+      },
     });
 
     invoice.status = 'deleted';
@@ -596,7 +579,7 @@ router.put('/employees/:id', async (req, res) => {
 // List employee loans
 router.get('/employee-loans', async (req, res) => {
   try {
-    const { employeeId, status, page = 1, limit = 50 } = req.query;
+    const { employeeId, status, page = 1, limit = 50, cursor } = req.query;
     const filters = {};
     if (employeeId) filters.employeeId = employeeId;
     if (status) filters.status = status;
@@ -605,15 +588,27 @@ router.get('/employee-loans', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [loans, total] = await Promise.all([
-      FursatkumEmployeeLoan.find(filters)
-        .sort({ createdAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: loans, pagination } = await findPage(FursatkumEmployeeLoan, filters, {
+        sortField: 'createdAt',
+        cursor,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('employeeId', 'name')
+          .populate('createdBy', 'username'),
+      });
+      return res.json({ loans, pagination });
+    }
+
+    const { docs: loans, total } = await findOffsetPage(FursatkumEmployeeLoan, filters, {
+      sort: { createdAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('employeeId', 'name')
         .populate('createdBy', 'username'),
-      FursatkumEmployeeLoan.countDocuments(filters),
-    ]);
+    });
 
     res.json({
       loans,
@@ -625,6 +620,9 @@ router.get('/employee-loans', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب القروض', error: error.message });
   }
 });
@@ -661,7 +659,7 @@ router.get('/employee-loans/:id', async (req, res) => {
 // List salary payments
 router.get('/salaries', async (req, res) => {
   try {
-    const { employeeId, startDate, endDate, page = 1, limit = 50 } = req.query;
+    const { employeeId, startDate, endDate, page = 1, limit = 50, cursor } = req.query;
     const filters = {};
     if (employeeId) filters.employeeId = employeeId;
     if (startDate || endDate) {
@@ -674,15 +672,26 @@ router.get('/salaries', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [salaries, total] = await Promise.all([
-      FursatkumSalaryPayment.find(filters)
-        .sort({ date: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: salaries, pagination } = await findPage(FursatkumSalaryPayment, filters, {
+        cursor,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('employeeId', 'name')
+          .populate('createdBy', 'username'),
+      });
+      return res.json({ salaries, pagination });
+    }
+
+    const { docs: salaries, total } = await findOffsetPage(FursatkumSalaryPayment, filters, {
+      sort: { date: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('employeeId', 'name')
         .populate('createdBy', 'username'),
-      FursatkumSalaryPayment.countDocuments(filters),
-    ]);
+    });
 
     res.json({
       salaries,
@@ -694,6 +703,9 @@ router.get('/salaries', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب الرواتب', error: error.message });
   }
 });
@@ -755,24 +767,8 @@ router.post('/employee-loans', async (req, res) => {
       return res.status(400).json({ message: 'الموظف غير موجود' });
     }
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(ledger);
-
-    if (numAmount > account[ledgerField]) {
-      return res.status(400).json({
-        message: 'الرصيد غير كافٍ في المصدر المحدد',
-        available: account[ledgerField],
-        required: numAmount,
-      });
-    }
-
-    account[ledgerField] -= numAmount;
-
-    const referenceNumber = await FursatkumAccount.getNextReference('loan');
-
     const loanData = {
       employeeId,
-      referenceNumber,
       originalAmount: numAmount,
       remainingAmount: numAmount,
       monthlyDeduction: numMonthlyDeduction,
@@ -784,21 +780,33 @@ router.post('/employee-loans', async (req, res) => {
     }
     const loan = new FursatkumEmployeeLoan(loanData);
 
-    await loan.save();
-    await account.save();
-
-    await FursatkumTransaction.create({
-      type: 'employee_loan_given',
-      ledger,
+    await postEntry(FursatkumAccount, FursatkumTransaction, {
+      field: getLedgerField(ledger),
       amount: -numAmount,
-      balanceAfter: account[ledgerField],
-      date: new Date(),
-      description: `صرف قرض موظف (${referenceNumber})`,
-      performedBy: getUserId(req),
+      requireFunds: true,
+      transaction: async () => {
+        loan.referenceNumber = await FursatkumAccount.getNextReference('loan');
+        await loan.save();
+        return {
+          type: 'employee_loan_given',
+          ledger,
+          date: new Date(),
+          description: `صرف قرض موظف (${loan.referenceNumber})`,
+          performedBy: getUserId(req),
+        };
+      },
+      rollback: () => FursatkumEmployeeLoan.deleteOne({ _id: loan._id }),
     });
 
     res.status(201).json({ message: 'تم إنشاء قرض الموظف بنجاح', loan });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({
+        message: 'الرصيد غير كافٍ في المصدر المحدد',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في إنشاء قرض الموظف', error: error.message });
   }
 });
@@ -828,35 +836,79 @@ router.post('/employee-loans/:id/repay', async (req, res) => {
       return res.status(400).json({ message: 'قيمة السداد أكبر من المتبقي' });
     }
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(ledger);
-
-    account[ledgerField] += numAmount;
-    loan.remainingAmount -= numAmount;
-    if (loan.remainingAmount <= 0) {
-      loan.remainingAmount = 0;
-      loan.status = 'paid';
+    // Decrement the loan in place so concurrent repayments cannot overpay it
+    const updatedLoan = await FursatkumEmployeeLoan.findOneAndUpdate(
+      { _id: loan._id, status: 'active', remainingAmount: { $gte: numAmount } },
+      [
+        { $set: { remainingAmount: { $max: [0, { $subtract: ['$remainingAmount', numAmount] }] } } },
+        { $set: { status: { $cond: [{ $lte: ['$remainingAmount', 0] }, 'paid', '$status'] } } },
+      ],
+      { new: true },
+    );
+    if (!updatedLoan) {
+      return res.status(400).json({ message: 'قيمة السداد أكبر من المتبقي' });
     }
 
-    await loan.save();
-    await account.save();
-
-    await FursatkumTransaction.create({
-      type: 'employee_loan_repayment',
-      ledger,
-      amount: numAmount,
-      balanceAfter: account[ledgerField],
-      date: new Date(),
-      description: `سداد قرض موظف (${loan.referenceNumber})`,
-      performedBy: getUserId(req),
-    });
+    try {
+      await postEntry(FursatkumAccount, FursatkumTransaction, {
+        field: getLedgerField(ledger),
+        amount: numAmount,
+        transaction: {
+          type: 'employee_loan_repayment',
+          ledger,
+          date: new Date(),
+          description: `سداد قرض موظف (${loan.referenceNumber})`,
+          performedBy: getUserId(req),
+        },
+      });
+    } catch (postingError) {
+      // Give the repayment back to the loan; the ledger is reverted by postEntry
+      await FursatkumEmployeeLoan.updateOne({ _id: loan._id }, [{
+        $set: {
+          remainingAmount: { $add: ['$remainingAmount', numAmount] },
+          status: { $cond: [{ $eq: ['$status', 'paid'] }, 'active', '$status'] },
+        },
+      }]).catch(() => {});
+      throw postingError;
+    }
 
-    res.json({ message: 'تم سداد القرض بنجاح', loan });
+    res.json({ message: 'تم سداد القرض بنجاح', loan: updatedLoan });
   } catch (error) {
     res.status(500).json({ message: 'خطأ في سداد القرض', error: error.message });
   }
 });
 
+// A loan changed between planning the payroll and applying its deductions
+class LoanChangedError extends Error {
+  constructor(loans) {
+    super('تغير رصيد بعض القروض أثناء صرف الرواتب، يرجى إعادة المحاولة');
+    this.name = 'LoanChangedError';
+    this.loans = loans;
+  }
+}
+
+// Loan deductions for one salary: active loans are settled oldest first, each
+// by its monthly deduction (or its full remaining amount when none is set),
+// until the salary runs out. `loans` must be sorted by createdAt ascending.
+function planLoanDeductions(grossSalary, loans) {
+  let deduction = 0;
+  const loanAdjustments = [];
+  let remainingSalary = grossSalary;
+  for (const loan of loans) {
+    if (remainingSalary <= 0) break;
+    const planned = loan.monthlyDeduction !== undefined && loan.monthlyDeduction !== null
+      ? loan.monthlyDeduction
+      : loan.remainingAmount;
+    const applied = Math.min(planned, loan.remainingAmount, remainingSalary);
+    if (applied > 0) {
+      deduction += applied;
+      remainingSalary -= applied;
+      loanAdjustments.push({ loan, applied });
+    }
+  }
+  return { deduction, loanAdjustments };
+}
+
 router.post('/salaries/pay', async (req, res) => {
   try {
     const { employeeId, grossSalary, ledger, date } = req.body;
@@ -878,42 +930,13 @@ router.post('/salaries/pay', async (req, res) => {
       return res.status(400).json({ message: 'الموظف غير موجود' });
     }
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(ledger);
-
     const activeLoans = await FursatkumEmployeeLoan.find({ employeeId, status: 'active' }).sort({ createdAt: 1 });
-    let deduction = 0;
-    const loanAdjustments = [];
-    let remainingSalary = numGrossSalary;
-    for (const loan of activeLoans) {
-      if (remainingSalary <= 0) break;
-      const planned = loan.monthlyDeduction !== undefined && loan.monthlyDeduction !== null
-        ? loan.monthlyDeduction
-        : loan.remainingAmount;
-      const applied = Math.min(planned, loan.remainingAmount, remainingSalary);
-      if (applied > 0) {
-        deduction += applied;
-        remainingSalary -= applied;
-        loanAdjustments.push({ loan, applied });
-      }
-    }
+    const { deduction, loanAdjustments } = planLoanDeductions(numGrossSalary, activeLoans);
 
     const netPaid = numGrossSalary - deduction;
-    if (netPaid > account[ledgerField]) {
-      return res.status(400).json({
-        message: 'الرصيد غير كافٍ في المصدر المحدد',
-        available: account[ledgerField],
-        required: netPaid,
-      });
-    }
-
-    account[ledgerField] -= netPaid;
-
-    const referenceNumber = await FursatkumAccount.getNextReference('salary');
 
     const salaryData = {
       employeeId,
-      referenceNumber,
       grossSalary: numGrossSalary,
       loanDeducted: deduction,
       netPaid,
@@ -926,16 +949,22 @@ router.post('/salaries/pay', async (req, res) => {
     }
     const salary = new FursatkumSalaryPayment(salaryData);
 
-    await salary.save();
-
-    await FursatkumTransaction.create({
-      type: 'salary_payment',
-      ledger,
+    const { balanceAfter } = await postEntry(FursatkumAccount, FursatkumTransaction, {
+      field: getLedgerField(ledger),
       amount: -netPaid,
-      balanceAfter: account[ledgerField],
-      date: new Date(date),
-      description: `صرف راتب (${referenceNumber})`,
-      performedBy: getUserId(req),
+      requireFunds: true,
+      transaction: async () => {
+        salary.referenceNumber = await FursatkumAccount.getNextReference('salary');
+        await salary.save();
+        return {
+          type: 'salary_payment',
+          ledger,
+          date: new Date(date),
+          description: `صرف راتب (${salary.referenceNumber})`,
+          performedBy: getUserId(req),
+        };
+      },
+      rollback: () => FursatkumSalaryPayment.deleteOne({ _id: salary._id }),
     });
 
     if (loanAdjustments.length > 0) {
@@ -954,43 +983,249 @@ router.post('/salaries/pay', async (req, res) => {
         type: 'salary_loan_deduction',
         ledger,
         amount: 0,
-        balanceAfter: account[ledgerField],
+        balanceAfter,
         date: new Date(date),
-        description: `خصم قروض (${refs.join(', ')}) من راتب (${referenceNumber})`,
+        description: `خصم قروض (${refs.join(', ')}) من راتب (${salary.referenceNumber})`,
         performedBy: getUserId(req),
       });
     }
 
-    await account.save();
-
     res.status(201).json({ message: 'تم صرف الراتب بنجاح', salary });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({
+        message: 'الرصيد غير كافٍ في المصدر المحدد',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في صرف الراتب', error: error.message });
   }
 });
 
+/**
+ * Payroll run: pay several employees from one ledger in a single pass.
+ * Body: { ledger, date, salaries?: [{ employeeId, grossSalary }] }. Without
+ * `salaries` every active employee is paid their monthly salary.
+ *
+ * Employees and their active loans are read with one query each, deductions
+ * are planned in memory, the ledger is checked and debited once for the total
+ * net pay, and salaries and transaction rows are written in bulk. Loan
+ * deductions are applied concurrently, one conditional update per loan. If a
+ * loan changed since it was planned (409) or any later write fails, the loans
+ * are restored, the salaries deleted and the debit reverted.
+ */
+router.post('/salaries/pay-batch', async (req, res) => {
+  try {
+    const { ledger, date, salaries } = req.body;
+
+    if (!ledger || !date) {
+      return res.status(400).json({ message: 'الحقول الأساسية مطلوبة' });
+    }
+    if (!['cash', 'bank'].includes(ledger)) {
+      return res.status(400).json({ message: 'مصدر/وجهة غير صالحة' });
+    }
+    const payDate = new Date(date);
+    if (Number.isNaN(payDate.getTime())) {
+      return res.status(400).json({ message: 'التاريخ غير صالح' });
+    }
+
+    let requested = null;
+    if (salaries !== undefined) {
+      if (!Array.isArray(salaries) || salaries.length === 0) {
+        return res.status(400).json({ message: 'قائمة الرواتب غير صالحة' });
+      }
+      requested = new Map();
+      for (const entry of salaries) {
+        const gross = parseFloat(entry?.grossSalary);
+        if (!mongoose.isValidObjectId(entry?.employeeId) || isNaN(gross) || gross <= 0) {
+          return res.status(400).json({ message: 'قيمة الراتب غير صالحة', employeeId: entry?.employeeId });
+        }
+        if (requested.has(String(entry.employeeId))) {
+          return res.status(400).json({ message: 'الموظف مكرر في قائمة الرواتب', employeeId: entry.employeeId });
+        }
+        requested.set(String(entry.employeeId), gross);
+      }
+    }
+
+    // Requested employees are read whatever their status so inactive ones can be reported
+    const employees = await FursatkumEmployee.find(requested
+      ? { _id: { $in: [...requested.keys()] } }
+      : { status: 'active' })
+      .select('name monthlySalary status')
+      .lean();
+    if (requested) {
+      const found = new Set(employees.map((employee) => String(employee._id)));
+      const missing = [...requested.keys()].filter((id) => !found.has(id));
+      if (missing.length) {
+        return res.status(400).json({ message: 'الموظف غير موجود', employeeIds: missing });
+      }
+      const inactive = employees.filter((employee) => employee.status !== 'active').map((employee) => employee._id);
+      if (inactive.length) {
+        return res.status(400).json({ message: 'لا يمكن صرف راتب لموظف غير نشط', employeeIds: inactive });
+      }
+    }
+    if (!employees.length) {
+      return res.status(400).json({ message: 'لا يوجد موظفون لصرف رواتبهم' });
+    }
+
+    const loans = await FursatkumEmployeeLoan.find({
+      employeeId: { $in: employees.map((employee) => employee._id) },
+      status: 'active',
+    })
+      .sort({ createdAt: 1 })
+      .lean();
+    const loansByEmployee = new Map();
+    loans.forEach((loan) => {
+      const key = String(loan.employeeId);
+      if (!loansByEmployee.has(key)) loansByEmployee.set(key, []);
+      loansByEmployee.get(key).push(loan);
+    });
+
+    const validCreatedBy = getValidCreatedBy(req);
+    const runs = employees.map((employee) => {
+      const grossSalary = requested ? requested.get(String(employee._id)) : employee.monthlySalary;
+      const { deduction, loanAdjustments } = planLoanDeductions(grossSalary, loansByEmployee.get(String(employee._id)) || []);
+      const salaryData = {
+        employeeId: employee._id,
+        grossSalary,
+        loanDeducted: deduction,
+        netPaid: grossSalary - deduction,
+        ledger,
+        date: payDate,
+      };
+      if (validCreatedBy) {
+        salaryData.createdBy = validCreatedBy;
+      }
+      return { employee, salary: new FursatkumSalaryPayment(salaryData), loanAdjustments };
+    });
+    const totals = runs.reduce((acc, { salary }) => ({
+      gross: acc.gross + salary.grossSalary,
+      deducted: acc.deducted + salary.loanDeducted,
+      net: acc.net + salary.netPaid,
+    }), { gross: 0, deducted: 0, net: 0 });
+
+    // What the batch has written so far, undone if a later step fails
+    let salariesInserted = false;
+    const appliedLoans = [];
+    const rollback = async () => {
+      if (appliedLoans.length) {
+        await FursatkumEmployeeLoan.bulkWrite(appliedLoans.map(({ loan, applied }) => ({
+          updateOne: {
+            filter: { _id: loan._id },
+            update: [{
+              $set: {
+                remainingAmount: { $add: ['$remainingAmount', applied] },
+                status: { $cond: [{ $eq: ['$status', 'paid'] }, 'active', '$status'] },
+              },
+            }],
+          },
+        })), { ordered: false });
+      }
+      if (salariesInserted) {
+        await FursatkumSalaryPayment.deleteMany({ _id: { $in: runs.map((run) => run.salary._id) } });
+      }
+    };
+
+    await postBatch(FursatkumAccount, FursatkumTransaction, {
+      field: getLedgerField(ledger),
+      amount: -totals.net,
+      requireFunds: true,
+      rollback,
+      transactions: async () => {
+        const references = await FursatkumAccount.getNextReferences('salary', runs.length);
+        runs.forEach((run, index) => { run.salary.referenceNumber = references[index]; });
+        await FursatkumSalaryPayment.insertMany(runs.map((run) => run.salary));
+        salariesInserted = true;
+
+        // Loans are decremented in place; the filter keeps a loan that changed
+        // since it was read from going below zero. Each update is checked on
+        // its own so a partial failure can be undone exactly.
+        const adjustments = runs.flatMap((run) => run.loanAdjustments);
+        const results = await Promise.allSettled(adjustments.map(({ loan, applied }) => FursatkumEmployeeLoan.updateOne(
+          { _id: loan._id, status: 'active', remainingAmount: { $gte: applied } },
+          [
+            { $set: { remainingAmount: { $max: [0, { $subtract: ['$remainingAmount', applied] }] } } },
+            { $set: { status: { $cond: [{ $lte: ['$remainingAmount', 0] }, 'paid', '$status'] } } },
+          ]
+        )));
+        results.forEach((result, index) => {
+          if (result.status === 'fulfilled' && result.value.matchedCount === 1) appliedLoans.push(adjustments[index]);
+        });
+        const failed = results.find((result) => result.status === 'rejected');
+        if (failed) throw failed.reason;
+        if (appliedLoans.length !== adjustments.length) {
+          throw new LoanChangedError(adjustments
+            .filter((adjustment) => !appliedLoans.includes(adjustment))
+            .map(({ loan }) => loan.referenceNumber));
+        }
+
+        return runs.flatMap(({ salary, loanAdjustments }) => {
+          const rows = [{
+            type: 'salary_payment',
+            ledger,
+            amount: -salary.netPaid,
+            date: payDate,
+            description: `صرف راتب (${salary.referenceNumber})`,
+            performedBy: getUserId(req),
+          }];
+          if (loanAdjustments.length > 0) {
+            const refs = loanAdjustments.map(({ loan }) => loan.referenceNumber);
+            rows.push({
+              type: 'salary_loan_deduction',
+              ledger,
+              amount: 0,
+              date: payDate,
+              description: `خصم قروض (${refs.join(', ')}) من راتب (${salary.referenceNumber})`,
+              performedBy: getUserId(req),
+            });
+          }
+          return rows;
+        });
+      },
+    });
+
+    res.status(201).json({
+      message: `تم صرف ${runs.length} راتب بنجاح`,
+      count: runs.length,
+      totals,
+      salaries: runs.map(({ employee, salary }) => ({ ...salary.toObject(), employeeName: employee.name })),
+    });
+  } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({
+        message: 'الرصيد غير كافٍ في المصدر المحدد',
+        available: error.available,
+        required: error.required,
+      });
+    }
+    if (error instanceof LoanChangedError) {
+      return res.status(409).json({ message: error.message, loans: error.loans });
+    }
+    res.status(500).json({ message: 'خطأ في صرف الرواتب', error: error.message });
+  }
+});
+
 // ==================== ACCOUNTING ====================
+// Ledger balance at a point in time: ?asOf=<date>&ledger=<ledger>
+router.get('/balance', balanceRoute('fursatkum'));
+
+// Income vs spending per day/week/month: ?granularity=month&from=&to=&ledger=
+router.get('/reports/timeseries', timeseriesRoute('fursatkum'));
+
 router.get('/accounting', async (req, res) => {
   try {
-    const account = await FursatkumAccount.getAccount();
-
-    const [incomeAgg, spendingAgg, transactions] = await Promise.all([
-      FursatkumInvoice.aggregate([
-        { $match: { type: 'income', status: 'active' } },
-        { $group: { _id: null, total: { $sum: '$value' } } },
-      ]),
-      FursatkumInvoice.aggregate([
-        { $match: { type: 'spending', status: 'active' } },
-        { $group: { _id: null, total: { $sum: '$value' } } },
-      ]),
+    const [{ account, summary }, ledgers, transactions] = await Promise.all([
+      getAccountSummary('fursatkum'),
+      getLedgerTotals('fursatkum'),
       FursatkumTransaction.find()
         .sort({ date: -1 })
         .limit(100)
         .populate('performedBy', 'username'),
     ]);
 
-    const totalIncome = incomeAgg.length ? incomeAgg[0].total : 0;
-    const totalSpendings = spendingAgg.length ? spendingAgg[0].total : 0;
+    const totalIncome = summary.incomeTotal;
+    const totalSpendings = summary.spendingTotal;
 
     res.json({
       bankBalance: account.bankBalance,
@@ -998,6 +1233,7 @@ router.get('/accounting', async (req, res) => {
       bankInfo: account.bankInfo,
       totalIncome,
       totalSpendings,
+      ledgers,
       transactions,
     });
   } catch (error) {
@@ -1008,7 +1244,7 @@ router.get('/accounting', async (req, res) => {
 // Transactions listing
 router.get('/transactions', async (req, res) => {
   try {
-    const { ledger, type, page = 1, limit = 50, startDate, endDate } = req.query;
+    const { ledger, type, page = 1, limit = 50, startDate, endDate, cursor } = req.query;
     const filters = {};
     if (ledger && ledger !== 'all') filters.ledger = ledger;
     if (type && type !== 'all') filters.type = type;
@@ -1022,14 +1258,25 @@ router.get('/transactions', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
 
-    const [transactions, total] = await Promise.all([
-      FursatkumTransaction.find(filters)
-        .sort({ date: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: transactions, pagination } = await findPage(FursatkumTransaction, filters, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('performedBy', 'username'),
+      });
+      return res.json({ transactions, pagination });
+    }
+
+    const { docs: transactions, total } = await findOffsetPage(FursatkumTransaction, filters, {
+      sort: { date: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('performedBy', 'username'),
-      FursatkumTransaction.countDocuments(filters),
-    ]);
+    });
 
     res.json({
       transactions,
@@ -1041,6 +1288,9 @@ router.get('/transactions', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب المعاملات', error: error.message });
   }
 });
@@ -1,5 +1,6 @@
 const express = require('express');
 const mongoose = require('mongoose');
+const { slowQueryReport, resetSlowQueries } = require('../utils/slowQueries');
 const router = express.Router();
 
 // Health check endpoint with comprehensive status
@@ -206,4 +207,16 @@ router.post('/wakeup', async (req, res) => {
   }
 });
 
+// Slowest query shapes of this process (admin): ?sort=total|max|count|avg&limit=20&collscan=true&reset=true
+router.get('/slow-queries', (req, res) => {
+  if (req.user?.role !== 'admin') {
+    return res.status(403).json({ message: 'هذا الإجراء للمسؤول فقط' });
+  }
+  const { sort = 'total', collscan, reset } = req.query;
+  const limit = Math.min(200, Math.max(1, parseInt(req.query.limit, 10) || 20));
+  const report = slowQueryReport({ sort, limit, collscanOnly: collscan === 'true' });
+  if (reset === 'true') resetSlowQueries();
+  res.json(report);
+});
+
 module.exports = router;
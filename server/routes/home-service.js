@@ -2,28 +2,22 @@ const express = require('express');
 const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
-const jwt = require('jsonwebtoken');
 const HSInvoice = require('../models/HSInvoice');
 const HSTransaction = require('../models/HSTransaction');
 const HSAccount = require('../models/HSAccount');
+const { postEntry, InsufficientFundsError } = require('../utils/ledger');
+const { findPage, findOffsetPage, InvalidCursorError } = require('../utils/pagination');
+const { summaryChange, getAccountSummary, getDashboard } = require('../utils/offices');
+const { getLedgerTotals } = require('../utils/ledgerCheckpoints');
+const { balanceRoute } = require('../utils/balances');
+const { timeseriesRoute } = require('../utils/timeseries');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
 // ==================== MIDDLEWARE ====================
 
 // Authentication middleware
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 // Role check middleware - admin and home_service_user only
 function requireHomeServiceAccess(req, res, next) {
   const allowedRoles = ['admin', 'home_service_user'];
@@ -75,32 +69,7 @@ const upload = multer({
 
 router.get('/dashboard', async (req, res) => {
   try {
-    const account = await HSAccount.getAccount();
-    
-    // Get recent transactions (last 10)
-    const recentTransactions = await HSTransaction.find()
-      .sort({ date: -1 })
-      .limit(10)
-      .populate('performedBy', 'username');
-    
-    // Get invoice counts
-    const [incomeCount, spendingCount, deletedCount] = await Promise.all([
-      HSInvoice.countDocuments({ type: 'income', status: 'active' }),
-      HSInvoice.countDocuments({ type: 'spending', status: 'active' }),
-      HSInvoice.countDocuments({ status: 'deleted' }),
-    ]);
-    
-    res.json({
-      fundingCredit: account.fundingCredit,
-      incomeProfit: account.incomeProfit,
-      invoiceCounts: {
-        income: incomeCount,
-        spending: spendingCount,
-        deleted: deletedCount,
-        total: incomeCount + spendingCount,
-      },
-      recentTransactions,
-    });
+    res.json(await getDashboard('home-service'));
   } catch (error) {
     res.status(500).json({ message: 'خطأ في جلب بيانات لوحة التحكم', error: error.message });
   }
@@ -111,7 +80,7 @@ router.get('/dashboard', async (req, res) => {
 // List invoices with filters
 router.get('/invoices', async (req, res) => {
   try {
-    const { type, status = 'active', page = 1, limit = 50, search } = req.query;
+    const { type, status = 'active', page = 1, limit = 50, search, cursor } = req.query;
     
     const filters = { status };
     if (type && type !== 'all') {
@@ -130,15 +99,27 @@ router.get('/invoices', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
     
-    const [invoices, total] = await Promise.all([
-      HSInvoice.find(filters)
-        .sort({ date: -1, createdAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: invoices, pagination } = await findPage(HSInvoice, filters, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('createdBy', 'username')
+          .populate('deletedBy', 'username'),
+      });
+      return res.json({ invoices, pagination });
+    }
+
+    const { docs: invoices, total } = await findOffsetPage(HSInvoice, filters, {
+      sort: { date: -1, createdAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username'),
-      HSInvoice.countDocuments(filters),
-    ]);
+    });
     
     res.json({
       invoices,
@@ -150,6 +131,9 @@ router.get('/invoices', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب الفواتير', error: error.message });
   }
 });
@@ -163,15 +147,14 @@ router.get('/deleted', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
     
-    const [invoices, total] = await Promise.all([
-      HSInvoice.find({ status: 'deleted' })
-        .sort({ deletedAt: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    const { docs: invoices, total } = await findOffsetPage(HSInvoice, { status: 'deleted' }, {
+      sort: { deletedAt: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('createdBy', 'username')
         .populate('deletedBy', 'username'),
-      HSInvoice.countDocuments({ status: 'deleted' }),
-    ]);
+    });
     
     res.json({
       invoices,
@@ -220,26 +203,8 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
       return res.status(400).json({ message: 'قيمة الفاتورة غير صالحة' });
     }
     
-    // Get account
-    const account = await HSAccount.getAccount();
-    
-    // For spending, check funding credit availability
-    if (type === 'spending') {
-      if (numValue > account.fundingCredit) {
-        return res.status(400).json({ 
-          message: 'رصيد التمويل غير كافٍ',
-          available: account.fundingCredit,
-          required: numValue,
-        });
-      }
-    }
-    
-    // Generate reference number
-    const referenceNumber = await HSAccount.getNextReference(type);
-    
     // Create invoice
     const invoiceData = {
-      referenceNumber,
       type,
       name,
       value: numValue,
@@ -256,39 +221,38 @@ router.post('/invoices', upload.single('document'), async (req, res) => {
     }
     
     const invoice = new HSInvoice(invoiceData);
-    await invoice.save();
-    
-    // Update account and create transaction
-    let balanceAfter;
-    let category;
-    
-    if (type === 'income') {
-      account.incomeProfit += numValue;
-      balanceAfter = account.incomeProfit;
-      category = 'income';
-    } else {
-      account.fundingCredit -= numValue;
-      balanceAfter = account.fundingCredit;
-      category = 'funding';
-    }
-    
-    await account.save();
     
-    // Create transaction record
-    await HSTransaction.create({
-      type,
+    // Income grows the profit balance; spending draws on the funding credit
+    await postEntry(HSAccount, HSTransaction, {
+      field: type === 'income' ? 'incomeProfit' : 'fundingCredit',
       amount: type === 'income' ? numValue : -numValue,
-      balanceAfter,
-      category,
-      date: new Date(date),
-      invoiceId: invoice._id,
-      invoiceRef: referenceNumber,
-      description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
-      performedBy: req.user.userId,
+      requireFunds: true,
+      inc: summaryChange.created(type, numValue),
+      transaction: async () => {
+        invoice.referenceNumber = await HSAccount.getNextReference(type);
+        await invoice.save();
+        return {
+          type,
+          category: type === 'income' ? 'income' : 'funding',
+          date: new Date(date),
+          invoiceId: invoice._id,
+          invoiceRef: invoice.referenceNumber,
+          description: `${type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${name}`,
+          performedBy: req.user.userId,
+        };
+      },
+      rollback: () => HSInvoice.deleteOne({ _id: invoice._id }),
     });
     
     res.status(201).json({ message: 'تم إنشاء الفاتورة بنجاح', invoice });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({ 
+        message: 'رصيد التمويل غير كافٍ',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في إنشاء الفاتورة', error: error.message });
   }
 });
@@ -308,7 +272,9 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
     
     const { name, value, date, details } = req.body;
     const editHistory = [];
-    const account = await HSAccount.getAccount();
+    // Kept to restore the invoice if its adjustment row cannot be written
+    const original = invoice.toObject();
+    let revaluation = null;
     
     // Handle value change with balance adjustment
     if (value !== undefined) {
@@ -320,16 +286,22 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
       const difference = newValue - invoice.value;
       
       if (difference !== 0) {
-        // For spending increase, check funding credit availability
-        if (invoice.type === 'spending' && difference > 0) {
-          if (difference > account.fundingCredit) {
-            return res.status(400).json({ 
-              message: 'رصيد التمويل غير كافٍ للزيادة',
-              available: account.fundingCredit,
-              required: difference,
-            });
-          }
-        }
+        // Adjust balances; a spending increase must be covered by the funding credit
+        revaluation = {
+          field: invoice.type === 'income' ? 'incomeProfit' : 'fundingCredit',
+          amount: invoice.type === 'income' ? difference : -difference,
+          requireFunds: invoice.type === 'spending',
+          inc: summaryChange.revalued(invoice.type, difference),
+          transaction: {
+            type: `${invoice.type}_adjustment`,
+            category: invoice.type === 'income' ? 'income' : 'funding',
+            date: new Date(),
+            invoiceId: invoice._id,
+            invoiceRef: invoice.referenceNumber,
+            description: `تعديل قيمة ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name} (${invoice.value} → ${newValue})`,
+            performedBy: req.user.userId,
+          },
+        };
         
         // Record edit history
         editHistory.push({
@@ -340,35 +312,6 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
           editedBy: req.user.userId,
         });
         
-        // Adjust balances
-        let balanceAfter;
-        let category;
-        
-        if (invoice.type === 'income') {
-          account.incomeProfit += difference;
-          balanceAfter = account.incomeProfit;
-          category = 'income';
-        } else {
-          account.fundingCredit -= difference;
-          balanceAfter = account.fundingCredit;
-          category = 'funding';
-        }
-        
-        await account.save();
-        
-        // Create adjustment transaction
-        await HSTransaction.create({
-          type: `${invoice.type}_adjustment`,
-          amount: invoice.type === 'income' ? difference : -difference,
-          balanceAfter,
-          category,
-          date: new Date(),
-          invoiceId: invoice._id,
-          invoiceRef: invoice.referenceNumber,
-          description: `تعديل قيمة ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name} (${invoice.value} → ${newValue})`,
-          performedBy: req.user.userId,
-        });
-        
         invoice.value = newValue;
       }
     }
@@ -440,10 +383,32 @@ router.put('/invoices/:id', upload.single('document'), async (req, res) => {
       invoice.editHistory.push(...editHistory);
     }
     
-    await invoice.save();
+    if (revaluation) {
+      // The invoice is saved together with its adjustment row: a rejected
+      // balance change leaves it untouched, a failed row write restores it
+      await invoice.validate();
+      const row = revaluation.transaction;
+      await postEntry(HSAccount, HSTransaction, {
+        ...revaluation,
+        transaction: async () => {
+          await invoice.save();
+          return row;
+        },
+        rollback: () => HSInvoice.replaceOne({ _id: invoice._id }, original),
+      });
+    } else {
+      await invoice.save();
+    }
     
     res.json({ message: 'تم تحديث الفاتورة بنجاح', invoice });
   } catch (error) {
+    if (error instanceof InsufficientFundsError) {
+      return res.status(400).json({ 
+        message: 'رصيد التمويل غير كافٍ للزيادة',
+        available: error.available,
+        required: error.required,
+      });
+    }
     res.status(500).json({ message: 'خطأ في تحديث الفاتورة', error: error.message });
   }
 });
@@ -461,36 +426,21 @@ router.delete('/invoices/:id', async (req, res) => {
       return res.status(400).json({ message: 'الفاتورة محذوفة بالفعل' });
     }
     
-    const account = await HSAccount.getAccount();
-    
-    // Reverse the amount
-    let balanceAfter;
-    let category;
-    
-    if (invoice.type === 'income') {
-      account.incomeProfit -= invoice.value;
-      if (account.incomeProfit < 0) account.incomeProfit = 0;
-      balanceAfter = account.incomeProfit;
-      category = 'income';
-    } else {
-      account.fundingCredit += invoice.value;
-      balanceAfter = account.fundingCredit;
-      category = 'funding';
-    }
-    
-    await account.save();
-    
-    // Create reversal transaction
-    await HSTransaction.create({
-      type: `${invoice.type}_reversal`,
+    // Reverse the amount (income reversals are clamped at zero)
+    await postEntry(HSAccount, HSTransaction, {
+      field: invoice.type === 'income' ? 'incomeProfit' : 'fundingCredit',
       amount: invoice.type === 'income' ? -invoice.value : invoice.value,
-      balanceAfter,
-      category,
-      date: new Date(),
-      invoiceId: invoice._id,
-      invoiceRef: invoice.referenceNumber,
-      description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
-      performedBy: req.user.userId,
+      floorAtZero: invoice.type === 'income',
+      inc: summaryChange.deleted(invoice.type, invoice.value),
+      transaction: {
+        type: `${invoice.type}_reversal`,
+        category: invoice.type === 'income' ? 'income' : 'funding',
+        date: new Date(),
+        invoiceId: invoice._id,
+        invoiceRef: invoice.referenceNumber,
+        description: `حذف ${invoice.type === 'income' ? 'فاتورة دخل' : 'إيصال صرف'}: ${invoice.name}`,
+        performedBy: req.user.userId,
+      },
     });
     
     // Soft delete
@@ -521,24 +471,21 @@ router.post('/funding/add', requireAdmin, async (req, res) => {
       return res.status(400).json({ message: 'المبلغ غير صالح' });
     }
     
-    const account = await HSAccount.getAccount();
-    account.fundingCredit += numAmount;
-    await account.save();
-    
-    // Create transaction
-    await HSTransaction.create({
-      type: 'add_funds',
+    const { balanceAfter } = await postEntry(HSAccount, HSTransaction, {
+      field: 'fundingCredit',
       amount: numAmount,
-      balanceAfter: account.fundingCredit,
-      category: 'funding',
-      date: new Date(),
-      description,
-      performedBy: req.user.userId,
+      transaction: {
+        type: 'add_funds',
+        category: 'funding',
+        date: new Date(),
+        description,
+        performedBy: req.user.userId,
+      },
     });
     
     res.json({ 
       message: 'تم إضافة الرصيد بنجاح', 
-      fundingCredit: account.fundingCredit,
+      fundingCredit: balanceAfter,
     });
   } catch (error) {
     res.status(500).json({ message: 'خطأ في إضافة الرصيد', error: error.message });
@@ -547,13 +494,19 @@ router.post('/funding/add', requireAdmin, async (req, res) => {
 
 // ==================== ACCOUNTING ====================
 
+// Ledger balance at a point in time: ?asOf=<date>&ledger=<ledger>
+router.get('/balance', balanceRoute('home-service'));
+
+// Income vs spending per day/week/month: ?granularity=month&from=&to=&ledger=
+router.get('/reports/timeseries', timeseriesRoute('home-service'));
+
 // Get accounting summary
 router.get('/accounting', async (req, res) => {
   try {
-    const account = await HSAccount.getAccount();
-    
-    // Get transaction history grouped by category and calculate total spendings
-    const [fundingTransactions, incomeTransactions, spendingsAggregation] = await Promise.all([
+    // Get transaction history grouped by category; total spendings come from the summary counters
+    const [{ account, summary }, ledgers, fundingTransactions, incomeTransactions] = await Promise.all([
+      getAccountSummary('home-service'),
+      getLedgerTotals('home-service'),
       HSTransaction.find({ category: 'funding' })
         .sort({ date: -1 })
         .limit(100)
@@ -562,20 +515,15 @@ router.get('/accounting', async (req, res) => {
         .sort({ date: -1 })
         .limit(100)
         .populate('performedBy', 'username'),
-      // Calculate total spendings from all active spending invoices
-      HSInvoice.aggregate([
-        { $match: { type: 'spending', status: 'active' } },
-        { $group: { _id: null, total: { $sum: '$value' } } },
-      ]),
     ]);
     
-    // Extract total spendings value
-    const totalSpendings = spendingsAggregation.length > 0 ? spendingsAggregation[0].total : 0;
+    const totalSpendings = summary.spendingTotal;
     
     res.json({
       fundingCredit: account.fundingCredit,
       incomeProfit: account.incomeProfit,
       totalSpendings,
+      ledgers,
       fundingTransactions,
       incomeTransactions,
     });
@@ -587,7 +535,7 @@ router.get('/accounting', async (req, res) => {
 // Get all transactions
 router.get('/transactions', async (req, res) => {
   try {
-    const { category, page = 1, limit = 50 } = req.query;
+    const { category, page = 1, limit = 50, cursor } = req.query;
     
     const filters = {};
     if (category && category !== 'all') {
@@ -598,14 +546,25 @@ router.get('/transactions', async (req, res) => {
     const pageSize = Math.min(200, Math.max(1, parseInt(limit, 10) || 50));
     const skip = (pageNumber - 1) * pageSize;
     
-    const [transactions, total] = await Promise.all([
-      HSTransaction.find(filters)
-        .sort({ date: -1 })
-        .skip(skip)
-        .limit(pageSize)
+    // Opt-in keyset pagination: ?cursor= (empty for the first page)
+    if (cursor !== undefined) {
+      const { docs: transactions, pagination } = await findPage(HSTransaction, filters, {
+        cursor,
+        archive: true,
+        limit: pageSize,
+        decorate: (query) => query
+          .populate('performedBy', 'username'),
+      });
+      return res.json({ transactions, pagination });
+    }
+
+    const { docs: transactions, total } = await findOffsetPage(HSTransaction, filters, {
+      sort: { date: -1 },
+      skip,
+      limit: pageSize,
+      decorate: (query) => query
         .populate('performedBy', 'username'),
-      HSTransaction.countDocuments(filters),
-    ]);
+    });
     
     res.json({
       transactions,
@@ -617,6 +576,9 @@ router.get('/transactions', async (req, res) => {
       },
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: 'خطأ في جلب المعاملات', error: error.message });
   }
 });
@@ -0,0 +1,73 @@
+const express = require('express');
+const { verifyLedgers } = require('../utils/ledgerVerifier');
+const { runArchiveExclusive, archiveStatus } = require('../utils/archive');
+const { OFFICES } = require('../utils/offices');
+const { requireAuth } = require('../utils/auth');
+
+const router = express.Router();
+
+function requireAdmin(req, res, next) {
+  if (req.user.role !== 'admin') {
+    return res.status(403).json({ message: 'هذا الإجراء للمسؤول فقط' });
+  }
+  return next();
+}
+
+router.use(requireAuth, requireAdmin);
+
+let running = null;
+
+// Replay the transaction logs and report balance drift: ?office=fursatkum,farwaniya1&maxRows=100
+router.get('/verify', async (req, res) => {
+  try {
+    const offices = req.query.office ? String(req.query.office).split(',') : undefined;
+    const maxRows = Math.min(10000, Math.max(0, parseInt(req.query.maxRows, 10) || 1000));
+
+    // One replay at a time; concurrent requests without filters share it
+    if (!offices && running) {
+      return res.json(await running);
+    }
+    const run = verifyLedgers(offices, { maxRows });
+    if (!offices) {
+      running = run.finally(() => { running = null; });
+    }
+    res.json(await run);
+  } catch (error) {
+    if (error.message.startsWith('Unknown office')) {
+      return res.status(400).json({ message: 'مكتب غير معروف', error: error.message });
+    }
+    res.status(500).json({ message: 'خطأ في التحقق من السجلات', error: error.message });
+  }
+});
+
+// Archive progress per collection
+router.get('/archive', async (req, res) => {
+  try {
+    res.json({ collections: await archiveStatus() });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في جلب حالة الأرشفة', error: error.message });
+  }
+});
+
+// Move old invoices and transactions to the archive: { offices?: [...], months?: 24 }
+// Runs in the background; progress is read from GET /archive
+router.post('/archive', async (req, res) => {
+  try {
+    const { offices, months } = req.body || {};
+    if (offices !== undefined && (!Array.isArray(offices) || !offices.length
+      || offices.some((office) => !OFFICES[office]))) {
+      return res.status(400).json({ message: 'قائمة المكاتب غير صالحة' });
+    }
+    if (months !== undefined && (!Number.isInteger(months) || months < 1)) {
+      return res.status(400).json({ message: 'عدد الأشهر غير صالح' });
+    }
+    runArchiveExclusive({ offices, months }).catch((error) => {
+      console.error('Archive run failed:', error.message);
+    });
+    res.status(202).json({ message: 'بدأت الأرشفة' });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في بدء الأرشفة', error: error.message });
+  }
+});
+
+module.exports = router;
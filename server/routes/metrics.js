@@ -0,0 +1,25 @@
+const crypto = require('crypto');
+const express = require('express');
+const { renderMetrics } = require('../utils/metrics');
+
+const router = express.Router();
+
+// Scrapers send `Authorization: Bearer <METRICS_TOKEN>`; admins may use their session
+function requireMetricsAccess(req, res, next) {
+  const expected = process.env.METRICS_TOKEN;
+  const hdr = req.headers.authorization || '';
+  const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : '';
+  if (expected && token.length === expected.length
+    && crypto.timingSafeEqual(Buffer.from(token), Buffer.from(expected))) {
+    return next();
+  }
+  if (req.user?.role === 'admin') return next();
+  return res.status(401).json({ message: 'غير مصرح' });
+}
+
+router.get('/', requireMetricsAccess, (req, res) => {
+  res.set('Cache-Control', 'no-store');
+  res.type('text/plain; version=0.0.4; charset=utf-8').send(renderMetrics());
+});
+
+module.exports = router;
@@ -0,0 +1,32 @@
+const express = require('express');
+const { SECTIONS, getOverview } = require('../utils/overview');
+const { requireAuth } = require('../utils/auth');
+
+const router = express.Router();
+
+router.use(requireAuth);
+
+// Every dashboard the user may see in one response: ?sections=fursatkum,accounts
+// Sections that fail or time out are null, with the reason under `status`
+router.get('/', async (req, res) => {
+  try {
+    const only = req.query.sections ? String(req.query.sections).split(',') : undefined;
+    const unknown = (only || []).filter((name) => !SECTIONS[name]);
+    if (unknown.length) {
+      return res.status(400).json({ message: 'قسم غير معروف', sections: Object.keys(SECTIONS) });
+    }
+
+    const { sections, status } = await getOverview(req.user.role, { only });
+    res.set('Cache-Control', 'private, no-cache');
+    res.json({
+      generatedAt: new Date(),
+      partial: Object.values(status).some((entry) => !entry.ok),
+      ...sections,
+      status,
+    });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في جلب بيانات لوحة التحكم', error: error.message });
+  }
+});
+
+module.exports = router;
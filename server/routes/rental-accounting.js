@@ -1,95 +1,88 @@
 const express = require('express');
 const dayjs = require('dayjs');
+const mongoose = require('mongoose');
 const RentalContract = require('../models/RentalContract');
+const { monthStages, entryStages, pageStages } = require('../utils/rentalMonths');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 router.use(requireAuth);
 
+// ملخص ومفصّل شهر واحد: ?month=YYYY-MM&unitId&secretaryId&page&limit
+// الأشهر تُقرأ من فهرس months.monthYear بدلاً من تحميل كل العقود
 router.get('/', async (req, res) => {
   try {
     const { month, unitId, secretaryId } = req.query;
     const targetMonth = month || dayjs().format('YYYY-MM');
+    const now = new Date();
+
+    if ([unitId, secretaryId].some((id) => id && !mongoose.isValidObjectId(id))) {
+      return res.status(400).json({ message: 'معرف غير صالح' });
+    }
 
     const query = {};
-    if (unitId) query.unitId = unitId;
-    if (secretaryId) query.rentalSecretaryId = secretaryId;
+    if (unitId) query.unitId = new mongoose.Types.ObjectId(String(unitId));
+    if (secretaryId) query.rentalSecretaryId = new mongoose.Types.ObjectId(String(secretaryId));
 
-    const contracts = await RentalContract.find(query)
-      .populate('unitId', 'unitNumber unitType address')
-      .populate('rentalSecretaryId', 'name phone');
+    const paging = req.query.limit === undefined ? {} : {
+      page: Math.max(1, parseInt(req.query.page, 10) || 1),
+      limit: Math.min(500, Math.max(1, parseInt(req.query.limit, 10) || 50)),
+    };
 
+    const open = { $gt: ['$month.remainingAmount', 0] };
+    const remainingWhen = (condition) => ({ $sum: { $cond: [condition, '$month.remainingAmount', 0] } });
+
+    const [result] = await RentalContract.aggregate([
+      ...monthStages(query, { monthYear: targetMonth }),
+      {
+        $facet: {
+          summary: [
+            {
+              $group: {
+                _id: null,
+                count: { $sum: 1 },
+                expected: { $sum: '$month.dueAmount' },
+                paid: { $sum: '$month.totalPaid' },
+                partiallyPaid: remainingWhen({ $and: [open, { $gt: ['$month.totalPaid', 0] }] }),
+                unpaid: remainingWhen(open),
+                overdue: remainingWhen({ $and: [open, { $lt: ['$month.dueDate', now] }] }),
+              },
+            },
+          ],
+          breakdown: [
+            ...pageStages(paging),
+            ...entryStages(),
+            { $addFields: { paidAmount: '$totalPaid' } },
+            { $project: { totalPaid: 0, monthYear: 0 } },
+          ],
+        },
+      },
+    ]);
+
+    const { count = 0, ...totals } = result.summary[0] || {};
     const summary = {
-      expected: 0,
-      paid: 0,
-      partiallyPaid: 0,
-      unpaid: 0,
-      overdue: 0,
+      expected: totals.expected || 0,
+      paid: totals.paid || 0,
+      partiallyPaid: totals.partiallyPaid || 0,
+      unpaid: totals.unpaid || 0,
+      overdue: totals.overdue || 0,
     };
 
-    const breakdown = [];
-
-    contracts.forEach((contract) => {
-      const monthEntry = contract.months.find((m) => m.monthYear === targetMonth);
-      if (!monthEntry) return;
-
-      const entry = {
-        contractId: contract._id,
-        referenceNumber: contract.referenceNumber,
-        unit: contract.unitId ? {
-          _id: contract.unitId._id,
-          unitNumber: contract.unitId.unitNumber,
-          unitType: contract.unitId.unitType,
-          address: contract.unitId.address,
-        } : contract.unitSnapshot,
-        secretary: contract.rentalSecretaryId ? {
-          _id: contract.rentalSecretaryId._id,
-          name: contract.rentalSecretaryId.name,
-          phone: contract.rentalSecretaryId.phone,
-        } : contract.secretarySnapshot,
-        dueAmount: monthEntry.dueAmount,
-        paidAmount: monthEntry.totalPaid,
-        remainingAmount: monthEntry.remainingAmount,
-        status: monthEntry.status,
-        dueDate: monthEntry.dueDate,
-      };
-
-      summary.expected += monthEntry.dueAmount;
-      summary.paid += monthEntry.totalPaid;
-
-      if (monthEntry.remainingAmount > 0) {
-        summary.unpaid += monthEntry.remainingAmount;
-        if (monthEntry.totalPaid > 0) {
-          summary.partiallyPaid += monthEntry.remainingAmount;
-        }
-        if (dayjs().isAfter(dayjs(monthEntry.dueDate))) {
-          summary.overdue += monthEntry.remainingAmount;
-        }
-      }
-
-      breakdown.push(entry);
-    });
-
-    breakdown.sort((a, b) => dayjs(a.dueDate).valueOf() - dayjs(b.dueDate).valueOf());
-
-    res.json({
+    const response = {
       month: targetMonth,
       summary,
-      breakdown,
-    });
+      breakdown: result.breakdown,
+    };
+    if (paging.limit) {
+      response.pagination = {
+        ...paging,
+        total: count,
+        totalPages: Math.ceil(count / paging.limit),
+        hasNext: paging.page * paging.limit < count,
+      };
+    }
+    res.json(response);
   } catch (error) {
     res.status(500).json({ message: 'خطأ في جلب بيانات المحاسبة', error: error.message });
   }
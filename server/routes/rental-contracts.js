@@ -1,23 +1,12 @@
 const express = require('express');
 const RentalContract = require('../models/RentalContract');
 const RentalUnit = require('../models/RentalUnit');
+const RentalUnitHistory = require('../models/RentalUnitHistory');
 const RentingSecretary = require('../models/RentingSecretary');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 router.use(requireAuth);
 
 router.get('/', async (req, res) => {
@@ -101,13 +90,13 @@ router.post('/', async (req, res) => {
 
     unit.status = 'نشط';
     unit.currentContract = contract._id;
-    unit.history = unit.history || [];
-    unit.history.push({
+    await unit.save();
+    await RentalUnitHistory.record({
+      unitId: unit._id,
       contractId: contract._id,
       action: 'create_contract',
       meta: { rentAmount, durationMonths },
     });
-    await unit.save();
 
     res.status(201).json({ message: 'تم إنشاء العقد', contract });
   } catch (error) {
@@ -133,13 +122,13 @@ router.patch('/:id/terminate', async (req, res) => {
     if (unit) {
       unit.status = 'متاح';
       unit.currentContract = null;
-      unit.history = unit.history || [];
-      unit.history.push({
+      await unit.save();
+      await RentalUnitHistory.record({
+        unitId: unit._id,
         contractId: contract._id,
         action: 'terminate_contract',
         meta: { reason },
       });
-      await unit.save();
     }
 
     res.json({ message: 'تم إنهاء العقد', contract });
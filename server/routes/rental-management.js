@@ -1,84 +1,157 @@
 const express = require('express');
-const dayjs = require('dayjs');
+const mongoose = require('mongoose');
 const RentalContract = require('../models/RentalContract');
-const RentalUnit = require('../models/RentalUnit');
-const RentingSecretary = require('../models/RentingSecretary');
+const {
+  BUCKETS,
+  bucketConditions,
+  bucketExpression,
+  monthStages,
+  entryStages,
+  pageStages,
+} = require('../utils/rentalMonths');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
+router.use(requireAuth);
+
+// صفحة من الأشهر: ?page=1&limit=50 (الحد الأقصى 500)
+function parsePage(query) {
+  if (query.limit === undefined) return {};
+  const page = Math.max(1, parseInt(query.page, 10) || 1);
+  const limit = Math.min(500, Math.max(1, parseInt(query.limit, 10) || 50));
+  return { page, limit };
 }
 
-router.use(requireAuth);
+function parseFilters(query) {
+  const contractMatch = {};
+  if (query.unitId) contractMatch.unitId = new mongoose.Types.ObjectId(String(query.unitId));
+  if (query.secretaryId) contractMatch.rentalSecretaryId = new mongoose.Types.ObjectId(String(query.secretaryId));
 
-function classifyMonth(month) {
-  if (month.remainingAmount <= 0) return 'paid';
-  const today = dayjs();
-  if (today.isAfter(dayjs(month.dueDate)) && month.remainingAmount > 0) {
-    return month.totalPaid > 0 ? 'overdue' : 'overdue';
+  // نطاق الأشهر YYYY-MM (مقارنة نصية على months.monthYear)
+  const monthMatch = {};
+  if (query.from || query.to) {
+    monthMatch.monthYear = {};
+    if (query.from) monthMatch.monthYear.$gte = String(query.from);
+    if (query.to) monthMatch.monthYear.$lte = String(query.to);
   }
-  if (month.totalPaid > 0) return 'partiallyPaid';
-  return 'pending';
+  return { contractMatch, monthMatch };
 }
 
+/**
+ * تصنيف أشهر العقود: مستحق، متأخر، مدفوع جزئياً، مدفوع
+ * - بدون معاملات: كل الفئات (كما في السابق) مع counts
+ * - ?summary=true: الأعداد والمبالغ المتبقية لكل فئة فقط
+ * - ?bucket=overdue&page=1&limit=50: صفحة من فئة واحدة
+ * - ?limit=50: أول صفحة من كل فئة مع counts
+ * فلاتر اختيارية: from / to (YYYY-MM)، unitId، secretaryId
+ */
 router.get('/', async (req, res) => {
   try {
-    const contracts = await RentalContract.find({})
-      .populate('unitId', 'unitNumber unitType address')
-      .populate('rentalSecretaryId', 'name phone');
+    const now = new Date();
+    const { bucket, summary } = req.query;
+    if (bucket !== undefined && !BUCKETS.includes(bucket)) {
+      return res.status(400).json({ message: 'فئة غير صالحة', buckets: BUCKETS });
+    }
+    if ([req.query.unitId, req.query.secretaryId].some((id) => id && !mongoose.isValidObjectId(id))) {
+      return res.status(400).json({ message: 'معرف غير صالح' });
+    }
+    const { contractMatch, monthMatch } = parseFilters(req.query);
+    const paging = parsePage(req.query);
 
+    // الأعداد والمبالغ لكل فئة
+    const countBuckets = async () => {
+      const rows = await RentalContract.aggregate([
+        ...monthStages(contractMatch, monthMatch),
+        {
+          $group: {
+            _id: bucketExpression(now),
+            count: { $sum: 1 },
+            remainingAmount: { $sum: { $max: ['$month.remainingAmount', 0] } },
+          },
+        },
+      ]);
+      const counts = {};
+      const amounts = {};
+      BUCKETS.forEach((name) => {
+        const row = rows.find((r) => r._id === name);
+        counts[name] = row ? row.count : 0;
+        amounts[name] = row ? row.remainingAmount : 0;
+      });
+      return { counts, amounts };
+    };
+
+    if (summary === 'true') {
+      return res.json(await countBuckets());
+    }
+
+    // صفحة من فئة واحدة
+    if (bucket) {
+      const [result] = await RentalContract.aggregate([
+        ...monthStages(contractMatch, { ...monthMatch, ...bucketConditions(bucket, now) }),
+        {
+          $facet: {
+            total: [{ $count: 'count' }],
+            entries: [...pageStages(paging.limit ? paging : { page: 1, limit: 50 }), ...entryStages()],
+          },
+        },
+      ]);
+      const total = result.total.length ? result.total[0].count : 0;
+      const { page = 1, limit = 50 } = paging;
+      return res.json({
+        bucket,
+        entries: result.entries,
+        pagination: {
+          page,
+          limit,
+          total,
+          totalPages: Math.ceil(total / limit),
+          hasNext: page * limit < total,
+        },
+      });
+    }
+
+    // أول صفحة من كل فئة
+    if (paging.limit) {
+      const [[result], { counts, amounts }] = await Promise.all([
+        RentalContract.aggregate([
+          ...monthStages(contractMatch, monthMatch),
+          { $addFields: { bucket: bucketExpression(now) } },
+          {
+            $facet: Object.fromEntries(BUCKETS.map((name) => [
+              name,
+              [{ $match: { bucket: name } }, ...pageStages(paging), ...entryStages()],
+            ])),
+          },
+        ]),
+        countBuckets(),
+      ]);
+      return res.json({ ...result, counts, amounts, pagination: paging });
+    }
+
+    // كل الفئات: صفوف مرتبة حسب تاريخ الاستحقاق تُوزع أثناء القراءة
     const buckets = {
       pending: [],
       overdue: [],
       partiallyPaid: [],
       paid: [],
     };
+    const cursor = RentalContract.aggregate([
+      ...monthStages(contractMatch, monthMatch),
+      { $addFields: { bucket: bucketExpression(now) } },
+      ...pageStages(),
+      ...entryStages().map((stage) => (stage.$project ? { $project: { ...stage.$project, bucket: 1 } } : stage)),
+    ]).cursor({ batchSize: 500 });
+    for await (const { bucket: name, ...entry } of cursor) {
+      buckets[name].push(entry);
+    }
 
-    contracts.forEach((contract) => {
-      contract.months.forEach((month) => {
-        const bucket = classifyMonth(month);
-        const entry = {
-          contractId: contract._id,
-          referenceNumber: contract.referenceNumber,
-          unit: contract.unitId ? {
-            _id: contract.unitId._id,
-            unitNumber: contract.unitId.unitNumber,
-            unitType: contract.unitId.unitType,
-            address: contract.unitId.address,
-          } : contract.unitSnapshot,
-          secretary: contract.rentalSecretaryId ? {
-            _id: contract.rentalSecretaryId._id,
-            name: contract.rentalSecretaryId.name,
-            phone: contract.rentalSecretaryId.phone,
-          } : contract.secretarySnapshot,
-          monthYear: month.monthYear,
-          dueDate: month.dueDate,
-          dueAmount: month.dueAmount,
-          totalPaid: month.totalPaid,
-          remainingAmount: month.remainingAmount,
-          status: month.status,
-        };
-        buckets[bucket].push(entry);
-      });
+    const counts = {};
+    BUCKETS.forEach((name) => {
+      counts[name] = buckets[name].length;
     });
 
-    const sortByDate = (a, b) => dayjs(a.dueDate).valueOf() - dayjs(b.dueDate).valueOf();
-    buckets.pending.sort(sortByDate);
-    buckets.overdue.sort(sortByDate);
-    buckets.partiallyPaid.sort(sortByDate);
-    buckets.paid.sort(sortByDate);
-
-    res.json(buckets);
+    res.json({ ...buckets, counts });
   } catch (error) {
     res.status(500).json({ message: 'خطأ في جلب بيانات الإدارة', error: error.message });
   }
@@ -1,28 +1,17 @@
 const express = require('express');
-const dayjs = require('dayjs');
 const mongoose = require('mongoose');
 const RentalPayment = require('../models/RentalPayment');
 const RentalContract = require('../models/RentalContract');
-const RentalUnit = require('../models/RentalUnit');
+const RentalUnitHistory = require('../models/RentalUnitHistory');
 const FursatkumAccount = require('../models/FursatkumAccount');
 const FursatkumInvoice = require('../models/FursatkumInvoice');
 const FursatkumTransaction = require('../models/FursatkumTransaction');
+const { applyBalanceChange, postEntry, postBatch } = require('../utils/ledger');
+const { summaryChange } = require('../utils/offices');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 router.use(requireAuth);
 
 const getValidUserId = (req) => {
@@ -36,136 +25,174 @@ const getValidUserId = (req) => {
 
 const getLedgerField = (ledger) => (ledger === 'bank' ? 'bankBalance' : 'cashBalance');
 
-function evaluateStatus(month, today = dayjs()) {
-  if (month.remainingAmount <= 0) return 'Paid';
-  if (month.totalPaid > 0) return today.isAfter(dayjs(month.dueDate)) ? 'Overdue' : 'Partially Paid';
-  if (today.isAfter(dayjs(month.dueDate))) return 'Overdue';
-  return 'Pending';
-}
+const MAX_BATCH_SIZE = 200;
 
-router.post('/', async (req, res) => {
-  try {
-    const {
-      contractId,
-      monthYear,
-      amount,
-      method,
-      transactionRef,
-      ledger,
-      paymentDate,
-      notes,
-    } = req.body;
+/**
+ * Validate one payment request and build its RentalPayment document. The
+ * contract itself is updated with a pipeline, which skips schema validation,
+ * so everything is checked here first.
+ *
+ * @returns {{error: string}|{paymentDoc: Document, payment: Object}}
+ */
+function buildPayment(input, req) {
+  const {
+    contractId,
+    monthYear,
+    amount,
+    method,
+    transactionRef,
+    ledger,
+    paymentDate,
+    notes,
+  } = input || {};
 
-    if (!contractId || !monthYear || !amount || !method) {
-      return res.status(400).json({ message: 'الحقول الأساسية مطلوبة' });
-    }
-    const ledgerValue = ledger || 'cash';
-    if (!['cash', 'bank'].includes(ledgerValue)) {
-      return res.status(400).json({ message: 'مصدر/وجهة غير صالحة' });
-    }
-    if (ledgerValue === 'bank' && !transactionRef) {
-      return res.status(400).json({ message: 'رقم مرجع المعاملة مطلوب لمدفوعات البنك' });
-    }
-
-    const contract = await RentalContract.findById(contractId);
-    if (!contract) return res.status(404).json({ message: 'العقد غير موجود' });
-
-    const monthEntry = contract.months.find((m) => m.monthYear === monthYear);
-    if (!monthEntry) {
-      return res.status(400).json({ message: 'الشهر غير موجود في جدول العقد' });
-    }
+  if (!contractId || !monthYear || !amount || !method) {
+    return { error: 'الحقول الأساسية مطلوبة' };
+  }
+  if (typeof monthYear !== 'string') {
+    return { error: 'الشهر غير موجود في جدول العقد' };
+  }
+  const ledgerValue = ledger || 'cash';
+  if (!['cash', 'bank'].includes(ledgerValue)) {
+    return { error: 'مصدر/وجهة غير صالحة' };
+  }
+  if (ledgerValue === 'bank' && !transactionRef) {
+    return { error: 'رقم مرجع المعاملة مطلوب لمدفوعات البنك' };
+  }
 
-    const numericAmount = Number(amount);
-    if (Number.isNaN(numericAmount) || numericAmount <= 0) {
-      return res.status(400).json({ message: 'مبلغ غير صالح' });
-    }
+  const numericAmount = Number(amount);
+  if (Number.isNaN(numericAmount) || numericAmount <= 0) {
+    return { error: 'مبلغ غير صالح' };
+  }
+  if (!mongoose.isValidObjectId(contractId)) {
+    return { error: 'معرف العقد غير صالح' };
+  }
 
-    const paymentDoc = new RentalPayment({
-      contractId,
-      monthYear,
-      amount: numericAmount,
-      method,
-      transactionRef,
-      ledger: ledgerValue,
-      paymentDate: paymentDate ? new Date(paymentDate) : new Date(),
-      notes,
-      enteredBy: req.user?.username,
-    });
+  const paymentDoc = new RentalPayment({
+    contractId,
+    monthYear,
+    amount: numericAmount,
+    method,
+    transactionRef,
+    ledger: ledgerValue,
+    paymentDate: paymentDate ? new Date(paymentDate) : new Date(),
+    notes,
+    enteredBy: req.user?.username,
+  });
+  const validationError = paymentDoc.validateSync();
+  if (validationError) {
+    return { error: 'بيانات الدفعة غير صالحة', details: validationError.message };
+  }
 
-    const newTotal = monthEntry.totalPaid + numericAmount;
-    monthEntry.totalPaid = newTotal;
-    monthEntry.remainingAmount = Math.max(0, monthEntry.dueAmount - newTotal);
-    monthEntry.status = evaluateStatus(monthEntry);
-    monthEntry.payments = monthEntry.payments || [];
-    monthEntry.payments.push({
+  return {
+    paymentDoc,
+    payment: {
       paymentId: paymentDoc._id,
       amount: numericAmount,
       method,
       transactionRef,
       paymentDate: paymentDoc.paymentDate,
-    });
+    },
+  };
+}
 
-    paymentDoc.remainingBalance = monthEntry.remainingAmount;
-    paymentDoc.isPartial = monthEntry.remainingAmount > 0;
+// Fursatkum income invoice for a payment (reference number assigned by the caller)
+function buildInvoice(paymentDoc, contract, validUserId) {
+  const invoiceData = {
+    type: 'income',
+    ledger: paymentDoc.ledger,
+    bankReference: paymentDoc.ledger === 'bank' ? paymentDoc.transactionRef : undefined,
+    name: `دفعة إيجار (${contract.referenceNumber})`,
+    value: paymentDoc.amount,
+    date: paymentDoc.paymentDate,
+    details: `دفعة إيجار شهر ${paymentDoc.monthYear}`,
+  };
+  if (validUserId) {
+    invoiceData.createdBy = validUserId;
+  }
+  return new FursatkumInvoice(invoiceData);
+}
 
-    const account = await FursatkumAccount.getAccount();
-    const ledgerField = getLedgerField(ledgerValue);
-    account[ledgerField] += numericAmount;
-
-    const referenceNumber = await FursatkumAccount.getNextReference('income');
-    const invoiceData = {
-      referenceNumber,
-      type: 'income',
-      ledger: ledgerValue,
-      bankReference: ledgerValue === 'bank' ? transactionRef : undefined,
-      name: `دفعة إيجار (${contract.referenceNumber})`,
-      value: numericAmount,
-      date: paymentDate ? new Date(paymentDate) : new Date(),
-      details: `دفعة إيجار شهر ${monthYear}`,
-    };
-    const validUserId = getValidUserId(req);
-    if (validUserId) {
-      invoiceData.createdBy = validUserId;
+function incomeTransaction(invoice, contract, validUserId) {
+  return {
+    type: 'income',
+    ledger: invoice.ledger,
+    date: invoice.date,
+    invoiceId: invoice._id,
+    invoiceRef: invoice.referenceNumber,
+    description: `دخل تأجير (${contract.referenceNumber})`,
+    performedBy: validUserId,
+  };
+}
+
+function historyEntry(contract, paymentDoc) {
+  return {
+    unitId: contract.unitId,
+    contractId: contract._id,
+    action: 'payment',
+    meta: {
+      monthYear: paymentDoc.monthYear,
+      amount: paymentDoc.amount,
+      method: paymentDoc.method,
+      transactionRef: paymentDoc.transactionRef,
+      remaining: paymentDoc.remainingBalance,
+    },
+  };
+}
+
+router.post('/', async (req, res) => {
+  try {
+    const built = buildPayment(req.body, req);
+    if (built.error) {
+      return res.status(400).json({ message: built.error, error: built.details });
     }
-    const fursatkumInvoice = new FursatkumInvoice(invoiceData);
+    const { paymentDoc, payment } = built;
+    const { contractId, monthYear } = paymentDoc;
+    const ledgerValue = paymentDoc.ledger;
+    const numericAmount = payment.amount;
 
-    await fursatkumInvoice.save();
-    await account.save();
+    // Apply the payment to the month in one write; status is derived by the update
+    const contract = await RentalContract.applyMonthPayment(contractId, monthYear, payment);
+    if (!contract) {
+      const exists = await RentalContract.exists({ _id: contractId });
+      if (!exists) return res.status(404).json({ message: 'العقد غير موجود' });
+      return res.status(400).json({ message: 'الشهر غير موجود في جدول العقد' });
+    }
+    const monthEntry = contract.months.find((m) => m.monthYear === monthYear);
 
-    await FursatkumTransaction.create({
-      type: 'income',
-      ledger: ledgerValue,
-      amount: numericAmount,
-      balanceAfter: account[ledgerField],
-      date: paymentDate ? new Date(paymentDate) : new Date(),
-      invoiceId: fursatkumInvoice._id,
-      invoiceRef: referenceNumber,
-      description: `دخل تأجير (${contract.referenceNumber})`,
-      performedBy: validUserId,
-    });
+    paymentDoc.remainingBalance = monthEntry.remainingAmount;
+    paymentDoc.isPartial = monthEntry.remainingAmount > 0;
 
-    paymentDoc.fursatkumInvoiceId = fursatkumInvoice._id;
-    paymentDoc.fursatkumInvoiceRef = referenceNumber;
-
-    await contract.save();
-    await paymentDoc.save();
-
-    const unit = await RentalUnit.findById(contract.unitId);
-    if (unit) {
-      unit.history = unit.history || [];
-      unit.history.push({
-        contractId,
-        action: 'payment',
-        meta: {
-          monthYear,
-          amount: numericAmount,
-          method,
-          transactionRef,
-          remaining: monthEntry.remainingAmount,
+    const validUserId = getValidUserId(req);
+    const fursatkumInvoice = buildInvoice(paymentDoc, contract, validUserId);
+
+    // The income posting, its invoice and the payment row form one unit of work:
+    // if any of them fails the ledger is reverted by postEntry and the month
+    // change is undone here.
+    try {
+      await postEntry(FursatkumAccount, FursatkumTransaction, {
+        field: getLedgerField(ledgerValue),
+        amount: numericAmount,
+        inc: summaryChange.created('income', numericAmount),
+        transaction: async () => {
+          fursatkumInvoice.referenceNumber = await FursatkumAccount.getNextReference('income');
+          paymentDoc.fursatkumInvoiceId = fursatkumInvoice._id;
+          paymentDoc.fursatkumInvoiceRef = fursatkumInvoice.referenceNumber;
+          await Promise.all([fursatkumInvoice.save(), paymentDoc.save()]);
+          return incomeTransaction(fursatkumInvoice, contract, validUserId);
         },
       });
-      await unit.save();
+    } catch (postingError) {
+      await Promise.all([
+        RentalContract.revertMonthPayment(contract._id, monthYear, payment),
+        FursatkumInvoice.deleteOne({ _id: fursatkumInvoice._id }),
+        RentalPayment.deleteOne({ _id: paymentDoc._id }),
+      ]).catch(() => {});
+      throw postingError;
     }
+    const { referenceNumber } = fursatkumInvoice;
+
+    await RentalUnitHistory.record(historyEntry(contract, paymentDoc));
 
     res.status(201).json({
       message: 'تم تسجيل الدفعة',
@@ -174,7 +201,6 @@ router.post('/', async (req, res) => {
       fursatkumInvoice: {
         _id: fursatkumInvoice._id,
         referenceNumber,
-      ledger: ledgerValue,
         ledger: ledgerValue,
       },
     });
@@ -183,6 +209,180 @@ router.post('/', async (req, res) => {
   }
 });
 
+/**
+ * Post many payments at once: body { payments: [{ contractId, monthYear, amount,
+ * method, ledger, transactionRef, paymentDate, notes }] }.
+ *
+ * Every entry is validated up front. Valid entries are applied with one
+ * bulkWrite on the contracts, one block of income reference numbers, one
+ * insertMany each for invoices and payments and one balance update per ledger.
+ * The response lists the outcome of every entry in request order.
+ */
+router.post('/batch', async (req, res) => {
+  try {
+    const entries = req.body?.payments;
+    if (!Array.isArray(entries) || entries.length === 0) {
+      return res.status(400).json({ message: 'قائمة الدفعات مطلوبة' });
+    }
+    if (entries.length > MAX_BATCH_SIZE) {
+      return res.status(400).json({ message: `الحد الأقصى ${MAX_BATCH_SIZE} دفعة في الطلب الواحد` });
+    }
+
+    const results = entries.map((entry, index) => ({ index, status: 'failed' }));
+    const fail = (item, message) => {
+      results[item.index].error = message;
+      item.failed = true;
+    };
+
+    // 1. Validate the input, then the contracts and months, in two reads total
+    const items = entries.map((entry, index) => ({ index, ...buildPayment(entry, req) }));
+    items.filter((item) => item.error).forEach((item) => fail(item, item.error));
+
+    const contractIds = [...new Set(items.filter((item) => !item.failed).map((item) => String(item.paymentDoc.contractId)))];
+    const contracts = await RentalContract.find({ _id: { $in: contractIds } })
+      .select('referenceNumber unitId months.monthYear')
+      .lean();
+    const contractsById = new Map(contracts.map((contract) => [String(contract._id), contract]));
+    items.filter((item) => !item.failed).forEach((item) => {
+      const contract = contractsById.get(String(item.paymentDoc.contractId));
+      if (!contract) return fail(item, 'العقد غير موجود');
+      if (!contract.months.some((m) => m.monthYear === item.paymentDoc.monthYear)) {
+        return fail(item, 'الشهر غير موجود في جدول العقد');
+      }
+      item.contract = contract;
+      return undefined;
+    });
+
+    let valid = items.filter((item) => !item.failed);
+    if (!valid.length) {
+      return res.status(400).json({ message: 'لم يتم تسجيل أي دفعة', posted: 0, failed: entries.length, results });
+    }
+
+    // 2. Apply all month updates, then read back which payments landed and the new balances
+    const monthUpdates = valid.map((item) => ({
+      contractId: item.contract._id,
+      monthYear: item.paymentDoc.monthYear,
+      payment: item.payment,
+    }));
+    await RentalContract.applyMonthPayments(monthUpdates);
+    const applied = await RentalContract.find({
+      _id: { $in: contractIds },
+      'months.payments.paymentId': { $in: valid.map((item) => item.payment.paymentId) },
+    })
+      .select('months.dueAmount months.totalPaid months.payments.paymentId months.payments.amount')
+      .lean();
+    // Payments are appended in the order they were applied, so the balance
+    // left after each one is the month's total minus what was paid after it
+    const remainingByPayment = new Map();
+    applied.forEach((contract) => contract.months.forEach((month) => {
+      let paidAfter = 0;
+      [...(month.payments || [])].reverse().forEach(({ paymentId, amount }) => {
+        const paidUpTo = (month.totalPaid || 0) - paidAfter;
+        remainingByPayment.set(String(paymentId), Math.max(0, month.dueAmount - paidUpTo));
+        paidAfter += amount || 0;
+      });
+    }));
+    valid.forEach((item) => {
+      const remaining = remainingByPayment.get(String(item.payment.paymentId));
+      if (remaining === undefined) return fail(item, 'تعذر تحديث الشهر في جدول العقد');
+      item.paymentDoc.remainingBalance = remaining;
+      item.paymentDoc.isPartial = remaining > 0;
+      return undefined;
+    });
+    valid = valid.filter((item) => !item.failed);
+
+    // 3. Invoices, payment rows and ledger postings for the applied payments.
+    // Any failure here undoes the whole group so balances never drift.
+    const validUserId = getValidUserId(req);
+    const posted = [];
+    try {
+      if (valid.length) {
+        const references = await FursatkumAccount.getNextReferences('income', valid.length);
+        valid.forEach((item, position) => {
+          item.invoice = buildInvoice(item.paymentDoc, item.contract, validUserId);
+          item.invoice.referenceNumber = references[position];
+          item.paymentDoc.fursatkumInvoiceId = item.invoice._id;
+          item.paymentDoc.fursatkumInvoiceRef = item.invoice.referenceNumber;
+        });
+        await FursatkumInvoice.insertMany(valid.map((item) => item.invoice));
+        await RentalPayment.insertMany(valid.map((item) => item.paymentDoc));
+        const postings = await Promise.allSettled(['cash', 'bank'].map(async (ledger) => {
+          const group = valid.filter((item) => item.paymentDoc.ledger === ledger);
+          if (!group.length) return null;
+          const total = group.reduce((sum, item) => sum + item.paymentDoc.amount, 0);
+          const inc = { ...summaryChange.created('income', total), 'summary.incomeCount': group.length };
+          const field = getLedgerField(ledger);
+          await postBatch(FursatkumAccount, FursatkumTransaction, {
+            field,
+            inc,
+            transactions: group.map((item) => ({
+              amount: item.paymentDoc.amount,
+              ...incomeTransaction(item.invoice, item.contract, validUserId),
+            })),
+          });
+          return { field, total, inc };
+        }));
+        postings.forEach((outcome) => {
+          if (outcome.status === 'fulfilled' && outcome.value) posted.push(outcome.value);
+        });
+        const rejected = postings.find((outcome) => outcome.status === 'rejected');
+        if (rejected) throw rejected.reason;
+      }
+    } catch (postingError) {
+      const undo = [
+        ['contract months', () => RentalContract.revertMonthPayments(valid.map((item) => ({
+          contractId: item.contract._id,
+          monthYear: item.paymentDoc.monthYear,
+          payment: item.payment,
+        })))],
+        ['invoices', () => FursatkumInvoice.deleteMany({ _id: { $in: valid.filter((item) => item.invoice).map((item) => item.invoice._id) } })],
+        ['payments', () => RentalPayment.deleteMany({ _id: { $in: valid.map((item) => item.paymentDoc._id) } })],
+        ...posted.map(({ field, total, inc }) => {
+          const revert = { [field]: -total };
+          Object.entries(inc).forEach(([key, delta]) => { revert[key] = -delta; });
+          return [`balance ${JSON.stringify(revert)}`, () => applyBalanceChange(FursatkumAccount, { inc: revert })];
+        }),
+      ];
+      const outcomes = await Promise.allSettled(undo.map(([, run]) => run()));
+      outcomes.forEach((outcome, index) => {
+        if (outcome.status === 'rejected') {
+          console.error(`❌ Rental payment batch: undo of ${undo[index][0]} failed, apply by hand:`, outcome.reason?.message);
+        }
+      });
+      throw postingError;
+    }
+
+    valid.forEach((item) => {
+      Object.assign(results[item.index], {
+        status: 'posted',
+        paymentId: item.paymentDoc._id,
+        contractId: item.contract._id,
+        monthYear: item.paymentDoc.monthYear,
+        amount: item.paymentDoc.amount,
+        remainingAmount: item.paymentDoc.remainingBalance,
+        fursatkumInvoice: {
+          _id: item.invoice._id,
+          referenceNumber: item.invoice.referenceNumber,
+          ledger: item.invoice.ledger,
+        },
+      });
+    });
+    if (valid.length) {
+      await RentalUnitHistory.insertMany(valid.map((item) => historyEntry(item.contract, item.paymentDoc)))
+        .catch((error) => console.error('خطأ في تسجيل سجل الوحدة:', error.message));
+    }
+
+    res.status(valid.length ? 201 : 400).json({
+      message: valid.length ? `تم تسجيل ${valid.length} دفعة` : 'لم يتم تسجيل أي دفعة',
+      posted: valid.length,
+      failed: entries.length - valid.length,
+      results,
+    });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في تسجيل الدفعات', error: error.message });
+  }
+});
+
 router.get('/contract/:contractId', async (req, res) => {
   try {
     const payments = await RentalPayment.find({ contractId: req.params.contractId })
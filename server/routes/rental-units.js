@@ -4,22 +4,11 @@ const path = require('path');
 const fs = require('fs');
 const RentalUnit = require('../models/RentalUnit');
 const RentalContract = require('../models/RentalContract');
+const RentalUnitHistory = require('../models/RentalUnitHistory');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 router.use(requireAuth);
 
 const uploadDir = path.join(__dirname, '../uploads/rental-units');
@@ -165,6 +154,39 @@ router.get('/:id/details', async (req, res) => {
   }
 });
 
+// Unit events, newest first (entries still embedded on the unit are returned as legacyHistory)
+router.get('/:id/history', async (req, res) => {
+  try {
+    const unit = await RentalUnit.findById(req.params.id).select('history').lean();
+    if (!unit) return res.status(404).json({ message: 'الوحدة غير موجودة' });
+
+    const page = Math.max(1, parseInt(req.query.page, 10) || 1);
+    const limit = Math.min(200, Math.max(1, parseInt(req.query.limit, 10) || 50));
+    const [entries, total] = await Promise.all([
+      RentalUnitHistory.find({ unitId: unit._id })
+        .sort({ timestamp: -1 })
+        .skip((page - 1) * limit)
+        .limit(limit)
+        .lean(),
+      RentalUnitHistory.countDocuments({ unitId: unit._id }),
+    ]);
+
+    res.json({
+      history: entries,
+      legacyHistory: (unit.history || []).slice().reverse(),
+      pagination: {
+        page,
+        limit,
+        total,
+        pages: Math.max(1, Math.ceil(total / limit)),
+        hasMore: page * limit < total,
+      },
+    });
+  } catch (error) {
+    res.status(500).json({ message: 'خطأ في جلب سجل الوحدة', error: error.message });
+  }
+});
+
 router.post('/', async (req, res) => {
   try {
     const { unitType, unitNumber, address, rentAmount, status, notes } = req.body;
@@ -3,22 +3,10 @@ const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
 const RentingSecretary = require('../models/RentingSecretary');
+const { requireAuth } = require('../utils/auth');
 
 const router = express.Router();
 
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (error) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
-
 router.use(requireAuth);
 
 const uploadDir = path.join(__dirname, '../uploads/rental-secretaries');
@@ -1,9 +1,9 @@
 const express = require('express');
 const router = express.Router();
-const mongoose = require('mongoose');
 const Secretary = require('../models/Secretary');
 const Visa = require('../models/Visa');
 const Account = require('../models/Account');
+const VisaStat = require('../models/VisaStat');
 
 // الحصول على جميع السكرتارية (محسّن)
 router.get('/', async (req, res) => {
@@ -29,58 +29,8 @@ router.get('/:id', async (req, res) => {
       return res.status(404).json({ message: 'السكرتيرة غير موجودة' });
     }
 
-    // حساب الإحصائيات باستخدام تجميع قاعدة البيانات (أسرع)
-    const stats = await Visa.aggregate([
-      { $match: { secretary: new mongoose.Types.ObjectId(req.params.id) } },
-      {
-        $group: {
-          _id: null,
-          totalVisas: { $sum: 1 },
-          totalExpenses: { $sum: "$totalExpenses" },
-          activeVisas: {
-            $sum: { $cond: [{ $eq: ["$status", "قيد_الشراء"] }, 1, 0] }
-          },
-          availableVisas: {
-            $sum: { $cond: [{ $eq: ["$status", "معروضة_للبيع"] }, 1, 0] }
-          },
-          soldVisas: {
-            $sum: { $cond: [{ $eq: ["$status", "مباعة"] }, 1, 0] }
-          },
-          cancelledVisas: {
-            $sum: { $cond: [{ $eq: ["$status", "ملغاة"] }, 1, 0] }
-          },
-          totalEarnings: {
-            $sum: {
-              $cond: [
-                { $eq: ["$status", "مباعة"] },
-                "$secretaryEarnings",
-                0
-              ]
-            }
-          },
-          totalDebt: {
-            $sum: {
-              $cond: [
-                { $eq: ["$status", "ملغاة"] },
-                "$totalExpenses",
-                0
-              ]
-            }
-          }
-        }
-      }
-    ]);
-
-    const statsData = stats[0] || {
-      totalVisas: 0,
-      totalExpenses: 0,
-      activeVisas: 0,
-      availableVisas: 0,
-      soldVisas: 0,
-      cancelledVisas: 0,
-      totalEarnings: 0,
-      totalDebt: 0
-    };
+    // الإحصائيات من الجدول المجمّع (سكرتيرة/شهر)
+    const statsData = await VisaStat.forSecretary(req.params.id);
 
     // جلب التأشيرات مع تحديد عدد النتائج لتحسين الأداء
     const visas = await Visa.find({ secretary: req.params.id })
@@ -204,23 +154,23 @@ router.get('/:id/statistics', async (req, res) => {
       return res.status(404).json({ message: 'السكرتيرة غير موجودة' });
     }
 
-    const visas = await Visa.find({ secretary: req.params.id });
-    
-    const statistics = {
-      totalVisas: visas.length,
-      activeVisas: visas.filter(v => v.status === 'قيد_الشراء').length,
-      availableVisas: visas.filter(v => v.status === 'معروضة_للبيع').length,
-      soldVisas: visas.filter(v => v.status === 'مباعة').length,
-      cancelledVisas: visas.filter(v => v.status === 'ملغاة').length,
-      totalExpenses: visas.reduce((sum, v) => sum + v.totalExpenses, 0),
-      totalEarnings: visas.filter(v => v.status === 'مباعة').reduce((sum, v) => sum + v.secretaryEarnings, 0),
-      totalDebt: visas.filter(v => v.status === 'ملغاة').reduce((sum, v) => sum + v.totalExpenses, 0),
-      averageProfitPerVisa: visas.filter(v => v.status === 'مباعة').length > 0 
-        ? visas.filter(v => v.status === 'مباعة').reduce((sum, v) => sum + v.profit, 0) / visas.filter(v => v.status === 'مباعة').length 
-        : 0
-    };
-
-    res.json(statistics);
+    const statistics = await VisaStat.forSecretary(req.params.id);
+    const {
+      totalVisas, activeVisas, availableVisas, soldVisas, cancelledVisas,
+      totalExpenses, totalEarnings, totalDebt, averageProfitPerVisa
+    } = statistics;
+
+    res.json({
+      totalVisas,
+      activeVisas,
+      availableVisas,
+      soldVisas,
+      cancelledVisas,
+      totalExpenses,
+      totalEarnings,
+      totalDebt,
+      averageProfitPerVisa
+    });
   } catch (error) {
     res.status(500).json({ message: error.message });
   }
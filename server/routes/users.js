@@ -1,22 +1,8 @@
 const express = require('express');
 const router = express.Router();
-const jwt = require('jsonwebtoken');
 const bcrypt = require('bcryptjs');
 const User = require('../models/User');
-
-// Auth middleware
-function requireAuth(req, res, next) {
-	const hdr = req.headers.authorization || '';
-	const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-	if (!token) return res.status(401).json({ message: 'غير مصرح' });
-	try {
-		const payload = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-		req.user = payload;
-		next();
-	} catch (e) {
-		return res.status(401).json({ message: 'جلسة غير صالحة' });
-	}
-}
+const { requireAuth } = require('../utils/auth');
 
 function requireAdmin(req, res, next) {
 	if (req.user?.role !== 'admin') return res.status(403).json({ message: 'صلاحيات غير كافية' });
@@ -6,20 +6,9 @@ const fs = require('fs');
 const Visa = require('../models/Visa');
 const Secretary = require('../models/Secretary');
 const Account = require('../models/Account');
-
-// Auth middleware
-function requireAuth(req, res, next) {
-  try {
-    const hdr = req.headers.authorization || '';
-    const token = hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
-    if (!token) return res.status(401).json({ message: 'غير مصرح' });
-    const jwt = require('jsonwebtoken');
-    req.user = jwt.verify(token, process.env.JWT_SECRET || 'dev_secret');
-    return next();
-  } catch (e) {
-    return res.status(401).json({ message: 'جلسة غير صالحة' });
-  }
-}
+const { findPage, InvalidCursorError } = require('../utils/pagination');
+const { runExclusive, recentRuns } = require('../utils/overdueVisas');
+const { requireAuth } = require('../utils/auth');
 
 router.use(requireAuth);
 
@@ -53,65 +42,12 @@ const upload = multer({
   }
 });
 
-// التحقق من التأشيرات المتأخرة وإلغاؤها تلقائياً
-const checkOverdueVisas = async () => {
-  try {
-    // النظام الجديد: البحث عن التأشيرات التي وصلت الخادمة ولها موعد نهائي نشط منتهي
-    const overdueVisas = await Visa.find({
-      maidArrivalVerified: true,
-      deadlineStatus: 'active',
-      activeCancellationDeadline: { $lt: new Date() },
-      status: { $in: ['قيد_الشراء', 'معروضة_للبيع', 'في_انتظار_الوصول'] }
-    }).populate('secretary');
-
-    for (const visa of overdueVisas) {
-      // إلغاء التأشيرة
-      visa.status = 'ملغاة';
-      visa.cancelledAt = new Date();
-      visa.cancelledReason = 'انتهاء الموعد النهائي بعد وصول الخادمة (30 يوماً)';
-      visa.currentStage = 'ملغاة';
-      visa.deadlineStatus = 'expired';
-      await visa.save();
-
-      // إضافة المصروفات كدين على السكرتيرة
-      if (visa.secretary) {
-        const secretary = await Secretary.findById(visa.secretary._id);
-        if (secretary) {
-          secretary.totalDebt += visa.totalExpenses;
-          secretary.activeVisas = secretary.activeVisas.filter(id => id.toString() !== visa._id.toString());
-          secretary.cancelledVisas.push(visa._id);
-          await secretary.save();
-        }
-      }
-    }
-
-    // تحديث حالة المواعيد النهائية للتأشيرات النشطة
-    const activeVisas = await Visa.find({
-      maidArrivalVerified: true,
-      deadlineStatus: 'active',
-      status: { $in: ['قيد_الشراء', 'معروضة_للبيع', 'في_انتظار_الوصول'] }
-    });
-
-    for (const visa of activeVisas) {
-      visa.updateDeadlineStatus();
-      await visa.save();
-    }
-
-    if (overdueVisas.length > 0) {
-      console.log(`🔄 النظام الجديد: تم إلغاء ${overdueVisas.length} تأشيرة بعد انتهاء 30 يوماً من وصول الخادمة`);
-    }
-  } catch (error) {
-    console.error('خطأ في التحقق من التأشيرات المتأخرة:', error);
-  }
-};
-
 // الحصول على جميع التأشيرات مع الفلترة والترقيم (محسّن للأداء)
 router.get('/', async (req, res) => {
   try {
-    // Skip overdue check for better performance - run it separately
-    // await checkOverdueVisas();
+    // فحص التأشيرات المتأخرة يعمل في الخلفية (utils/overdueVisas.js)
     
-    const { status, stage, secretary, page = 1, limit = 10 } = req.query; // Reduced default limit
+    const { status, stage, secretary, page = 1, limit = 10, cursor } = req.query; // Reduced default limit
     let filter = {};
     
     if (status) filter.status = status;
@@ -123,6 +59,17 @@ router.get('/', async (req, res) => {
     const limitNum = parseInt(limit);
     const skip = (pageNum - 1) * limitNum;
     
+    // ترقيم بالمؤشر (اختياري): ?cursor= فارغ للصفحة الأولى
+    if (cursor !== undefined) {
+      const { docs, pagination } = await findPage(Visa, filter, {
+        sortField: 'createdAt',
+        cursor,
+        limit: Math.min(200, Math.max(1, limitNum || 10)),
+        decorate: (query) => query.populate('secretary', 'name code'),
+      });
+      return res.json({ visas: docs, pagination });
+    }
+    
     // جلب البيانات مع الترقيم
     const [visas, totalCount] = await Promise.all([
       Visa.find(filter)
@@ -144,6 +91,9 @@ router.get('/', async (req, res) => {
       }
     });
   } catch (error) {
+    if (error instanceof InvalidCursorError) {
+      return res.status(400).json({ message: error.message });
+    }
     res.status(500).json({ message: error.message });
   }
 });
@@ -743,64 +693,17 @@ router.get('/pending-arrival-verification', async (req, res) => {
   }
 });
 
-// فحص التأشيرات المتأخرة (نقطة نهاية للمهام المجدولة) - النظام الجديد
+// فحص التأشيرات المتأخرة (تشغيل يدوي؛ المجدول يشغّله تلقائياً) - النظام الجديد
 router.post('/check-overdue', async (req, res) => {
   try {
-    // البحث عن التأشيرات التي وصلت الخادمة ولها موعد نهائي نشط منتهي
-    const overdueVisas = await Visa.find({
-      maidArrivalVerified: true,
-      deadlineStatus: 'active',
-      activeCancellationDeadline: { $lt: new Date() },
-      status: { $in: ['قيد_الشراء', 'معروضة_للبيع', 'في_انتظار_الوصول'] }
-    });
-
-    let cancelledCount = 0;
-    for (const visa of overdueVisas) {
-      visa.status = 'ملغاة';
-      visa.cancelledAt = new Date();
-      visa.cancelledReason = 'انتهاء الموعد النهائي بعد وصول الخادمة (30 يوماً)';
-      visa.currentStage = 'ملغاة';
-      visa.deadlineStatus = 'expired';
-      await visa.save();
-      cancelledCount++;
-
-      // إضافة الدين على السكرتيرة
-      const secretary = await Secretary.findById(visa.secretary);
-      if (secretary) {
-        secretary.totalDebt += visa.totalExpenses;
-        secretary.activeVisas = secretary.activeVisas.filter(id => id.toString() !== visa._id.toString());
-        secretary.completedVisas = secretary.completedVisas.filter(id => id.toString() !== visa._id.toString());
-        secretary.cancelledVisas.push(visa._id);
-        await secretary.save();
-      }
-      
-      console.log(`❌ تم إلغاء التأشيرة ${visa.visaNumber} - انتهى الموعد النهائي بعد وصول الخادمة`);
-    }
+    const report = await runExclusive({ trigger: 'manual' });
+    const { cancelled: cancelledCount, deadlinesExpired, deadlinesDeactivated } = report.counts;
 
-    // تحديث حالة المواعيد النهائية للتأشيرات النشطة
-    const activeVisas = await Visa.find({
-      maidArrivalVerified: true,
-      deadlineStatus: 'active',
-      status: { $in: ['قيد_الشراء', 'معروضة_للبيع', 'في_انتظار_الوصول'] }
-    });
-
-    let updatedCount = 0;
-    for (const visa of activeVisas) {
-      const oldStatus = visa.deadlineStatus;
-      visa.updateDeadlineStatus();
-      if (oldStatus !== visa.deadlineStatus) {
-        await visa.save();
-        updatedCount++;
-      }
-    }
-
-    console.log(`🔄 النظام الجديد: تم إلغاء ${cancelledCount} تأشيرة بعد انتهاء 30 يوماً من وصول الخادمة`);
-    console.log(`📊 تم تحديث حالة ${updatedCount} تأشيرة`);
-    
     res.json({ 
       message: `تم فحص التأشيرات المتأخرة وإلغاء ${cancelledCount} تأشيرة`,
       cancelledCount,
-      updatedCount,
+      updatedCount: deadlinesExpired + deadlinesDeactivated,
+      report,
       note: 'النظام الجديد: الإلغاء يتم فقط بعد 30 يوماً من وصول الخادمة',
       explanation: 'التأشيرات التي لم تصل الخادمة بعد محمية من الإلغاء التلقائي'
     });
@@ -810,4 +713,14 @@ router.post('/check-overdue', async (req, res) => {
   }
 });
 
+// تقارير آخر عمليات فحص التأشيرات المتأخرة
+router.get('/check-overdue/runs', async (req, res) => {
+  try {
+    const limit = Math.min(100, Math.max(1, parseInt(req.query.limit) || 20));
+    res.json({ runs: await recentRuns(limit) });
+  } catch (error) {
+    res.status(500).json({ message: error.message });
+  }
+});
+
 module.exports = router; 
\ No newline at end of file
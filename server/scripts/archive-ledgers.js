@@ -0,0 +1,53 @@
+/**
+ * Maintenance Script: Archive Old Ledger Rows
+ *
+ * Moves invoices and transactions dated before the archive cutoff
+ * (ARCHIVE_AFTER_MONTHS complete months back) into the `<collection>_archive`
+ * collections, after closing those months into ledger checkpoints. Safe to
+ * re-run: an interrupted run resumes where it stopped.
+ *
+ * Usage: node scripts/archive-ledgers.js [fursatkum|home-service|farwaniya1|farwaniya2 ...]
+ */
+
+const mongoose = require('mongoose');
+require('dotenv').config();
+
+const { runArchive, ARCHIVE_AFTER_MONTHS } = require('../utils/archive');
+
+const MONGODB_URI = process.env.MONGODB_URI;
+
+async function connectToDatabase() {
+  if (!MONGODB_URI) {
+    console.error('❌ MONGODB_URI is not set');
+    process.exit(1);
+  }
+  try {
+    await mongoose.connect(MONGODB_URI, {
+      maxPoolSize: 10,
+      serverSelectionTimeoutMS: 30000,
+      socketTimeoutMS: 60000,
+    });
+    console.log('✅ Connected to MongoDB');
+  } catch (error) {
+    console.error('❌ Failed to connect to MongoDB:', error);
+    process.exit(1);
+  }
+}
+
+if (require.main === module) {
+  const offices = process.argv.slice(2);
+  console.log(`📦 Archiving rows older than ${ARCHIVE_AFTER_MONTHS} months`);
+  connectToDatabase()
+    .then(() => runArchive({ offices: offices.length ? offices : undefined }))
+    .then(({ cutoff, moved }) => {
+      console.log(`\n✅ Cutoff ${cutoff.toISOString().slice(0, 10)}`);
+      Object.entries(moved).forEach(([office, counts]) => {
+        console.log(`   • ${office}: ${counts.invoices} invoices, ${counts.transactions} transactions moved`);
+      });
+    })
+    .catch((error) => {
+      console.error('\n❌ Archiving failed:', error);
+      process.exitCode = 1;
+    })
+    .finally(() => mongoose.connection.close());
+}
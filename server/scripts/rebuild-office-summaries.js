@@ -0,0 +1,70 @@
+/**
+ * Repair Script: Office Invoice Summaries
+ *
+ * Rebuilds the invoice counters stored on each office account (account.summary)
+ * from the invoice collections, and re-closes the monthly ledger checkpoints
+ * (utils/ledgerCheckpoints.js). Run it after restoring a backup, after manual
+ * edits to invoices in the database, or whenever a dashboard count looks off.
+ *
+ * Usage: node scripts/rebuild-office-summaries.js [fursatkum|home-service|farwaniya1|farwaniya2 ...]
+ */
+
+const mongoose = require('mongoose');
+require('dotenv').config();
+
+const { OFFICES, rebuildSummary } = require('../utils/offices');
+const { rebuildCheckpoints } = require('../utils/ledgerCheckpoints');
+
+const MONGODB_URI = process.env.MONGODB_URI;
+
+async function connectToDatabase() {
+  if (!MONGODB_URI) {
+    console.error('❌ MONGODB_URI is not set');
+    process.exit(1);
+  }
+  try {
+    await mongoose.connect(MONGODB_URI, {
+      maxPoolSize: 10,
+      serverSelectionTimeoutMS: 30000,
+      socketTimeoutMS: 60000,
+    });
+    console.log('✅ Connected to MongoDB');
+  } catch (error) {
+    console.error('❌ Failed to connect to MongoDB:', error);
+    process.exit(1);
+  }
+}
+
+async function rebuildOfficeSummaries(offices = Object.keys(OFFICES)) {
+  const results = {};
+  for (const office of offices) {
+    if (!OFFICES[office]) {
+      throw new Error(`Unknown office: ${office}`);
+    }
+    console.log(`🔄 Rebuilding ${office}...`);
+    results[office] = await rebuildSummary(office);
+    const { incomeCount, spendingCount, deletedCount, incomeTotal, spendingTotal } = results[office];
+    console.log(`   • income: ${incomeCount} (${incomeTotal}), spending: ${spendingCount} (${spendingTotal}), deleted: ${deletedCount}`);
+    const closedMonths = await rebuildCheckpoints(office);
+    console.log(`   • checkpoints: ${closedMonths} month(s) closed`);
+  }
+  return results;
+}
+
+if (require.main === module) {
+  const offices = process.argv.slice(2);
+  connectToDatabase()
+    .then(() => rebuildOfficeSummaries(offices.length ? offices : undefined))
+    .then(() => {
+      console.log('\n✅ Office summaries rebuilt');
+    })
+    .catch((error) => {
+      console.error('\n❌ Rebuild failed:', error);
+      process.exitCode = 1;
+    })
+    .finally(() => mongoose.connection.close());
+}
+
+module.exports = {
+  rebuildOfficeSummaries,
+};
@@ -0,0 +1,59 @@
+/**
+ * Repair Script: Visa Statistics Rollup
+ *
+ * Rebuilds the per-secretary, per-month visa statistics collection (VisaStat)
+ * from the visas. The rollup is maintained incrementally on every visa save;
+ * run this after bulk edits made directly in the database.
+ *
+ * Usage: node scripts/rebuild-visa-stats.js
+ */
+
+const mongoose = require('mongoose');
+require('dotenv').config();
+
+require('../models/Visa');
+const VisaStat = require('../models/VisaStat');
+
+const MONGODB_URI = process.env.MONGODB_URI;
+
+async function connectToDatabase() {
+  if (!MONGODB_URI) {
+    console.error('❌ MONGODB_URI is not set');
+    process.exit(1);
+  }
+  try {
+    await mongoose.connect(MONGODB_URI, {
+      maxPoolSize: 10,
+      serverSelectionTimeoutMS: 30000,
+      socketTimeoutMS: 60000,
+    });
+    console.log('✅ Connected to MongoDB');
+  } catch (error) {
+    console.error('❌ Failed to connect to MongoDB:', error);
+    process.exit(1);
+  }
+}
+
+async function rebuildVisaStats() {
+  console.log('🔄 Rebuilding visa statistics rollup...');
+  const buckets = await VisaStat.rebuild();
+  console.log(`   • ${buckets} secretary/month buckets written`);
+  return buckets;
+}
+
+if (require.main === module) {
+  connectToDatabase()
+    .then(rebuildVisaStats)
+    .then(() => {
+      console.log('\n✅ Visa statistics rebuilt');
+    })
+    .catch((error) => {
+      console.error('\n❌ Rebuild failed:', error);
+      process.exitCode = 1;
+    })
+    .finally(() => mongoose.connection.close());
+}
+
+module.exports = {
+  rebuildVisaStats,
+};
@@ -0,0 +1,69 @@
+/**
+ * Check Script: Ledger Drift
+ *
+ * Replays every office's transaction log in posting order and reports rows
+ * whose balanceAfter does not follow from the previous row, and the difference
+ * between the replayed balances and the balances stored on the account
+ * documents. Nothing is written. Exits with code 1 when drift is found.
+ *
+ * Usage: node scripts/verify-ledgers.js [fursatkum|home-service|farwaniya1|farwaniya2 ...]
+ */
+
+const mongoose = require('mongoose');
+require('dotenv').config();
+
+const { verifyLedgers } = require('../utils/ledgerVerifier');
+
+const MONGODB_URI = process.env.MONGODB_URI;
+
+async function connectToDatabase() {
+  if (!MONGODB_URI) {
+    console.error('❌ MONGODB_URI is not set');
+    process.exit(1);
+  }
+  try {
+    await mongoose.connect(MONGODB_URI, {
+      maxPoolSize: 10,
+      serverSelectionTimeoutMS: 30000,
+      socketTimeoutMS: 60000,
+    });
+    console.log('✅ Connected to MongoDB');
+  } catch (error) {
+    console.error('❌ Failed to connect to MongoDB:', error);
+    process.exit(1);
+  }
+}
+
+function printReport({ ok, durationMs, offices }) {
+  offices.forEach((report) => {
+    console.log(`\n${report.ok ? '✅' : '⚠️ '} ${report.office} (${report.durationMs}ms)`);
+    Object.entries(report.ledgers).forEach(([ledger, entry]) => {
+      console.log(`   • ${ledger}: ${entry.rows} rows, replayed ${entry.replayedBalance}, last balanceAfter ${entry.lastBalanceAfter}, stored ${entry.storedBalance} (difference ${entry.difference})`);
+      entry.mismatches.forEach((row) => {
+        console.log(`     - ${row._id} ${row.type} ${row.invoiceRef || ''} amount ${row.amount}: expected ${row.expected}, balanceAfter ${row.balanceAfter}`);
+      });
+      if (entry.mismatchCount > entry.mismatches.length) {
+        console.log(`     … ${entry.mismatchCount - entry.mismatches.length} more mismatching rows`);
+      }
+    });
+    if (report.unknownLedgerRows) {
+      console.log(`   • ${report.unknownLedgerRows} rows with an unknown ledger`);
+    }
+  });
+  console.log(`\n${ok ? '✅ No drift found' : '⚠️  Drift found'} in ${durationMs}ms`);
+}
+
+if (require.main === module) {
+  const offices = process.argv.slice(2);
+  connectToDatabase()
+    .then(() => verifyLedgers(offices.length ? offices : undefined))
+    .then((result) => {
+      printReport(result);
+      if (!result.ok) process.exitCode = 1;
+    })
+    .catch((error) => {
+      console.error('\n❌ Verification failed:', error);
+      process.exitCode = 1;
+    })
+    .finally(() => mongoose.connection.close());
+}
@@ -0,0 +1,307 @@
+// Hot/cold archival of office invoices and transactions.
+// Rows dated before a cutoff (ARCHIVE_AFTER_MONTHS complete months back, and
+// only once those months have been closed into ledger checkpoints) are moved
+// in batches into a `<collection>_archive` collection with the same schema and
+// indexes. Each batch is copied (replacing any copy left by a run that stopped
+// half-way, so a failed run is resumed by simply running it again), then
+// deleted from the live collection only where the row still carries the
+// updatedAt/__v it was copied with. Rows edited in between are copied again,
+// and rows re-dated out of range meanwhile lose their copy.
+// Progress and the read boundary live in ArchiveState.
+//
+// Readers consult archiveBoundary(): list, export and ledger queries only touch
+// the archive when their date range starts before the boundary, and merge the
+// two sorted result sets (or $unionWith the archive in aggregations).
+
+const mongoose = require('mongoose');
+const ArchiveState = require('../models/ArchiveState');
+
+const ARCHIVE_AFTER_MONTHS = parseInt(process.env.ARCHIVE_AFTER_MONTHS, 10) || 24;
+const BATCH_SIZE = parseInt(process.env.ARCHIVE_BATCH_SIZE, 10) || 1000;
+const BOUNDARY_TTL_MS = 10 * 1000;
+
+const archiveModels = new Map();
+const boundaries = new Map();
+
+const archiveCollectionName = (Model) => `${Model.collection.name}_archive`;
+
+// Model over the archive collection, sharing the live schema (so populate works)
+function archiveModelFor(Model) {
+  if (!archiveModels.has(Model.modelName)) {
+    const name = `${Model.modelName}Archive`;
+    const ArchiveModel = Model.db.models[name]
+      || Model.db.model(name, Model.schema.clone(), archiveCollectionName(Model));
+    archiveModels.set(Model.modelName, ArchiveModel);
+  }
+  return archiveModels.get(Model.modelName);
+}
+
+/**
+ * Date before which rows of Model may be archived, or null when nothing is.
+ * Cached for a few seconds per process.
+ */
+async function archiveBoundary(Model) {
+  const key = Model.collection.name;
+  const cached = boundaries.get(key);
+  if (cached && cached.expiresAt > Date.now()) return cached.cutoff;
+  const state = await ArchiveState.findOne({ collectionName: key }).select('cutoff').lean();
+  const cutoff = state?.cutoff || null;
+  boundaries.set(key, { cutoff, expiresAt: Date.now() + BOUNDARY_TTL_MS });
+  return cutoff;
+}
+
+// Lower bound of a `date` filter value (a Date or { $gte / $gt }), or null
+function lowerDateBound(dateFilter) {
+  if (!dateFilter) return null;
+  if (dateFilter instanceof Date) return dateFilter;
+  const bound = dateFilter.$gte || dateFilter.$gt || dateFilter.$eq;
+  return bound ? new Date(bound) : null;
+}
+
+/**
+ * Whether a query with this `date` filter can match archived rows.
+ *
+ * @param {Model} Model - live model
+ * @param {Object|Date} [dateFilter] - the query's `date` condition
+ */
+async function reachesArchive(Model, dateFilter) {
+  const cutoff = await archiveBoundary(Model);
+  if (!cutoff) return false;
+  const lower = lowerDateBound(dateFilter);
+  return !lower || lower < cutoff;
+}
+
+// $unionWith stage reading the archive of Model through `pipeline`
+function unionWithArchive(Model, pipeline = []) {
+  return { $unionWith: { coll: archiveCollectionName(Model), pipeline } };
+}
+
+function compareValues(a, b) {
+  if (a === b) return 0;
+  if (a === undefined || a === null) return -1;
+  if (b === undefined || b === null) return 1;
+  const x = a instanceof Date ? a.getTime() : (a instanceof mongoose.Types.ObjectId ? String(a) : a);
+  const y = b instanceof Date ? b.getTime() : (b instanceof mongoose.Types.ObjectId ? String(b) : b);
+  if (x < y) return -1;
+  return x > y ? 1 : 0;
+}
+
+// Comparator for documents in a Mongo sort order, with _id as the final tie-break
+function compareBy(sort) {
+  const keys = Object.entries(sort);
+  if (!sort._id) keys.push(['_id', keys.length ? keys[keys.length - 1][1] : 1]);
+  return (a, b) => {
+    for (const [field, direction] of keys) {
+      const order = compareValues(a[field], b[field]);
+      if (order) return order * direction;
+    }
+    return 0;
+  };
+}
+
+const sameRow = (a, b) => String(a._id) === String(b._id);
+
+// Merge two lists already sorted by `compare`; a row present in both is kept once
+function mergeSorted(live, archived, compare) {
+  const merged = [];
+  let i = 0;
+  let j = 0;
+  while (i < live.length || j < archived.length) {
+    if (j >= archived.length || (i < live.length && compare(live[i], archived[j]) <= 0)) {
+      if (j < archived.length && sameRow(live[i], archived[j])) j += 1;
+      merged.push(live[i]);
+      i += 1;
+    } else {
+      merged.push(archived[j]);
+      j += 1;
+    }
+  }
+  return merged;
+}
+
+// Same as mergeSorted() for two async iterables (export cursors)
+async function* mergeCursors(live, archived, compare) {
+  const a = live[Symbol.asyncIterator]();
+  const b = archived[Symbol.asyncIterator]();
+  let x = await a.next();
+  let y = await b.next();
+  while (!x.done || !y.done) {
+    if (y.done || (!x.done && compare(x.value, y.value) <= 0)) {
+      if (!y.done && sameRow(x.value, y.value)) y = await b.next();
+      yield x.value;
+      x = await a.next();
+    } else {
+      yield y.value;
+      y = await b.next();
+    }
+  }
+}
+
+/**
+ * Streaming read over live and archived rows: `build(Model)` returns the
+ * cursor (or other async iterable) for one collection, already sorted by `sort`.
+ * The archive is only opened when `dateFilter` reaches it.
+ */
+async function archiveAwareCursor(Model, dateFilter, sort, build) {
+  if (!(await reachesArchive(Model, dateFilter))) return build(Model);
+  return mergeCursors(build(Model), build(archiveModelFor(Model)), compareBy(sort));
+}
+
+// First day (UTC) of the month `months` complete months before `now`
+function archiveCutoff(now = new Date(), months = ARCHIVE_AFTER_MONTHS) {
+  return new Date(Date.UTC(now.getUTCFullYear(), now.getUTCMonth() - months, 1));
+}
+
+// Attempts at moving a row that keeps being edited before it is left live
+const MOVE_ATTEMPTS = 3;
+
+// Filter matching a row only while it is the version that was copied
+const unchanged = (row) => ({
+  _id: row._id,
+  updatedAt: row.updatedAt === undefined ? null : row.updatedAt,
+  __v: row.__v === undefined ? null : row.__v,
+});
+
+const sleep = (ms) => new Promise((resolve) => { setTimeout(resolve, ms); });
+
+/**
+ * Move the rows of one collection dated before `cutoff` into its archive.
+ *
+ * @returns {Promise<number>} rows moved by this run
+ */
+async function archiveCollection(Model, cutoff) {
+  const ArchiveModel = archiveModelFor(Model);
+  const collectionName = Model.collection.name;
+  const state = await ArchiveState.findOneAndUpdate(
+    { collectionName },
+    { $setOnInsert: { collectionName } },
+    { upsert: true, new: true, lean: true }
+  );
+
+  if (!state.cutoff || state.cutoff < cutoff) {
+    // Publish the new boundary first and give other processes time to see it,
+    // so rows never disappear from a reader that does not yet look in the archive
+    await ArchiveState.updateOne({ collectionName }, { $max: { cutoff } });
+    boundaries.delete(collectionName);
+    await sleep(BOUNDARY_TTL_MS);
+  }
+
+  await ArchiveState.updateOne({ collectionName }, {
+    $set: { status: 'running', startedAt: new Date(), lastRunMoved: 0 },
+    $unset: { error: 1, finishedAt: 1 },
+  });
+  let moved = 0;
+  try {
+    // Raw collection calls: rows move as stored, without casting or write hooks
+    const skipped = [];
+    for (;;) {
+      const batch = await Model.collection.find({ date: { $lt: cutoff }, _id: { $nin: skipped } })
+        .sort({ date: 1, _id: 1 })
+        .limit(BATCH_SIZE)
+        .toArray();
+      if (!batch.length) break;
+
+      let pending = batch;
+      let batchMoved = 0;
+      for (let attempt = 0; pending.length && attempt < MOVE_ATTEMPTS; attempt += 1) {
+        await ArchiveModel.collection.bulkWrite(pending.map((row) => ({
+          replaceOne: { filter: { _id: row._id }, replacement: row, upsert: true },
+        })), { ordered: false });
+        const { deletedCount } = await Model.collection.deleteMany({ $or: pending.map(unchanged) });
+        batchMoved += deletedCount;
+        if (deletedCount === pending.length) {
+          pending = [];
+          break;
+        }
+
+        // The rows still live changed after they were copied: copy the ones
+        // still in range again, drop the copies of the ones re-dated out of it
+        const current = await Model.collection.find({ _id: { $in: pending.map((row) => row._id) } }).toArray();
+        const redated = current.filter((row) => !(row.date < cutoff));
+        if (redated.length) {
+          await ArchiveModel.collection.deleteMany({ _id: { $in: redated.map((row) => row._id) } });
+        }
+        pending = current.filter((row) => row.date < cutoff);
+      }
+      if (pending.length) {
+        // Still being edited: leave them live for the next run
+        await ArchiveModel.collection.deleteMany({ _id: { $in: pending.map((row) => row._id) } });
+        skipped.push(...pending.map((row) => row._id));
+      }
+
+      moved += batchMoved;
+      await ArchiveState.updateOne({ collectionName }, {
+        $inc: { movedCount: batchMoved, lastRunMoved: batchMoved },
+        $set: { lastBatchAt: new Date() },
+      });
+    }
+    await ArchiveState.updateOne({ collectionName }, { $set: { status: 'idle', finishedAt: new Date() } });
+  } catch (error) {
+    await ArchiveState.updateOne({ collectionName }, {
+      $set: { status: 'failed', finishedAt: new Date(), error: error.message },
+    }).catch(() => {});
+    throw error;
+  }
+  return moved;
+}
+
+/**
+ * Archive the invoices and transactions of the given offices. The months being
+ * archived are closed into ledger checkpoints first.
+ *
+ * @param {Object} [options]
+ * @param {string[]} [options.offices] - keys of OFFICES (default: all)
+ * @param {number} [options.months] - complete months kept hot
+ * @returns {Promise<{cutoff: Date, moved: Object}>}
+ */
+async function runArchive({ offices, months = ARCHIVE_AFTER_MONTHS, now = new Date() } = {}) {
+  const { OFFICES } = require('./offices');
+  const { ensureClosed } = require('./ledgerCheckpoints');
+  const selected = offices || Object.keys(OFFICES);
+  const unknown = selected.filter((office) => !OFFICES[office]);
+  if (unknown.length) throw new Error(`Unknown office: ${unknown.join(', ')}`);
+
+  const cutoff = archiveCutoff(now, months);
+  const moved = {};
+  for (const office of selected) {
+    await ensureClosed(office, now);
+    const { Invoice, Transaction } = OFFICES[office];
+    moved[office] = {
+      invoices: await archiveCollection(Invoice, cutoff),
+      transactions: await archiveCollection(Transaction, cutoff),
+    };
+  }
+  return { cutoff, moved };
+}
+
+let running = null;
+
+// Run unless a run is already in progress (returns the in-flight run otherwise)
+function runArchiveExclusive(options) {
+  if (!running) {
+    running = runArchive(options).finally(() => {
+      running = null;
+    });
+  }
+  return running;
+}
+
+function archiveStatus() {
+  return ArchiveState.find().sort({ collectionName: 1 }).lean();
+}
+
+module.exports = {
+  ARCHIVE_AFTER_MONTHS,
+  archiveModelFor,
+  archiveBoundary,
+  reachesArchive,
+  unionWithArchive,
+  compareBy,
+  mergeSorted,
+  mergeCursors,
+  archiveAwareCursor,
+  archiveCutoff,
+  runArchive,
+  runArchiveExclusive,
+  archiveStatus,
+};
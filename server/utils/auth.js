@@ -0,0 +1,121 @@
+// JWT authentication shared by every router.
+// authenticate() is mounted once on /api in index.js and sets req.user from a
+// valid Bearer token without rejecting anything (login and health stay public).
+// Routers keep `router.use(requireAuth)`, which is a no-op once req.user is set
+// and otherwise verifies the token itself (e.g. a router mounted elsewhere).
+//
+// Verified tokens are kept in a bounded LRU keyed by the token's SHA-256, so a
+// session pays the HMAC verification once. An entry never outlives the token's
+// own `exp`, nor AUTH_CACHE_TTL_MS.
+
+const crypto = require('crypto');
+const jwt = require('jsonwebtoken');
+const { addSpan } = require('./tracing');
+
+const MAX_ENTRIES = parseInt(process.env.AUTH_CACHE_MAX_ENTRIES, 10) || 1000;
+const TTL_MS = parseInt(process.env.AUTH_CACHE_TTL_MS, 10) || 5 * 60 * 1000;
+
+const secret = () => process.env.JWT_SECRET || 'dev_secret';
+
+// token hash => { payload, expiresAt }
+const verified = new Map();
+const stats = { hits: 0, misses: 0, rejected: 0, evictions: 0 };
+
+const hashToken = (token) => crypto.createHash('sha256').update(token).digest('base64');
+
+function bearerToken(req) {
+  const hdr = req.headers.authorization || '';
+  return hdr.startsWith('Bearer ') ? hdr.slice(7) : null;
+}
+
+/**
+ * Verify a token, answering from the cache when it was verified recently.
+ * Throws like jwt.verify() when the token is invalid or expired.
+ *
+ * @param {string} token
+ * @returns {Object} a copy of the token payload
+ */
+function verifyToken(token) {
+  const startedAt = process.hrtime.bigint();
+  try {
+    return verifyCached(token);
+  } finally {
+    addSpan('auth', Number(process.hrtime.bigint() - startedAt) / 1e6);
+  }
+}
+
+function verifyCached(token) {
+  const key = hashToken(token);
+  const entry = verified.get(key);
+  if (entry) {
+    verified.delete(key);
+    if (entry.expiresAt > Date.now()) {
+      verified.set(key, entry);
+      stats.hits += 1;
+      return { ...entry.payload };
+    }
+  }
+
+  stats.misses += 1;
+  let payload;
+  try {
+    payload = jwt.verify(token, secret());
+  } catch (error) {
+    stats.rejected += 1;
+    throw error;
+  }
+  const expiresAt = Math.min(
+    Date.now() + TTL_MS,
+    typeof payload.exp === 'number' ? payload.exp * 1000 : Infinity
+  );
+  verified.set(key, { payload, expiresAt });
+  while (verified.size > MAX_ENTRIES) {
+    verified.delete(verified.keys().next().value);
+    stats.evictions += 1;
+  }
+  return { ...payload };
+}
+
+// Set req.user from a valid Bearer token; never rejects
+function authenticate(req, res, next) {
+  const token = bearerToken(req);
+  if (token && !req.user) {
+    try {
+      req.user = verifyToken(token);
+    } catch (error) {
+      // Left to requireAuth on protected routes
+    }
+  }
+  next();
+}
+
+// Reject requests without a valid token
+function requireAuth(req, res, next) {
+  if (req.user) return next();
+  const token = bearerToken(req);
+  if (!token) return res.status(401).json({ message: 'غير مصرح' });
+  try {
+    req.user = verifyToken(token);
+    return next();
+  } catch (error) {
+    return res.status(401).json({ message: 'جلسة غير صالحة' });
+  }
+}
+
+function authCacheStatus() {
+  const lookups = stats.hits + stats.misses;
+  return {
+    entries: verified.size,
+    maxEntries: MAX_ENTRIES,
+    ttl: TTL_MS,
+    ...stats,
+    hitRate: lookups > 0 ? stats.hits / lookups : 0,
+  };
+}
+
+module.exports = {
+  verifyToken,
+  authenticate,
+  requireAuth,
+  authCacheStatus,
+};
@@ -0,0 +1,150 @@
+// Point-in-time ledger balances.
+// The balance of a ledger at a moment is read from the latest transaction row
+// dated at or before it: one backwards seek on the (ledger, date, _id) index,
+// returning that row's balanceAfter. balanceAfter is a running balance in
+// insertion order, so the seek only holds when the rows split cleanly at that
+// row: nothing dated after asOf was posted before it and nothing dated at or
+// before asOf was posted after it. That is checked against the NEIGHBOURS rows
+// on each side of the seek in (date, _id) order, which keeps the lookup to a
+// few index seeks; a row back-dated past more than NEIGHBOURS later rows is not
+// seen (ask for `source=checkpoint` for the exact figure). When the check
+// fails, no usable row is found or `source=checkpoint` is asked for, the
+// balance is rebuilt by business date from the last closed monthly checkpoint
+// (re-closed first when dirty) plus the rows dated after it.
+
+const LedgerCheckpoint = require('../models/LedgerCheckpoint');
+const { OFFICE_LEDGERS, ensureClosed, periodOf } = require('./ledgerCheckpoints');
+const { archiveModelFor, archiveBoundary, reachesArchive, unionWithArchive } = require('./archive');
+
+function ledgerMatch(office, ledger) {
+  const { ledgerField } = OFFICE_LEDGERS[office];
+  return ledgerField ? { [ledgerField]: ledger } : {};
+}
+
+const NEIGHBOURS = 20;
+
+// The latest rows at or before asOf, newest first (the first is the seek)
+function latestRows(Model, office, ledger, asOf) {
+  return Model.find({ ...ledgerMatch(office, ledger), date: { $lte: asOf } })
+    .sort({ date: -1, _id: -1 })
+    .limit(NEIGHBOURS + 1)
+    .select('date type amount balanceAfter invoiceRef')
+    .lean();
+}
+
+// Whether the seek row's balanceAfter is the balance by business date at asOf:
+// none of the rows dated just after asOf was inserted before it, and none of
+// the rows dated just before it was inserted after it
+async function seekHolds(models, office, ledger, asOf, row, earlier) {
+  const after = await Promise.all(models.map((Model) => Model
+    .find({ ...ledgerMatch(office, ledger), date: { $gt: asOf } })
+    .sort({ date: 1, _id: 1 })
+    .limit(NEIGHBOURS)
+    .select('_id')
+    .lean()));
+  const insertedAfter = (other) => String(other._id) > String(row._id);
+  return after.flat().every(insertedAfter) && !earlier.some(insertedAfter);
+}
+
+// Latest row at or before asOf, by business date then insertion order
+async function balanceFromTransaction(office, ledger, asOf) {
+  const { OFFICES } = require('./offices');
+  const { Transaction } = OFFICES[office];
+  const cutoff = await archiveBoundary(Transaction);
+  const models = cutoff ? [Transaction, archiveModelFor(Transaction)] : [Transaction];
+  let rows = await latestRows(Transaction, office, ledger, asOf);
+  // Rows dated before the archive boundary live in the archive collection
+  if (!rows.length && cutoff) rows = await latestRows(models[1], office, ledger, asOf);
+  const [row, ...earlier] = rows;
+  if (!row || typeof row.balanceAfter !== 'number') return null;
+  if (!(await seekHolds(models, office, ledger, asOf, row, earlier))) return { backdated: true };
+  return {
+    balance: row.balanceAfter,
+    source: 'transaction',
+    transaction: row,
+  };
+}
+
+// Closing balance of the last closed month before asOf plus the rows dated since
+async function balanceFromCheckpoint(office, ledger, asOf) {
+  const { OFFICES } = require('./offices');
+  const { Transaction } = OFFICES[office];
+  await ensureClosed(office);
+  const checkpoint = await LedgerCheckpoint.findOne({ office, ledger, period: { $lt: periodOf(asOf) } })
+    .sort({ period: -1 })
+    .select('period periodEnd closingBalance')
+    .lean();
+
+  const date = { $lte: asOf };
+  if (checkpoint) date.$gte = checkpoint.periodEnd;
+  const match = { $match: { ...ledgerMatch(office, ledger), date } };
+  const pipeline = [match];
+  if (await reachesArchive(Transaction, date)) pipeline.push(unionWithArchive(Transaction, [match]));
+  const [delta] = await Transaction.aggregate([
+    ...pipeline,
+    { $group: { _id: null, total: { $sum: '$amount' }, count: { $sum: 1 } } },
+  ]);
+  return {
+    balance: Math.round(((checkpoint?.closingBalance || 0) + (delta?.total || 0)) * 1000) / 1000,
+    source: 'checkpoint',
+    checkpoint: checkpoint ? { period: checkpoint.period, closingBalance: checkpoint.closingBalance } : null,
+    rowsSinceCheckpoint: delta?.count || 0,
+  };
+}
+
+/**
+ * Balance of one office ledger as of a moment.
+ *
+ * @param {string} office - key of OFFICE_LEDGERS
+ * @param {string} ledger - one of the office's ledgers
+ * @param {Date} asOf
+ * @param {Object} [options]
+ * @param {string} [options.source] - 'checkpoint' to skip the transaction seek
+ */
+async function balanceAsOf(office, ledger, asOf, { source } = {}) {
+  let reason;
+  if (source !== 'checkpoint') {
+    const found = await balanceFromTransaction(office, ledger, asOf);
+    if (found && !found.backdated) return { ledger, ...found };
+    // Tell the caller why the faster seek was not used
+    reason = found ? 'backdated' : 'no_transaction';
+  }
+  const result = { ledger, ...(await balanceFromCheckpoint(office, ledger, asOf)) };
+  if (reason) result.fallbackReason = reason;
+  return result;
+}
+
+/**
+ * GET handler for /api/<office>/balance?asOf=&ledger=&source=
+ * Without `ledger` every ledger of the office is returned.
+ */
+function balanceRoute(office) {
+  return async (req, res) => {
+    try {
+      const { ledgers } = OFFICE_LEDGERS[office];
+      const { asOf, ledger, source } = req.query;
+
+      const at = asOf ? new Date(asOf) : new Date();
+      if (Number.isNaN(at.getTime())) {
+        return res.status(400).json({ message: 'التاريخ غير صالح' });
+      }
+      if (ledger !== undefined && !ledgers.includes(ledger)) {
+        return res.status(400).json({ message: 'مصدر/وجهة غير صالحة', ledgers });
+      }
+      if (source !== undefined && !['transaction', 'checkpoint'].includes(source)) {
+        return res.status(400).json({ message: 'مصدر الرصيد غير صالح' });
+      }
+
+      const balances = await Promise.all((ledger ? [ledger] : ledgers)
+        .map((name) => balanceAsOf(office, name, at, { source })));
+      res.json({ office, asOf: at, balances });
+    } catch (error) {
+      res.status(500).json({ message: 'خطأ في جلب الرصيد', error: error.message });
+    }
+  };
+}
+
+module.exports = {
+  balanceAsOf,
+  balanceRoute,
+};
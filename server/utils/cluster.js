@@ -0,0 +1,83 @@
+// Worker side of cluster mode (see cluster.js).
+// Outside cluster mode every helper degrades to single-process behaviour:
+// broadcast() does nothing and this process is always the leader.
+//
+// Messages sent with broadcast() go to the primary, which relays them to every
+// other worker; subscribe() registers the handler for one message type. The
+// primary also tells each worker whether it is the leader, the one worker that
+// runs jobs which must only run once (schedulers).
+
+const cluster = require('cluster');
+
+const clustered = cluster.isWorker && typeof process.send === 'function';
+const handlers = new Map();
+const leadership = [];
+let leader = !clustered;
+
+/**
+ * Send a message to every other worker.
+ *
+ * @param {string} type
+ * @param {Object} [payload]
+ */
+function broadcast(type, payload = {}) {
+  if (!clustered || !process.connected) return;
+  process.send({ cluster: 'broadcast', type, payload });
+}
+
+function subscribe(type, handler) {
+  if (!handlers.has(type)) handlers.set(type, []);
+  handlers.get(type).push(handler);
+}
+
+function isLeader() {
+  return leader;
+}
+
+/**
+ * Run `start` while this process is the leader and `stop` when it stops being
+ * one. Outside cluster mode `start` runs right away.
+ */
+function whenLeader(start, stop = () => {}) {
+  leadership.push({ start, stop });
+  if (leader) start();
+}
+
+function setLeader(value) {
+  if (value === leader) return;
+  leader = value;
+  leadership.forEach(({ start, stop }) => {
+    try {
+      if (leader) start();
+      else stop();
+    } catch (error) {
+      console.error('Leadership change failed:', error.message);
+    }
+  });
+  if (leader) console.log(`👑 Worker ${cluster.worker.id} is the leader`);
+}
+
+if (clustered) {
+  process.on('message', (message) => {
+    if (!message || typeof message !== 'object') return;
+    if (message.cluster === 'leader') {
+      setLeader(Boolean(message.leader));
+    } else if (message.cluster === 'broadcast') {
+      (handlers.get(message.type) || []).forEach((handler) => {
+        try {
+          handler(message.payload);
+        } catch (error) {
+          console.error(`Cluster message ${message.type} failed:`, error.message);
+        }
+      });
+    }
+  });
+}
+
+module.exports = {
+  clustered,
+  broadcast,
+  subscribe,
+  isLeader,
+  whenLeader,
+};
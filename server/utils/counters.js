@@ -0,0 +1,149 @@
+// Atomic sequence allocator backed by the counters collection.
+// Each call is a single findOneAndUpdate with $inc, so concurrent requests never
+// read-modify-write a shared document. Callers may opt into an in-process block
+// lease (COUNTER_BLOCK_SIZE or the blockSize option): a whole range is reserved
+// in one round trip and handed out from memory. Unused numbers in a lease are
+// skipped when the process restarts, so references stay unique but may have gaps.
+
+const Counter = require('../models/Counter');
+
+const DEFAULT_BLOCK_SIZE = Math.max(1, parseInt(process.env.COUNTER_BLOCK_SIZE, 10) || 1);
+
+const leases = new Map();
+const refills = new Map();
+
+// Create the counter the first time a key is used. `seed` is the last number
+// already issued (a value or an async function), so legacy counters continue
+// where they left off instead of restarting at 1.
+async function ensureCounter(key, seed) {
+  const start = typeof seed === 'function' ? await seed() : seed;
+  try {
+    await Counter.updateOne(
+      { _id: key },
+      { $setOnInsert: { seq: Number(start) || 0 } },
+      { upsert: true }
+    );
+  } catch (error) {
+    // Another request created it first
+    if (error.code !== 11000) throw error;
+  }
+}
+
+/**
+ * Reserve `count` consecutive numbers for a sequence.
+ *
+ * @param {string} key
+ * @param {number} [count=1]
+ * @param {Object} [options]
+ * @param {number|Function} [options.seed] - last number issued before the counter existed
+ * @returns {Promise<{start: number, end: number}>} inclusive range
+ */
+async function reserveRange(key, count = 1, { seed = 0 } = {}) {
+  const size = Math.max(1, Math.floor(count));
+  let counter = await Counter.findOneAndUpdate(
+    { _id: key },
+    { $inc: { seq: size } },
+    { new: true, lean: true }
+  );
+  if (!counter) {
+    await ensureCounter(key, seed);
+    counter = await Counter.findOneAndUpdate(
+      { _id: key },
+      { $inc: { seq: size } },
+      { new: true, lean: true }
+    );
+  }
+  return { start: counter.seq - size + 1, end: counter.seq };
+}
+
+async function nextFromLease(key, blockSize, seed) {
+  for (;;) {
+    const lease = leases.get(key);
+    if (lease && lease.next <= lease.end) {
+      const value = lease.next;
+      lease.next += 1;
+      return value;
+    }
+    // One refill per key at a time; concurrent callers wait for it
+    if (!refills.has(key)) {
+      refills.set(key, reserveRange(key, blockSize, { seed })
+        .then(({ start, end }) => { leases.set(key, { next: start, end }); })
+        .finally(() => { refills.delete(key); }));
+    }
+    await refills.get(key);
+  }
+}
+
+/**
+ * Get the next number of a sequence.
+ *
+ * @param {string} key
+ * @param {Object} [options]
+ * @param {number|Function} [options.seed] - last number issued before the counter existed
+ * @param {number} [options.blockSize] - numbers reserved per round trip (defaults to COUNTER_BLOCK_SIZE)
+ * @returns {Promise<number>}
+ */
+async function nextSequence(key, { seed = 0, blockSize = DEFAULT_BLOCK_SIZE } = {}) {
+  if (blockSize > 1) {
+    return nextFromLease(key, blockSize, seed);
+  }
+  const { end } = await reserveRange(key, 1, { seed });
+  return end;
+}
+
+const formatReference = (prefix, counter) => `${prefix}-${counter.toString().padStart(3, '0')}`;
+
+/**
+ * Reference number statics for an office account model:
+ * getNextReference(type) and getNextReferences(type, count). Each type has its
+ * own sequence, seeded from the legacy counter field on the singleton account
+ * (Model.getAccount()) so numbering continues where it left off. Unknown types
+ * use the `spending` sequence.
+ *
+ * @param {Object} types - type => { counterField, prefix }
+ * @returns {Object} statics to assign to the schema
+ */
+function referenceStatics(types) {
+  function referenceSequence(Model, type) {
+    const { counterField, prefix } = types[type] || types.spending;
+    return {
+      key: `${Model.modelName}:${counterField}`,
+      prefix,
+      seed: async () => {
+        const account = await Model.getAccount();
+        return account[counterField] || 0;
+      },
+    };
+  }
+
+  return {
+    async getNextReference(type) {
+      const { key, prefix, seed } = referenceSequence(this, type);
+      const counter = await nextSequence(key, { seed });
+      return formatReference(prefix, counter);
+    },
+
+    // Allocate several consecutive reference numbers in one round trip
+    async getNextReferences(type, count) {
+      const { key, prefix, seed } = referenceSequence(this, type);
+      const { start, end } = await reserveRange(key, count, { seed });
+      const references = [];
+      for (let counter = start; counter <= end; counter += 1) {
+        references.push(formatReference(prefix, counter));
+      }
+      return references;
+    },
+  };
+}
+
+// Drop leased ranges (tests, or after restoring the counters collection)
+function resetLeases() {
+  leases.clear();
+}
+
+module.exports = {
+  nextSequence,
+  reserveRange,
+  referenceStatics,
+  resetLeases,
+};
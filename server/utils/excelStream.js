@@ -0,0 +1,137 @@
+// Streaming Excel exports.
+// Workbooks are written with ExcelJS's streaming writer straight into the HTTP
+// response, and rows are read from lean Mongo cursors and committed one by one.
+// An export therefore holds one cursor batch plus whatever the socket has not
+// yet accepted, instead of the full result set and the finished workbook.
+
+const ExcelJS = require('exceljs');
+
+const EXPORT_BATCH_SIZE = parseInt(process.env.EXPORT_BATCH_SIZE, 10) || 500;
+
+const XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet';
+
+const HEADER_FILL = {
+  type: 'pattern',
+  pattern: 'solid',
+  fgColor: { argb: 'FFE0E0E0' },
+};
+
+const HEADER_STYLE = { font: { bold: true }, fill: HEADER_FILL };
+
+// Attachment headers for an .xlsx download
+function setDownloadHeaders(res, filename) {
+  res.setHeader('Content-Type', XLSX_CONTENT_TYPE);
+  res.setHeader('Content-Disposition', `attachment; filename=${filename}`);
+}
+
+/**
+ * Streaming workbook writing into any writable stream (a response or a file).
+ *
+ * @param {Writable} stream - destination of the .xlsx bytes
+ * @returns {ExcelJS.stream.xlsx.WorkbookWriter} call `await workbook.commit()` to finish
+ */
+function createWorkbookWriter(stream) {
+  return new ExcelJS.stream.xlsx.WorkbookWriter({
+    stream,
+    useStyles: true,
+    useSharedStrings: false,
+  });
+}
+
+// Start an .xlsx download on `res`
+function createWorkbookStream(res, filename) {
+  setDownloadHeaders(res, filename);
+  return createWorkbookWriter(res);
+}
+
+// Bold grey header row. Must be called before the first data row is committed.
+function styleHeaderRow(worksheet, rowNumber = 1) {
+  return Object.assign(worksheet.getRow(rowNumber), HEADER_STYLE);
+}
+
+// Lean cursor for an export query (populate() still applies, batch by batch)
+function exportCursor(query) {
+  return query.lean().cursor({ batchSize: EXPORT_BATCH_SIZE });
+}
+
+// Resolve once the destination accepts more data; reject if it was closed
+function waitForDrain(stream) {
+  if (stream.destroyed) {
+    return Promise.reject(new Error('Export aborted: destination closed'));
+  }
+  return new Promise((resolve, reject) => {
+    const onDrain = () => {
+      stream.off('close', onClose);
+      resolve();
+    };
+    const onClose = () => {
+      stream.off('drain', onDrain);
+      reject(new Error('Export aborted: destination closed'));
+    };
+    stream.once('drain', onDrain);
+    stream.once('close', onClose);
+  });
+}
+
+/**
+ * Add and commit a row, pausing while the destination buffer is full.
+ *
+ * @param {Worksheet} worksheet - streaming worksheet
+ * @param {Object|Array} values - row values (keyed by column key, or positional)
+ * @param {Writable} stream - response (or file) the workbook streams into
+ * @param {Object} [style] - row style (font, fill...) applied before commit
+ */
+async function commitRow(worksheet, values, stream, style) {
+  const row = worksheet.addRow(values);
+  if (style) Object.assign(row, style);
+  row.commit();
+  if (stream.writableNeedDrain) {
+    await waitForDrain(stream);
+  }
+  return row;
+}
+
+/**
+ * Write one row per cursor document.
+ *
+ * @param {Worksheet} worksheet - streaming worksheet
+ * @param {QueryCursor} cursor - see exportCursor()
+ * @param {Writable} stream - response (or file) the workbook streams into
+ * @param {Function} toRow - maps a document to row values; return null to skip it
+ * @returns {Promise<number>} number of rows written
+ */
+async function streamRows(worksheet, cursor, stream, toRow) {
+  let count = 0;
+  for await (const doc of cursor) {
+    const values = toRow(doc);
+    if (values) {
+      await commitRow(worksheet, values, stream);
+      count += 1;
+    }
+  }
+  return count;
+}
+
+// Report an export failure: JSON if nothing was sent yet, otherwise cut the download
+function exportFailed(res, error, body) {
+  console.error('❌ فشل التصدير:', error.message);
+  if (res.headersSent) {
+    res.destroy();
+    return;
+  }
+  res.removeHeader('Content-Disposition');
+  res.status(500).json(body);
+}
+
+module.exports = {
+  EXPORT_BATCH_SIZE,
+  HEADER_STYLE,
+  setDownloadHeaders,
+  createWorkbookWriter,
+  createWorkbookStream,
+  styleHeaderRow,
+  exportCursor,
+  commitRow,
+  streamRows,
+  exportFailed,
+};
@@ -0,0 +1,265 @@
+// Background export jobs.
+// Long exports run outside the HTTP request on a small worker pool and write
+// their workbook to local disk. Clients create a job, poll its status and then
+// download the file. Finished files are kept for a TTL, and an identical
+// request (same export type and query) made while a job is pending or shortly
+// after it finished is answered with that job instead of running it again.
+//
+// Job state lives in the ExportJob collection, so in cluster mode any worker
+// answers status and download requests (the workers share the artifact
+// directory, which is local to the host). A job runs in the process that
+// accepted it; files are only deleted once no job owns them.
+
+const crypto = require('crypto');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const ExportJob = require('../models/ExportJob');
+
+const EXPORT_JOBS_DIR = process.env.EXPORT_JOBS_DIR || path.join(os.tmpdir(), 'accounting-exports');
+const CONCURRENCY = parseInt(process.env.EXPORT_JOB_CONCURRENCY, 10) || 2;
+const TTL_MS = parseInt(process.env.EXPORT_JOB_TTL_MS, 10) || 30 * 60 * 1000;
+const DEDUPE_WINDOW_MS = parseInt(process.env.EXPORT_JOB_DEDUPE_MS, 10) || 2 * 60 * 1000;
+const OWNER = `${os.hostname()}:${process.pid}`;
+
+class UnknownExportError extends Error {
+  constructor(type) {
+    super(`Unknown export type: ${type}`);
+    this.name = 'UnknownExportError';
+    this.type = type;
+  }
+}
+
+// Export type + query with keys sorted, so equivalent requests share a job
+function jobKey(type, query) {
+  const params = new URLSearchParams();
+  Object.keys(query).sort().forEach((name) => {
+    [].concat(query[name]).forEach((value) => params.append(name, String(value)));
+  });
+  return `${type}?${params.toString()}`;
+}
+
+class ExportJobQueue {
+  constructor({ dir = EXPORT_JOBS_DIR, concurrency = CONCURRENCY, ttl = TTL_MS, dedupeWindow = DEDUPE_WINDOW_MS } = {}) {
+    this.dir = dir;
+    this.concurrency = concurrency;
+    this.ttl = ttl;
+    this.dedupeWindow = dedupeWindow;
+    this.exporters = new Map();
+    this.local = new Map(); // jobs run by this process, with their live stream
+    this.pending = [];
+    this.running = 0;
+    this.ready = null;
+    this.sweeper = null;
+  }
+
+  /**
+   * Register an export that can run as a job.
+   *
+   * @param {string} type - job type clients ask for
+   * @param {Object} exporter
+   * @param {Function} exporter.filename - (query) => download file name
+   * @param {Function} exporter.write - async (stream, query) => writes the workbook into stream
+   */
+  register(type, exporter) {
+    this.exporters.set(type, exporter);
+  }
+
+  types() {
+    return [...this.exporters.keys()];
+  }
+
+  // Create the artifact directory once, fail the jobs of processes that died
+  // and drop the files no live job owns
+  init() {
+    if (!this.ready) {
+      this.ready = (async () => {
+        await fs.promises.mkdir(this.dir, { recursive: true });
+
+        const unfinished = await ExportJob.find({ status: { $in: ['queued', 'running'] } }).select('owner').lean();
+        const orphaned = unfinished.filter((job) => !ownerAlive(job.owner)).map((job) => job._id);
+        if (orphaned.length) {
+          const finishedAt = new Date();
+          await ExportJob.updateMany({ _id: { $in: orphaned }, status: { $in: ['queued', 'running'] } }, {
+            $set: {
+              status: 'failed',
+              error: 'Interrupted: the process running the export stopped',
+              finishedAt,
+              expiresAt: new Date(finishedAt.getTime() + this.ttl),
+            },
+          });
+        }
+
+        const files = await fs.promises.readdir(this.dir);
+        const ids = [...new Set(files.map((name) => name.replace(/\.xlsx(\.part)?$/, '')))];
+        const owned = await ExportJob.find({ _id: { $in: ids }, expiresAt: { $not: { $lte: new Date() } } })
+          .select('status')
+          .lean();
+        const statusOf = new Map(owned.map((job) => [job._id, job.status]));
+        await Promise.all(files.map((name) => {
+          const status = statusOf.get(name.replace(/\.xlsx(\.part)?$/, ''));
+          const keep = name.endsWith('.part')
+            ? status === 'queued' || status === 'running'
+            : status === 'completed';
+          return keep ? null : fs.promises.rm(path.join(this.dir, name), { force: true });
+        }));
+
+        this.sweeper = setInterval(() => {
+          this.sweep().catch((error) => console.error('❌ Export job sweep failed:', error.message));
+        }, Math.min(this.ttl, 60 * 1000));
+        this.sweeper.unref();
+      })().catch((error) => {
+        this.ready = null;
+        throw error;
+      });
+    }
+    return this.ready;
+  }
+
+  /**
+   * Queue an export, or return the pending / recently finished job for the same request.
+   *
+   * @returns {Promise<{job: Object, reused: boolean}>}
+   */
+  async submit(type, query = {}) {
+    const exporter = this.exporters.get(type);
+    if (!exporter) throw new UnknownExportError(type);
+    await this.init();
+
+    const key = jobKey(type, query);
+    const existing = await ExportJob.findOne({
+      key,
+      $or: [
+        { status: { $in: ['queued', 'running'] } },
+        { status: 'completed', finishedAt: { $gte: new Date(Date.now() - this.dedupeWindow) } },
+      ],
+    }).sort({ createdAt: -1 }).lean();
+    if (existing) {
+      return { job: this.local.get(existing._id) || existing, reused: true };
+    }
+
+    const id = crypto.randomUUID();
+    const record = await ExportJob.create({
+      _id: id,
+      type,
+      query,
+      key,
+      status: 'queued',
+      filename: exporter.filename(query),
+      filePath: path.join(this.dir, `${id}.xlsx`),
+      owner: OWNER,
+    });
+    const job = { ...record.toObject(), stream: null };
+    this.local.set(id, job);
+    this.pending.push(job);
+    this.pump();
+    return { job, reused: false };
+  }
+
+  // The job as this process sees it (live for its own jobs), or null once expired
+  async get(id) {
+    if (this.local.has(id)) return this.local.get(id);
+    const job = await ExportJob.findById(String(id)).lean();
+    if (!job || (job.expiresAt && job.expiresAt <= new Date())) return null;
+    return job;
+  }
+
+  pump() {
+    while (this.running < this.concurrency && this.pending.length) {
+      const job = this.pending.shift();
+      this.running += 1;
+      this.run(job).finally(() => {
+        this.running -= 1;
+        this.pump();
+      });
+    }
+  }
+
+  async update(job, fields) {
+    Object.assign(job, fields);
+    await ExportJob.updateOne({ _id: job._id }, { $set: fields });
+  }
+
+  async run(job) {
+    const { write } = this.exporters.get(job.type);
+    const partPath = `${job.filePath}.part`;
+    try {
+      await this.update(job, { status: 'running', startedAt: new Date() });
+      job.stream = fs.createWriteStream(partPath);
+      await write(job.stream, job.query);
+      const bytesWritten = job.stream.bytesWritten;
+      await fs.promises.rename(partPath, job.filePath);
+      const finishedAt = new Date();
+      await this.update(job, {
+        status: 'completed',
+        bytesWritten,
+        finishedAt,
+        expiresAt: new Date(finishedAt.getTime() + this.ttl),
+      });
+      console.log(`✅ Export job ${job._id} (${job.type}) finished: ${bytesWritten} bytes`);
+    } catch (error) {
+      console.error(`❌ Export job ${job._id} (${job.type}) failed:`, error.message);
+      if (job.stream) job.stream.destroy();
+      await fs.promises.rm(partPath, { force: true });
+      const finishedAt = new Date();
+      await this.update(job, {
+        status: 'failed',
+        error: error.message,
+        finishedAt,
+        expiresAt: new Date(finishedAt.getTime() + this.ttl),
+      }).catch((updateError) => console.error(`❌ Export job ${job._id} state not saved:`, updateError.message));
+    } finally {
+      job.stream = null;
+      // Finished jobs are read back from the collection like any other worker's
+      this.local.delete(job._id);
+    }
+  }
+
+  // Remove expired jobs and their files
+  async sweep(now = new Date()) {
+    const expired = await ExportJob.find({ expiresAt: { $lte: now } }).select('filePath').lean();
+    await Promise.all(expired.map((job) => (job.filePath ? fs.promises.rm(job.filePath, { force: true }) : null)));
+    if (expired.length) {
+      await ExportJob.deleteMany({ _id: { $in: expired.map((job) => job._id) }, expiresAt: { $lte: now } });
+    }
+    return expired.length;
+  }
+
+  // Public view of a job
+  describe(job) {
+    const live = this.local.get(job._id);
+    return {
+      id: job._id,
+      type: job.type,
+      query: job.query,
+      status: job.status,
+      filename: job.filename,
+      progress: {
+        bytesWritten: live?.stream ? live.stream.bytesWritten : job.bytesWritten,
+        // Only known to the worker holding the queue
+        queuePosition: job.status === 'queued' ? (live ? this.pending.indexOf(live) + 1 : null) : 0,
+      },
+      error: job.error || null,
+      createdAt: job.createdAt,
+      startedAt: job.startedAt || null,
+      finishedAt: job.finishedAt || null,
+      expiresAt: job.expiresAt || null,
+    };
+  }
+
+  async status() {
+    const counts = { queued: 0, running: 0, completed: 0, failed: 0 };
+    const groups = await ExportJob.aggregate([{ $group: { _id: '$status', count: { $sum: 1 } } }]);
+    groups.forEach(({ _id, count }) => { counts[_id] = count; });
+    return { ...counts, concurrency: this.concurrency, ttl: this.ttl, dedupeWindow: this.dedupeWindow };
+  }
+}
+
+const exportJobs = new ExportJobQueue();
+
+module.exports = {
+  ExportJobQueue,
+  UnknownExportError,
+  exportJobs,
+  jobKey,
+};
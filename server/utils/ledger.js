@@ -0,0 +1,267 @@
+// Shared posting engine for the office ledgers (Fursatkum, Home Service, Farwaniya).
+// Balance changes are applied with a single conditional $inc on the singleton
+// account document; the sufficient-funds guard lives in the update filter so
+// concurrent postings can never overdraw or lose an update, and the new balance
+// returned by the update is what gets written to the transaction row.
+
+class InsufficientFundsError extends Error {
+  constructor(available, required) {
+    super('الرصيد غير كافٍ');
+    this.name = 'InsufficientFundsError';
+    this.available = available;
+    this.required = required;
+  }
+}
+
+// Singleton account ids are cached per model so postings skip the getAccount() read
+const accountIds = new Map();
+
+async function getAccountId(Account) {
+  if (!accountIds.has(Account.modelName)) {
+    const account = await Account.getAccount();
+    accountIds.set(Account.modelName, account._id);
+  }
+  return accountIds.get(Account.modelName);
+}
+
+// Build the update document. Plain deltas use $inc; fields listed in `floor`
+// keep the legacy "clamp at zero" semantics and need a pipeline update.
+function buildUpdate(inc, floor) {
+  if (!floor.length) return { $inc: inc };
+  const set = {};
+  Object.entries(inc).forEach(([field, delta]) => {
+    const next = { $add: [{ $ifNull: [`$${field}`, 0] }, delta] };
+    set[field] = floor.includes(field) ? { $max: [0, next] } : next;
+  });
+  return [{ $set: set }];
+}
+
+// Attempts at a balance change before giving up on a vanishing singleton or a
+// guard that keeps flipping under contention
+const MAX_ATTEMPTS = 5;
+
+const valueAt = (doc, path) => path.split('.').reduce((value, key) => (value == null ? undefined : value[key]), doc);
+
+function setAt(doc, path, value) {
+  const keys = path.split('.');
+  const last = keys.pop();
+  const parent = keys.reduce((node, key) => {
+    if (node[key] == null || typeof node[key] !== 'object') node[key] = {};
+    return node[key];
+  }, doc);
+  parent[last] = value;
+}
+
+/**
+ * Apply balance changes and report the deltas that actually landed, which
+ * differ from `inc` when a `floor` field was clamped at zero.
+ *
+ * @returns {Promise<{account: Object, applied: Object}>}
+ */
+async function changeBalance(Account, { inc, guard = {}, floor = [], session } = {}, attempt = 1) {
+  if (attempt > MAX_ATTEMPTS) {
+    throw new Error(`تعذر تحديث رصيد ${Account.modelName} بعد ${MAX_ATTEMPTS} محاولات`);
+  }
+  const accountId = await getAccountId(Account);
+  const filter = { _id: accountId };
+  Object.entries(guard).forEach(([field, min]) => {
+    if (min > 0) filter[field] = { $gte: min };
+  });
+
+  // A clamped update needs the balance before it to know what it moved
+  const clamps = floor.length > 0;
+  const result = await Account.findOneAndUpdate(filter, buildUpdate(inc, floor), {
+    new: !clamps,
+    lean: true,
+    session,
+  });
+  if (result) {
+    if (!clamps) return { account: result, applied: { ...inc } };
+    const account = { ...result };
+    const applied = {};
+    Object.entries(inc).forEach(([field, delta]) => {
+      const before = valueAt(result, field) || 0;
+      const clamped = floor.includes(field) && before + delta < 0;
+      setAt(account, field, clamped ? 0 : before + delta);
+      applied[field] = clamped ? -before : delta;
+    });
+    return { account, applied };
+  }
+
+  const current = await Account.findById(accountId).lean().session(session || null);
+  if (!current) {
+    // The singleton was removed underneath us; recreate it and retry
+    accountIds.delete(Account.modelName);
+    return changeBalance(Account, { inc, guard, floor, session }, attempt + 1);
+  }
+  const failed = Object.entries(guard).find(([field, min]) => (current[field] || 0) < min);
+  if (!failed) {
+    // The balance moved between the update and the read; the guard may hold now
+    return changeBalance(Account, { inc, guard, floor, session }, attempt + 1);
+  }
+  throw new InsufficientFundsError(current[failed[0]] || 0, failed[1]);
+}
+
+/**
+ * Atomically apply balance changes to an office account.
+ *
+ * @param {Model} Account - account model exposing the getAccount() singleton static
+ * @param {Object} options
+ * @param {Object} options.inc - field => signed delta, e.g. { cashBalance: -25 }
+ * @param {Object} [options.guard] - field => minimum balance required before the change
+ * @param {string[]} [options.floor] - fields clamped at zero instead of going negative
+ * @param {ClientSession} [options.session]
+ * @returns {Promise<Object>} the account document after the update (lean)
+ * @throws {InsufficientFundsError} when a guard does not hold
+ */
+async function applyBalanceChange(Account, options) {
+  const { account } = await changeBalance(Account, options);
+  return account;
+}
+
+// Undo a posting's balance change. A failure here leaves the balance wrong, so
+// it is logged with everything needed to correct it by hand.
+async function revertBalanceChange(Account, applied, session) {
+  const revert = {};
+  Object.entries(applied).forEach(([field, delta]) => { revert[field] = -delta; });
+  try {
+    await applyBalanceChange(Account, { inc: revert, session });
+  } catch (error) {
+    console.error(`❌ Ledger revert failed on ${Account.modelName}, apply by hand: ${JSON.stringify(revert)}:`, error.message);
+  }
+}
+
+// Run a caller's compensation for what its row callback saved; never throws
+async function runRollback(Account, rollback) {
+  if (!rollback) return;
+  try {
+    await rollback();
+  } catch (error) {
+    console.error(`❌ Ledger rollback failed on ${Account.modelName}:`, error.message);
+  }
+}
+
+/**
+ * Post a single ledger movement: update the balance and write the transaction
+ * row carrying the resulting balanceAfter.
+ *
+ * `transaction` may be a plain object or an async function returning one. The
+ * function form runs only once the balance change has been accepted, which lets
+ * callers allocate reference numbers and save the source document (invoice,
+ * loan, salary) without burning a number on an insufficient-funds rejection.
+ * If building or writing the row fails, `rollback` undoes what the callback
+ * saved and the balance change actually applied is reverted.
+ *
+ * @param {Model} Account
+ * @param {Model} Transaction
+ * @param {Object} options
+ * @param {string} options.field - balance field the movement applies to
+ * @param {number} options.amount - signed amount (negative for money leaving the ledger)
+ * @param {boolean} [options.requireFunds] - reject debits larger than the current balance
+ * @param {boolean} [options.floorAtZero] - clamp the balance at zero (legacy reversal behaviour)
+ * @param {Object} [options.inc] - extra counters to move in the same write
+ * @param {string[]} [options.floor] - extra fields clamped at zero
+ * @param {Object|Function} [options.transaction] - transaction row fields (balanceAfter is filled in)
+ * @param {Function} [options.rollback] - async compensation for the side effects of `transaction`
+ * @param {ClientSession} [options.session]
+ * @returns {Promise<{account: Object, balanceAfter: number, transaction: Document}>}
+ */
+async function postEntry(Account, Transaction, {
+  field,
+  amount,
+  requireFunds = false,
+  floorAtZero = false,
+  inc = {},
+  floor = [],
+  transaction,
+  rollback,
+  session,
+}) {
+  const guard = requireFunds && amount < 0 ? { [field]: -amount } : {};
+  const changes = { ...inc, [field]: amount };
+  const { account, applied } = await changeBalance(Account, {
+    inc: changes,
+    guard,
+    floor: floorAtZero ? [...floor, field] : floor,
+    session,
+  });
+
+  const balanceAfter = account[field];
+  let row;
+  try {
+    const fields = typeof transaction === 'function' ? await transaction(balanceAfter) : transaction;
+    if (fields) {
+      [row] = await Transaction.create([{ amount, ...fields, balanceAfter }], { session });
+    }
+  } catch (error) {
+    await runRollback(Account, rollback);
+    await revertBalanceChange(Account, applied, session);
+    throw error;
+  }
+
+  return { account, balanceAfter, transaction: row };
+}
+
+/**
+ * Post several movements on the same balance field with one balance update and
+ * one insertMany. Rows get consecutive balanceAfter values in the given order,
+ * ending at the balance returned by the update. If the rows cannot be written
+ * the balance change is reverted, after `rollback` has undone whatever the
+ * `transactions` function wrote.
+ *
+ * `transactions` may be an array or an async function returning one; as with
+ * postEntry, the function form runs only once the balance change has been
+ * accepted. The total moved is `amount` when given, otherwise the sum of the
+ * row amounts (which must then be known before the rows are built).
+ *
+ * @param {Model} Account
+ * @param {Model} Transaction
+ * @param {Object} options
+ * @param {string} options.field - balance field the movements apply to
+ * @param {number} [options.amount] - signed total of the rows
+ * @param {Object[]|Function} options.transactions - transaction rows, each with a signed `amount`
+ * @param {boolean} [options.requireFunds] - reject a net debit larger than the current balance
+ * @param {Object} [options.inc] - extra counters to move in the same write
+ * @param {Function} [options.rollback] - async compensation for the side effects of `transactions`
+ * @param {ClientSession} [options.session]
+ * @returns {Promise<{account: Object, balanceAfter: number, transactions: Document[]}>}
+ */
+async function postBatch(Account, Transaction, {
+  field,
+  amount,
+  transactions,
+  requireFunds = false,
+  inc = {},
+  rollback,
+  session,
+}) {
+  const total = amount !== undefined ? amount : transactions.reduce((sum, row) => sum + row.amount, 0);
+  const guard = requireFunds && total < 0 ? { [field]: -total } : {};
+  const changes = { ...inc, [field]: total };
+  const { account, applied } = await changeBalance(Account, { inc: changes, guard, session });
+
+  const balanceAfter = account[field];
+  let inserted;
+  try {
+    const fields = typeof transactions === 'function' ? await transactions(balanceAfter) : transactions;
+    let running = balanceAfter - total;
+    const rows = fields.map((row) => {
+      running += row.amount;
+      return { ...row, balanceAfter: running };
+    });
+    inserted = await Transaction.insertMany(rows, { session });
+  } catch (error) {
+    await runRollback(Account, rollback);
+    await revertBalanceChange(Account, applied, session);
+    throw error;
+  }
+
+  return { account, balanceAfter, transactions: inserted };
+}
+
+module.exports = {
+  InsufficientFundsError,
+  applyBalanceChange,
+  postEntry,
+  postBatch,
+};
@@ -0,0 +1,459 @@
+// Monthly ledger checkpoints.
+// Every complete month (UTC) of every office ledger is closed into a
+// LedgerCheckpoint holding its opening balance, income, spending, reversals,
+// adjustments and closing balance from the transaction rows, plus the invoice
+// figures for the month. Ledger totals are then the closed checkpoints plus an
+// aggregate over the open period only.
+//
+// Invoice and transaction models carry ledgerCheckpointPlugin: writing a row
+// dated in a past month marks that month dirty, and dirty (or missing) months
+// are re-closed on the next read. Later months only have their opening and
+// closing balances shifted, so re-closing costs one aggregate per collection
+// over the dirty months, not over the whole history.
+
+const LedgerCheckpoint = require('../models/LedgerCheckpoint');
+const { archiveModelFor, archiveBoundary, unionWithArchive } = require('./archive');
+
+// How transaction rows and invoices map onto each office's ledgers
+// (ledgerField is the transaction field naming the ledger, null for single-ledger
+// offices; balanceFields maps each ledger to its balance on the account document)
+const OFFICE_LEDGERS = {
+  fursatkum: {
+    ledgers: ['cash', 'bank'],
+    ledgerField: 'ledger',
+    balanceFields: { cash: 'cashBalance', bank: 'bankBalance' },
+    transactionLedger: '$ledger',
+    invoiceLedger: '$ledger',
+  },
+  'home-service': {
+    ledgers: ['funding', 'income'],
+    ledgerField: 'category',
+    balanceFields: { funding: 'fundingCredit', income: 'incomeProfit' },
+    transactionLedger: '$category',
+    invoiceLedger: { $cond: [{ $eq: ['$type', 'income'] }, 'income', 'funding'] },
+  },
+  farwaniya1: {
+    ledgers: ['main'],
+    ledgerField: null,
+    balanceFields: { main: 'balance' },
+    transactionLedger: { $literal: 'main' },
+    invoiceLedger: { $literal: 'main' },
+  },
+  farwaniya2: {
+    ledgers: ['main'],
+    ledgerField: null,
+    balanceFields: { main: 'balance' },
+    transactionLedger: { $literal: 'main' },
+    invoiceLedger: { $literal: 'main' },
+  },
+};
+
+// Transaction types grouped into the checkpoint movement figures
+const MOVEMENT_TYPES = {
+  income: ['income', 'add_funds', 'employee_loan_repayment'],
+  spending: ['spending', 'salary_payment', 'employee_loan_given', 'salary_loan_deduction'],
+  reversals: ['income_reversal', 'spending_reversal'],
+  adjustments: ['income_adjustment', 'spending_adjustment'],
+};
+const movementOf = new Map();
+Object.entries(MOVEMENT_TYPES).forEach(([movement, types]) => {
+  types.forEach((type) => movementOf.set(type, movement));
+});
+
+const round = (value) => Math.round(value * 1000) / 1000;
+
+function periodOf(date) {
+  const d = new Date(date);
+  return `${d.getUTCFullYear()}-${String(d.getUTCMonth() + 1).padStart(2, '0')}`;
+}
+
+function periodStart(period) {
+  const [year, month] = period.split('-').map(Number);
+  return new Date(Date.UTC(year, month - 1, 1));
+}
+
+function nextPeriod(period) {
+  const start = periodStart(period);
+  return periodOf(new Date(Date.UTC(start.getUTCFullYear(), start.getUTCMonth() + 1, 1)));
+}
+
+function emptyFigures() {
+  return {
+    income: 0,
+    spending: 0,
+    reversals: 0,
+    adjustments: 0,
+    transactionCount: 0,
+    invoices: {
+      incomeCount: 0,
+      incomeTotal: 0,
+      spendingCount: 0,
+      spendingTotal: 0,
+      deletedCount: 0,
+    },
+  };
+}
+
+const netMovement = (figures) => figures.income - figures.spending + figures.reversals + figures.adjustments;
+
+/**
+ * Mark the checkpoints of the months containing `dates` dirty. Dates in the
+ * current or a future month are ignored since those months are never closed.
+ * Missing checkpoints are created dirty so a back-dated row before the first
+ * closed month is picked up as well. Never throws.
+ */
+async function markDirty(office, dates) {
+  const current = periodStart(periodOf(new Date()));
+  const periods = [...new Set(dates
+    .filter((date) => date && new Date(date) < current)
+    .map((date) => periodOf(date)))];
+  if (!periods.length) return;
+
+  const now = new Date();
+  try {
+    await LedgerCheckpoint.bulkWrite(periods.flatMap((period) => OFFICE_LEDGERS[office].ledgers.map((ledger) => ({
+      updateOne: {
+        filter: { office, ledger, period },
+        update: {
+          $set: { dirty: true, dirtiedAt: now },
+          $setOnInsert: { periodStart: periodStart(period), periodEnd: periodStart(nextPeriod(period)) },
+        },
+        upsert: true,
+      },
+    }))), { ordered: false });
+  } catch (error) {
+    console.error(`خطأ في تحديث نقاط إقفال ${office}:`, error.message);
+  }
+}
+
+const SINGLE_QUERY_WRITES = ['updateOne', 'findOneAndUpdate', 'deleteOne', 'findOneAndDelete'];
+const MULTI_QUERY_WRITES = ['updateMany', 'deleteMany'];
+
+// Dates read by the pre hook of a query write, marked dirty once it has run
+const queryDates = new WeakMap();
+
+// The `date` an update sets, null when it leaves it alone, undefined when it
+// cannot be told (a pipeline update touching the date)
+function updatedDate(update) {
+  if (!update) return null;
+  if (Array.isArray(update)) {
+    return update.some((stage) => JSON.stringify(stage).includes('"date"')) ? undefined : null;
+  }
+  const set = update.$set || {};
+  if ('date' in set) return set.date;
+  if ('date' in update) return update.date;
+  return null;
+}
+
+/**
+ * Schema plugin for invoice and transaction models of an office.
+ *
+ * @param {Schema} schema
+ * @param {Object} options
+ * @param {string} options.office - key of OFFICE_LEDGERS
+ */
+function ledgerCheckpointPlugin(schema, { office }) {
+  schema.post('init', (doc) => {
+    doc.$locals.checkpointDate = doc.date;
+  });
+  schema.post('save', async (doc) => {
+    const dates = [doc.date, doc.$locals.checkpointDate];
+    doc.$locals.checkpointDate = doc.date;
+    await markDirty(office, dates);
+  });
+  schema.post('insertMany', async (docs) => {
+    await markDirty(office, [].concat(docs).map((doc) => doc.date));
+  });
+
+  // Query writes do not return the dates they touched, so the matching rows'
+  // dates are read first (one indexed read for the single-document forms)
+  async function readDates() {
+    const filter = this.getFilter();
+    const newDate = updatedDate(this.getUpdate());
+    let dates;
+    if (newDate === undefined) {
+      dates = null;
+    } else if (SINGLE_QUERY_WRITES.includes(this.op)) {
+      const row = await this.model.findOne(filter).sort(this.getOptions().sort).select('date').lean();
+      dates = row ? [row.date] : [];
+    } else {
+      dates = await this.model.distinct('date', filter);
+    }
+    if (dates && newDate) dates.push(newDate);
+    queryDates.set(this, dates);
+  }
+
+  async function markQueryDates() {
+    if (!queryDates.has(this)) return;
+    const dates = queryDates.get(this);
+    queryDates.delete(this);
+    if (dates) {
+      await markDirty(office, dates);
+      return;
+    }
+    // The new date is computed by the pipeline: re-check every closed month
+    await LedgerCheckpoint.updateMany({ office }, { $set: { dirty: true, dirtiedAt: new Date() } })
+      .catch((error) => console.error(`خطأ في تحديث نقاط إقفال ${office}:`, error.message));
+  }
+
+  const queryWrites = [...SINGLE_QUERY_WRITES, ...MULTI_QUERY_WRITES];
+  schema.pre(queryWrites, { document: false, query: true }, readDates);
+  schema.post(queryWrites, { document: false, query: true }, markQueryDates);
+}
+
+/**
+ * Movement and invoice figures per month and ledger for the given date ranges.
+ *
+ * @param {string} office
+ * @param {Array<{start: Date, end?: Date}>} ranges
+ * @returns {Promise<Map<string, Object>>} `${period}|${ledger}` => figures
+ */
+async function aggregateFigures(office, ranges) {
+  const { OFFICES } = require('./offices');
+  const { Invoice, Transaction } = OFFICES[office];
+  const { transactionLedger, invoiceLedger } = OFFICE_LEDGERS[office];
+  const match = {
+    $or: ranges.map(({ start, end }) => ({ date: end ? { $gte: start, $lt: end } : { $gte: start } })),
+  };
+  const period = { $dateToString: { format: '%Y-%m', date: '$date' } };
+  // Re-closing a month older than the archive boundary reads the archived rows too
+  const withArchive = async (Model) => {
+    const cutoff = await archiveBoundary(Model);
+    const reaches = cutoff && ranges.some(({ start }) => start < cutoff);
+    return reaches ? [{ $match: match }, unionWithArchive(Model, [{ $match: match }])] : [{ $match: match }];
+  };
+  const [transactionSource, invoiceSource] = await Promise.all([withArchive(Transaction), withArchive(Invoice)]);
+
+  const [movements, invoices] = await Promise.all([
+    Transaction.aggregate([
+      ...transactionSource,
+      {
+        $group: {
+          _id: { period, ledger: transactionLedger, type: '$type' },
+          total: { $sum: '$amount' },
+          count: { $sum: 1 },
+        },
+      },
+    ]),
+    Invoice.aggregate([
+      ...invoiceSource,
+      {
+        $group: {
+          _id: { period, ledger: invoiceLedger, type: '$type', status: '$status' },
+          total: { $sum: '$value' },
+          count: { $sum: 1 },
+        },
+      },
+    ]),
+  ]);
+
+  const figures = new Map();
+  const figuresFor = ({ period: month, ledger }) => {
+    const key = `${month}|${ledger}`;
+    if (!figures.has(key)) figures.set(key, emptyFigures());
+    return figures.get(key);
+  };
+  movements.forEach(({ _id, total, count }) => {
+    const entry = figuresFor(_id);
+    const movement = movementOf.get(_id.type) || 'adjustments';
+    entry[movement] += movement === 'spending' ? -total : total;
+    entry.transactionCount += count;
+  });
+  invoices.forEach(({ _id, total, count }) => {
+    const entry = figuresFor(_id);
+    if (_id.status === 'deleted') {
+      entry.invoices.deletedCount += count;
+    } else if (_id.status === 'active' && ['income', 'spending'].includes(_id.type)) {
+      entry.invoices[`${_id.type}Count`] += count;
+      entry.invoices[`${_id.type}Total`] += total;
+    }
+  });
+  return figures;
+}
+
+// Earliest row of a collection, looking in its archive first once one exists
+async function earliestRow(Model) {
+  if (await archiveBoundary(Model)) {
+    const archived = await archiveModelFor(Model).findOne().sort({ date: 1 }).select('date').lean();
+    if (archived) return archived;
+  }
+  return Model.findOne().sort({ date: 1 }).select('date').lean();
+}
+
+// First month holding any transaction or invoice of the office
+async function firstPeriod(office) {
+  const { OFFICES } = require('./offices');
+  const { Invoice, Transaction } = OFFICES[office];
+  const [transaction, invoice] = await Promise.all([earliestRow(Transaction), earliestRow(Invoice)]);
+  const dates = [transaction?.date, invoice?.date].filter(Boolean);
+  if (!dates.length) return null;
+  return periodOf(Math.min(...dates.map((date) => new Date(date).getTime())));
+}
+
+async function closePeriods(office, now) {
+  const { ledgers } = OFFICE_LEDGERS[office];
+  const current = periodOf(now);
+  const checkpoints = await LedgerCheckpoint.find({ office, period: { $lt: current } }).sort({ period: 1 }).lean();
+  const first = checkpoints.length ? checkpoints[0].period : await firstPeriod(office);
+  if (!first || first >= current) return 0;
+
+  const existing = new Map(checkpoints.map((checkpoint) => [`${checkpoint.period}|${checkpoint.ledger}`, checkpoint]));
+  const periods = [];
+  for (let period = first; period < current; period = nextPeriod(period)) periods.push(period);
+  const stale = new Set(periods.filter((period) => ledgers.some((ledger) => {
+    const checkpoint = existing.get(`${period}|${ledger}`);
+    return !checkpoint || checkpoint.dirty;
+  })));
+  if (!stale.size) return 0;
+
+  const closedAt = new Date();
+  const figures = await aggregateFigures(office, [...stale].map((period) => ({
+    start: periodStart(period),
+    end: periodStart(nextPeriod(period)),
+  })));
+
+  const ops = [];
+  ledgers.forEach((ledger) => {
+    let opening = 0;
+    let shifted = false;
+    periods.forEach((period) => {
+      const key = `${period}|${ledger}`;
+      const checkpoint = existing.get(key);
+      if (!stale.has(period) && !shifted) {
+        opening = checkpoint.closingBalance;
+        return;
+      }
+      // Months after a re-closed one keep their figures and only move their balances
+      const entry = stale.has(period) ? (figures.get(key) || emptyFigures()) : checkpoint;
+      const closing = round(opening + netMovement(entry));
+      if (stale.has(period) || checkpoint.openingBalance !== opening) {
+        ops.push({
+          updateOne: {
+            filter: { office, ledger, period },
+            update: [{
+              $set: {
+                periodStart: periodStart(period),
+                periodEnd: periodStart(nextPeriod(period)),
+                openingBalance: opening,
+                income: round(entry.income),
+                spending: round(entry.spending),
+                reversals: round(entry.reversals),
+                adjustments: round(entry.adjustments),
+                closingBalance: closing,
+                transactionCount: entry.transactionCount,
+                invoices: {
+                  incomeCount: entry.invoices.incomeCount,
+                  incomeTotal: round(entry.invoices.incomeTotal),
+                  spendingCount: entry.invoices.spendingCount,
+                  spendingTotal: round(entry.invoices.spendingTotal),
+                  deletedCount: entry.invoices.deletedCount,
+                },
+                // A row written while this close was running keeps the month dirty
+                dirty: { $gt: [{ $ifNull: ['$dirtiedAt', new Date(0)] }, closedAt] },
+                closedAt,
+              },
+            }],
+            upsert: true,
+          },
+        });
+      }
+      shifted = true;
+      opening = closing;
+    });
+  });
+
+  if (ops.length) await LedgerCheckpoint.bulkWrite(ops, { ordered: false });
+  return stale.size;
+}
+
+const closing = new Map();
+
+/**
+ * Close every complete month of an office that is missing or dirty. Concurrent
+ * callers for the same office share one run.
+ *
+ * @returns {Promise<number>} number of months re-closed
+ */
+function ensureClosed(office, now = new Date()) {
+  if (!OFFICE_LEDGERS[office]) return Promise.reject(new Error(`Unknown office: ${office}`));
+  if (!closing.has(office)) {
+    closing.set(office, closePeriods(office, now).finally(() => closing.delete(office)));
+  }
+  return closing.get(office);
+}
+
+// Drop an office's checkpoints and close every complete month again
+async function rebuildCheckpoints(office, now = new Date()) {
+  await LedgerCheckpoint.deleteMany({ office });
+  return ensureClosed(office, now);
+}
+
+/**
+ * Totals per ledger since the first month: closed checkpoints plus the open period.
+ *
+ * @param {string} office - key of OFFICE_LEDGERS
+ * @returns {Promise<{closedThrough: string|null, openPeriod: string, ledgers: Object}>}
+ */
+async function getLedgerTotals(office, now = new Date()) {
+  await ensureClosed(office, now);
+  const current = periodOf(now);
+  const [checkpoints, open] = await Promise.all([
+    LedgerCheckpoint.find({ office, period: { $lt: current } }).sort({ period: 1 }).lean(),
+    aggregateFigures(office, [{ start: periodStart(current) }]),
+  ]);
+
+  const ledgers = {};
+  OFFICE_LEDGERS[office].ledgers.forEach((ledger) => {
+    ledgers[ledger] = { ...emptyFigures(), closingBalance: 0, openNet: 0 };
+  });
+  const add = (totals, entry) => {
+    ['income', 'spending', 'reversals', 'adjustments', 'transactionCount'].forEach((field) => {
+      totals[field] += entry[field] || 0;
+    });
+    Object.keys(totals.invoices).forEach((field) => {
+      totals.invoices[field] += entry.invoices?.[field] || 0;
+    });
+  };
+  checkpoints.forEach((checkpoint) => {
+    const totals = ledgers[checkpoint.ledger];
+    if (!totals) return;
+    add(totals, checkpoint);
+    totals.closingBalance = checkpoint.closingBalance;
+  });
+  open.forEach((entry, key) => {
+    const totals = ledgers[key.split('|')[1]];
+    if (!totals) return;
+    add(totals, entry);
+    totals.openNet += netMovement(entry);
+  });
+
+  Object.entries(ledgers).forEach(([ledger, { openNet, ...totals }]) => {
+    ['income', 'spending', 'reversals', 'adjustments'].forEach((field) => {
+      totals[field] = round(totals[field]);
+    });
+    Object.keys(totals.invoices).forEach((field) => {
+      totals.invoices[field] = round(totals.invoices[field]);
+    });
+    // Balance carried by the transaction rows: last closing plus the open period
+    totals.balance = round(totals.closingBalance + openNet);
+    ledgers[ledger] = totals;
+  });
+
+  return {
+    closedThrough: checkpoints.length ? checkpoints[checkpoints.length - 1].period : null,
+    openPeriod: current,
+    ledgers,
+  };
+}
+
+module.exports = {
+  OFFICE_LEDGERS,
+  ledgerCheckpointPlugin,
+  markDirty,
+  ensureClosed,
+  rebuildCheckpoints,
+  getLedgerTotals,
+  periodOf,
+  periodStart,
+  nextPeriod,
+};
@@ -0,0 +1,176 @@
+// Ledger replay and drift check.
+// Each office's transaction log is streamed through one lean cursor in posting
+// order (_id), the running balance of every ledger is recomputed from the row
+// amounts, and two kinds of drift are reported:
+//   - rows whose balanceAfter is not the previous row's balanceAfter plus the
+//     row amount (where the log itself breaks, e.g. a reversal clamped at zero);
+//   - the difference between the replayed balance, the last balanceAfter and
+//     the balance stored on the account document.
+// Archived rows are replayed too, merged into the live stream by _id.
+// Offices are verified concurrently.
+//
+// _id order is not always the order the balance updates were applied in: two
+// postings racing each other can insert their rows the other way round. A row
+// that does not chain is held back in a small per-ledger window until a later
+// row makes it chain; only a row that falls out of the window (or is still held
+// at the end) is reported, and the replay resumes from its balanceAfter.
+
+const { OFFICE_LEDGERS } = require('./ledgerCheckpoints');
+const { archiveAwareCursor } = require('./archive');
+
+const BATCH_SIZE = 5000;
+const TOLERANCE = 0.0005; // amounts are KWD with three decimals
+const DEFAULT_MAX_ROWS = 1000;
+const REORDER_WINDOW = 16; // rows a posting may land out of _id order by
+
+const round = (value) => Math.round(value * 1000) / 1000;
+
+/**
+ * Replay one office's transaction log.
+ *
+ * @param {string} office - key of OFFICE_LEDGERS
+ * @param {Object} [options]
+ * @param {number} [options.maxRows] - mismatching rows listed per ledger (all are counted)
+ * @returns {Promise<Object>} report for the office
+ */
+async function verifyOffice(office, { maxRows = DEFAULT_MAX_ROWS } = {}) {
+  const { OFFICES } = require('./offices');
+  const { Account, Transaction } = OFFICES[office];
+  const { ledgers, ledgerField, balanceFields } = OFFICE_LEDGERS[office];
+  const startedAt = Date.now();
+
+  const state = {};
+  ledgers.forEach((ledger) => {
+    state[ledger] = {
+      rows: 0,
+      replayed: 0,
+      lastBalanceAfter: null,
+      mismatchCount: 0,
+      mismatches: [],
+      held: [],
+    };
+  });
+
+  const previousOf = (entry) => (entry.lastBalanceAfter === null ? 0 : entry.lastBalanceAfter);
+  const chains = (entry, row) => Math.abs(row.balanceAfter - (previousOf(entry) + (row.amount || 0))) <= TOLERANCE;
+
+  function mismatch(entry, row) {
+    const amount = row.amount || 0;
+    const expected = previousOf(entry) + amount;
+    entry.mismatchCount += 1;
+    if (entry.mismatches.length < maxRows) {
+      entry.mismatches.push({
+        _id: row._id,
+        date: row.date,
+        type: row.type,
+        invoiceRef: row.invoiceRef,
+        amount,
+        expected: round(expected),
+        balanceAfter: row.balanceAfter,
+        difference: typeof row.balanceAfter === 'number' ? round(row.balanceAfter - expected) : null,
+      });
+    }
+  }
+
+  // Chain held rows for as long as one of them continues the balance
+  function release(entry) {
+    for (;;) {
+      const index = entry.held.findIndex((row) => chains(entry, row));
+      if (index === -1) return;
+      const [row] = entry.held.splice(index, 1);
+      entry.lastBalanceAfter = row.balanceAfter;
+    }
+  }
+
+  // Report the oldest held row and resume the replay from it
+  function evict(entry) {
+    const row = entry.held.shift();
+    mismatch(entry, row);
+    entry.lastBalanceAfter = row.balanceAfter;
+    release(entry);
+  }
+
+  const projection = { date: 1, type: 1, amount: 1, balanceAfter: 1, invoiceRef: 1 };
+  if (ledgerField) projection[ledgerField] = 1;
+  const cursor = await archiveAwareCursor(Transaction, undefined, { _id: 1 }, (Model) => Model.find({}, projection)
+    .sort({ _id: 1 })
+    .lean()
+    .cursor({ batchSize: BATCH_SIZE }));
+
+  let unknownLedgerRows = 0;
+  for await (const row of cursor) {
+    const entry = state[ledgerField ? row[ledgerField] : ledgers[0]];
+    if (!entry) {
+      unknownLedgerRows += 1;
+      continue;
+    }
+    entry.rows += 1;
+    entry.replayed += row.amount || 0;
+
+    if (typeof row.balanceAfter !== 'number') {
+      mismatch(entry, row);
+    } else if (chains(entry, row)) {
+      entry.lastBalanceAfter = row.balanceAfter;
+      release(entry);
+    } else {
+      entry.held.push(row);
+      if (entry.held.length > REORDER_WINDOW) evict(entry);
+    }
+  }
+  Object.values(state).forEach((entry) => {
+    while (entry.held.length) evict(entry);
+  });
+
+  const account = await Account.findOne().lean();
+  const report = {};
+  ledgers.forEach((ledger) => {
+    const entry = state[ledger];
+    const stored = account ? account[balanceFields[ledger]] || 0 : 0;
+    const replayed = round(entry.replayed);
+    report[ledger] = {
+      rows: entry.rows,
+      replayedBalance: replayed,
+      lastBalanceAfter: entry.lastBalanceAfter,
+      storedBalance: stored,
+      difference: round(stored - replayed),
+      mismatchCount: entry.mismatchCount,
+      mismatches: entry.mismatches,
+    };
+  });
+
+  const drifted = Object.values(report)
+    .some((entry) => entry.mismatchCount > 0 || Math.abs(entry.difference) > TOLERANCE);
+  return {
+    office,
+    ok: !drifted,
+    durationMs: Date.now() - startedAt,
+    unknownLedgerRows,
+    ledgers: report,
+  };
+}
+
+/**
+ * Verify several offices concurrently.
+ *
+ * @param {string[]} [offices] - defaults to every office
+ * @param {Object} [options] - passed to verifyOffice
+ * @returns {Promise<{ok: boolean, durationMs: number, offices: Object[]}>}
+ */
+async function verifyLedgers(offices = Object.keys(OFFICE_LEDGERS), options = {}) {
+  const unknown = offices.filter((office) => !OFFICE_LEDGERS[office]);
+  if (unknown.length) {
+    throw new Error(`Unknown office: ${unknown.join(', ')}`);
+  }
+  const startedAt = Date.now();
+  const reports = await Promise.all(offices.map((office) => verifyOffice(office, options)));
+  return {
+    ok: reports.every((report) => report.ok),
+    durationMs: Date.now() - startedAt,
+    offices: reports,
+  };
+}
+
+module.exports = {
+  verifyOffice,
+  verifyLedgers,
+};
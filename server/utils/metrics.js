@@ -0,0 +1,194 @@
+// Request and database pool metrics in Prometheus text format (/api/metrics).
+// The middleware only touches a few counters per request: timing starts when the
+// request arrives and is recorded on 'finish' (or 'close' for aborted requests)
+// under the matched route pattern (e.g. /api/visas/:id), so the number of series
+// stays bounded. Requests no route matched are recorded under their router
+// prefix (`/api/visas/*`) or `unmatched`. Response sizes are the bytes written
+// to the socket, i.e. after compression and including headers.
+// Metrics are per process: in cluster mode each worker keeps its own.
+
+const mongoose = require('mongoose');
+const { monitorEventLoopDelay } = require('perf_hooks');
+
+const DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30];
+const SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216];
+
+const escape = (value) => String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+const labelString = (labels) => Object.entries(labels).map(([name, value]) => `${name}="${escape(value)}"`).join(',');
+
+class Histogram {
+  constructor(buckets) {
+    this.buckets = buckets;
+    this.series = new Map(); // label string => { counts, sum, count }
+  }
+
+  observe(labels, value) {
+    let entry = this.series.get(labels);
+    if (!entry) {
+      entry = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+      this.series.set(labels, entry);
+    }
+    // Per-bucket counts here; cumulative only when rendered
+    const index = this.buckets.findIndex((bound) => value <= bound);
+    if (index !== -1) entry.counts[index] += 1;
+    entry.sum += value;
+    entry.count += 1;
+  }
+
+  render(name, lines) {
+    this.series.forEach((entry, labels) => {
+      const prefix = labels ? `${labels},` : '';
+      let cumulative = 0;
+      this.buckets.forEach((bound, index) => {
+        cumulative += entry.counts[index];
+        lines.push(`${name}_bucket{${prefix}le="${bound}"} ${cumulative}`);
+      });
+      lines.push(`${name}_bucket{${prefix}le="+Inf"} ${entry.count}`);
+      lines.push(`${name}_sum{${labels}} ${entry.sum}`);
+      lines.push(`${name}_count{${labels}} ${entry.count}`);
+    });
+  }
+}
+
+const durations = new Histogram(DURATION_BUCKETS);
+const sizes = new Histogram(SIZE_BUCKETS);
+const responses = new Map(); // labels => count
+const inFlight = new Map(); // method => count
+let aborted = 0;
+
+const pool = {
+  open: 0,
+  checkedOut: 0,
+  waiting: 0,
+  checkouts: 0,
+  checkoutFailures: 0,
+  maxPoolSize: 0,
+};
+
+const eventLoop = monitorEventLoopDelay({ resolution: 20 });
+eventLoop.enable();
+
+function routeOf(req, res) {
+  if (req.route) {
+    const path = req.route.path === '/' && req.baseUrl ? '' : String(req.route.path);
+    return `${req.baseUrl}${path}`;
+  }
+  if (req.originalUrl.startsWith('/uploads/')) return '/uploads/*';
+  if (req.baseUrl) return `${req.baseUrl}/*`;
+  return res.statusCode === 404 ? 'unmatched' : 'middleware';
+}
+
+/**
+ * Express middleware recording latency, status class and size per route.
+ * Mount it first, so the timing covers every other middleware.
+ */
+function requestMetrics(req, res, next) {
+  const startedAt = process.hrtime.bigint();
+  const { method } = req;
+  const socket = req.socket;
+  const bytesBefore = socket ? socket.bytesWritten : 0;
+  inFlight.set(method, (inFlight.get(method) || 0) + 1);
+
+  let done = false;
+  const record = () => {
+    if (done) return;
+    done = true;
+    inFlight.set(method, inFlight.get(method) - 1);
+    if (!res.writableFinished) aborted += 1;
+
+    const seconds = Number(process.hrtime.bigint() - startedAt) / 1e9;
+    const route = routeOf(req, res);
+    const labels = labelString({ method, route });
+    durations.observe(labels, seconds);
+    if (socket) sizes.observe(labels, socket.bytesWritten - bytesBefore);
+
+    const statusLabels = labelString({ method, route, status: `${Math.floor(res.statusCode / 100)}xx` });
+    responses.set(statusLabels, (responses.get(statusLabels) || 0) + 1);
+  };
+  res.once('finish', record);
+  res.once('close', record);
+  next();
+}
+
+const watchedClients = new WeakSet();
+
+// Follow the connection pool of the current mongoose client (call on 'connected')
+function watchMongoPool(client = mongoose.connection.getClient()) {
+  if (!client || watchedClients.has(client)) return;
+  watchedClients.add(client);
+  pool.maxPoolSize = client.options?.maxPoolSize || 0;
+  client.on('connectionCreated', () => { pool.open += 1; });
+  client.on('connectionClosed', () => { pool.open = Math.max(0, pool.open - 1); });
+  client.on('connectionCheckOutStarted', () => { pool.waiting += 1; });
+  client.on('connectionCheckedOut', () => {
+    pool.waiting = Math.max(0, pool.waiting - 1);
+    pool.checkedOut += 1;
+    pool.checkouts += 1;
+  });
+  client.on('connectionCheckOutFailed', () => {
+    pool.waiting = Math.max(0, pool.waiting - 1);
+    pool.checkoutFailures += 1;
+  });
+  client.on('connectionCheckedIn', () => { pool.checkedOut = Math.max(0, pool.checkedOut - 1); });
+  client.on('connectionPoolCleared', () => { pool.checkedOut = 0; });
+}
+
+function metric(lines, name, type, help) {
+  lines.push(`# HELP ${name} ${help}`);
+  lines.push(`# TYPE ${name} ${type}`);
+}
+
+// All metrics in Prometheus text exposition format
+function renderMetrics() {
+  const lines = [];
+
+  metric(lines, 'http_request_duration_seconds', 'histogram', 'Request latency by route.');
+  durations.render('http_request_duration_seconds', lines);
+
+  metric(lines, 'http_response_size_bytes', 'histogram', 'Bytes written to the socket per response.');
+  sizes.render('http_response_size_bytes', lines);
+
+  metric(lines, 'http_responses_total', 'counter', 'Responses by route and status class.');
+  responses.forEach((count, labels) => lines.push(`http_responses_total{${labels}} ${count}`));
+
+  metric(lines, 'http_requests_aborted_total', 'counter', 'Requests closed before the response was sent.');
+  lines.push(`http_requests_aborted_total ${aborted}`);
+
+  metric(lines, 'http_requests_in_flight', 'gauge', 'Requests being served.');
+  inFlight.forEach((count, method) => lines.push(`http_requests_in_flight{method="${method}"} ${count}`));
+
+  metric(lines, 'mongodb_pool_connections', 'gauge', 'Open connections in the MongoDB pool.');
+  lines.push(`mongodb_pool_connections ${pool.open}`);
+  metric(lines, 'mongodb_pool_checked_out', 'gauge', 'Connections in use.');
+  lines.push(`mongodb_pool_checked_out ${pool.checkedOut}`);
+  metric(lines, 'mongodb_pool_waiting', 'gauge', 'Operations waiting for a connection.');
+  lines.push(`mongodb_pool_waiting ${pool.waiting}`);
+  metric(lines, 'mongodb_pool_max_size', 'gauge', 'Configured maxPoolSize.');
+  lines.push(`mongodb_pool_max_size ${pool.maxPoolSize}`);
+  metric(lines, 'mongodb_pool_checkouts_total', 'counter', 'Connections checked out.');
+  lines.push(`mongodb_pool_checkouts_total ${pool.checkouts}`);
+  metric(lines, 'mongodb_pool_checkout_failures_total', 'counter', 'Failed connection checkouts.');
+  lines.push(`mongodb_pool_checkout_failures_total ${pool.checkoutFailures}`);
+
+  const memory = process.memoryUsage();
+  metric(lines, 'process_heap_used_bytes', 'gauge', 'V8 heap in use.');
+  lines.push(`process_heap_used_bytes ${memory.heapUsed}`);
+  metric(lines, 'process_resident_memory_bytes', 'gauge', 'Resident set size.');
+  lines.push(`process_resident_memory_bytes ${memory.rss}`);
+  metric(lines, 'process_uptime_seconds', 'gauge', 'Process uptime.');
+  lines.push(`process_uptime_seconds ${process.uptime()}`);
+  metric(lines, 'nodejs_eventloop_delay_seconds', 'gauge', 'Event loop delay since the previous scrape.');
+  [50, 90, 99].forEach((percentile) => {
+    lines.push(`nodejs_eventloop_delay_seconds{quantile="${percentile / 100}"} ${eventLoop.percentile(percentile) / 1e9}`);
+  });
+  lines.push(`nodejs_eventloop_delay_seconds{quantile="1"} ${eventLoop.max / 1e9}`);
+  eventLoop.reset();
+
+  return `${lines.join('\n')}\n`;
+}
+
+module.exports = {
+  requestMetrics,
+  watchMongoPool,
+  renderMetrics,
+};
@@ -0,0 +1,166 @@
+// Registry of the office ledgers and helpers for their invoice summary counters.
+// The counters live on each office's singleton account (account.summary) and
+// are moved by the same ledger write that posts an invoice, so dashboards read
+// them instead of counting and aggregating the invoice collection.
+
+const FursatkumAccount = require('../models/FursatkumAccount');
+const FursatkumInvoice = require('../models/FursatkumInvoice');
+const FursatkumTransaction = require('../models/FursatkumTransaction');
+const HSAccount = require('../models/HSAccount');
+const HSInvoice = require('../models/HSInvoice');
+const HSTransaction = require('../models/HSTransaction');
+const FW1Account = require('../models/FW1Account');
+const FW1Invoice = require('../models/FW1Invoice');
+const FW1Transaction = require('../models/FW1Transaction');
+const FW2Account = require('../models/FW2Account');
+const FW2Invoice = require('../models/FW2Invoice');
+const FW2Transaction = require('../models/FW2Transaction');
+const { archiveBoundary, unionWithArchive } = require('./archive');
+
+const OFFICES = {
+  fursatkum: { Account: FursatkumAccount, Invoice: FursatkumInvoice, Transaction: FursatkumTransaction },
+  'home-service': { Account: HSAccount, Invoice: HSInvoice, Transaction: HSTransaction },
+  farwaniya1: { Account: FW1Account, Invoice: FW1Invoice, Transaction: FW1Transaction },
+  farwaniya2: { Account: FW2Account, Invoice: FW2Invoice, Transaction: FW2Transaction },
+};
+
+// Account fields shown on each office's dashboard
+const DASHBOARD_FIELDS = {
+  fursatkum: ['bankBalance', 'cashBalance', 'bankInfo'],
+  'home-service': ['fundingCredit', 'incomeProfit'],
+  farwaniya1: ['balance', 'incomeTotal', 'spendingTotal'],
+  farwaniya2: ['balance', 'incomeTotal', 'spendingTotal'],
+};
+
+// Counter deltas to pass as postEntry's `inc` for each invoice event
+const summaryChange = {
+  created: (type, value) => ({
+    [`summary.${type}Count`]: 1,
+    [`summary.${type}Total`]: value,
+    'summary.version': 1,
+  }),
+  revalued: (type, difference) => ({
+    [`summary.${type}Total`]: difference,
+    'summary.version': 1,
+  }),
+  deleted: (type, value) => ({
+    [`summary.${type}Count`]: -1,
+    [`summary.${type}Total`]: -value,
+    'summary.deletedCount': 1,
+    'summary.version': 1,
+  }),
+};
+
+const REBUILD_ATTEMPTS = 3;
+
+/**
+ * Recompute an office's summary counters from its invoices.
+ *
+ * The result is only written if no counter change landed while the invoices
+ * were being aggregated (summary.version is unchanged); otherwise the rebuild
+ * is retried, and after REBUILD_ATTEMPTS the incrementally kept counters are
+ * left as they are.
+ *
+ * @param {string} office - key of OFFICES
+ * @returns {Promise<Object>} the rebuilt summary
+ */
+async function rebuildSummary(office) {
+  const { Account, Invoice } = OFFICES[office];
+  const { _id: accountId } = await Account.getAccount();
+
+  let summary;
+  for (let attempt = 0; attempt < REBUILD_ATTEMPTS; attempt += 1) {
+    const current = await Account.findById(accountId).select('summary.version').lean();
+    const version = current?.summary?.version;
+    // Archived invoices still count towards the summary
+    const source = (await archiveBoundary(Invoice)) ? [unionWithArchive(Invoice)] : [];
+    const groups = await Invoice.aggregate([
+      ...source,
+      { $group: { _id: { type: '$type', status: '$status' }, count: { $sum: 1 }, total: { $sum: '$value' } } },
+    ]);
+
+    summary = {
+      incomeCount: 0,
+      spendingCount: 0,
+      deletedCount: 0,
+      incomeTotal: 0,
+      spendingTotal: 0,
+      rebuiltAt: new Date(),
+    };
+    groups.forEach(({ _id, count, total }) => {
+      if (_id.status === 'deleted') {
+        summary.deletedCount += count;
+      } else if (_id.status === 'active' && ['income', 'spending'].includes(_id.type)) {
+        summary[`${_id.type}Count`] += count;
+        summary[`${_id.type}Total`] += total;
+      }
+    });
+
+    const set = {};
+    Object.entries(summary).forEach(([field, value]) => { set[`summary.${field}`] = value; });
+    const { matchedCount } = await Account.updateOne(
+      { _id: accountId, 'summary.version': version === undefined ? null : version },
+      { $set: set }
+    );
+    if (matchedCount) return summary;
+  }
+  console.warn(`⚠️  ${office}: summary rebuild kept racing invoice postings; counters left unchanged`);
+  return summary;
+}
+
+/**
+ * Read an office's account together with its summary counters, rebuilding the
+ * counters first if they have never been built (accounts created before the
+ * counters existed).
+ *
+ * @param {string} office - key of OFFICES
+ * @returns {Promise<{account: Document, summary: Object}>}
+ */
+async function getAccountSummary(office) {
+  const { Account } = OFFICES[office];
+  const account = await Account.getAccount();
+  const summary = account.summary?.rebuiltAt
+    ? account.summary.toObject()
+    : await rebuildSummary(office);
+  return { account, summary };
+}
+
+/**
+ * Dashboard payload of an office: balances, invoice counts and the last ten
+ * transactions.
+ *
+ * @param {string} office - key of OFFICES
+ */
+async function getDashboard(office) {
+  const { Transaction } = OFFICES[office];
+  const [{ account, summary }, recentTransactions] = await Promise.all([
+    getAccountSummary(office),
+    Transaction.find()
+      .sort({ date: -1 })
+      .limit(10)
+      .populate('performedBy', 'username'),
+  ]);
+
+  const dashboard = {};
+  DASHBOARD_FIELDS[office].forEach((field) => {
+    dashboard[field] = account[field];
+  });
+  return {
+    ...dashboard,
+    invoiceCounts: {
+      income: summary.incomeCount,
+      spending: summary.spendingCount,
+      deleted: summary.deletedCount,
+      total: summary.incomeCount + summary.spendingCount,
+    },
+    recentTransactions,
+  };
+}
+
+module.exports = {
+  OFFICES,
+  summaryChange,
+  rebuildSummary,
+  getAccountSummary,
+  getDashboard,
+};
@@ -0,0 +1,230 @@
+// Overdue-visa engine and its in-process scheduler.
+// A visa whose maid arrived and whose 30-day cancellation deadline has passed
+// is cancelled and its expenses become debt on the secretary. The engine does
+// this in batches: one updateMany per batch of visas, one bulkWrite grouping
+// the secretary changes ($inc debt, $pull from active/completed, $push to
+// cancelled), and one rollup update for the visa statistics. Deadline statuses
+// are refreshed with filtered updates that only touch documents whose status
+// actually changes. Every run is recorded in SchedulerRun.
+
+const mongoose = require('mongoose');
+const Visa = require('../models/Visa');
+const VisaStat = require('../models/VisaStat');
+const Secretary = require('../models/Secretary');
+const SchedulerRun = require('../models/SchedulerRun');
+
+const JOB_NAME = 'overdue-visas';
+const BATCH_SIZE = 500;
+const DEADLINE_DAYS = 30;
+const OPEN_STATUSES = ['قيد_الشراء', 'معروضة_للبيع', 'في_انتظار_الوصول'];
+const CANCELLED_REASON = 'انتهاء الموعد النهائي بعد وصول الخادمة (30 يوماً)';
+const INTERVAL_MS = parseInt(process.env.OVERDUE_CHECK_INTERVAL_MS, 10);
+
+// Cancel one batch of overdue visas and move their expenses to the secretaries
+async function cancelBatch(visas, now, counts) {
+  const ids = visas.map((visa) => visa._id);
+  const result = await Visa.updateMany(
+    {
+      _id: { $in: ids },
+      deadlineStatus: 'active',
+      status: { $in: OPEN_STATUSES },
+    },
+    {
+      $set: {
+        status: 'ملغاة',
+        cancelledAt: now,
+        cancelledReason: CANCELLED_REASON,
+        currentStage: 'ملغاة',
+        deadlineStatus: 'expired',
+        updatedAt: now,
+      },
+    }
+  );
+  counts.cancelled += result.modifiedCount;
+  if (result.modifiedCount === 0) return;
+
+  // Visas changed by someone else between the read and the update are left out
+  const cancelled = result.modifiedCount === visas.length
+    ? visas
+    : await Visa.find({ _id: { $in: ids }, status: 'ملغاة', cancelledAt: now })
+      .select('secretary status totalExpenses profit secretaryEarnings createdAt soldAt')
+      .lean();
+  const cancelledIds = new Set(cancelled.map((visa) => String(visa._id)));
+  const before = visas.filter((visa) => cancelledIds.has(String(visa._id)));
+
+  const bySecretary = new Map();
+  cancelled.forEach((visa) => {
+    if (!visa.secretary) return;
+    const key = String(visa.secretary);
+    const entry = bySecretary.get(key) || { debt: 0, ids: [] };
+    entry.debt += visa.totalExpenses || 0;
+    entry.ids.push(visa._id);
+    bySecretary.set(key, entry);
+  });
+
+  if (bySecretary.size) {
+    const secretaryResult = await Secretary.bulkWrite([...bySecretary].map(([secretary, { debt, ids: visaIds }]) => ({
+      updateOne: {
+        filter: { _id: secretary },
+        update: {
+          $inc: { totalDebt: debt },
+          $pull: { activeVisas: { $in: visaIds }, completedVisas: { $in: visaIds } },
+          $push: { cancelledVisas: { $each: visaIds } },
+          $set: { updatedAt: now },
+        },
+      },
+    })), { ordered: false });
+    counts.secretariesUpdated += secretaryResult.modifiedCount;
+    counts.debtAdded += [...bySecretary.values()].reduce((sum, { debt }) => sum + debt, 0);
+  }
+
+  // updateMany skips the Visa save hooks, so apply the rollup change here
+  await VisaStat.applyVisaChange(
+    before.flatMap((visa) => VisaStat.contributionsFor(visa)),
+    cancelled.flatMap((visa) => VisaStat.contributionsFor({ ...visa, status: 'ملغاة' }))
+  );
+}
+
+// Bring deadlineStatus in line with maidArrivalDate for still-open visas
+async function refreshDeadlines(now, counts) {
+  const expiredBefore = new Date(now);
+  expiredBefore.setDate(expiredBefore.getDate() - DEADLINE_DAYS);
+  const active = { maidArrivalVerified: true, deadlineStatus: 'active', status: { $in: OPEN_STATUSES } };
+
+  const [expired, inactive] = await Promise.all([
+    Visa.updateMany(
+      { ...active, maidArrivalDate: { $lt: expiredBefore } },
+      [{
+        $set: {
+          deadlineStatus: 'expired',
+          activeCancellationDeadline: { $dateAdd: { startDate: '$maidArrivalDate', unit: 'day', amount: DEADLINE_DAYS } },
+          updatedAt: now,
+        },
+      }]
+    ),
+    Visa.updateMany(
+      { ...active, maidArrivalDate: null },
+      { $set: { deadlineStatus: 'inactive', activeCancellationDeadline: null, updatedAt: now } }
+    ),
+  ]);
+  counts.deadlinesExpired = expired.modifiedCount;
+  counts.deadlinesDeactivated = inactive.modifiedCount;
+}
+
+/**
+ * Cancel overdue visas and refresh deadline statuses, then record the run.
+ *
+ * @param {Object} [options]
+ * @param {string} [options.trigger] - 'schedule' or 'manual'
+ * @param {Date} [options.now] - reference time
+ * @returns {Promise<Object>} the SchedulerRun report
+ */
+async function runOverdueCheck({ trigger = 'schedule', now = new Date() } = {}) {
+  const startedAt = new Date();
+  const counts = {
+    matched: 0,
+    cancelled: 0,
+    secretariesUpdated: 0,
+    debtAdded: 0,
+    deadlinesExpired: 0,
+    deadlinesDeactivated: 0,
+  };
+
+  let status = 'success';
+  let failure;
+  try {
+    const cursor = Visa.find({
+      maidArrivalVerified: true,
+      deadlineStatus: 'active',
+      activeCancellationDeadline: { $lt: now },
+      status: { $in: OPEN_STATUSES },
+    })
+      .select('secretary status totalExpenses profit secretaryEarnings createdAt soldAt')
+      .lean()
+      .cursor({ batchSize: BATCH_SIZE });
+
+    let batch = [];
+    for await (const visa of cursor) {
+      batch.push(visa);
+      counts.matched += 1;
+      if (batch.length === BATCH_SIZE) {
+        await cancelBatch(batch, now, counts);
+        batch = [];
+      }
+    }
+    if (batch.length) await cancelBatch(batch, now, counts);
+
+    await refreshDeadlines(now, counts);
+  } catch (error) {
+    status = 'failed';
+    failure = error;
+  }
+
+  const finishedAt = new Date();
+  const report = await SchedulerRun.create({
+    job: JOB_NAME,
+    trigger,
+    status,
+    startedAt,
+    finishedAt,
+    durationMs: finishedAt - startedAt,
+    counts,
+    error: failure ? failure.message : undefined,
+  });
+
+  if (failure) throw failure;
+  if (counts.cancelled > 0) {
+    console.log(`🔄 تم إلغاء ${counts.cancelled} تأشيرة بعد انتهاء 30 يوماً من وصول الخادمة (${report.durationMs}ms)`);
+  }
+  return report;
+}
+
+// Recent run reports, newest first
+function recentRuns(limit = 20) {
+  return SchedulerRun.find({ job: JOB_NAME }).sort({ startedAt: -1 }).limit(limit).lean();
+}
+
+let timer = null;
+let running = null;
+
+// Run unless a run is already in progress (returns the in-flight run otherwise)
+function runExclusive(options) {
+  if (!running) {
+    running = runOverdueCheck(options).finally(() => {
+      running = null;
+    });
+  }
+  return running;
+}
+
+/**
+ * Start the periodic check. OVERDUE_CHECK_INTERVAL_MS sets the period
+ * (default 15 minutes, 0 disables). Ticks are skipped while the database is
+ * not connected or a previous run is still going. The first run starts right away.
+ */
+function startOverdueScheduler({ intervalMs = Number.isNaN(INTERVAL_MS) ? 15 * 60 * 1000 : INTERVAL_MS } = {}) {
+  if (timer || intervalMs <= 0) return;
+  const tick = () => {
+    if (mongoose.connection.readyState !== 1 || running) return;
+    runExclusive({ trigger: 'schedule' }).catch((error) => {
+      console.error('خطأ في التحقق من التأشيرات المتأخرة:', error.message);
+    });
+  };
+  timer = setInterval(tick, intervalMs);
+  timer.unref();
+  setImmediate(tick);
+  console.log(`⏰ فحص التأشيرات المتأخرة كل ${Math.round(intervalMs / 60000)} دقيقة`);
+}
+
+function stopOverdueScheduler() {
+  clearInterval(timer);
+  timer = null;
+}
+
+module.exports = {
+  runOverdueCheck,
+  runExclusive,
+  recentRuns,
+  startOverdueScheduler,
+  stopOverdueScheduler,
+};
@@ -0,0 +1,114 @@
+// Sections of the consolidated overview (/api/overview).
+// Each section is read through the query cache, tagged with the collections it
+// reads, and raced against a timeout: a slow or failing section is reported as
+// such while the others are returned. A timed-out read keeps running and fills
+// the cache, so the next request usually gets the section.
+
+const Account = require('../models/Account');
+const Secretary = require('../models/Secretary');
+const Visa = require('../models/Visa');
+const VisaStat = require('../models/VisaStat');
+const { OFFICES, getDashboard } = require('./offices');
+const { cachedValue } = require('./queryCache');
+
+const SECTION_TIMEOUT_MS = parseInt(process.env.OVERVIEW_SECTION_TIMEOUT_MS, 10) || 3000;
+
+/**
+ * Visa and secretary totals from the per-secretary monthly rollup
+ * (the /api/accounts/summary payload).
+ */
+async function getVisaSummary() {
+  const [[statsRow], secretaryCount] = await Promise.all([
+    VisaStat.summarize(),
+    Secretary.countDocuments()
+  ]);
+  const statsData = { ...VisaStat.emptySummary(), ...statsRow };
+
+  return {
+    totalVisas: statsData.totalVisas,
+    activeVisas: statsData.activeVisas,
+    availableVisas: statsData.availableVisas,
+    soldVisas: statsData.soldVisas,
+    cancelledVisas: statsData.cancelledVisas,
+    totalExpenses: statsData.totalExpenses,
+    totalProfit: statsData.totalCompanyProfit,
+    totalSecretaryEarnings: statsData.totalEarnings,
+    totalCompanyProfit: statsData.totalCompanyProfit,
+    totalSecretaryDebt: 0,
+    secretaryCount: secretaryCount,
+    overdueVisas: 0
+  };
+}
+
+// Section name => roles allowed to read it, collections read, builder
+const SECTIONS = {
+  accounts: {
+    roles: ['admin'],
+    sources: [Visa, VisaStat, Secretary, Account],
+    build: getVisaSummary,
+  },
+  fursatkum: { roles: ['admin'] },
+  'home-service': { roles: ['admin', 'home_service_user'] },
+  farwaniya1: { roles: ['admin', 'farwaniya1_user'] },
+  farwaniya2: { roles: ['admin', 'farwaniya2_user'] },
+};
+Object.keys(OFFICES).forEach((office) => {
+  const { Account: OfficeAccount, Transaction } = OFFICES[office];
+  SECTIONS[office].sources = [OfficeAccount, Transaction];
+  SECTIONS[office].build = () => getDashboard(office);
+});
+
+function withTimeout(promise, ms) {
+  let timer;
+  const timeout = new Promise((resolve) => {
+    timer = setTimeout(() => resolve({ timedOut: true }), ms);
+  });
+  return Promise.race([promise, timeout]).finally(() => clearTimeout(timer));
+}
+
+/**
+ * Read the sections visible to `role` in parallel.
+ *
+ * @param {string} role - role of the requesting user
+ * @param {Object} [options]
+ * @param {string[]} [options.only] - restrict to these section names
+ * @param {number} [options.timeout] - per-section timeout in milliseconds
+ * @returns {Promise<{sections: Object, status: Object}>}
+ */
+async function getOverview(role, { only, timeout = SECTION_TIMEOUT_MS } = {}) {
+  const names = Object.keys(SECTIONS)
+    .filter((name) => SECTIONS[name].roles.includes(role))
+    .filter((name) => !only || only.includes(name));
+
+  const results = await Promise.allSettled(names.map((name) => {
+    const { sources, build } = SECTIONS[name];
+    const startedAt = Date.now();
+    const read = cachedValue(`overview:${name}`, sources, build)
+      .then((result) => ({ ...result, durationMs: Date.now() - startedAt }));
+    read.catch((error) => console.error(`Overview section ${name} failed:`, error.message));
+    return withTimeout(read, timeout);
+  }));
+
+  const sections = {};
+  const status = {};
+  results.forEach((result, index) => {
+    const name = names[index];
+    if (result.status === 'rejected') {
+      sections[name] = null;
+      status[name] = { ok: false, error: result.reason.message };
+    } else if (result.value.timedOut) {
+      sections[name] = null;
+      status[name] = { ok: false, timedOut: true };
+    } else {
+      sections[name] = result.value.value;
+      status[name] = { ok: true, cached: result.value.hit, durationMs: result.value.durationMs };
+    }
+  });
+  return { sections, status };
+}
+
+module.exports = {
+  SECTIONS,
+  getVisaSummary,
+  getOverview,
+};
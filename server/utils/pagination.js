@@ -0,0 +1,205 @@
+// Keyset (cursor) pagination for the list endpoints.
+// Pages are addressed by the last/first row of the previous page on a
+// (sortField, _id) descending order instead of skip(), so deep pages cost the
+// same as the first one. Cursors are opaque base64url strings; clients only pass
+// back the nextCursor/prevCursor values they received.
+
+const mongoose = require('mongoose');
+const { archiveModelFor, archiveBoundary, reachesArchive, compareBy, mergeSorted } = require('./archive');
+
+const COUNT_TTL_MS = parseInt(process.env.PAGINATION_COUNT_TTL_MS, 10) || 30000;
+const MAX_CACHED_COUNTS = 500;
+
+const countCache = new Map();
+
+class InvalidCursorError extends Error {
+  constructor() {
+    super('مؤشر الصفحة غير صالح');
+    this.name = 'InvalidCursorError';
+  }
+}
+
+function encodeCursor(doc, sortField, direction) {
+  const value = doc[sortField];
+  const payload = {
+    v: value instanceof Date ? value.toISOString() : value,
+    id: String(doc._id),
+    d: direction,
+  };
+  return Buffer.from(JSON.stringify(payload)).toString('base64url');
+}
+
+function decodeCursor(cursor) {
+  try {
+    const payload = JSON.parse(Buffer.from(cursor, 'base64url').toString('utf8'));
+    const value = new Date(payload.v);
+    if (Number.isNaN(value.getTime()) || !mongoose.Types.ObjectId.isValid(payload.id)) {
+      throw new InvalidCursorError();
+    }
+    return {
+      value,
+      id: new mongoose.Types.ObjectId(payload.id),
+      direction: payload.d === 'prev' ? 'prev' : 'next',
+    };
+  } catch (error) {
+    throw new InvalidCursorError();
+  }
+}
+
+// RegExp filters (search) serialise to {} with plain JSON.stringify
+function filterKey(Model, filters) {
+  return `${Model.modelName}:${JSON.stringify(filters, (key, value) => (
+    value instanceof RegExp ? value.toString() : value
+  ))}`;
+}
+
+/**
+ * Total for a listing without an exact count on every page: unfiltered lists
+ * use the collection metadata count, filtered ones a short-lived cached count.
+ */
+async function estimateTotal(Model, filters = {}) {
+  if (!Object.keys(filters).length) {
+    return Model.estimatedDocumentCount();
+  }
+
+  const key = filterKey(Model, filters);
+  const cached = countCache.get(key);
+  if (cached && cached.expiresAt > Date.now()) {
+    return cached.total;
+  }
+
+  const total = await Model.countDocuments(filters);
+  countCache.delete(key);
+  countCache.set(key, { total, expiresAt: Date.now() + COUNT_TTL_MS });
+  if (countCache.size > MAX_CACHED_COUNTS) {
+    countCache.delete(countCache.keys().next().value);
+  }
+  return total;
+}
+
+/**
+ * Fetch one page of `Model.find(filters)` ordered by (sortField desc, _id desc).
+ *
+ * @param {Model} Model
+ * @param {Object} filters - the endpoint's normal filters
+ * @param {Object} options
+ * @param {string} [options.sortField='date']
+ * @param {string} [options.cursor] - cursor from a previous response; empty for the first page
+ * @param {number} options.limit
+ * @param {Function} [options.decorate] - adds populate/select to the query
+ * @param {boolean} [options.archive] - also read the archive collection when the date filter reaches it
+ * @returns {Promise<{docs: Array, pagination: Object}>}
+ * @throws {InvalidCursorError}
+ */
+async function findPage(Model, filters, {
+  sortField = 'date',
+  cursor,
+  limit,
+  decorate = (query) => query,
+  archive = false,
+}) {
+  const position = cursor ? decodeCursor(cursor) : null;
+  const backwards = position?.direction === 'prev';
+  const order = backwards ? 1 : -1;
+
+  let query = filters;
+  if (position) {
+    const op = backwards ? '$gt' : '$lt';
+    query = {
+      $and: [
+        filters,
+        {
+          $or: [
+            { [sortField]: { [op]: position.value } },
+            { [sortField]: position.value, _id: { [op]: position.id } },
+          ],
+        },
+      ],
+    };
+  }
+
+  const sort = { [sortField]: order, _id: order };
+  const inArchive = archive && await reachesArchive(Model, filters.date);
+  const ArchiveModel = inArchive ? archiveModelFor(Model) : null;
+  const [live, archived, liveTotal, archivedTotal] = await Promise.all([
+    decorate(Model.find(query).sort(sort).limit(limit + 1)),
+    inArchive ? decorate(ArchiveModel.find(query).sort(sort).limit(limit + 1)) : [],
+    estimateTotal(Model, filters),
+    inArchive ? estimateTotal(ArchiveModel, filters) : 0,
+  ]);
+  const rows = inArchive ? mergeSorted(live, archived, compareBy(sort)).slice(0, limit + 1) : live;
+  const total = liveTotal + archivedTotal;
+
+  const hasMore = rows.length > limit;
+  const docs = hasMore ? rows.slice(0, limit) : rows;
+  if (backwards) docs.reverse();
+
+  const hasNext = backwards ? Boolean(position) : hasMore;
+  const hasPrev = backwards ? hasMore : Boolean(position);
+
+  return {
+    docs,
+    pagination: {
+      limit,
+      total,
+      totalIsEstimate: true,
+      hasNext,
+      hasPrev,
+      nextCursor: hasNext && docs.length ? encodeCursor(docs[docs.length - 1], sortField, 'next') : null,
+      prevCursor: hasPrev && docs.length ? encodeCursor(docs[0], sortField, 'prev') : null,
+    },
+  };
+}
+
+/**
+ * One skip/limit page of `Model.find(filters)` plus the exact total, reading
+ * the archive collection as well when the date filter reaches it.
+ *
+ * @param {Model} Model
+ * @param {Object} filters
+ * @param {Object} options
+ * @param {Object} options.sort - Mongo sort
+ * @param {number} options.skip
+ * @param {number} options.limit
+ * @param {Function} [options.decorate] - adds populate/select to the query
+ * @returns {Promise<{docs: Array, total: number}>}
+ */
+async function findOffsetPage(Model, filters, {
+  sort,
+  skip,
+  limit,
+  decorate = (query) => query,
+}) {
+  if (!(await reachesArchive(Model, filters.date))) {
+    const [docs, total] = await Promise.all([
+      decorate(Model.find(filters).sort(sort).skip(skip).limit(limit)),
+      Model.countDocuments(filters),
+    ]);
+    return { docs, total };
+  }
+
+  // Both sides are read from the top and merged; the archive is skipped when
+  // the live rows alone fill the page with rows newer than the boundary
+  const ArchiveModel = archiveModelFor(Model);
+  const [live, liveTotal, archivedTotal, cutoff] = await Promise.all([
+    decorate(Model.find(filters).sort(sort).limit(skip + limit)),
+    Model.countDocuments(filters),
+    estimateTotal(ArchiveModel, filters),
+    archiveBoundary(Model),
+  ]);
+  const newestFirst = sort.date === -1 && Object.keys(sort)[0] === 'date';
+  const pageIsLive = newestFirst && live.length === skip + limit && live[live.length - 1].date >= cutoff;
+  const archived = pageIsLive ? [] : await decorate(ArchiveModel.find(filters).sort(sort).limit(skip + limit));
+
+  return {
+    docs: mergeSorted(live, archived, compareBy(sort)).slice(skip, skip + limit),
+    total: liveTotal + archivedTotal,
+  };
+}
+
+module.exports = {
+  InvalidCursorError,
+  estimateTotal,
+  findPage,
+  findOffsetPage,
+};
@@ -0,0 +1,220 @@
+// In-process cache for expensive read endpoints.
+// Entries are keyed by route + normalized query string and tagged with the
+// collections they read. Every collection has a version number that the
+// mongoose plugin below bumps on any write, so an entry whose tag versions no
+// longer match is stale immediately instead of waiting for a TTL. Entries are
+// evicted least-recently-used once the entry count or byte budget is exceeded.
+// In cluster mode version bumps and clears are relayed to the other workers.
+
+const mongoose = require('mongoose');
+const { broadcast, subscribe } = require('./cluster');
+
+const MAX_ENTRIES = parseInt(process.env.QUERY_CACHE_MAX_ENTRIES, 10) || 500;
+const MAX_BYTES = parseInt(process.env.QUERY_CACHE_MAX_BYTES, 10) || 32 * 1024 * 1024;
+const DEFAULT_TTL_MS = parseInt(process.env.QUERY_CACHE_TTL_MS, 10) || 5 * 60 * 1000;
+
+class QueryCache {
+  constructor({ maxEntries = MAX_ENTRIES, maxBytes = MAX_BYTES, ttl = DEFAULT_TTL_MS } = {}) {
+    this.maxEntries = maxEntries;
+    this.maxBytes = maxBytes;
+    this.ttl = ttl;
+    this.entries = new Map();
+    this.versions = new Map();
+    this.bytes = 0;
+    this.stats = { hits: 0, misses: 0, stale: 0, evictions: 0, bumps: 0 };
+  }
+
+  version(collection) {
+    return this.versions.get(collection) || 0;
+  }
+
+  bump(collection) {
+    this.versions.set(collection, this.version(collection) + 1);
+    this.stats.bumps += 1;
+  }
+
+  snapshot(tags) {
+    const versions = {};
+    tags.forEach((tag) => { versions[tag] = this.version(tag); });
+    return versions;
+  }
+
+  isFresh(entry) {
+    if (entry.expiresAt <= Date.now()) return false;
+    return Object.entries(entry.versions).every(([tag, version]) => this.version(tag) === version);
+  }
+
+  get(key) {
+    const entry = this.entries.get(key);
+    if (!entry) {
+      this.stats.misses += 1;
+      return undefined;
+    }
+    if (!this.isFresh(entry)) {
+      this.delete(key);
+      this.stats.stale += 1;
+      this.stats.misses += 1;
+      return undefined;
+    }
+    // Move to the most-recently-used end
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    this.stats.hits += 1;
+    return entry.body;
+  }
+
+  // `versions` must be the snapshot taken before the value was computed, so a
+  // write that lands during the computation leaves the entry stale.
+  set(key, body, versions, ttl = this.ttl) {
+    const size = Buffer.byteLength(body);
+    if (size > this.maxBytes) return;
+    this.delete(key);
+    this.entries.set(key, { body, size, versions, expiresAt: Date.now() + ttl });
+    this.bytes += size;
+    while (this.entries.size > this.maxEntries || this.bytes > this.maxBytes) {
+      this.delete(this.entries.keys().next().value);
+      this.stats.evictions += 1;
+    }
+  }
+
+  delete(key) {
+    const entry = this.entries.get(key);
+    if (entry) {
+      this.bytes -= entry.size;
+      this.entries.delete(key);
+    }
+  }
+
+  clear() {
+    this.entries.clear();
+    this.bytes = 0;
+  }
+
+  status() {
+    const lookups = this.stats.hits + this.stats.misses;
+    return {
+      entries: this.entries.size,
+      bytes: this.bytes,
+      maxEntries: this.maxEntries,
+      maxBytes: this.maxBytes,
+      ttl: this.ttl,
+      ...this.stats,
+      hitRate: lookups > 0 ? this.stats.hits / lookups : 0,
+      versions: Object.fromEntries(this.versions),
+    };
+  }
+}
+
+const queryCache = new QueryCache();
+
+// Writes made by other workers
+subscribe('cache:bump', ({ collection }) => queryCache.bump(collection));
+subscribe('cache:clear', () => queryCache.clear());
+
+// Clear this process's cache and every other worker's
+function clearEverywhere() {
+  queryCache.clear();
+  broadcast('cache:clear');
+}
+
+// Route + query string with keys sorted, so ?a=1&b=2 and ?b=2&a=1 share an entry
+function cacheKey(req) {
+  const params = new URLSearchParams();
+  Object.keys(req.query).sort().forEach((name) => {
+    [].concat(req.query[name]).forEach((value) => params.append(name, String(value)));
+  });
+  return `${req.baseUrl}${req.path}?${params.toString()}`;
+}
+
+/**
+ * Express middleware caching successful JSON responses of a GET route.
+ *
+ * @param {Array<Model|string>} sources - models (or collection names) the route reads
+ * @param {Object} [options]
+ * @param {number} [options.ttl] - upper bound on entry age in milliseconds
+ */
+function cacheResponse(sources, { ttl } = {}) {
+  return (req, res, next) => {
+    const tags = sources.map((source) => (typeof source === 'string' ? source : source.collection.name));
+    const key = cacheKey(req);
+    const body = queryCache.get(key);
+    if (body !== undefined) {
+      res.set('X-Cache', 'HIT');
+      return res.type('application/json').send(body);
+    }
+
+    const versions = queryCache.snapshot(tags);
+    const json = res.json.bind(res);
+    res.json = (payload) => {
+      if (res.statusCode >= 200 && res.statusCode < 300) {
+        const serialized = JSON.stringify(payload);
+        queryCache.set(key, serialized, versions, ttl);
+        res.set('X-Cache', 'MISS');
+        return res.type('application/json').send(serialized);
+      }
+      return json(payload);
+    };
+    return next();
+  };
+}
+
+/**
+ * Cache a computed JSON-serializable value under `key`, tagged like
+ * cacheResponse(). Returns the cached copy while the sources are unchanged.
+ *
+ * @param {string} key
+ * @param {Array<Model|string>} sources - models (or collection names) the value reads
+ * @param {Function} compute - async () => value
+ * @param {Object} [options]
+ * @param {number} [options.ttl] - upper bound on entry age in milliseconds
+ * @returns {Promise<{value: *, hit: boolean}>}
+ */
+async function cachedValue(key, sources, compute, { ttl } = {}) {
+  const tags = sources.map((source) => (typeof source === 'string' ? source : source.collection.name));
+  const body = queryCache.get(key);
+  if (body !== undefined) return { value: JSON.parse(body), hit: true };
+
+  const versions = queryCache.snapshot(tags);
+  const serialized = JSON.stringify(await compute());
+  queryCache.set(key, serialized, versions, ttl);
+  return { value: JSON.parse(serialized), hit: false };
+}
+
+// Resolve the collection written by a document, query or model middleware call
+function collectionOf(context) {
+  if (!context || context.$isSubdocument) return null;
+  if (context instanceof mongoose.Query) return context.model.collection.name;
+  // Documents and models both expose the mongoose collection object
+  const { collection } = context;
+  return collection && typeof collection === 'object' ? collection.name : null;
+}
+
+function bumpCollection() {
+  const collection = collectionOf(this);
+  if (collection) {
+    queryCache.bump(collection);
+    broadcast('cache:bump', { collection });
+  }
+}
+
+/**
+ * Global mongoose plugin: bump the collection version after every write.
+ * Register with mongoose.plugin() before any model is compiled.
+ */
+function collectionVersionPlugin(schema) {
+  schema.post('save', bumpCollection);
+  schema.post(['updateOne', 'updateMany', 'replaceOne', 'deleteOne', 'deleteMany'], { document: false, query: true }, bumpCollection);
+  schema.post(['findOneAndUpdate', 'findOneAndDelete', 'findOneAndReplace'], bumpCollection);
+  schema.post(['updateOne', 'deleteOne'], { document: true, query: false }, bumpCollection);
+  schema.post(['insertMany', 'bulkWrite'], bumpCollection);
+}
+
+module.exports = {
+  QueryCache,
+  queryCache,
+  cacheKey,
+  cacheResponse,
+  cachedValue,
+  clearEverywhere,
+  collectionVersionPlugin,
+};
@@ -0,0 +1,132 @@
+// Month-level queries over the rental schedules embedded in RentalContract.
+// Contracts are narrowed with an $elemMatch on `months` (served by the
+// months.monthYear / months.dueDate multikey indexes), the schedule is unwound
+// to one row per month and filtered again, and unit / secretary names are
+// joined only for the rows that are actually returned.
+
+const RentalUnit = require('../models/RentalUnit');
+const RentingSecretary = require('../models/RentingSecretary');
+
+const BUCKETS = ['pending', 'overdue', 'partiallyPaid', 'paid'];
+
+// Month conditions (unprefixed, as used inside $elemMatch) for each bucket.
+// `$not: { $gt: 0 }` also matches a missing field, which bucketExpression()
+// compares as less than zero, so legacy months land in the same bucket.
+function bucketConditions(bucket, now) {
+  switch (bucket) {
+    case 'paid':
+      return { remainingAmount: { $not: { $gt: 0 } } };
+    case 'overdue':
+      return { remainingAmount: { $gt: 0 }, dueDate: { $lt: now } };
+    case 'partiallyPaid':
+      return { remainingAmount: { $gt: 0 }, dueDate: { $gte: now }, totalPaid: { $gt: 0 } };
+    case 'pending':
+      return { remainingAmount: { $gt: 0 }, dueDate: { $gte: now }, totalPaid: { $not: { $gt: 0 } } };
+    default:
+      throw new Error(`Unknown bucket: ${bucket}`);
+  }
+}
+
+// Bucket of an unwound `month` row, same rules as bucketConditions()
+function bucketExpression(now) {
+  return {
+    $switch: {
+      branches: [
+        { case: { $lte: ['$month.remainingAmount', 0] }, then: 'paid' },
+        { case: { $lt: ['$month.dueDate', now] }, then: 'overdue' },
+        { case: { $gt: ['$month.totalPaid', 0] }, then: 'partiallyPaid' },
+      ],
+      default: 'pending',
+    },
+  };
+}
+
+/**
+ * Stages producing one row per schedule month: { _id, referenceNumber, unitId,
+ * rentalSecretaryId, unitSnapshot, secretarySnapshot, month }.
+ *
+ * @param {Object} contractMatch - contract-level filter
+ * @param {Object} monthMatch - month-level filter with unprefixed field names
+ */
+function monthStages(contractMatch = {}, monthMatch = {}) {
+  const hasMonthMatch = Object.keys(monthMatch).length > 0;
+  const stages = [
+    { $match: hasMonthMatch ? { ...contractMatch, months: { $elemMatch: monthMatch } } : contractMatch },
+    {
+      $project: {
+        referenceNumber: 1,
+        unitId: 1,
+        rentalSecretaryId: 1,
+        unitSnapshot: 1,
+        secretarySnapshot: 1,
+        month: '$months',
+      },
+    },
+    { $unwind: '$month' },
+  ];
+  if (hasMonthMatch) {
+    const prefixed = {};
+    Object.entries(monthMatch).forEach(([field, condition]) => {
+      prefixed[`month.${field}`] = condition;
+    });
+    stages.push({ $match: prefixed });
+  }
+  return stages;
+}
+
+// Join unit / secretary (falling back to the contract snapshots) and shape the entry
+function entryStages() {
+  return [
+    {
+      $lookup: {
+        from: RentalUnit.collection.name,
+        localField: 'unitId',
+        foreignField: '_id',
+        pipeline: [{ $project: { unitNumber: 1, unitType: 1, address: 1 } }],
+        as: 'unit',
+      },
+    },
+    {
+      $lookup: {
+        from: RentingSecretary.collection.name,
+        localField: 'rentalSecretaryId',
+        foreignField: '_id',
+        pipeline: [{ $project: { name: 1, phone: 1 } }],
+        as: 'secretary',
+      },
+    },
+    {
+      $project: {
+        _id: 0,
+        contractId: '$_id',
+        referenceNumber: 1,
+        unit: { $ifNull: [{ $first: '$unit' }, '$unitSnapshot'] },
+        secretary: { $ifNull: [{ $first: '$secretary' }, '$secretarySnapshot'] },
+        monthYear: '$month.monthYear',
+        dueDate: '$month.dueDate',
+        dueAmount: '$month.dueAmount',
+        totalPaid: '$month.totalPaid',
+        remainingAmount: '$month.remainingAmount',
+        status: '$month.status',
+      },
+    },
+  ];
+}
+
+// Sort by due date (stable on contract id) and optionally take one page
+function pageStages({ page, limit } = {}) {
+  const stages = [{ $sort: { 'month.dueDate': 1, _id: 1 } }];
+  if (limit) {
+    stages.push({ $skip: (page - 1) * limit }, { $limit: limit });
+  }
+  return stages;
+}
+
+module.exports = {
+  BUCKETS,
+  bucketConditions,
+  bucketExpression,
+  monthStages,
+  entryStages,
+  pageStages,
+};
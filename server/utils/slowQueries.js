@@ -0,0 +1,235 @@
+// Slow-query profiler.
+// A global mongoose plugin times every query and aggregate. Operations slower
+// than SLOW_QUERY_MS are logged with their filter shape (field names and
+// operators, values replaced by their type) and counted per
+// collection + operation + shape. A sample of them (SLOW_QUERY_EXPLAIN_RATE,
+// at most one explain at a time and one per shape every few minutes) is
+// re-run through the driver with explain('executionStats'); a winning plan
+// containing a COLLSCAN flags the shape. /api/health/slow-queries lists the
+// worst shapes.
+
+const mongoose = require('mongoose');
+const { currentRequestId } = require('./tracing');
+
+const SLOW_MS = parseInt(process.env.SLOW_QUERY_MS, 10) || 200;
+const EXPLAIN_RATE = Number.isNaN(parseFloat(process.env.SLOW_QUERY_EXPLAIN_RATE))
+  ? 0.1
+  : parseFloat(process.env.SLOW_QUERY_EXPLAIN_RATE);
+const EXPLAIN_INTERVAL_MS = 10 * 60 * 1000;
+const MAX_SHAPES = 500;
+
+const QUERY_OPS = [
+  'find', 'findOne', 'countDocuments', 'distinct',
+  'findOneAndUpdate', 'findOneAndDelete', 'findOneAndReplace',
+  'updateOne', 'updateMany', 'replaceOne', 'deleteOne', 'deleteMany',
+];
+const EXPLAINABLE_OPS = ['find', 'findOne', 'countDocuments', 'aggregate'];
+
+const startTimes = new WeakMap();
+const shapes = new Map();
+let explaining = false;
+
+/**
+ * Structure of a filter with the values replaced by their type, e.g.
+ * { status: 'string', date: { $gte: 'Date' }, name: 'RegExp' }.
+ */
+function shapeOf(value, depth = 0) {
+  if (value === null || value === undefined) return String(value);
+  if (value instanceof RegExp) return value.source.startsWith('^') ? 'RegExp(^)' : 'RegExp';
+  if (value instanceof Date) return 'Date';
+  if (value instanceof mongoose.Types.ObjectId) return 'ObjectId';
+  if (Array.isArray(value)) return value.length ? [shapeOf(value[0], depth + 1)] : [];
+  if (typeof value !== 'object') return typeof value;
+  if (depth > 4) return 'object';
+  const shape = {};
+  Object.keys(value).sort().forEach((key) => {
+    shape[key] = shapeOf(value[key], depth + 1);
+  });
+  return shape;
+}
+
+// Stage names of a pipeline, with the shape of its leading $match
+function pipelineShape(pipeline) {
+  return pipeline.map((stage) => {
+    const [name] = Object.keys(stage);
+    return name === '$match' ? { $match: shapeOf(stage.$match) } : name;
+  });
+}
+
+// Whether the winning plan(s) of an explain result scan a whole collection
+function hasCollscan(node) {
+  if (!node || typeof node !== 'object') return false;
+  if (node.stage === 'COLLSCAN') return true;
+  return Object.entries(node).some(([key, child]) => key !== 'rejectedPlans' && hasCollscan(child));
+}
+
+// Summary of an explain('executionStats') result
+function planSummary(explain) {
+  const stats = [];
+  const collect = (node) => {
+    if (!node || typeof node !== 'object') return;
+    if (node.executionStats) stats.push(node.executionStats);
+    Object.entries(node).forEach(([key, child]) => {
+      if (key !== 'executionStats' && key !== 'rejectedPlans') collect(child);
+    });
+  };
+  collect(explain);
+  const total = (field) => stats.reduce((sum, entry) => sum + (entry[field] || 0), 0);
+  return {
+    collscan: hasCollscan(explain.queryPlanner || explain.stages || explain),
+    docsExamined: total('totalDocsExamined'),
+    keysExamined: total('totalKeysExamined'),
+    returned: total('nReturned'),
+    executionTimeMs: total('executionTimeMillis'),
+  };
+}
+
+function entryFor(collection, op, shape) {
+  const key = `${collection}|${op}|${JSON.stringify(shape)}`;
+  let entry = shapes.get(key);
+  if (!entry) {
+    if (shapes.size >= MAX_SHAPES) {
+      // Forget the shape that has cost the least so far
+      let cheapest = null;
+      shapes.forEach((candidate, candidateKey) => {
+        if (!cheapest || candidate.totalMs < shapes.get(cheapest).totalMs) cheapest = candidateKey;
+      });
+      shapes.delete(cheapest);
+    }
+    entry = { collection, op, shape, count: 0, totalMs: 0, maxMs: 0, lastMs: 0, lastAt: null, plan: null, explainedAt: 0 };
+    shapes.set(key, entry);
+  }
+  return entry;
+}
+
+async function explainSample(entry, run) {
+  explaining = true;
+  entry.explainedAt = Date.now();
+  try {
+    const explain = await run();
+    entry.plan = planSummary(explain);
+    if (entry.plan.collscan) {
+      console.warn(`⚠️  COLLSCAN: ${entry.collection}.${entry.op} ${JSON.stringify(entry.shape)} (${entry.plan.docsExamined} docs examined, ${entry.plan.returned} returned)`);
+    }
+  } catch (error) {
+    entry.plan = { error: error.message };
+  } finally {
+    explaining = false;
+  }
+}
+
+function record(collection, op, shape, ms, explain) {
+  const entry = entryFor(collection, op, shape);
+  entry.count += 1;
+  entry.totalMs += ms;
+  entry.maxMs = Math.max(entry.maxMs, ms);
+  entry.lastMs = ms;
+  entry.lastAt = new Date();
+  const requestId = currentRequestId();
+  console.warn(`🐢 Slow query ${Math.round(ms)}ms: ${collection}.${op} ${JSON.stringify(shape)}${requestId ? ` [${requestId}]` : ''}`);
+
+  if (EXPLAINABLE_OPS.includes(op) && !explaining && Math.random() < EXPLAIN_RATE
+    && Date.now() - entry.explainedAt > EXPLAIN_INTERVAL_MS) {
+    explainSample(entry, explain);
+  }
+}
+
+const elapsedMs = (startedAt) => Number(process.hrtime.bigint() - startedAt) / 1e6;
+
+function startTimer() {
+  startTimes.set(this, process.hrtime.bigint());
+}
+
+function finishQuery() {
+  const startedAt = startTimes.get(this);
+  if (startedAt === undefined) return;
+  startTimes.delete(this);
+  const ms = elapsedMs(startedAt);
+  if (ms < SLOW_MS) return;
+
+  const { collection } = this.model;
+  const filter = this.getFilter();
+  const { sort, limit, skip } = this.getOptions();
+  const shape = sort ? { filter: shapeOf(filter), sort } : shapeOf(filter);
+  // Re-run through the driver so the explain itself is not timed or hooked
+  // (counts are explained as the equivalent find)
+  record(collection.name, this.op, shape, ms, () => collection
+    .find(filter, { sort, limit: this.op === 'findOne' ? 1 : limit, skip })
+    .explain('executionStats'));
+}
+
+function finishAggregate() {
+  const startedAt = startTimes.get(this);
+  if (startedAt === undefined) return;
+  startTimes.delete(this);
+  const ms = elapsedMs(startedAt);
+  if (ms < SLOW_MS) return;
+
+  const pipeline = this.pipeline();
+  const { collection } = this._model;
+  record(collection.name, 'aggregate', pipelineShape(pipeline), ms, () => collection
+    .aggregate(pipeline, { allowDiskUse: true })
+    .explain('executionStats'));
+}
+
+/**
+ * Global mongoose plugin. Register with mongoose.plugin() before any model is compiled.
+ */
+function slowQueryPlugin(schema) {
+  schema.pre(QUERY_OPS, { document: false, query: true }, startTimer);
+  schema.post(QUERY_OPS, { document: false, query: true }, finishQuery);
+  schema.pre('aggregate', startTimer);
+  schema.post('aggregate', finishAggregate);
+}
+
+/**
+ * Slowest query shapes seen by this process.
+ *
+ * @param {Object} [options]
+ * @param {string} [options.sort] - 'total' (default), 'max', 'count' or 'avg'
+ * @param {number} [options.limit]
+ * @param {boolean} [options.collscanOnly]
+ */
+function slowQueryReport({ sort = 'total', limit = 20, collscanOnly = false } = {}) {
+  const value = {
+    total: (entry) => entry.totalMs,
+    max: (entry) => entry.maxMs,
+    count: (entry) => entry.count,
+    avg: (entry) => entry.totalMs / entry.count,
+  }[sort] || ((entry) => entry.totalMs);
+
+  const entries = [...shapes.values()]
+    .filter((entry) => !collscanOnly || entry.plan?.collscan)
+    .sort((a, b) => value(b) - value(a))
+    .slice(0, limit)
+    .map((entry) => ({
+      collection: entry.collection,
+      op: entry.op,
+      shape: entry.shape,
+      count: entry.count,
+      totalMs: Math.round(entry.totalMs),
+      avgMs: Math.round(entry.totalMs / entry.count),
+      maxMs: Math.round(entry.maxMs),
+      lastMs: Math.round(entry.lastMs),
+      lastAt: entry.lastAt,
+      collscan: entry.plan ? Boolean(entry.plan.collscan) : null,
+      plan: entry.plan,
+    }));
+  return {
+    thresholdMs: SLOW_MS,
+    explainRate: EXPLAIN_RATE,
+    shapes: shapes.size,
+    queries: entries,
+  };
+}
+
+function resetSlowQueries() {
+  shapes.clear();
+}
+
+module.exports = {
+  shapeOf,
+  slowQueryPlugin,
+  slowQueryReport,
+  resetSlowQueries,
+};
@@ -0,0 +1,227 @@
+// Income/spending time series over active invoices.
+// Buckets are $dateTrunc'd (UTC) days, weeks (starting Sunday) or months. A
+// bucket that ended before the current month is "closed": its figures are
+// memoized in process and only recomputed once a write back-dated into one of
+// its months marks that month's ledger checkpoint dirty (dirtiedAt later than
+// the memo). Buckets in the current month, and ones not yet memoized, are
+// computed by one aggregation over the (status, date) index.
+
+const LedgerCheckpoint = require('../models/LedgerCheckpoint');
+const { OFFICE_LEDGERS, periodOf, periodStart, nextPeriod } = require('./ledgerCheckpoints');
+const { reachesArchive, unionWithArchive } = require('./archive');
+
+const GRANULARITIES = ['day', 'week', 'month'];
+const DEFAULT_SPAN = { day: 30, week: 26, month: 12 };
+const MAX_BUCKETS = 1000;
+const MAX_MEMO_ENTRIES = 50000;
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+// `${office}|${ledger}|${granularity}|${bucketStartISO}` => { figures, computedAt }
+const memo = new Map();
+
+const round = (value) => Math.round(value * 1000) / 1000;
+
+// Same truncation as $dateTrunc with timezone UTC and startOfWeek sunday
+function bucketStart(date, granularity) {
+  const d = new Date(date);
+  const day = Date.UTC(d.getUTCFullYear(), d.getUTCMonth(), d.getUTCDate());
+  if (granularity === 'day') return new Date(day);
+  if (granularity === 'week') return new Date(day - d.getUTCDay() * DAY_MS);
+  return new Date(Date.UTC(d.getUTCFullYear(), d.getUTCMonth(), 1));
+}
+
+function shiftBucket(start, granularity, count) {
+  if (granularity === 'day') return new Date(start.getTime() + count * DAY_MS);
+  if (granularity === 'week') return new Date(start.getTime() + count * 7 * DAY_MS);
+  return new Date(Date.UTC(start.getUTCFullYear(), start.getUTCMonth() + count, 1));
+}
+
+const emptyFigures = () => ({ income: 0, spending: 0, incomeCount: 0, spendingCount: 0 });
+
+function remember(key, entry) {
+  memo.delete(key);
+  memo.set(key, entry);
+  while (memo.size > MAX_MEMO_ENTRIES) memo.delete(memo.keys().next().value);
+}
+
+// Months touched by back-dated writes since `since`: period => latest dirtiedAt
+async function dirtiedPeriods(office, since) {
+  const rows = await LedgerCheckpoint.find({ office, dirtiedAt: { $gt: since } })
+    .select('period dirtiedAt')
+    .lean();
+  const periods = new Map();
+  rows.forEach(({ period, dirtiedAt }) => {
+    if (!periods.has(period) || periods.get(period) < dirtiedAt) periods.set(period, dirtiedAt);
+  });
+  return periods;
+}
+
+function isStale(entry, start, end, dirtied) {
+  const last = periodOf(end.getTime() - 1);
+  for (let period = periodOf(start); period <= last; period = nextPeriod(period)) {
+    const dirtiedAt = dirtied.get(period);
+    if (dirtiedAt && dirtiedAt > entry.computedAt) return true;
+  }
+  return false;
+}
+
+// Invoice figures per bucket start (ms) over the given date ranges
+async function aggregateBuckets(office, ledger, granularity, ranges) {
+  const { OFFICES } = require('./offices');
+  const { Invoice } = OFFICES[office];
+  const match = {
+    status: 'active',
+    type: { $in: ['income', 'spending'] },
+    $or: ranges.map(({ start, end }) => ({ date: { $gte: start, $lt: end } })),
+  };
+  if (ledger) match.$expr = { $eq: [OFFICE_LEDGERS[office].invoiceLedger, ledger] };
+
+  const pipeline = [{ $match: match }];
+  const earliest = new Date(Math.min(...ranges.map(({ start }) => start.getTime())));
+  if (await reachesArchive(Invoice, { $gte: earliest })) {
+    pipeline.push(unionWithArchive(Invoice, [{ $match: match }]));
+  }
+  const trunc = { date: '$date', unit: granularity, timezone: 'UTC' };
+  if (granularity === 'week') trunc.startOfWeek = 'sunday';
+  const rows = await Invoice.aggregate([
+    ...pipeline,
+    {
+      $group: {
+        _id: {
+          bucket: { $dateTrunc: trunc },
+          type: '$type',
+        },
+        total: { $sum: '$value' },
+        count: { $sum: 1 },
+      },
+    },
+  ]);
+
+  const buckets = new Map();
+  rows.forEach(({ _id, total, count }) => {
+    const key = new Date(_id.bucket).getTime();
+    if (!buckets.has(key)) buckets.set(key, emptyFigures());
+    const figures = buckets.get(key);
+    figures[_id.type] += total;
+    figures[`${_id.type}Count`] += count;
+  });
+  return buckets;
+}
+
+/**
+ * Income and spending per bucket for one office.
+ *
+ * @param {string} office - key of OFFICE_LEDGERS
+ * @param {Object} options
+ * @param {string} options.granularity - 'day' | 'week' | 'month'
+ * @param {Date} options.from - widened to the start of its bucket
+ * @param {Date} options.to - widened to the end of its bucket
+ * @param {string} [options.ledger] - one of the office's ledgers (default: all)
+ */
+async function getTimeseries(office, { granularity, from, to, ledger, now = new Date() }) {
+  const first = bucketStart(from, granularity);
+  const starts = [];
+  for (let start = first; start <= to; start = shiftBucket(start, granularity, 1)) starts.push(start);
+
+  // Buckets ending before the current month (and its week, for weekly buckets) are closed
+  const openFrom = new Date(Math.min(
+    bucketStart(now, granularity).getTime(),
+    periodStart(periodOf(now)).getTime()
+  ));
+  const keyOf = (start) => `${office}|${ledger || '*'}|${granularity}|${start.toISOString()}`;
+
+  const closed = starts.filter((start) => shiftBucket(start, granularity, 1) <= openFrom);
+  const memoized = closed.map((start) => memo.get(keyOf(start))).filter(Boolean);
+  const dirtied = memoized.length
+    ? await dirtiedPeriods(office, new Date(Math.min(...memoized.map((entry) => entry.computedAt.getTime()))))
+    : new Map();
+
+  const results = new Map();
+  const missing = [];
+  let hits = 0;
+  starts.forEach((start) => {
+    const end = shiftBucket(start, granularity, 1);
+    const entry = end <= openFrom ? memo.get(keyOf(start)) : undefined;
+    if (entry && !isStale(entry, start, end, dirtied)) {
+      results.set(start.getTime(), entry.figures);
+      hits += 1;
+    } else if (start <= now) {
+      missing.push({ start, end });
+    }
+  });
+
+  if (missing.length) {
+    // Taken before reading, so a write landing meanwhile leaves the memo stale
+    const computedAt = new Date();
+    // Adjacent buckets are read as one range
+    const ranges = missing.reduce((merged, range) => {
+      const last = merged[merged.length - 1];
+      if (last && last.end.getTime() === range.start.getTime()) last.end = range.end;
+      else merged.push({ ...range });
+      return merged;
+    }, []);
+    const computed = await aggregateBuckets(office, ledger, granularity, ranges);
+    missing.forEach(({ start, end }) => {
+      const figures = computed.get(start.getTime()) || emptyFigures();
+      results.set(start.getTime(), figures);
+      if (end <= openFrom) remember(keyOf(start), { figures, computedAt });
+    });
+  }
+
+  return {
+    buckets: starts.map((start) => {
+      const figures = results.get(start.getTime()) || emptyFigures();
+      return {
+        start,
+        end: shiftBucket(start, granularity, 1),
+        income: round(figures.income),
+        spending: round(figures.spending),
+        net: round(figures.income - figures.spending),
+        incomeCount: figures.incomeCount,
+        spendingCount: figures.spendingCount,
+      };
+    }),
+    cachedBuckets: hits,
+    computedBuckets: missing.length,
+  };
+}
+
+/**
+ * GET handler for /api/<office>/reports/timeseries?granularity=&from=&to=&ledger=
+ */
+function timeseriesRoute(office) {
+  return async (req, res) => {
+    try {
+      const { ledgers } = OFFICE_LEDGERS[office];
+      const { granularity = 'day', ledger } = req.query;
+      if (!GRANULARITIES.includes(granularity)) {
+        return res.status(400).json({ message: 'الفترة الزمنية غير صالحة', granularities: GRANULARITIES });
+      }
+      if (ledger !== undefined && !ledgers.includes(ledger)) {
+        return res.status(400).json({ message: 'مصدر/وجهة غير صالحة', ledgers });
+      }
+
+      const to = req.query.to ? new Date(req.query.to) : new Date();
+      const from = req.query.from
+        ? new Date(req.query.from)
+        : shiftBucket(bucketStart(to, granularity), granularity, 1 - DEFAULT_SPAN[granularity]);
+      if (Number.isNaN(from.getTime()) || Number.isNaN(to.getTime()) || from > to) {
+        return res.status(400).json({ message: 'التاريخ غير صالح' });
+      }
+      const first = bucketStart(from, granularity);
+      if (shiftBucket(first, granularity, MAX_BUCKETS) <= to) {
+        return res.status(400).json({ message: `الحد الأقصى ${MAX_BUCKETS} فترة في الطلب الواحد` });
+      }
+
+      const series = await getTimeseries(office, { granularity, from, to, ledger });
+      res.json({ office, granularity, ledger: ledger || null, from: first, to, ...series });
+    } catch (error) {
+      res.status(500).json({ message: 'خطأ في جلب التقرير', error: error.message });
+    }
+  };
+}
+
+module.exports = {
+  getTimeseries,
+  timeseriesRoute,
+};
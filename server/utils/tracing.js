@@ -0,0 +1,176 @@
+// Per-request tracing.
+// requestTracing() gives each request an ID (the incoming X-Request-Id when it
+// looks sane, a new UUID otherwise) and an AsyncLocalStorage context. Spans
+// are added to that context while the request runs:
+//   - db.<collection>.<op> for every mongoose query and aggregate (the global
+//     tracingPlugin), which includes the extra finds issued by populate();
+//   - auth for token verification (utils/auth.js);
+//   - serialize for res.json()'s JSON.stringify, including toJSON of documents.
+// The spans are sent back in a Server-Timing header (readable from browser
+// devtools and, through CORS exposedHeaders, from scripts), and requests slower
+// than TRACE_SLOW_MS are logged as one JSON line.
+
+const crypto = require('crypto');
+const { AsyncLocalStorage } = require('async_hooks');
+
+const SLOW_MS = parseInt(process.env.TRACE_SLOW_MS, 10) || 1000;
+const MAX_HEADER_SPANS = 8;
+const REQUEST_ID = /^[\w.:-]{1,64}$/;
+
+const storage = new AsyncLocalStorage();
+const startTimes = new WeakMap();
+
+const now = () => process.hrtime.bigint();
+const msSince = (startedAt) => Number(now() - startedAt) / 1e6;
+
+function currentTrace() {
+  return storage.getStore();
+}
+
+function currentRequestId() {
+  return storage.getStore()?.id;
+}
+
+/**
+ * Add `ms` to the span `name` of the current request (no-op outside a request).
+ */
+function addSpan(name, ms) {
+  const trace = storage.getStore();
+  if (!trace) return;
+  const span = trace.spans.get(name);
+  if (span) {
+    span.count += 1;
+    span.ms += ms;
+  } else {
+    trace.spans.set(name, { count: 1, ms });
+  }
+}
+
+function serverTiming(trace) {
+  const spans = [...trace.spans.entries()];
+  const db = spans.filter(([name]) => name.startsWith('db.'));
+  const dbMs = db.reduce((sum, [, span]) => sum + span.ms, 0);
+  const dbCount = db.reduce((sum, [, span]) => sum + span.count, 0);
+
+  const parts = [`total;dur=${msSince(trace.startedAt).toFixed(1)}`];
+  if (dbCount) parts.push(`db;dur=${dbMs.toFixed(1)};desc="${dbCount} ops"`);
+  spans
+    .sort((a, b) => b[1].ms - a[1].ms)
+    .slice(0, MAX_HEADER_SPANS)
+    .forEach(([name, span]) => {
+      const desc = span.count > 1 ? `;desc="x${span.count}"` : '';
+      parts.push(`${name};dur=${span.ms.toFixed(1)}${desc}`);
+    });
+  return parts.join(', ');
+}
+
+/**
+ * Express middleware opening the trace of a request. Mount it before the
+ * body parsers and routes; the header is added when the response head is written.
+ */
+function requestTracing(req, res, next) {
+  const incoming = req.headers['x-request-id'];
+  const trace = {
+    id: typeof incoming === 'string' && REQUEST_ID.test(incoming) ? incoming : crypto.randomUUID(),
+    startedAt: now(),
+    spans: new Map(),
+  };
+  req.id = trace.id;
+  res.setHeader('X-Request-Id', trace.id);
+  if (req.headers.origin) res.setHeader('Timing-Allow-Origin', req.headers.origin);
+
+  const writeHead = res.writeHead;
+  res.writeHead = function writeHeadWithTiming(...args) {
+    if (!this.headersSent) this.setHeader('Server-Timing', serverTiming(trace));
+    return writeHead.apply(this, args);
+  };
+
+  // Same output as express' res.json, with the stringify timed on its own
+  res.json = function jsonWithTiming(body) {
+    const startedAt = now();
+    const app = this.app;
+    const serialized = JSON.stringify(body, app.get('json replacer'), app.get('json spaces'));
+    addSpan('serialize', msSince(startedAt));
+    if (!this.get('Content-Type')) this.set('Content-Type', 'application/json');
+    return this.send(serialized);
+  };
+
+  res.once('finish', () => {
+    const durationMs = msSince(trace.startedAt);
+    if (durationMs < SLOW_MS) return;
+    const spans = {};
+    trace.spans.forEach((span, name) => {
+      spans[name] = { count: span.count, ms: Math.round(span.ms * 10) / 10 };
+    });
+    console.warn(JSON.stringify({
+      level: 'warn',
+      msg: 'slow request',
+      requestId: trace.id,
+      method: req.method,
+      path: req.originalUrl.split('?')[0],
+      route: req.route ? `${req.baseUrl}${req.route.path}` : undefined,
+      status: res.statusCode,
+      durationMs: Math.round(durationMs),
+      user: req.user?.username || req.user?.id,
+      spans,
+    }));
+  });
+
+  storage.run(trace, next);
+}
+
+const QUERY_OPS = [
+  'find', 'findOne', 'countDocuments', 'estimatedDocumentCount', 'distinct',
+  'findOneAndUpdate', 'findOneAndDelete', 'findOneAndReplace',
+  'updateOne', 'updateMany', 'replaceOne', 'deleteOne', 'deleteMany',
+];
+
+function startSpan() {
+  if (storage.getStore()) startTimes.set(this, now());
+}
+
+function endQuerySpan() {
+  const startedAt = startTimes.get(this);
+  if (startedAt === undefined) return;
+  startTimes.delete(this);
+  addSpan(`db.${this.model.collection.name}.${this.op}`, msSince(startedAt));
+}
+
+function endAggregateSpan() {
+  const startedAt = startTimes.get(this);
+  if (startedAt === undefined) return;
+  startTimes.delete(this);
+  addSpan(`db.${this._model.collection.name}.aggregate`, msSince(startedAt));
+}
+
+function startSaveSpan() {
+  if (!this.$isSubdocument && storage.getStore()) this.$locals.traceStartedAt = now();
+}
+
+function endSaveSpan(doc) {
+  const startedAt = doc.$locals.traceStartedAt;
+  if (startedAt === undefined) return;
+  delete doc.$locals.traceStartedAt;
+  addSpan(`db.${doc.collection.name}.save`, msSince(startedAt));
+}
+
+/**
+ * Global mongoose plugin timing every operation of the current request.
+ * Register with mongoose.plugin() before any model is compiled.
+ */
+function tracingPlugin(schema) {
+  schema.pre(QUERY_OPS, { document: false, query: true }, startSpan);
+  schema.post(QUERY_OPS, { document: false, query: true }, endQuerySpan);
+  schema.pre('aggregate', startSpan);
+  schema.post('aggregate', endAggregateSpan);
+  schema.pre('save', startSaveSpan);
+  schema.post('save', endSaveSpan);
+}
+
+module.exports = {
+  currentTrace,
+  currentRequestId,
+  addSpan,
+  requestTracing,
+  tracingPlugin,
+};